@@ -0,0 +1,214 @@
+# Agent エンドポイントのルーティング - 複数のエイリアス・リージョンからリクエスト毎に呼び出し先を選ぶ
+#
+# AGENT_ENDPOINTS（JSON 配列）で呼び出し先を設定する。未設定時は AGENT_ID / AGENT_ALIAS_ID / BEDROCK_REGION の1件。
+#   [{"name": "tokyo", "agentId": "...", "aliasId": "...", "region": "ap-northeast-1", "weight": 9},
+#    {"name": "virginia", "agentId": "...", "aliasId": "...", "region": "us-east-1", "weight": 1}]
+# エンドポイント毎に直近の最初のチャンクまでの時間（TTFB）と失敗を記録し、
+#   latency : TTFB の中央値（失敗率で割り増し）が最小のエンドポイント（一部は探索のためランダム）
+#   weighted: weight の比率でランダムに振り分け（A/B テスト）
+# で選ぶ。失敗が続いたエンドポイントは一定時間外し、失敗したリクエストは別の呼び出し先で再試行する。
+# Agent のセッション状態はエイリアス・リージョン毎のため、セッションは最初に選んだエンドポイントに固定する
+# （直近会話ウィンドウ行の agentEndpoint に保存し、コンテナをまたいでも同じ呼び出し先を使う）。
+import os
+import json
+import time
+import random
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, List
+from common import setup_logger
+
+# ルーティング設定
+AGENT_ENDPOINTS = os.environ.get('AGENT_ENDPOINTS', '')
+AGENT_ROUTING_MODE = os.environ.get('AGENT_ROUTING_MODE', 'latency').lower()
+# 統計に使う直近のサンプル数と有効期間
+AGENT_ROUTING_WINDOW = int(os.environ.get('AGENT_ROUTING_WINDOW', '50'))
+AGENT_ROUTING_WINDOW_SECONDS = float(os.environ.get('AGENT_ROUTING_WINDOW_SECONDS', '300'))
+# latency モードで最速以外を試す割合（統計が古くならないように）
+AGENT_ROUTING_EXPLORE_RATE = float(os.environ.get('AGENT_ROUTING_EXPLORE_RATE', '0.05'))
+# 失敗率の割り増し（スコア = TTFB 中央値 × (1 + 失敗率 × これ)）
+AGENT_ROUTING_ERROR_PENALTY = float(os.environ.get('AGENT_ROUTING_ERROR_PENALTY', '4'))
+# 連続失敗がこの回数に達したら AGENT_ROUTING_EJECT_SECONDS の間は選ばない
+AGENT_ROUTING_EJECT_AFTER = int(os.environ.get('AGENT_ROUTING_EJECT_AFTER', '3'))
+AGENT_ROUTING_EJECT_SECONDS = float(os.environ.get('AGENT_ROUTING_EJECT_SECONDS', '30'))
+# 呼び出しに失敗したら別の呼び出し先で1回だけ再試行する（セッションは再試行先に固定し直す）
+AGENT_ROUTING_FAILOVER = os.environ.get('AGENT_ROUTING_FAILOVER', 'true').lower() == 'true'
+# コンテナ内で覚えておくセッションの固定先の件数
+AGENT_ROUTING_PIN_CACHE_SIZE = int(os.environ.get('AGENT_ROUTING_PIN_CACHE_SIZE', '10000'))
+
+ROUTING_MODES = ('latency', 'weighted')
+
+logger = setup_logger(__name__)
+
+class AgentEndpoint:
+    """Agent の呼び出し先（エイリアス・リージョン）と直近の計測値"""
+
+    def __init__(self, name: str, agent_id: str, alias_id: str, region: str, weight: float = 1.0):
+        self.name = name
+        self.agent_id = agent_id
+        self.alias_id = alias_id
+        self.region = region
+        self.weight = weight
+        # (記録時刻, TTFB ms, 成功したか)
+        self.samples = deque(maxlen=AGENT_ROUTING_WINDOW)
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.selections = 0
+
+    def _recent(self, now: float) -> List[tuple]:
+        cutoff = now - AGENT_ROUTING_WINDOW_SECONDS
+        return [s for s in self.samples if s[0] >= cutoff]
+
+    def score(self, now: float) -> Optional[float]:
+        """小さいほど良い（サンプルがなければ None）"""
+        recent = self._recent(now)
+        if not recent:
+            return None
+        latencies = sorted(s[1] for s in recent if s[2])
+        error_rate = sum(1 for s in recent if not s[2]) / len(recent)
+        if not latencies:
+            return float('inf')
+        return latencies[len(latencies) // 2] * (1 + error_rate * AGENT_ROUTING_ERROR_PENALTY)
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self, now: float = None) -> Dict[str, Any]:
+        now = now or time.time()
+        recent = self._recent(now)
+        latencies = sorted(s[1] for s in recent if s[2])
+        return {
+            'name': self.name,
+            'region': self.region,
+            'aliasId': self.alias_id,
+            'weight': self.weight,
+            'samples': len(recent),
+            'errorRate': round(sum(1 for s in recent if not s[2]) / len(recent), 3) if recent else None,
+            'p50Ms': round(latencies[len(latencies) // 2], 1) if latencies else None,
+            'p95Ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1) if latencies else None,
+            'ejected': not self.available(now),
+            'selections': self.selections
+        }
+
+def load_endpoints(config: str, default_agent_id: str, default_alias_id: str,
+                   default_region: str) -> List[AgentEndpoint]:
+    """AGENT_ENDPOINTS を読み込む（未設定時は既定の1件。不正な場合は ValueError）"""
+    if not config.strip():
+        return [AgentEndpoint('default', default_agent_id, default_alias_id, default_region)]
+    try:
+        entries = json.loads(config)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'AGENT_ENDPOINTS が不正な JSON です: {str(e)}')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('AGENT_ENDPOINTS はエンドポイントの配列で指定してください')
+    endpoints = []
+    for i, entry in enumerate(entries):
+        endpoints.append(AgentEndpoint(
+            name=entry.get('name') or f"{entry.get('region', default_region)}-{i}",
+            agent_id=entry.get('agentId', default_agent_id),
+            alias_id=entry.get('aliasId', default_alias_id),
+            region=entry.get('region', default_region),
+            weight=float(entry.get('weight', 1))
+        ))
+    if len({e.name for e in endpoints}) != len(endpoints):
+        raise ValueError('AGENT_ENDPOINTS の name が重複しています')
+    return endpoints
+
+class AgentRouter:
+    """リクエスト毎の呼び出し先の選択とセッションの固定"""
+
+    def __init__(self, endpoints: List[AgentEndpoint], mode: str = None, rng: random.Random = None):
+        self.endpoints = endpoints
+        self.by_name = {e.name: e for e in endpoints}
+        self.default = endpoints[0]
+        self.mode = mode or AGENT_ROUTING_MODE
+        if self.mode not in ROUTING_MODES:
+            raise ValueError(f'AGENT_ROUTING_MODE は {ROUTING_MODES} のいずれかを指定してください')
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._pins = OrderedDict()
+
+    def select(self, session_id: str = None, pinned: str = None) -> AgentEndpoint:
+        """呼び出し先を選ぶ（固定済みのセッションは固定先。固定先が外されていれば選び直す）"""
+        now = time.time()
+        with self._lock:
+            name = pinned or (self._pins.get(session_id) if session_id else None)
+            endpoint = self.by_name.get(name) if name else None
+            if endpoint is not None and not endpoint.available(now):
+                logger.warning(f"Pinned endpoint {endpoint.name} is ejected; re-routing session {session_id}")
+                endpoint = None
+            if endpoint is None:
+                endpoint = self._choose(now)
+            endpoint.selections += 1
+            if session_id:
+                self._pin(session_id, endpoint.name)
+            return endpoint
+
+    def failover(self, failed: AgentEndpoint, session_id: str = None) -> Optional[AgentEndpoint]:
+        """失敗した呼び出し先以外から再試行先を選ぶ（再試行しない・候補がなければ None）"""
+        if not AGENT_ROUTING_FAILOVER:
+            return None
+        now = time.time()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e is not failed and e.available(now)]
+            if not candidates:
+                return None
+            scored = [e for e in candidates if e.score(now) is not None]
+            endpoint = min(scored, key=lambda e: e.score(now)) if scored else self._weighted(candidates)
+            endpoint.selections += 1
+            if session_id:
+                self._pin(session_id, endpoint.name)
+            logger.warning(f"Failing over from {failed.name} to {endpoint.name}")
+            return endpoint
+
+    def _pin(self, session_id: str, name: str):
+        self._pins[session_id] = name
+        self._pins.move_to_end(session_id)
+        while len(self._pins) > AGENT_ROUTING_PIN_CACHE_SIZE:
+            self._pins.popitem(last=False)
+
+    def _choose(self, now: float) -> AgentEndpoint:
+        candidates = [e for e in self.endpoints if e.available(now)]
+        if not candidates:
+            # 全て外されている場合は外れる時刻が最も早いものを使う
+            return min(self.endpoints, key=lambda e: e.ejected_until)
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.mode == 'weighted':
+            return self._weighted(candidates)
+
+        # 計測値のないエンドポイントは優先して試す
+        unmeasured = [e for e in candidates if e.score(now) is None]
+        if unmeasured:
+            return self._weighted(unmeasured)
+        if self.rng.random() < AGENT_ROUTING_EXPLORE_RATE:
+            return self.rng.choice(candidates)
+        return min(candidates, key=lambda e: e.score(now))
+
+    def _weighted(self, candidates: List[AgentEndpoint]) -> AgentEndpoint:
+        weights = [max(e.weight, 0.0) for e in candidates]
+        if not any(weights):
+            return self.rng.choice(candidates)
+        return self.rng.choices(candidates, weights=weights)[0]
+
+    def record(self, endpoint: AgentEndpoint, ttfb_ms: Optional[float], ok: bool):
+        """呼び出し結果を記録（失敗が続いたエンドポイントは一定時間外す）"""
+        now = time.time()
+        with self._lock:
+            endpoint.samples.append((now, ttfb_ms or 0.0, ok))
+            if ok:
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= AGENT_ROUTING_EJECT_AFTER and len(self.endpoints) > 1:
+                endpoint.ejected_until = now + AGENT_ROUTING_EJECT_SECONDS
+                endpoint.consecutive_failures = 0
+                logger.warning(f"Ejected agent endpoint {endpoint.name} for {AGENT_ROUTING_EJECT_SECONDS}s")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {'mode': self.mode, 'endpoints': [e.stats(now) for e in self.endpoints]}
+
+def create_agent_router(default_agent_id: str, default_alias_id: str, default_region: str) -> AgentRouter:
+    """環境変数の設定からルーターを作成"""
+    return AgentRouter(load_endpoints(AGENT_ENDPOINTS, default_agent_id, default_alias_id, default_region))
@@ -0,0 +1,295 @@
+# asyncio 版ヘルパー - 1回の呼び出し内で独立した DynamoDB / Bedrock 呼び出しを並行実行する
+#
+# aiobotocore がインストールされていれば低レベルクライアントを非同期 I/O で呼び出し、
+# なければ同期ヘルパーの各呼び出しを asyncio.to_thread で実行する（結果・エラー処理は同期版と同じ）。
+# Lambda ハンドラは同期のまま run_async() でコルーチンを実行する（イベントループはスレッド毎に再利用）。
+import os
+import asyncio
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List
+from common import (
+    setup_logger,
+    tracer,
+    client_config_options,
+    context_key,
+    AWS_REGION,
+    CLIENT_MAX_POOL_CONNECTIONS,
+    LEGACY_HISTORY_READS,
+    BATCH_GET_MAX_KEYS
+)
+
+try:
+    from aiobotocore.session import get_session as get_aio_session
+    from aiobotocore.config import AioConfig
+except ImportError:  # aiobotocore はオプション依存
+    get_aio_session = None
+    AioConfig = None
+
+# 非同期 I/O 設定（既定は従来の逐次実行）
+ASYNC_IO_ENABLED = os.environ.get('ASYNC_IO_ENABLED', 'false').lower() == 'true'
+ASYNC_NATIVE_CLIENTS = os.environ.get('ASYNC_NATIVE_CLIENTS', 'true').lower() == 'true'
+
+# aiobotocore がない場合に同期呼び出しを実行するスレッド数（boto3 の接続プールと揃える）
+ASYNC_FALLBACK_WORKERS = int(os.environ.get('ASYNC_FALLBACK_WORKERS', str(CLIENT_MAX_POOL_CONNECTIONS)))
+
+_local = threading.local()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """このスレッドのイベントループ（aiobotocore のクライアントを呼び出し間で再利用するため使い回す）"""
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        # 既定のスレッド数（CPU 数 + 4）ではファンアウト時に待たされるため広げる
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_FALLBACK_WORKERS,
+                                                     thread_name_prefix='async-io'))
+        _local.loop = loop
+    return loop
+
+def run_async(coro):
+    """同期コードからコルーチンを実行して結果を返す"""
+    return get_event_loop().run_until_complete(coro)
+
+def set_native_clients(enabled: bool):
+    """aiobotocore クライアントの使用を切り替える（ローカルのスタンドイン使用時は無効にする）"""
+    global ASYNC_NATIVE_CLIENTS
+    ASYNC_NATIVE_CLIENTS = enabled
+
+class AsyncClientFactory:
+    """aiobotocore クライアントの生成・再利用（1つのイベントループ内で使う）"""
+
+    def __init__(self, region_name: str = None, **config_overrides):
+        self.region_name = region_name or AWS_REGION
+        self.config_overrides = config_overrides
+        self.session = get_aio_session()
+        self._stack = contextlib.AsyncExitStack()
+        self._clients = {}
+        self._lock = asyncio.Lock()
+
+    async def client(self, service_name: str, region_name: str = None, **config_overrides):
+        """低レベルクライアントを取得"""
+        region = region_name or self.region_name
+        options = dict(self.config_overrides, **config_overrides)
+        cache_key = (service_name, region, tuple(sorted(options.items())))
+
+        client = self._clients.get(cache_key)
+        if client is not None:
+            return client
+        async with self._lock:
+            client = self._clients.get(cache_key)
+            if client is None:
+                client = await self._stack.enter_async_context(self.session.create_client(
+                    service_name, region_name=region, config=AioConfig(**client_config_options(**options))
+                ))
+                self._clients[cache_key] = client
+            return client
+
+    async def close(self):
+        await self._stack.aclose()
+        self._clients = {}
+
+def async_client_factory() -> Optional[AsyncClientFactory]:
+    """このスレッドの aiobotocore クライアントファクトリ（aiobotocore がなければ None）"""
+    if get_aio_session is None or not ASYNC_NATIVE_CLIENTS:
+        return None
+    factory = getattr(_local, 'factory', None)
+    if factory is None:
+        factory = _local.factory = AsyncClientFactory()
+    return factory
+
+class AsyncDatabaseHelper:
+    """DatabaseHelper の asyncio 版（safe_* の戻り値・エラー処理は同期版と同じ）"""
+
+    def __init__(self, db_helper):
+        self.db_helper = db_helper
+        self.logger = setup_logger('AsyncDatabaseHelper')
+
+    async def _call(self, table_name: str, operation: str, **kwargs) -> Dict[str, Any]:
+        factory = async_client_factory()
+        if factory is None:
+            return await asyncio.to_thread(self.db_helper._call, table_name, operation, **kwargs)
+        client = await factory.client('dynamodb')
+        response = await getattr(client, operation)(**self.db_helper.encode_request(table_name, kwargs))
+        return self.db_helper.decode_response(table_name, response)
+
+    async def transact_write(self, operations: list) -> None:
+        """TransactWriteItems を実行（失敗時は例外をそのまま送出）"""
+        factory = async_client_factory()
+        if factory is None:
+            return await asyncio.to_thread(self.db_helper.transact_write, operations)
+        client = await factory.client('dynamodb')
+        transact_items = self.db_helper.encode_transact_items(operations)
+        with tracer.span('dynamodb.TransactWriteItems', operations=len(transact_items)):
+            await client.transact_write_items(TransactItems=transact_items)
+
+    async def safe_get_item(self, table_name: str, key: Dict[str, Any],
+                            consistent_read: bool = False) -> Optional[Dict[str, Any]]:
+        try:
+            with tracer.span('dynamodb.GetItem', table=table_name):
+                if consistent_read:
+                    response = await self._call(table_name, 'get_item', Key=key, ConsistentRead=True)
+                else:
+                    response = await self._call(table_name, 'get_item', Key=key)
+                return response.get('Item')
+        except Exception as e:
+            self.logger.error(f"Failed to get item from {table_name}: {str(e)}")
+            return None
+
+    async def safe_put_item(self, table_name: str, item: Dict[str, Any]) -> bool:
+        try:
+            with tracer.span('dynamodb.PutItem', table=table_name):
+                await self._call(table_name, 'put_item', Item=item)
+                return True
+        except Exception as e:
+            self.logger.error(f"Failed to put item to {table_name}: {str(e)}")
+            return False
+
+    async def safe_update_item(self, table_name: str, key: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        try:
+            with tracer.span('dynamodb.UpdateItem', table=table_name):
+                response = await self._call(table_name, 'update_item', Key=key, **kwargs)
+                return response.get('Attributes', {})
+        except Exception as e:
+            self.logger.error(f"Failed to update item in {table_name}: {str(e)}")
+            return None
+
+    async def safe_query(self, table_name: str, **kwargs) -> Optional[list]:
+        try:
+            with tracer.span('dynamodb.Query', table=table_name) as span:
+                response = await self._call(table_name, 'query', **kwargs)
+                items = response.get('Items', [])
+                if span is not None:
+                    span.set_attribute('item_count', len(items))
+                return items
+        except Exception as e:
+            self.logger.error(f"Failed to query {table_name}: {str(e)}")
+            return None
+
+    async def safe_query_page(self, table_name: str, **kwargs) -> Optional[tuple]:
+        try:
+            with tracer.span('dynamodb.Query', table=table_name) as span:
+                response = await self._call(table_name, 'query', **kwargs)
+                items = response.get('Items', [])
+                if span is not None:
+                    span.set_attribute('item_count', len(items))
+                return items, response.get('LastEvaluatedKey')
+        except Exception as e:
+            self.logger.error(f"Failed to query {table_name}: {str(e)}")
+            return None
+
+    async def _batch_get_chunk(self, table_name: str, keys: list, **options) -> list:
+        """100件以下のキーを未処理キーがなくなるまで取得（リクエストの変換・再試行間隔は同期版と共通）"""
+        factory = async_client_factory()
+        if factory is None:
+            items = await asyncio.to_thread(self.db_helper.safe_batch_get_items, table_name, keys, **options)
+            if items is None:
+                raise RuntimeError('BatchGetItem failed')
+            return items
+
+        client = await factory.client('dynamodb')
+        items = []
+        pending = keys
+        attempt = 0
+        while pending:
+            response = await client.batch_get_item(**self.db_helper.encode_batch_get(table_name, pending, options))
+            found, pending = self.db_helper.decode_batch_get(table_name, response)
+            items.extend(found)
+            if pending:
+                attempt += 1
+                await asyncio.sleep(self.db_helper.batch_get_retry_delay(attempt, pending))
+        return items
+
+    async def safe_batch_get_items(self, table_name: str, keys: list, **options) -> Optional[list]:
+        """複数アイテムを BatchGetItem で取得（100件単位のリクエストを並行実行。順序は保証しない）"""
+        try:
+            with tracer.span('dynamodb.BatchGetItem', table=table_name, keys=len(keys)):
+                chunks = await asyncio.gather(*(
+                    self._batch_get_chunk(table_name, keys[start:start + BATCH_GET_MAX_KEYS], **options)
+                    for start in range(0, len(keys), BATCH_GET_MAX_KEYS)
+                ))
+            return [item for chunk in chunks for item in chunk]
+        except Exception as e:
+            self.logger.error(f"Failed to batch get items from {table_name}: {str(e)}")
+            return None
+
+class AsyncProfileHelper:
+    """ProfileHelper の asyncio 版（I/O のないメソッドは同期版に委譲）"""
+
+    def __init__(self, profile_helper, async_db_helper: AsyncDatabaseHelper):
+        self.profile_helper = profile_helper
+        self.db = async_db_helper
+        self.user_table = profile_helper.user_table
+
+    def __getattr__(self, name):
+        return getattr(self.profile_helper, name)
+
+    async def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.safe_get_item(self.user_table, {'userId': user_id})
+
+    async def get_user_profiles(self, user_ids: list) -> Optional[Dict[str, Dict[str, Any]]]:
+        unique_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+        if not unique_ids:
+            return {}
+        items = await self.db.safe_batch_get_items(self.user_table, [{'userId': user_id} for user_id in unique_ids])
+        if items is None:
+            return None
+        return {item['userId']: item for item in items}
+
+class AsyncHistoryHelper:
+    """HistoryHelper の asyncio 版（読み込みの I/O だけを並行実行する）
+
+    クエリ条件・キー・結果の組み立ては同期版のメソッドを使う。書き込みは同期版を使うこと。
+    S3 からの復元（アーカイブ・退避した本文）は同期版を asyncio.to_thread で実行する。
+    """
+
+    def __init__(self, history_helper, async_db_helper: AsyncDatabaseHelper):
+        self.history_helper = history_helper
+        self.db = async_db_helper
+        self.history_table = history_helper.history_table
+        self.logger = setup_logger('AsyncHistoryHelper')
+
+    def __getattr__(self, name):
+        return getattr(self.history_helper, name)
+
+    async def get_context_window(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.safe_get_item(
+            self.history_table,
+            {'userId': user_id, 'timestamp': context_key(session_id)}
+        )
+
+    async def get_session_history(self, user_id: str, session_id: str) -> Optional[list]:
+        """HistoryHelper.get_session_history と同じ（新形式・旧形式の行のクエリと要約行の読み込みを並行実行）"""
+        helper = self.history_helper
+        try:
+            reads = [self.db.safe_query(self.history_table, **helper.session_query(user_id, session_id))]
+            if LEGACY_HISTORY_READS:
+                reads.append(self.db.safe_query(
+                    self.history_table, **helper.legacy_session_query(user_id, session_id)
+                ))
+            if helper.reads_archive():
+                reads.append(self.db.safe_get_item(self.history_table, helper.archive_key(user_id, session_id)))
+            results = await asyncio.gather(*reads)
+            messages = results[0]
+            legacy_messages = results[1] if LEGACY_HISTORY_READS else []
+            tombstone = results[-1] if helper.reads_archive() else None
+            if tombstone:
+                merged = await asyncio.to_thread(helper.merge_session_history, messages, legacy_messages, tombstone)
+            else:
+                merged = helper.merge_session_history(messages, legacy_messages, None)
+            return await self._hydrate_overflow(merged)
+        except Exception as e:
+            self.logger.error(f"Failed to get session history: {str(e)}")
+            return None
+
+    async def _hydrate_overflow(self, messages: Optional[list]) -> Optional[list]:
+        """S3 に退避した本文を復元（退避した本文を含む場合のみスレッドで実行）"""
+        if not messages or not any(m.get('contentRef') for m in messages):
+            return messages
+        return await asyncio.to_thread(self.history_helper.hydrate_overflow, messages)
+
+    async def get_sessions_history(self, user_id: str, session_ids: List[str]) -> Dict[str, Optional[list]]:
+        """複数セッションの履歴を並行取得（sessionId → メッセージ一覧。失敗したセッションは None）"""
+        session_ids = list(dict.fromkeys(session_ids))
+        results = await asyncio.gather(*(self.get_session_history(user_id, sid) for sid in session_ids))
+        return dict(zip(session_ids, results))
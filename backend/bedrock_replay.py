@@ -0,0 +1,284 @@
+# Bedrock Agent イベントストリームの記録と再生
+#
+# 記録: bedrock-agent-runtime クライアントを RecordingAgentRuntime で包むと、invoke_agent の
+#       応答開始までの時間・各イベントの到着時刻・チャンクのバイト数・トレースイベントを
+#       1呼び出し1ファイルの JSON フィクスチャに書き出す（既定で本文とトレースの文字列は伏せ字化）。
+# 再生: ReplayAgentRuntime はフィクスチャを読み込み、記録時の到着時刻どおり（original）、
+#       speed 倍速（accelerated）、待ち時間なし（zero）で同じイベントを返す。
+#   python bedrock_replay.py record fixtures/bedrock --message "こんにちは！"   # 記録（Lambda では BEDROCK_RECORD_DIR）
+#   python benchmarks/bench_handlers.py --replay fixtures/bedrock --replay-mode accelerated --replay-speed 10
+#   python bedrock_replay.py inspect fixtures/bedrock
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from common import setup_logger
+
+# 記録・再生設定（いずれも未設定なら無効）
+BEDROCK_RECORD_DIR = os.environ.get('BEDROCK_RECORD_DIR', '')
+BEDROCK_RECORD_REDACT = os.environ.get('BEDROCK_RECORD_REDACT', 'true').lower() == 'true'
+BEDROCK_REPLAY_DIR = os.environ.get('BEDROCK_REPLAY_DIR', '')
+BEDROCK_REPLAY_MODE = os.environ.get('BEDROCK_REPLAY_MODE', 'original')
+BEDROCK_REPLAY_SPEED = float(os.environ.get('BEDROCK_REPLAY_SPEED', '10'))
+
+FIXTURE_VERSION = 1
+REPLAY_MODES = ('original', 'accelerated', 'zero')
+
+# 伏せ字化しないトレースのキー（種別・ステータスなど本文を含まない値）
+REDACT_KEEP_KEYS = frozenset([
+    'type', 'eventType', 'invocationType', 'source', 'stopReason', 'status', 'traceId',
+    'agentId', 'agentAliasId', 'agentVersion', 'actionGroupName', 'knowledgeBaseId'
+])
+
+logger = setup_logger(__name__)
+
+def redact_text(text: str) -> str:
+    """文字数と UTF-8 のバイト数を保ったまま伏せ字化（空白・改行は残す）"""
+    out = []
+    for char in text:
+        if char.isspace():
+            out.append(char)
+            continue
+        size = len(char.encode('utf-8', 'surrogatepass'))
+        out.append('x' if size == 1 else 'é' if size == 2 else '〇' if size == 3 else '🀫')
+    return ''.join(out)
+
+def redact_value(value: Any, key: str = None) -> Any:
+    """トレースイベントの文字列を再帰的に伏せ字化（構造・数値・真偽値は残す）"""
+    if isinstance(value, dict):
+        return {k: redact_value(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_value(v, key) for v in value]
+    if isinstance(value, str) and key not in REDACT_KEEP_KEYS:
+        return redact_text(value)
+    if isinstance(value, (bytes, bytearray)):
+        return redact_text(bytes(value).decode('utf-8', 'replace'))
+    return value
+
+def _json_value(value: Any) -> Any:
+    """フィクスチャに書けない値（datetime・bytes など）を文字列に"""
+    if isinstance(value, dict):
+        return {k: _json_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_json_value(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode('utf-8', 'replace')
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+def fixture_stats(fixture: Dict[str, Any]) -> Dict[str, Any]:
+    """フィクスチャのタイミング概要"""
+    events = fixture['events']
+    chunks = [event for event in events if event[0] == 'chunk']
+    sizes = [len(event[2].encode('utf-8')) for event in chunks]
+    return {
+        'requestMs': fixture['requestMs'],
+        'firstChunkMs': chunks[0][1] if chunks else None,
+        'totalMs': events[-1][1] if events else fixture['requestMs'],
+        'events': len(events),
+        'chunks': len(chunks),
+        'bytes': sum(sizes),
+        'maxChunkBytes': max(sizes) if sizes else 0,
+        'error': any(event[0] == 'error' for event in events)
+    }
+
+class _RecordingStream:
+    """completion を消費しながら各イベントの到着時刻を記録するラッパー"""
+
+    def __init__(self, recorder: 'RecordingAgentRuntime', stream, fixture: Dict[str, Any], started: float):
+        self.recorder = recorder
+        self.stream = stream
+        self.fixture = fixture
+        self.started = started
+
+    def _offset_ms(self) -> float:
+        return round((time.monotonic() - self.started) * 1000, 1)
+
+    def __iter__(self):
+        events = self.fixture['events']
+        try:
+            for event in self.stream:
+                offset = self._offset_ms()
+                for kind, payload in event.items():
+                    if kind == 'chunk':
+                        text = payload.get('bytes', b'').decode('utf-8', 'replace')
+                        events.append(['chunk', offset, redact_text(text) if self.recorder.redact else text])
+                    else:
+                        payload = redact_value(payload) if self.recorder.redact else payload
+                        events.append([kind, offset, _json_value(payload)])
+                yield event
+        except Exception as e:
+            events.append(['error', self._offset_ms(), type(e).__name__])
+            raise
+        finally:
+            self.recorder.write(self.fixture)
+
+class RecordingAgentRuntime:
+    """invoke_agent のイベントストリームをフィクスチャに記録する bedrock-agent-runtime ラッパー
+
+    ストリームを最後まで（または例外で）消費した時点で1ファイル書き出す。
+    入力文・セッションIDは保存せず、入力文の文字数のみ残す。
+    """
+
+    def __init__(self, client, fixture_dir: str, redact: bool = True):
+        self.client = client
+        self.fixture_dir = fixture_dir
+        self.redact = redact
+        os.makedirs(fixture_dir, exist_ok=True)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def invoke_agent(self, **kwargs):
+        started = time.monotonic()
+        response = self.client.invoke_agent(**kwargs)
+        fixture = {
+            'v': FIXTURE_VERSION,
+            'recordedAt': datetime.utcnow().isoformat(),
+            'redacted': self.redact,
+            'inputChars': len(kwargs.get('inputText', '')),
+            'requestMs': round((time.monotonic() - started) * 1000, 1),
+            'events': []
+        }
+        response = dict(response)
+        response['completion'] = _RecordingStream(self, response.get('completion', []), fixture, started)
+        return response
+
+    def write(self, fixture: Dict[str, Any]) -> Optional[str]:
+        """フィクスチャを書き出す（失敗しても呼び出し元には影響させない）"""
+        name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+        path = os.path.join(self.fixture_dir, name)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(fixture, f, ensure_ascii=False, separators=(',', ':'))
+            return path
+        except Exception as e:
+            logger.error(f"Failed to write Bedrock fixture {path}: {str(e)}")
+            return None
+
+class ReplayEventStream:
+    """記録時の到着時刻に合わせてイベントを返す completion
+
+    待ち時間は呼び出し開始からの絶対時刻で合わせるため、消費側の処理が遅くても
+    記録時より早く届くことはなく、消費側の遅延がそのままレイテンシに現れる。
+    """
+
+    def __init__(self, events: List[list], started: float, scale: float):
+        self.events = events
+        self.started = started
+        self.scale = scale
+
+    def __iter__(self):
+        for kind, offset, payload in self.events:
+            if self.scale:
+                delay = self.started + offset / 1000 * self.scale - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == 'chunk':
+                yield {'chunk': {'bytes': payload.encode('utf-8')}}
+            elif kind == 'error':
+                raise RuntimeError(f'Replayed stream error: {payload}')
+            else:
+                yield {kind: payload}
+
+class ReplayAgentRuntime:
+    """フィクスチャを再生する bedrock-agent-runtime 相当のスタンドイン
+
+    フィクスチャは呼び出し順に循環して使う（同じ呼び出し列には常に同じ応答を返す）。
+    """
+
+    def __init__(self, fixtures: List[Dict[str, Any]], mode: str = 'original', speed: float = None):
+        if not fixtures:
+            raise ValueError('再生するフィクスチャがありません')
+        if mode not in REPLAY_MODES:
+            raise ValueError(f'mode は {", ".join(REPLAY_MODES)} のいずれかで指定してください')
+        self.fixtures = fixtures
+        self.mode = mode
+        if mode == 'zero':
+            self.scale = 0.0
+        elif mode == 'accelerated':
+            self.scale = 1.0 / (speed or BEDROCK_REPLAY_SPEED)
+        else:
+            self.scale = 1.0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dir(cls, fixture_dir: str, mode: str = 'original', speed: float = None) -> 'ReplayAgentRuntime':
+        return cls(load_fixtures(fixture_dir), mode, speed)
+
+    def invoke_agent(self, **kwargs):
+        started = time.monotonic()
+        with self._lock:
+            fixture = self.fixtures[len(self.calls) % len(self.fixtures)]
+            self.calls.append(kwargs)
+        delay = fixture['requestMs'] / 1000 * self.scale
+        if delay > 0:
+            time.sleep(delay)
+        return {
+            'completion': ReplayEventStream(fixture['events'], started, self.scale),
+            'contentType': 'application/json',
+            'sessionId': kwargs.get('sessionId')
+        }
+
+def load_fixtures(fixture_dir: str) -> List[Dict[str, Any]]:
+    """ディレクトリ内のフィクスチャをファイル名順に読み込む"""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(fixture_dir, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            fixture = json.load(f)
+        if fixture.get('v') != FIXTURE_VERSION:
+            logger.warning(f"Skipping fixture with unsupported version: {path}")
+            continue
+        fixtures.append(fixture)
+    return fixtures
+
+def configure_agent_runtime(client):
+    """環境変数に応じて bedrock-agent-runtime クライアントを再生・記録用に差し替える"""
+    if BEDROCK_REPLAY_DIR:
+        logger.info(f"Replaying Bedrock fixtures from {BEDROCK_REPLAY_DIR} ({BEDROCK_REPLAY_MODE})")
+        return ReplayAgentRuntime.from_dir(BEDROCK_REPLAY_DIR, BEDROCK_REPLAY_MODE, BEDROCK_REPLAY_SPEED)
+    if BEDROCK_RECORD_DIR:
+        logger.info(f"Recording Bedrock event streams to {BEDROCK_RECORD_DIR}")
+        return RecordingAgentRuntime(client, BEDROCK_RECORD_DIR, BEDROCK_RECORD_REDACT)
+    return client
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bedrock Agent イベントストリームの記録・確認')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='実際の Agent を呼び出して記録')
+    record_parser.add_argument('output', help='フィクスチャの出力ディレクトリ')
+    record_parser.add_argument('--message', action='append', required=True, help='入力文（複数指定可）')
+    record_parser.add_argument('--no-redact', action='store_true', help='本文を伏せ字化せずに保存')
+
+    inspect_parser = subparsers.add_parser('inspect', help='フィクスチャのタイミング概要を表示')
+    inspect_parser.add_argument('fixtures', help='フィクスチャのディレクトリ')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        import chat_lambda_refactored
+
+        chat_lambda_refactored.bedrock_agent_runtime = RecordingAgentRuntime(
+            chat_lambda_refactored.bedrock_agent_runtime, args.output, redact=not args.no_redact
+        )
+        for message in args.message:
+            chat_lambda_refactored.invoke_bedrock_agent(message, f'record-{uuid.uuid4().hex[:12]}')
+    else:
+        paths = sorted(glob.glob(os.path.join(args.fixtures, '*.json')))
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                stats = fixture_stats(json.load(f))
+            stats['file'] = os.path.basename(path)
+            print(json.dumps(stats, ensure_ascii=False))
+        if not paths:
+            print(f'フィクスチャがありません: {args.fixtures}', file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,97 @@
+# Agent エンドポイントのルーティングの効果測定
+#
+# TTFB の異なる2つの呼び出し先（近いリージョン・遠いリージョン相当）をスタンドインで用意し、
+#   static  : 既定の1件だけを使う（従来の動作）
+#   weighted: weight の比率で振り分け
+#   latency : 直近の TTFB が小さい呼び出し先を選ぶ
+# で POST /chat を処理した時のレイテンシと振り分けを比較する。--fail-rate で近い方の呼び出し先を一定の割合で失敗させ、
+# 失敗したエンドポイントを外す動作も確認できる。
+#   python benchmarks/bench_agent_router.py --requests 200 --near-ms 40 --far-ms 180
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_handlers import make_token, percentile
+
+import chat_lambda_refactored
+from agent_router import AgentRouter, AgentEndpoint
+from local_aws import InMemoryDynamoDB, FakeBedrockAgentRuntime, attach_to_handler, seed_dataset
+
+class FlakyAgentRuntime(FakeBedrockAgentRuntime):
+    """一定の割合で失敗するスタンドイン"""
+
+    def __init__(self, fail_rate: float, seed: int, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+
+    def invoke_agent(self, **kwargs):
+        if self.rng.random() < self.fail_rate:
+            self.calls.append(kwargs)
+            raise RuntimeError('throttled')
+        return super().invoke_agent(**kwargs)
+
+def build_router(mode: str) -> AgentRouter:
+    # 既定（先頭）は従来の us-east-1
+    far = AgentEndpoint('virginia', 'AGENT', 'ALIAS_US', 'us-east-1', weight=1)
+    near = AgentEndpoint('tokyo', 'AGENT', 'ALIAS_JP', 'ap-northeast-1', weight=1)
+    if mode == 'static':
+        return AgentRouter([far], mode='latency')
+    return AgentRouter([far, near], mode=mode, rng=random.Random(1))
+
+def main():
+    parser = argparse.ArgumentParser(description='Agent エンドポイントのルーティングの効果測定')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=50, help='リクエストを振り分けるセッション数')
+    parser.add_argument('--near-ms', type=float, default=40.0, help='近いリージョンの TTFB')
+    parser.add_argument('--far-ms', type=float, default=180.0, help='遠いリージョンの TTFB')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='近いリージョンの失敗率')
+    args = parser.parse_args()
+
+    # 失敗時のエラーログで出力の JSON が崩れないようにする
+    logging.disable(logging.CRITICAL)
+    module = chat_lambda_refactored
+    results = []
+    for mode in ('static', 'weighted', 'latency'):
+        dynamodb = InMemoryDynamoDB()
+        seed_dataset(dynamodb, 1, 0, 0)
+        far = FakeBedrockAgentRuntime(first_chunk_ms=args.far_ms)
+        near = FlakyAgentRuntime(args.fail_rate, seed=7, first_chunk_ms=args.near_ms)
+        attach_to_handler(module, dynamodb=dynamodb, bedrock_agent_runtime=far)
+        module.agent_router = build_router(mode)
+        module.regional_agent_runtimes['ap-northeast-1'] = near
+
+        headers = {'Authorization': f"Bearer {make_token('bench-user-0000')}"}
+        latencies, errors = [], 0
+        for i in range(args.requests):
+            event = {
+                'httpMethod': 'POST', 'resource': '/chat', 'path': '/chat', 'headers': headers,
+                'body': json.dumps({'message': '最近ランニングを始めました！', 'sessionId': f'session-{i % args.sessions}'})
+            }
+            t0 = time.perf_counter()
+            response = module.lambda_handler(event, None)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if response['statusCode'] != 200:
+                errors += 1
+        latencies.sort()
+        results.append({
+            'mode': mode,
+            'requests': args.requests,
+            'errors': errors,
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'calls': {'virginia': len(far.calls), 'tokyo': len(near.calls)},
+            'router': module.agent_router.stats()
+        })
+
+    print(json.dumps({'near_ms': args.near_ms, 'far_ms': args.far_ms, 'fail_rate': args.fail_rate,
+                      'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
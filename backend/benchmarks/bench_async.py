@@ -0,0 +1,102 @@
+# asyncio 版ヘルパーのベンチマーク（ファンアウトの多いリクエスト）
+#
+# 擬似レイテンシ付きのインメモリ DynamoDB に対して、複数セッションの履歴取得
+# （セッション毎に新形式・旧形式の2クエリ）とチャットの前処理（プロフィール + 直近会話の読み込み）を
+# 逐次実行・スレッドプール・asyncio.gather で比較する。
+#   python benchmarks/bench_async.py --sessions 1,5,20 --db-latency-ms 5
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import async_helpers
+from common import DatabaseHelper, ProfileHelper, HistoryHelper, USER_TABLE, HISTORY_TABLE
+from async_helpers import AsyncDatabaseHelper, AsyncProfileHelper, AsyncHistoryHelper, run_async
+from local_aws import InMemoryDynamoDB, seed_dataset
+
+USER_ID = 'bench-user-0000'
+
+def median_ms(func, repeat):
+    wall, cpu = [], []
+    for _ in range(repeat):
+        t0, c0 = time.perf_counter(), time.process_time()
+        func()
+        wall.append(time.perf_counter() - t0)
+        cpu.append(time.process_time() - c0)
+    wall.sort()
+    cpu.sort()
+    return round(wall[len(wall) // 2] * 1000, 2), round(cpu[len(cpu) // 2] * 1000, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description='asyncio 版ヘルパーのベンチマーク')
+    parser.add_argument('--sessions', default='1,5,20', help='1リクエストで取得するセッション数')
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    async_helpers.set_native_clients(False)
+    counts = [int(n) for n in args.sessions.split(',')]
+
+    dynamodb = InMemoryDynamoDB(latency_ms=args.db_latency_ms)
+    seed_dataset(dynamodb, 1, max(counts), 10)
+    db_helper = DatabaseHelper(dynamodb)
+    profile_helper = ProfileHelper(db_helper, USER_TABLE)
+    history_helper = HistoryHelper(db_helper, HISTORY_TABLE)
+    async_db = AsyncDatabaseHelper(db_helper)
+    async_profile = AsyncProfileHelper(profile_helper, async_db)
+    async_history = AsyncHistoryHelper(history_helper, async_db)
+
+    results = []
+    for count in counts:
+        session_ids = [f'session-0000-{s:04d}' for s in range(count)]
+
+        def sequential():
+            return {sid: history_helper.get_session_history(USER_ID, sid) for sid in session_ids}
+
+        def threaded():
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                return dict(zip(session_ids, executor.map(
+                    lambda sid: history_helper.get_session_history(USER_ID, sid), session_ids
+                )))
+
+        def gathered():
+            return run_async(async_history.get_sessions_history(USER_ID, session_ids))
+
+        expected = sequential()
+        assert threaded() == expected and gathered() == expected
+
+        row = {'scenario': 'get_sessions', 'sessions': count, 'queries': count * 2}
+        for name, func in (('sequential', sequential), ('threads', threaded), ('asyncio', gathered)):
+            row[f'{name}_ms'], row[f'{name}_cpu_ms'] = median_ms(func, args.repeat)
+        row['asyncio_speedup'] = round(row['sequential_ms'] / row['asyncio_ms'], 1)
+        results.append(row)
+
+    # チャットの前処理（プロフィールと直近会話ウィンドウ）
+    def chat_sequential():
+        return (profile_helper.get_user_profile(USER_ID),
+                history_helper.get_context_window(USER_ID, 'session-0000-0000'))
+
+    async def load():
+        return await asyncio.gather(async_profile.get_user_profile(USER_ID),
+                                    async_history.get_context_window(USER_ID, 'session-0000-0000'))
+
+    row = {'scenario': 'chat_context', 'queries': 2}
+    row['sequential_ms'], row['sequential_cpu_ms'] = median_ms(chat_sequential, args.repeat)
+    row['asyncio_ms'], row['asyncio_cpu_ms'] = median_ms(lambda: run_async(load()), args.repeat)
+    row['asyncio_speedup'] = round(row['sequential_ms'] / row['asyncio_ms'], 1)
+    results.append(row)
+
+    print(json.dumps({
+        'db_latency_ms': args.db_latency_ms,
+        'native_clients': async_helpers.get_aio_session is not None,
+        'results': results
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# 履歴アイテムのデコード速度比較: boto3 TypeDeserializer vs dynamo_codec.ItemCodec
+#   python benchmarks/bench_codec.py --items 5000
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from boto3.dynamodb.types import TypeDeserializer
+from dynamo_codec import HISTORY_CODEC
+
+def make_wire_items(count):
+    """Query レスポンスと同じ低レベル形式の履歴アイテムを生成"""
+    items = []
+    for i in range(count):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        timestamp = f'2025-01-{(i // 1000) % 28 + 1:02d}T12:{(i // 60) % 60:02d}:{i % 60:02d}.{i:06d}'
+        content = ('今日はちょっと疲れました。' if role == 'user'
+                   else 'お疲れさまです！まずは深呼吸してみましょう。温かい飲み物でひと休みするのもおすすめです。') * 3
+        items.append({
+            'userId': {'S': 'bench-user'},
+            'timestamp': {'S': timestamp},
+            'sessionId': {'S': f'session-{i // 20}'},
+            'role': {'S': role},
+            'content': {'S': content},
+            'messageId': {'S': f'session-{i // 20}_{timestamp}_{role}'},
+            'tokenCount': {'N': str(len(content))}
+        })
+    return items
+
+def best_of(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='履歴アイテムデコードベンチマーク')
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    wire_items = make_wire_items(args.items)
+    deserializer = TypeDeserializer()
+
+    def decode_resource():
+        return [{k: deserializer.deserialize(v) for k, v in item.items()} for item in wire_items]
+
+    def decode_codec():
+        return HISTORY_CODEC.decode_items(wire_items)
+
+    resource_time, resource_items = best_of(decode_resource, args.repeat)
+    codec_time, codec_items = best_of(decode_codec, args.repeat)
+
+    # ResponseBuilder.success と同等のシリアライズ
+    dumps_resource, _ = best_of(lambda: json.dumps(resource_items, ensure_ascii=False, default=str), args.repeat)
+    dumps_codec, _ = best_of(lambda: json.dumps(codec_items, ensure_ascii=False), args.repeat)
+
+    print(json.dumps({
+        'items': args.items,
+        'type_deserializer_ms': round(resource_time * 1000, 2),
+        'item_codec_ms': round(codec_time * 1000, 2),
+        'decode_speedup': round(resource_time / codec_time, 1),
+        'json_dumps_decimal_default_str_ms': round(dumps_resource * 1000, 2),
+        'json_dumps_native_ms': round(dumps_codec * 1000, 2)
+    }, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
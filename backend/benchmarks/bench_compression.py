@@ -0,0 +1,72 @@
+# 履歴レスポンス圧縮の CPU コストと削減バイト数
+#   python benchmarks/bench_compression.py --sizes 10,100,1000
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compression import compress_bytes, brotli
+
+def make_session_body(messages):
+    """セッション詳細レスポンス相当の日本語 JSON"""
+    replies = [
+        'お疲れさまです！毎日本当によく頑張っていますね。まずは今日できたことを一つ思い出してみましょう。',
+        '不安な気持ち、よくわかります。面接の前は誰でも緊張するものです。深呼吸して、準備してきたことを信じましょう。',
+        '素敵な目標ですね！小さな一歩から始めれば大丈夫です。明日の朝、5分だけ散歩してみるのはいかがでしょう。'
+    ]
+    body = {
+        'sessionId': 'session-000001',
+        'messages': [
+            {
+                'role': 'user' if i % 2 == 0 else 'assistant',
+                'content': '最近仕事が忙しくて、なかなか休めていません。' if i % 2 == 0 else replies[i % 3] * 2,
+                'timestamp': f'2025-01-01T09:{i // 60 % 60:02d}:{i % 60:02d}.000000'
+            }
+            for i in range(messages)
+        ],
+        'messageCount': messages
+    }
+    return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+def best_of(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description='レスポンス圧縮ベンチマーク')
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+    if brotli is not None:
+        cases += [('br', 1), ('br', 5), ('br', 11)]
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        raw = make_session_body(size)
+        for encoding, level in cases:
+            elapsed, compressed = best_of(lambda: compress_bytes(raw, encoding, level), args.repeat)
+            b64 = base64.b64encode(compressed)
+            print(json.dumps({
+                'messages': size,
+                'encoding': encoding,
+                'level': level,
+                'raw_bytes': len(raw),
+                'compressed_bytes': len(compressed),
+                'base64_bytes': len(b64),
+                'saved_ratio': round(1 - len(b64) / len(raw), 3),
+                'compress_ms': round(elapsed, 3),
+                'mb_per_sec': round(len(raw) / 1e6 / (elapsed / 1000), 1)
+            }))
+
+if __name__ == "__main__":
+    main()
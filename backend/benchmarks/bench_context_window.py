@@ -0,0 +1,89 @@
+# 直近会話ウィンドウのターン毎レイテンシ計測
+#
+# チャット POST を以下の3方式で実行し、履歴参照によって増えるレイテンシを比較する。
+#   off    : 履歴参照なし（従来）
+#   window : CONTEXT#<sessionId> 行を GetItem し、ターンと一緒に TransactWriteItems で更新
+#   naive  : 毎ターン get_session_history でセッションの全メッセージをクエリ
+#   python benchmarks/bench_context_window.py --turns 40 --db-latency-ms 5
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_handlers import make_token, percentile, USER_MESSAGES
+
+import chat_lambda_refactored
+from local_aws import InMemoryDynamoDB, FakeBedrockAgentRuntime, attach_to_handler
+
+def naive_context_window(user_id, session_id):
+    """セッション履歴のクエリから直近ウィンドウ相当を作成（比較用）"""
+    messages = chat_lambda_refactored.history_helper.get_session_history(user_id, session_id) or []
+    turns = [{'role': m.get('role'), 'content': m.get('content', '')} for m in messages]
+    return {'turns': turns} if turns else None
+
+def run_mode(mode, sessions, turns, db_latency_ms):
+    dynamodb = InMemoryDynamoDB(latency_ms=db_latency_ms)
+    attach_to_handler(chat_lambda_refactored, dynamodb=dynamodb, bedrock_agent_runtime=FakeBedrockAgentRuntime())
+    helper = chat_lambda_refactored.history_helper
+    original = helper.get_context_window
+    chat_lambda_refactored.CONTEXT_WINDOW_ENABLED = mode != 'off'
+    if mode == 'naive':
+        helper.get_context_window = naive_context_window
+        helper.save_turn = lambda items, window=None, endpoint=None: all([helper.save_message_item(i) for i in items])
+
+    token = make_token('bench-user-context')
+    headers = {'Authorization': f'Bearer {token}'}
+    latencies = []
+    errors = 0
+    try:
+        for turn in range(turns):
+            for s in range(sessions):
+                event = {
+                    'httpMethod': 'POST',
+                    'headers': headers,
+                    'body': json.dumps({'message': USER_MESSAGES[turn % len(USER_MESSAGES)],
+                                        'sessionId': f'context-{s}'}, ensure_ascii=False)
+                }
+                t0 = time.perf_counter()
+                response = chat_lambda_refactored.lambda_handler(event, None)
+                latencies.append(time.perf_counter() - t0)
+                if response['statusCode'] >= 400:
+                    errors += 1
+        calls = chat_lambda_refactored.bedrock_agent_runtime.calls
+        prompt_chars = [len(call['inputText']) for call in calls]
+        db_calls = dynamodb.Table(chat_lambda_refactored.HISTORY_TABLE).call_counts
+    finally:
+        helper.get_context_window = original
+        helper.__dict__.pop('save_turn', None)
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'turns': turns * sessions,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'avg_prompt_chars': round(sum(prompt_chars) / len(prompt_chars), 1),
+        'history_table_calls': db_calls
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='直近会話ウィンドウのレイテンシ計測')
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=40, help='セッション毎のターン数')
+    parser.add_argument('--db-latency-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = [run_mode(mode, args.sessions, args.turns, args.db_latency_ms) for mode in ('off', 'window', 'naive')]
+    baseline = results[0]['mean_ms']
+    for result in results:
+        result['added_ms_per_turn'] = round(result['mean_ms'] - baseline, 3)
+    print(json.dumps({'db_latency_ms': args.db_latency_ms, 'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# DatabaseHelper のテーブルハンドルキャッシュ・接続プール設定のマイクロベンチマーク
+#
+# ローカルの HTTP サーバーを DynamoDB エンドポイントとして使い、
+# スレッドプールからの safe_get_item 1回あたりのオーバーヘッドを比較する。
+#   python benchmarks/bench_db_pool.py --threads 32 --calls 2000 --latency-ms 2
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+import boto3
+from botocore.config import Config
+from common import DatabaseHelper, ClientFactory
+
+class _DynamoHandler(BaseHTTPRequestHandler):
+    """GetItem に空レスポンスを返すだけのスタブエンドポイント"""
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        body = b'{"Item": {"userId": {"S": "bench-user"}}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _UncachedDatabaseHelper(DatabaseHelper):
+    """キャッシュ導入前の挙動（毎回 Table を生成）"""
+
+    def get_table(self, table_name):
+        return self.dynamodb.Table(table_name)
+
+def run_case(name, db_helper, threads, calls):
+    latencies = []
+    lock = threading.Lock()
+
+    def one_call(i):
+        start = time.perf_counter()
+        db_helper.safe_get_item('GenkiChatUserTable', {'userId': f'user-{i % 100}'})
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    # ウォームアップ
+    for i in range(threads):
+        one_call(i)
+    latencies.clear()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one_call, range(calls)))
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'case': name,
+        'threads': threads,
+        'calls': calls,
+        'throughput_per_sec': round(calls / total, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='DatabaseHelper 接続プールベンチマーク')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    _DynamoHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _DynamoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+
+    # 変更前: 既定の Config（プール10）・毎回 Table 生成
+    default_resource = boto3.session.Session().resource(
+        'dynamodb', region_name='ap-northeast-1', endpoint_url=endpoint,
+        config=Config(retries={'mode': 'legacy'})
+    )
+    baseline = _UncachedDatabaseHelper(default_resource)
+
+    # 変更後: ClientFactory の Config・テーブルハンドルキャッシュ
+    factory = ClientFactory(region_name='ap-northeast-1', max_pool_connections=max(args.threads, 10))
+    tuned_resource = factory.session.resource(
+        'dynamodb', region_name='ap-northeast-1', endpoint_url=endpoint,
+        config=factory.resource('dynamodb').meta.client.meta.config
+    )
+    tuned = DatabaseHelper(tuned_resource)
+
+    results = [
+        run_case('default_config_uncached_table', baseline, args.threads, args.calls),
+        run_case('tuned_pool_cached_table', tuned, args.threads, args.calls)
+    ]
+
+    # Table ハンドル生成そのもののコスト
+    start = time.perf_counter()
+    for _ in range(1000):
+        default_resource.Table('GenkiChatUserTable')
+    uncached_us = (time.perf_counter() - start) / 1000 * 1e6
+    start = time.perf_counter()
+    for _ in range(1000):
+        tuned.get_table('GenkiChatUserTable')
+    cached_us = (time.perf_counter() - start) / 1000 * 1e6
+    results.append({
+        'case': 'get_table_only',
+        'uncached_us_per_call': round(uncached_us, 2),
+        'cached_us_per_call': round(cached_us, 3)
+    })
+
+    server.shutdown()
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
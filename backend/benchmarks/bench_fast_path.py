@@ -0,0 +1,111 @@
+# 雑談の高速経路の効果測定
+#
+# Agent（オーケストレーションを挟むため最初のチャンクまでが長い）と基盤モデルの直接呼び出しをスタンドインで用意し、
+# 短い雑談と相談を混ぜた POST /chat を
+#   off: 全て Agent（従来の動作）
+#   on : FastPathPolicy の判定で短い雑談だけ直接呼び出し
+# で処理した時のレイテンシを比較する。--sample-rate を 1 未満にすると対象のターンの一部を Agent に送り、
+# 同じ条件のターンの経路毎のレイテンシ（eligibleLatency）を比べられる。--fail-rate で直接呼び出しを失敗させ、
+# Agent への切り替えも確認できる。
+#   python benchmarks/bench_fast_path.py --requests 200 --agent-ms 800 --direct-ms 200
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_handlers import make_token, percentile
+
+import chat_lambda_refactored
+from fast_path import FastPathPolicy, FastPathMetrics
+from local_aws import InMemoryDynamoDB, FakeBedrockAgentRuntime, FakeBedrockRuntime, attach_to_handler, seed_dataset
+
+SMALL_TALK = ['おはよう！', 'ありがとう', '今日は晴れてるね', 'ただいま〜', 'おやすみなさい', 'お昼ごはん食べた！']
+CONSULTATIONS = [
+    '最近仕事がうまくいかなくて不安です。どうしたらいいでしょうか？',
+    '転職するかどうか悩んでいます。今の職場は人間関係は良いのですが、給料が上がる見込みがありません。',
+    '夜なかなか眠れない日が続いていて、昼間も集中できません。何か良い習慣はありますか？'
+]
+
+class FlakyBedrockRuntime(FakeBedrockRuntime):
+    """一定の割合で失敗するスタンドイン"""
+
+    def __init__(self, fail_rate: float, seed: int, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+
+    def converse_stream(self, **kwargs):
+        if self.rng.random() < self.fail_rate:
+            self.calls.append(kwargs)
+            raise RuntimeError('throttled')
+        return super().converse_stream(**kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description='雑談の高速経路の効果測定')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--small-talk-ratio', type=float, default=0.6, help='短い雑談の割合')
+    parser.add_argument('--agent-ms', type=float, default=800.0, help='Agent の最初のチャンクまでの時間')
+    parser.add_argument('--direct-ms', type=float, default=200.0, help='直接呼び出しの最初のチャンクまでの時間')
+    parser.add_argument('--sample-rate', type=float, default=1.0, help='対象のターンのうち高速経路に送る割合')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='直接呼び出しの失敗率')
+    args = parser.parse_args()
+
+    # 失敗時のログで出力の JSON が崩れないようにする
+    logging.disable(logging.CRITICAL)
+    module = chat_lambda_refactored
+    rng = random.Random(3)
+    messages = [rng.choice(SMALL_TALK) if rng.random() < args.small_talk_ratio else rng.choice(CONSULTATIONS)
+                for _ in range(args.requests)]
+
+    results = []
+    for mode in ('off', 'on'):
+        dynamodb = InMemoryDynamoDB()
+        seed_dataset(dynamodb, 1, 0, 0)
+        agent = FakeBedrockAgentRuntime(first_chunk_ms=args.agent_ms)
+        direct = FlakyBedrockRuntime(args.fail_rate, seed=7, first_chunk_ms=args.direct_ms)
+        attach_to_handler(module, dynamodb=dynamodb, bedrock_agent_runtime=agent, bedrock_runtime=direct)
+        module.fast_path_policy = FastPathPolicy(enabled=mode == 'on', sample_rate=args.sample_rate,
+                                                 rng=random.Random(1))
+        module.fast_path_metrics = FastPathMetrics()
+
+        headers = {'Authorization': f"Bearer {make_token('bench-user-0000')}"}
+        latencies = {'small_talk': [], 'consultation': []}
+        errors = 0
+        for i, message in enumerate(messages):
+            event = {
+                'httpMethod': 'POST', 'resource': '/chat', 'path': '/chat', 'headers': headers,
+                'body': json.dumps({'message': message, 'sessionId': f'session-{i % 20}'})
+            }
+            t0 = time.perf_counter()
+            response = module.lambda_handler(event, None)
+            kind = 'small_talk' if message in SMALL_TALK else 'consultation'
+            latencies[kind].append((time.perf_counter() - t0) * 1000)
+            if response['statusCode'] != 200:
+                errors += 1
+
+        summary = {}
+        for kind, values in latencies.items():
+            values.sort()
+            if values:
+                summary[kind] = {
+                    'requests': len(values),
+                    'p50_ms': round(percentile(values, 50), 2),
+                    'p95_ms': round(percentile(values, 95), 2)
+                }
+        results.append({
+            'mode': mode,
+            'errors': errors,
+            'latency': summary,
+            'calls': {'agent': len(agent.calls), 'direct': len(direct.calls)},
+            'metrics': module.fast_path_metrics.stats()
+        })
+
+    print(json.dumps({'agent_ms': args.agent_ms, 'direct_ms': args.direct_ms, 'sample_rate': args.sample_rate,
+                      'fail_rate': args.fail_rate, 'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Lambda ハンドラのベンチマークスイート
+#
+# インメモリ DynamoDB・Bedrock スタンドイン（local_aws.py）に対して各 lambda_handler を実行し、
+# スループット・p50/p99 レイテンシ・ピークメモリを JSON で出力する。
+#   python benchmarks/bench_handlers.py --users 10 --sessions 20 --messages 10 --output bench.json
+#   python benchmarks/bench_handlers.py --compare bench_before.json
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+import jwt
+import chat_lambda_refactored
+import history_lambda_refactored
+import profile_lambda_refactored
+from local_aws import InMemoryDynamoDB, FakeBedrockAgentRuntime, attach_to_handler, seed_dataset, USER_MESSAGES
+from bedrock_replay import ReplayAgentRuntime, REPLAY_MODES
+
+def make_token(user_id):
+    """署名検証なしでデコードされる JWT を生成"""
+    return jwt.encode({'sub': user_id, 'email': f'{user_id}@example.com'}, 'benchmark-secret-key-0123456789abcdef')
+
+def build_scenarios(users, sessions):
+    """シナリオ名 → (ハンドラ, イベント生成関数, 最大実行回数)"""
+    tokens = [make_token(f'bench-user-{u:04d}') for u in range(users)]
+
+    def headers(i):
+        return {'Authorization': f'Bearer {tokens[i % users]}'}
+
+    def chat_event(i):
+        return {
+            'httpMethod': 'POST',
+            'headers': headers(i),
+            'body': json.dumps({'message': USER_MESSAGES[i % len(USER_MESSAGES)],
+                                'sessionId': f'bench-chat-{i % 50}'}, ensure_ascii=False)
+        }
+
+    def history_get_event(i):
+        return {'httpMethod': 'GET', 'headers': headers(i)}
+
+    def history_delete_event(i):
+        u = i % users
+        s = (i // users) % sessions
+        return {
+            'httpMethod': 'DELETE',
+            'headers': headers(u),
+            'queryStringParameters': {'sessionId': f'session-{u:04d}-{s:04d}'}
+        }
+
+    def profile_get_event(i):
+        return {'httpMethod': 'GET', 'headers': headers(i)}
+
+    def profile_post_event(i):
+        return {
+            'httpMethod': 'POST',
+            'headers': headers(i),
+            'body': json.dumps({'userName': f'ユーザー{i}', 'age': '20代', 'occupation': '学生',
+                                'gender': '答えない', 'responseLength': 'short'}, ensure_ascii=False)
+        }
+
+    # DELETE はデータを消費するため最後に、セッション数までしか実行しない
+    return [
+        ('chat_post', chat_lambda_refactored.lambda_handler, chat_event, None),
+        ('history_get', history_lambda_refactored.lambda_handler, history_get_event, None),
+        ('profile_get', profile_lambda_refactored.lambda_handler, profile_get_event, None),
+        ('profile_post', profile_lambda_refactored.lambda_handler, profile_post_event, None),
+        ('history_delete', history_lambda_refactored.lambda_handler, history_delete_event, users * sessions)
+    ]
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def run_scenario(name, handler, make_event, iterations, memory_iterations):
+    # ウォームアップ
+    handler(make_event(0), None)
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(1, iterations + 1):
+        event = make_event(i)
+        t0 = time.perf_counter()
+        response = handler(event, None)
+        latencies.append(time.perf_counter() - t0)
+        if response.get('statusCode', 500) >= 400:
+            errors += 1
+    total = time.perf_counter() - start
+
+    # ピークメモリは tracemalloc のオーバーヘッドを避けて別パスで計測
+    tracemalloc.start()
+    for i in range(iterations + 1, iterations + 1 + memory_iterations):
+        handler(make_event(i), None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'errors': errors,
+        'throughput_per_sec': round(iterations / total, 1) if total else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1)
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def compare(current, baseline_path):
+    """以前の結果ファイルとの比較を出力"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {r['scenario']: r for r in json.load(f)['results']}
+    rows = []
+    for result in current['results']:
+        before = baseline.get(result['scenario'])
+        if not before:
+            continue
+        rows.append({
+            'scenario': result['scenario'],
+            'throughput_ratio': round(result['throughput_per_sec'] / before['throughput_per_sec'], 3)
+            if before.get('throughput_per_sec') else None,
+            'p50_ms_delta': round(result['p50_ms'] - before['p50_ms'], 3),
+            'p99_ms_delta': round(result['p99_ms'] - before['p99_ms'], 3),
+            'peak_memory_kb_delta': round(result['peak_memory_kb'] - before['peak_memory_kb'], 1)
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Lambda ハンドラベンチマーク')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--memory-iterations', type=int, default=20)
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='DynamoDB 呼び出し毎の擬似レイテンシ')
+    parser.add_argument('--scenarios', default=None, help='カンマ区切りで対象シナリオを限定')
+    parser.add_argument('--replay', default=None, help='Bedrock 応答を再生するフィクスチャのディレクトリ')
+    parser.add_argument('--replay-mode', default='original', choices=REPLAY_MODES)
+    parser.add_argument('--replay-speed', type=float, default=10.0, help='accelerated モードの倍速')
+    parser.add_argument('--output', default=None, help='結果 JSON の出力先（省略時は標準出力）')
+    parser.add_argument('--compare', default=None, help='比較対象の結果 JSON')
+    args = parser.parse_args()
+
+    # ハンドラの INFO ログは計測対象外
+    logging.disable(logging.INFO)
+
+    dynamodb = InMemoryDynamoDB(latency_ms=args.db_latency_ms)
+    seed_dataset(dynamodb, args.users, args.sessions, args.messages)
+    if args.replay:
+        bedrock = ReplayAgentRuntime.from_dir(args.replay, args.replay_mode, args.replay_speed)
+    else:
+        bedrock = FakeBedrockAgentRuntime()
+    for module in (chat_lambda_refactored, history_lambda_refactored, profile_lambda_refactored):
+        attach_to_handler(module, dynamodb=dynamodb, bedrock_agent_runtime=bedrock)
+
+    selected = set(args.scenarios.split(',')) if args.scenarios else None
+    results = []
+    for name, handler, make_event, limit in build_scenarios(args.users, args.sessions):
+        if selected and name not in selected:
+            continue
+        iterations = args.iterations if limit is None else max(1, min(args.iterations, limit - args.memory_iterations - 1))
+        results.append(run_scenario(name, handler, make_event, iterations, args.memory_iterations))
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'dataset': {'users': args.users, 'sessions': args.sessions, 'messages': args.messages,
+                    'db_latency_ms': args.db_latency_ms,
+                    'bedrock': f'replay:{args.replay_mode}' if args.replay else 'synthetic'},
+        'results': results
+    }
+    if args.compare:
+        report['comparison'] = compare(report, args.compare)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
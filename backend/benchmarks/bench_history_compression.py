@@ -0,0 +1,139 @@
+# 履歴本文圧縮の RCU/WCU・レイテンシへの影響
+#   python benchmarks/bench_history_compression.py --replies 2000
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import history_compression
+from history_compression import compress_text, decompress_text, train_dictionary, zstandard
+
+OPENINGS = [
+    'お疲れさまです！毎日本当によく頑張っていますね。',
+    'お話ししてくれてありがとうございます！',
+    'その気持ち、とてもよくわかります。',
+    '不安になるのは自然なことですよ。',
+    '素敵な目標ですね！聞いているだけでワクワクします。'
+]
+BODIES = [
+    'そう感じるのは、それだけ真剣に向き合っている証拠です。',
+    '完璧を目指さなくても大丈夫です。できたことに目を向けてみましょう。',
+    '誰かに話を聞いてもらうだけでも、気持ちが軽くなることがありますよ。',
+    '睡眠・食事・運動のバランスを整えることも大切です。',
+    '忙しい日が続くと、自分のための時間を後回しにしてしまいがちですよね。',
+    '面接では、これまでの経験を自分の言葉で伝えることが一番大切です。',
+    '新しいことを始めるときは、最初の一週間が一番大変です。',
+    '人間関係の悩みは、一人で抱え込まないことが大事です。'
+]
+ACTIONS = [
+    '寝る前の10分間はスマートフォンを置いて、ゆっくり深呼吸してみましょう。',
+    '今日できたことを3つ、ノートに書き出してみてください。',
+    '5分だけ散歩して、外の空気を吸ってみるのはいかがでしょう。',
+    '好きな音楽を聴いたり、温かい飲み物を飲んだりしてリラックスしましょう。',
+    '想定される質問を3つ選んで、声に出して答える練習をしてみましょう。',
+    '信頼できる友人に、今の気持ちを少しだけ話してみてください。',
+    '週に一度、自分へのご褒美の日を決めてみましょう。'
+]
+CLOSINGS = [
+    'あなたならきっと大丈夫です。応援しています！',
+    '無理をせず、自分のペースで進んでいきましょう。',
+    '小さな一歩でも、前に進んでいることに変わりはありません。'
+]
+
+def make_reply(rng):
+    """ゲンキちゃんの応答パターン（受け止め→共感→前向きな視点→3つの提案→励まし）"""
+    parts = [rng.choice(OPENINGS), ''.join(rng.sample(BODIES, rng.randint(2, 4)))]
+    parts.append('具体的にできることを3つ提案しますね。')
+    parts.append('\n'.join(f'{i + 1}. {a}' for i, a in enumerate(rng.sample(ACTIONS, 3))))
+    parts.append(''.join(rng.sample(BODIES, rng.randint(1, 3))))
+    parts.append(rng.choice(CLOSINGS))
+    return '\n\n'.join(parts)
+
+def item_size(content_attrs):
+    """DynamoDB のアイテムサイズ（属性名 + 値のバイト数）"""
+    base = {'userId': 'a1b2c3d4-e5f6-7890-abcd-ef1234567890',
+            'timestamp': 'SESSION#8f14e45f-ceea-467f-a0e5-7e5c1c3b1a2d#01JABCDEFGHJKMNPQRSTVWXYZ0',
+            'sessionId': '8f14e45f-ceea-467f-a0e5-7e5c1c3b1a2d', 'role': 'assistant',
+            'createdAt': '2025-01-01T09:00:00.000000',
+            'messageId': '8f14e45f-ceea-467f-a0e5-7e5c1c3b1a2d_01JABCDEFGHJKMNPQRSTVWXYZ0_assistant'}
+    size = 0
+    for name, value in list(base.items()) + list(content_attrs.items()):
+        size += len(name.encode('utf-8'))
+        size += len(value) if isinstance(value, bytes) else len(value.encode('utf-8'))
+    return size
+
+def evaluate(name, replies, encode, decode):
+    sizes = []
+    encode_time = 0.0
+    decode_time = 0.0
+    for reply in replies:
+        t0 = time.perf_counter()
+        attrs = encode(reply)
+        t1 = time.perf_counter()
+        restored = decode(attrs)
+        t2 = time.perf_counter()
+        assert restored == reply
+        encode_time += t1 - t0
+        decode_time += t2 - t1
+        sizes.append(item_size(attrs))
+
+    count = len(replies)
+    # 20 メッセージのセッションを Query で読む場合の RCU（強い整合性, 4KB 単位）
+    session_rcu = [math.ceil(sum(sizes[i:i + 20]) / 4096) for i in range(0, count, 20)]
+    return {
+        'codec': name,
+        'avg_item_bytes': round(sum(sizes) / count, 1),
+        'avg_wcu_per_put': round(sum(math.ceil(s / 1024) for s in sizes) / count, 3),
+        'avg_rcu_per_getitem': round(sum(math.ceil(s / 4096) for s in sizes) / count, 3),
+        'avg_rcu_per_20msg_session_query': round(sum(session_rcu) / len(session_rcu), 2),
+        'encode_us': round(encode_time / count * 1e6, 1),
+        'decode_us': round(decode_time / count * 1e6, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='履歴本文圧縮ベンチマーク')
+    parser.add_argument('--replies', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    training = [make_reply(rng) for _ in range(500)]
+    replies = [make_reply(rng) for _ in range(args.replies)]
+
+    # 学習用サンプルから作った辞書（評価は別サンプル）
+    history_compression.DICTIONARIES['trained'] = train_dictionary(training)
+
+    def plain_zlib(text):
+        return {'contentZ': zlib.compress(text.encode('utf-8'), 6)}
+
+    cases = [
+        ('none', lambda t: {'content': t}, lambda a: a['content']),
+        ('zlib', plain_zlib, lambda a: zlib.decompress(a['contentZ']).decode('utf-8')),
+        ('zlib+default_dict', lambda t: compress_text(t, 'zlib', 'd1'),
+         lambda a: decompress_text(a['contentEncoding'], a['contentZ'])),
+        ('zlib+trained_dict', lambda t: compress_text(t, 'zlib', 'trained'),
+         lambda a: decompress_text(a['contentEncoding'], a['contentZ']))
+    ]
+    if zstandard is not None:
+        cases += [
+            ('zstd+default_dict', lambda t: compress_text(t, 'zstd', 'd1', 3),
+             lambda a: decompress_text(a['contentEncoding'], a['contentZ'])),
+            ('zstd+trained_dict', lambda t: compress_text(t, 'zstd', 'trained', 3),
+             lambda a: decompress_text(a['contentEncoding'], a['contentZ']))
+        ]
+
+    avg_chars = sum(len(r) for r in replies) / len(replies)
+    print(json.dumps({'replies': len(replies), 'avg_reply_chars': round(avg_chars, 1),
+                      'trained_dictionary_bytes': len(history_compression.DICTIONARIES['trained'])},
+                     ensure_ascii=False))
+    for name, encode, decode in cases:
+        print(json.dumps(evaluate(name, replies, encode, decode), ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
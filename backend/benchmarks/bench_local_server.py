@@ -0,0 +1,99 @@
+# ローカル HTTP サーバーのスループット計測
+#
+# local_server をワーカー数を変えて起動し（擬似レイテンシ付きインメモリ DynamoDB・擬似 Bedrock）、
+# 同時接続数 --clients で履歴一覧・プロフィール取得を繰り返して req/s とワーカー毎の分散を比較する。
+#   python benchmarks/bench_local_server.py --workers 1,2,4 --requests 400 --clients 8
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+from bench_handlers import make_token, percentile
+
+PATHS = ['/history', '/profile']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_ready(url, headers, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'server did not start: {url}')
+
+def run(workers, requests, clients, users, db_latency_ms):
+    port = free_port()
+    # ハンドラ未読み込みの別プロセスで起動（ワーカー毎のコールドスタートを計測するため）
+    server = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'local_server.py'),
+                               '--port', str(port), '--workers', str(workers), '--local', '--seed-users', str(users)],
+                              env=dict(os.environ, LOCAL_DB_LATENCY_MS=str(db_latency_ms)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    tokens = [{'Authorization': f'Bearer {make_token(f"bench-user-{u:04d}")}'} for u in range(users)]
+    try:
+        wait_ready(base + '/profile', tokens[0])
+
+        def call(i):
+            request = urllib.request.Request(base + PATHS[i % len(PATHS)], headers=tokens[i % users])
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                    return (time.perf_counter() - t0) * 1000, response.headers.get('X-Worker-Id'), \
+                        response.headers.get('X-Cold-Start'), None
+            except Exception as e:
+                return (time.perf_counter() - t0) * 1000, None, None, str(e)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            results = list(executor.map(call, range(requests)))
+        wall = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(15)
+
+    latencies = sorted(r[0] for r in results if r[3] is None)
+    per_worker = {}
+    for _, worker, _, error in results:
+        if error is None:
+            per_worker[worker] = per_worker.get(worker, 0) + 1
+    return {
+        'workers': workers,
+        'requests': requests,
+        'errors': sum(1 for r in results if r[3] is not None),
+        'req_per_sec': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'cold_starts': sum(1 for r in results if r[2]),
+        'per_worker': sorted(per_worker.values(), reverse=True)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='ローカル HTTP サーバーのスループット計測')
+    parser.add_argument('--workers', default='1,2,4', help='比較するワーカー数')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=8, help='同時接続数')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = [run(int(n), args.requests, args.clients, args.users, args.db_latency_ms) for n in args.workers.split(',')]
+    print(json.dumps({'clients': args.clients, 'db_latency_ms': args.db_latency_ms, 'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
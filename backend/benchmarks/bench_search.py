@@ -0,0 +1,101 @@
+# 履歴検索のベンチマーク（バイグラム転置インデックス vs 全件走査）
+#
+# 擬似的な会話履歴を生成し、BigramIndex の検索と全メッセージの部分一致走査のレイテンシを比較する。
+#   python benchmarks/bench_search.py --sizes 10000,100000
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from history_search import BigramIndex, normalize_text, parse_query, matches_term, recency_key
+from common import encode_ulid
+
+TOPICS = ['ランニング', '仕事', '面接', '睡眠', '友達', '勉強', '料理', '旅行', '読書', 'ヨガ',
+          '転職', '引っ越し', '家族', '散歩', '筋トレ', 'プレゼン', '資格試験', '残業', 'ゲーム', '映画']
+TEMPLATES = [
+    '今日は{0}のことで少し悩んでいます。',
+    '{0}がうまくいかなくて落ち込んでいます。どうしたらいいでしょう。',
+    '最近{0}を始めました！続けるコツはありますか？',
+    '{0}と{1}の両立が難しいです。',
+    'お話ししてくれてありがとうございます！{0}について前向きに考えてみましょう。小さな目標を立てるのがおすすめです。',
+    '{0}で疲れたときは、深呼吸をして{1}の時間を作ってみてくださいね。応援しています！'
+]
+QUERIES = ['ランニング', '資格試験', '面接 プレゼン', '転職', '深呼吸', '引っ越し 家族', '続けるコツ', 'ヨガ']
+
+def generate_messages(count, seed=7):
+    rng = random.Random(seed)
+    base_ms = 1735689600000
+    messages = []
+    for i in range(count):
+        text = rng.choice(TEMPLATES).format(rng.choice(TOPICS), rng.choice(TOPICS))
+        doc_id = f"SESSION#s{i // 10}#{encode_ulid(base_ms + i * 1000, rng.getrandbits(80))}"
+        messages.append((doc_id, text))
+    return messages
+
+def brute_force_search(texts, query, limit=20):
+    """全メッセージを走査して部分一致（一致語数 → 新しい順）"""
+    terms = parse_query(query)
+    scored = []
+    for doc_id, text in texts.items():
+        matched = sum(1 for runs in terms if matches_term(text, runs))
+        if matched:
+            scored.append((doc_id, matched))
+    scored.sort(key=lambda entry: recency_key(entry[0]), reverse=True)
+    scored.sort(key=lambda entry: entry[1], reverse=True)
+    return scored[:limit]
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def run(size, repeat):
+    messages = generate_messages(size)
+    index = BigramIndex()
+    t0 = time.perf_counter()
+    for doc_id, text in messages:
+        index.add(doc_id, text)
+    build_seconds = time.perf_counter() - t0
+    texts = {doc_id: normalize_text(text) for doc_id, text in messages}
+
+    queries = []
+    for query in QUERIES:
+        index_ms = timed(lambda: index.search(query), repeat) * 1000
+        brute_ms = timed(lambda: brute_force_search(texts, query), repeat) * 1000
+        hits = len(index.search(query, limit=size))
+        assert hits == len(brute_force_search(texts, query, limit=size))
+        queries.append({
+            'query': query,
+            'hits': hits,
+            'index_ms': round(index_ms, 3),
+            'brute_force_ms': round(brute_ms, 3),
+            'speedup': round(brute_ms / index_ms, 1) if index_ms else None
+        })
+
+    return {
+        'messages': size,
+        'build_seconds': round(build_seconds, 3),
+        'incremental_add_us': round(build_seconds / size * 1e6, 1),
+        'bigrams': len(index.postings),
+        'postings': sum(len(p) for p in index.postings.values()),
+        'queries': queries
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='履歴検索ベンチマーク')
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run(int(size), args.repeat) for size in args.sizes.split(',')]
+    print(json.dumps({'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
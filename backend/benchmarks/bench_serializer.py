@@ -0,0 +1,67 @@
+# ResponseBuilder のシリアライズ速度比較（ペイロードサイズ別）
+#   python benchmarks/bench_serializer.py --sizes 10,100,1000,10000
+import os
+import sys
+import json
+import time
+import argparse
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from serializer import StdlibJsonSerializer, OrjsonSerializer, orjson
+
+def make_conversations(count):
+    """handle_get_history が返す形の会話一覧（DynamoDB 由来の Decimal を含む）"""
+    return {
+        'conversations': [
+            {
+                'sessionId': f'session-{i:06d}',
+                'firstMessage': '最近仕事が忙しくて、なかなか休めていません。どうしたらいいですか？',
+                'messageCount': Decimal(i % 40 + 2),
+                'userMessageCount': Decimal(i % 20 + 1),
+                'assistantMessageCount': Decimal(i % 20 + 1),
+                'createdAt': '2025-01-01T09:00:00.000000',
+                'updatedAt': '2025-01-01T09:30:00.000000',
+                'preview': '👤: 最近仕事が忙しくて | 🤖: お疲れさまです！まずは深呼吸して'
+            }
+            for i in range(count)
+        ],
+        'totalCount': count
+    }
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='シリアライザベンチマーク')
+    parser.add_argument('--sizes', default='10,100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=7)
+    args = parser.parse_args()
+
+    serializers = [StdlibJsonSerializer()]
+    if orjson is not None:
+        serializers.append(OrjsonSerializer())
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        payload = make_conversations(size)
+        body = json.dumps(payload, ensure_ascii=False, default=str)
+        result = {
+            'conversations': size,
+            'body_bytes': len(body.encode('utf-8')),
+            'legacy_json_dumps_ms': round(best_of(
+                lambda: json.dumps(payload, ensure_ascii=False, default=str), args.repeat), 3)
+        }
+        for serializer in serializers:
+            result[f'{serializer.name}_ms'] = round(best_of(lambda: serializer.dumps(payload), args.repeat), 3)
+            result[f'{serializer.name}_chunked_ms'] = round(best_of(
+                lambda: sum(len(c) for c in serializer.iter_encode(payload)), args.repeat), 3)
+        print(json.dumps(result, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
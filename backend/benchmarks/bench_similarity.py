@@ -0,0 +1,90 @@
+# 類似会話検索のベンチマーク（ハッシュ埋め込み + コサイン top-k）
+#
+# 擬似メッセージの埋め込みを計算して VectorMatrix に詰め、NumPy と純 Python の
+# 検索レイテンシ、および 1万メッセージあたりのメモリ使用量を計測する。
+#   python benchmarks/bench_similarity.py --sizes 10000,100000
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import hashed_embedding
+from hashed_embedding import VectorMatrix, embed_bytes, embed_text, EMBEDDING_DIM
+from bench_search import TOPICS, TEMPLATES
+
+QUERIES = ['ランニングのペースを上げたい', '仕事の締め切りがつらい', '資格試験の勉強が続かない', '家族と旅行に行きたい']
+
+def generate_texts(count, seed=11):
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES).format(rng.choice(TOPICS), rng.choice(TOPICS)) for _ in range(count)]
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 3)
+
+def run(size, repeat, k, python_max):
+    texts = generate_texts(size)
+    # 同じ文面の埋め込みは同じなので、計算時間は重複を除いて計測
+    unique = list(dict.fromkeys(texts))
+    t0 = time.perf_counter()
+    cache = {text: embed_bytes(text) for text in unique}
+    embed_us = (time.perf_counter() - t0) / len(unique) * 1e6
+    rows = [cache[text] for text in texts]
+    ids = [f'SESSION#s{i // 10}#{i:026d}' for i in range(size)]
+
+    tracemalloc.start()
+    matrix = VectorMatrix(ids, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queries = [embed_text(query) for query in QUERIES]
+    numpy_ms = [median_ms(lambda q=q: matrix.top_k(q, k), repeat) for q in queries]
+
+    result = {
+        'messages': size,
+        'dim': EMBEDDING_DIM,
+        'embed_us_per_message': round(embed_us, 1),
+        'stored_bytes_per_message': len(rows[0]),
+        'matrix_bytes_per_10k': round(matrix.nbytes / size * 10000),
+        'build_peak_bytes_per_10k': round(peak / size * 10000),
+        'numpy_query_ms': sorted(numpy_ms)[len(numpy_ms) // 2]
+    }
+
+    if size <= python_max:
+        # NumPy なしの経路（同じデータを純 Python の行列で検索）
+        numpy_module = hashed_embedding.numpy
+        hashed_embedding.numpy = None
+        try:
+            fallback = VectorMatrix(ids, rows)
+            python_ms = [median_ms(lambda q=q: fallback.top_k(q, k), 1) for q in queries]
+        finally:
+            hashed_embedding.numpy = numpy_module
+        result['python_query_ms'] = sorted(python_ms)[len(python_ms) // 2]
+        result['speedup'] = round(result['python_query_ms'] / result['numpy_query_ms'], 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='類似会話検索ベンチマーク')
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--python-max', type=int, default=10000, help='純 Python 経路を計測する最大件数')
+    args = parser.parse_args()
+
+    if hashed_embedding.numpy is None:
+        print('numpy がインストールされていません', file=sys.stderr)
+        sys.exit(1)
+    results = [run(int(size), args.repeat, args.k, args.python_max) for size in args.sizes.split(',')]
+    print(json.dumps({'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# single-flight の効果測定（同じユーザーの同一 GET が同時に届く場合）
+#
+# 擬似レイテンシ付きのインメモリ DynamoDB に対し、--burst 件の同一リクエストを同時に送る操作を
+# --rounds 回繰り返し、まとめない場合（off）とまとめる場合（on）の DynamoDB 呼び出し数とレイテンシを比較する。
+#   python benchmarks/bench_single_flight.py --burst 1,4,8 --db-latency-ms 10
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_handlers import make_token, percentile
+
+import history_lambda_refactored
+import profile_lambda_refactored
+from common import SingleFlight, HISTORY_TABLE, USER_TABLE
+from local_aws import InMemoryDynamoDB, attach_to_handler, seed_dataset
+
+SCENARIOS = [
+    ('get_history', history_lambda_refactored, 'history_flight', '/history', HISTORY_TABLE),
+    ('get_profile', profile_lambda_refactored, 'profile_flight', '/profile', USER_TABLE)
+]
+
+def run_burst(module, event, burst):
+    """burst 件を同時に呼び出し、各リクエストのレイテンシを返す"""
+    latencies = [None] * burst
+    errors = []
+    barrier = threading.Barrier(burst)
+
+    def call(i):
+        barrier.wait()
+        t0 = time.perf_counter()
+        response = module.lambda_handler(event, None)
+        latencies[i] = (time.perf_counter() - t0) * 1000
+        if response['statusCode'] != 200:
+            errors.append(response['statusCode'])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(burst)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description='single-flight の効果測定')
+    parser.add_argument('--burst', default='1,4,8', help='同時に送る同一リクエスト数')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--db-latency-ms', type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    dynamodb = InMemoryDynamoDB(latency_ms=args.db_latency_ms)
+    seed_dataset(dynamodb, 1, args.sessions, 10)
+    for _, module, _, _, _ in SCENARIOS:
+        attach_to_handler(module, dynamodb=dynamodb)
+    event_headers = {'Authorization': f"Bearer {make_token('bench-user-0000')}"}
+
+    results = []
+    for name, module, attr, resource, table_name in SCENARIOS:
+        event = {'httpMethod': 'GET', 'resource': resource, 'path': resource, 'headers': event_headers}
+        table = dynamodb.Table(table_name)
+        for burst in (int(n) for n in args.burst.split(',')):
+            for mode in ('off', 'on'):
+                flight = SingleFlight(name) if mode == 'on' else None
+                setattr(module, attr, flight)
+                table.call_counts.clear()
+                latencies, errors = [], 0
+                for _ in range(args.rounds):
+                    round_latencies, round_errors = run_burst(module, event, burst)
+                    latencies.extend(round_latencies)
+                    errors += round_errors
+                latencies.sort()
+                row = {
+                    'scenario': name,
+                    'burst': burst,
+                    'mode': mode,
+                    'requests': len(latencies),
+                    'errors': errors,
+                    'db_calls': sum(table.call_counts.values()),
+                    'p50_ms': round(percentile(latencies, 50), 2),
+                    'p95_ms': round(percentile(latencies, 95), 2)
+                }
+                if flight is not None:
+                    row['stats'] = flight.stats()
+                results.append(row)
+
+    print(json.dumps({'db_latency_ms': args.db_latency_ms, 'rounds': args.rounds, 'results': results},
+                     ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# 初期化フェーズのプライミングによる初回リクエストのレイテンシ改善の計測
+#
+# ハンドラ毎に新しいプロセスを起動し（コールドスタート相当）、インメモリのスタンドインを接続した上で
+#   cold   : プライミングなしで初回リクエストを処理
+#   primed : primer.prime()（Lambda では初期化フェーズで実行）の後に初回リクエストを処理
+# の初回・2回目のレイテンシを比較する。スタンドインには接続確立のコストがないため、
+# ここで計測できるのは初回利用時の読み込み・初期化の分のみ（実環境では TLS ハンドシェイク分が加わる）。
+#   python benchmarks/bench_warmup.py --runs 5
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+HANDLERS = {
+    'chat': ('chat_lambda_refactored', 'POST', '/chat'),
+    'history': ('history_lambda_refactored', 'GET', '/history'),
+    'profile': ('profile_lambda_refactored', 'GET', '/profile')
+}
+
+def child(handler: str, mode: str):
+    """1回分のコールドスタートを計測して JSON を出力"""
+    logging.disable(logging.INFO)
+    module_name, method, resource = HANDLERS[handler]
+    t0 = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_ms = (time.perf_counter() - t0) * 1000
+
+    from bench_handlers import make_token
+    from local_aws import InMemoryDynamoDB, FakeBedrockAgentRuntime, attach_to_handler, seed_dataset
+    dynamodb = InMemoryDynamoDB()
+    seed_dataset(dynamodb, 1, 5, 10)
+    attach_to_handler(module, dynamodb=dynamodb, bedrock_agent_runtime=FakeBedrockAgentRuntime())
+
+    prime_ms = 0.0
+    if mode == 'primed':
+        t0 = time.perf_counter()
+        module.primer.prime()
+        prime_ms = (time.perf_counter() - t0) * 1000
+
+    event = {
+        'httpMethod': method,
+        'resource': resource,
+        'path': resource,
+        'headers': {'Authorization': f"Bearer {make_token('bench-user-0000')}", 'Accept-Encoding': 'br, gzip'},
+        'body': json.dumps({'message': '最近ランニングを始めました！', 'sessionId': 'session-0000-0000'})
+    }
+    latencies = []
+    for _ in range(2):
+        t0 = time.perf_counter()
+        response = module.lambda_handler(event, None)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        assert response['statusCode'] == 200, response
+    print(json.dumps({'import_ms': import_ms, 'prime_ms': prime_ms,
+                      'first_ms': latencies[0], 'second_ms': latencies[1]}))
+
+def median(values):
+    values = sorted(values)
+    return round(values[len(values) // 2], 2)
+
+def main():
+    parser = argparse.ArgumentParser(description='プライミングによる初回リクエストのレイテンシ改善の計測')
+    parser.add_argument('--handlers', default='chat,history,profile')
+    parser.add_argument('--runs', type=int, default=5, help='モード毎のコールドスタート回数')
+    parser.add_argument('--child', nargs=2, metavar=('HANDLER', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    env = dict(os.environ, WARMUP_PRIME_ON_INIT='false', PYTHONWARNINGS='ignore')
+    results = []
+    for handler in args.handlers.split(','):
+        row = {'handler': handler}
+        for mode in ('cold', 'primed'):
+            runs = []
+            for _ in range(args.runs):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', handler, mode],
+                                        env=env, capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            for field in ('import_ms', 'prime_ms', 'first_ms', 'second_ms'):
+                row[f'{mode}_{field}'] = median([r[field] for r in runs])
+        row['first_request_speedup'] = round(row['cold_first_ms'] / row['primed_first_ms'], 1)
+        results.append(row)
+
+    print(json.dumps({'runs': args.runs, 'results': results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# チャットの一括実行 - プロンプト変更の検証用に多数のテストメッセージを Agent に流す
+#
+# 各アイテム（message, sessionId, profile）を通常の /chat と同じ
+# customize_message_with_profile → invoke_bedrock_agent の経路で、同時実行数を制限して処理する。
+# 結果は履歴に保存せず、アイテム毎の応答とレイテンシを返す（CLI は完了順に NDJSON で書き出す）。
+#   python chat_batch.py cases.jsonl --output results.ndjson --concurrency 8
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Optional, Callable, Iterator
+from common import (
+    setup_logger,
+    tracer,
+    PROFILE_FIELDS
+)
+
+# 一括実行設定
+BATCH_MAX_ITEMS = int(os.environ.get('CHAT_BATCH_MAX_ITEMS', '100'))
+BATCH_CONCURRENCY = int(os.environ.get('CHAT_BATCH_CONCURRENCY', '8'))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('CHAT_BATCH_MAX_CONCURRENCY', '16'))
+BATCH_ITEM_TIMEOUT_SECONDS = float(os.environ.get('CHAT_BATCH_ITEM_TIMEOUT_SECONDS', '30'))
+
+# Lambda の残り時間がこれを下回ったら新しいアイテムを開始しない
+BATCH_TIME_MARGIN_MS = int(os.environ.get('CHAT_BATCH_TIME_MARGIN_MS', '5000'))
+
+BATCH_MESSAGE_MAX_CHARS = 4000
+
+def parse_batch_items(items: Any, max_items: int = None) -> List[Dict[str, Any]]:
+    """一括実行アイテムを検証・正規化（不正な場合は ValueError）"""
+    max_items = max_items or BATCH_MAX_ITEMS
+    if not isinstance(items, list) or not items:
+        raise ValueError('items は1件以上の配列で指定してください')
+    if len(items) > max_items:
+        raise ValueError(f'items は{max_items}件以内で指定してください')
+
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'items[{index}] はオブジェクトで指定してください')
+        message = item.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise ValueError(f'items[{index}] にメッセージが必要です')
+        if len(message) > BATCH_MESSAGE_MAX_CHARS:
+            raise ValueError(f'items[{index}] のメッセージは{BATCH_MESSAGE_MAX_CHARS}文字以内で指定してください')
+        entry = {'index': index, 'message': message, 'sessionId': item.get('sessionId'), 'id': item.get('id')}
+        if 'profile' in item:
+            profile = item['profile']
+            if profile is not None and not isinstance(profile, dict):
+                raise ValueError(f'items[{index}] の profile はオブジェクトで指定してください')
+            # プロフィールはプロンプト構築に使うフィールドだけを受け付ける
+            entry['profile'] = {k: v for k, v in profile.items() if k in PROFILE_FIELDS} if profile else None
+        parsed.append(entry)
+    return parsed
+
+def _percentile(sorted_values: List[float], ratio: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+def summarize_results(results: List[Dict[str, Any]], wall_ms: float) -> Dict[str, Any]:
+    """ステータス別件数とレイテンシの集計"""
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    latencies = sorted(r['latencyMs'] for r in results if r['status'] == 'ok')
+    return {
+        'total': len(results),
+        'counts': counts,
+        'wallMs': round(wall_ms, 1),
+        'latencyMs': {
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'max': latencies[-1] if latencies else None
+        }
+    }
+
+class ChatBatchRunner:
+    """同時実行数とアイテム毎のタイムアウトを制限してチャットを一括実行
+
+    invoke は (カスタマイズ済みメッセージ, sessionId) を受け取り応答テキストを返す関数
+    （通常は chat_lambda_refactored.invoke_bedrock_agent）。
+    タイムアウトしたアイテムは結果を待たずに timeout として返す（呼び出し自体は
+    クライアントの read_timeout で打ち切られる）。
+    """
+
+    def __init__(self, profile_helper, invoke: Callable[[str, str], str],
+                 concurrency: int = None, item_timeout: float = None):
+        self.profile_helper = profile_helper
+        self.invoke = invoke
+        self.concurrency = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+        self.item_timeout = item_timeout or BATCH_ITEM_TIMEOUT_SECONDS
+        self.logger = setup_logger('ChatBatchRunner')
+
+    def run_item(self, item: Dict[str, Any], default_profile: Optional[Dict[str, Any]],
+                 batch_id: str, started: Dict[int, float]) -> Dict[str, Any]:
+        """1アイテムを処理（例外は結果の error に変換）"""
+        index = item['index']
+        session_id = item.get('sessionId') or f"batch-{batch_id}-{index}"
+        profile = item['profile'] if 'profile' in item else default_profile
+        result = {'index': index, 'id': item.get('id'), 'sessionId': session_id}
+
+        start = time.monotonic()
+        started[index] = start
+        with tracer.span('chat.batch_item', index=index) as span:
+            try:
+                customized_message = self.profile_helper.customize_message_with_profile(item['message'], profile)
+                result['response'] = self.invoke(customized_message, session_id)
+                result['status'] = 'ok'
+            except Exception as e:
+                if span is not None:
+                    span.record_error(e)
+                result['status'] = 'error'
+                result['error'] = str(e)
+        result['latencyMs'] = round((time.monotonic() - start) * 1000, 1)
+        return result
+
+    def iter_results(self, items: List[Dict[str, Any]], default_profile: Optional[Dict[str, Any]] = None,
+                     should_stop: Callable[[], bool] = None) -> Iterator[Dict[str, Any]]:
+        """完了順に結果を返す
+
+        実行中のアイテムは常に concurrency 件以下で、should_stop が True を返した後は
+        未開始のアイテムを skipped として返す。
+        """
+        batch_id = uuid.uuid4().hex[:12]
+        queue = list(reversed(items))
+        started = {}
+        in_flight = {}
+        # タイムアウトしたアイテムのスレッドは呼び出しが終わるまで占有されるため、
+        # 後続のアイテムが待たされないよう同じ数だけ予備のワーカーを用意する
+        executor = ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix='chat-batch')
+        try:
+            while queue or in_flight:
+                stopping = should_stop is not None and should_stop()
+                while queue and len(in_flight) < self.concurrency and not stopping:
+                    item = queue.pop()
+                    # トレースのスパンをワーカースレッドに引き継ぐため、コンテキストをコピーして実行
+                    context = contextvars.copy_context()
+                    future = executor.submit(context.run, self.run_item, item, default_profile, batch_id, started)
+                    in_flight[future] = item
+                if stopping:
+                    while queue:
+                        item = queue.pop()
+                        yield {'index': item['index'], 'id': item.get('id'), 'status': 'skipped', 'latencyMs': None}
+                if not in_flight:
+                    continue
+
+                # 最も早く期限が来るアイテムまで待つ
+                now = time.monotonic()
+                deadlines = [started[item['index']] + self.item_timeout
+                             for item in in_flight.values() if item['index'] in started]
+                timeout = max(0.0, min(deadlines) - now) if deadlines else self.item_timeout
+                done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+                    yield future.result()
+
+                now = time.monotonic()
+                for future, item in list(in_flight.items()):
+                    start = started.get(item['index'])
+                    if start is not None and now - start >= self.item_timeout:
+                        in_flight.pop(future)
+                        yield {
+                            'index': item['index'],
+                            'id': item.get('id'),
+                            'sessionId': item.get('sessionId') or f"batch-{batch_id}-{item['index']}",
+                            'status': 'timeout',
+                            'error': f'{self.item_timeout:g}秒以内に応答がありませんでした',
+                            'latencyMs': round((now - start) * 1000, 1)
+                        }
+        finally:
+            # タイムアウトしたアイテムの終了は待たない
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @tracer.traced('ChatBatchRunner.run')
+    def run(self, items: List[Dict[str, Any]], default_profile: Optional[Dict[str, Any]] = None,
+            should_stop: Callable[[], bool] = None) -> Dict[str, Any]:
+        """全アイテムを実行し、入力順の結果と集計を返す"""
+        start = time.monotonic()
+        results = sorted(self.iter_results(items, default_profile, should_stop), key=lambda r: r['index'])
+        summary = summarize_results(results, (time.monotonic() - start) * 1000)
+        self.logger.info(f"Batch finished: {summary['counts']} in {summary['wallMs']}ms")
+        return {'results': results, 'summary': summary}
+
+def read_items(path: str) -> List[Dict[str, Any]]:
+    """JSONL（1行1アイテム）または {"items": [...]} / 配列の JSON ファイルを読み込む"""
+    with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith('[') or stripped.startswith('{"items"'):
+        data = json.loads(text)
+        return data['items'] if isinstance(data, dict) else data
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+if __name__ == "__main__":
+    from common import ProfileHelper, create_database_helper, USER_TABLE
+    from chat_lambda_refactored import invoke_bedrock_agent
+
+    parser = argparse.ArgumentParser(description='テストメッセージを Bedrock Agent で一括実行')
+    parser.add_argument('input', help='アイテムの JSONL / JSON ファイル（- で標準入力）')
+    parser.add_argument('--output', default='-', help='結果の NDJSON 出力先（既定: 標準出力）')
+    parser.add_argument('--user', default=None, help='profile のないアイテムに使うユーザーID')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=BATCH_ITEM_TIMEOUT_SECONDS, help='アイテム毎のタイムアウト（秒）')
+    args = parser.parse_args()
+
+    items = parse_batch_items(read_items(args.input), max_items=sys.maxsize)
+    profile_helper = ProfileHelper(create_database_helper(), USER_TABLE)
+    default_profile = profile_helper.get_user_profile(args.user) if args.user else None
+    runner = ChatBatchRunner(profile_helper, invoke_bedrock_agent, args.concurrency, args.timeout)
+
+    # 完了順に1行ずつ書き出す（途中経過を tail -f で確認できる）
+    results = []
+    started_at = time.monotonic()
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        for result in runner.iter_results(items, default_profile):
+            results.append(result)
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    summary = summarize_results(results, (time.monotonic() - started_at) * 1000)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
@@ -1,38 +1,152 @@
 import json
-import boto3
+import time
 import uuid
+import asyncio
 from datetime import datetime
 import logging
 from common import (
     setup_logger,
+    tracer,
     ResponseBuilder,
     RequestValidator,
-    DatabaseHelper,
+    client_factory,
+    create_database_helper,
     ProfileHelper,
     HistoryHelper,
+    select_context_turns,
+    format_context_turns,
     USER_TABLE,
     HISTORY_TABLE,
     AGENT_ID,
     AGENT_ALIAS_ID,
-    BEDROCK_REGION
+    BEDROCK_REGION,
+    CONTEXT_WINDOW_ENABLED,
+    CHAT_MESSAGE_MAX_BYTES,
+    EMBEDDING_ENABLED
+)
+
+from history_search import HistorySearchIndex, HISTORY_SEARCH_ENABLED
+from history_similarity import EmbeddingChunks, SIMILARITY_SEARCH_ENABLED
+from history_overflow import HistoryOverflow, HISTORY_OVERFLOW_BUCKET
+from bedrock_replay import configure_agent_runtime
+from agent_router import create_agent_router
+from async_helpers import (
+    AsyncDatabaseHelper,
+    AsyncProfileHelper,
+    AsyncHistoryHelper,
+    run_async,
+    ASYNC_IO_ENABLED
+)
+from chat_batch import (
+    ChatBatchRunner,
+    parse_batch_items,
+    BATCH_ITEM_TIMEOUT_SECONDS,
+    BATCH_MAX_CONCURRENCY,
+    BATCH_TIME_MARGIN_MS
+)
+from warmup import (
+    Primer,
+    is_warmup_event,
+    should_prime_on_init,
+    prime_dynamodb,
+    prime_bedrock_agent,
+    prime_local_caches,
+    WARMUP_USER_ID
+)
+from usage_accounting import UsageAccountant, UsageCollector, USAGE_ACCOUNTING_ENABLED, USAGE_AGENT_TRACE_ENABLED
+from fast_path import (
+    FastPathPolicy,
+    FastPathMetrics,
+    invoke_fast_path,
+    load_instruction,
+    ROUTE_FAST,
+    ROUTE_AGENT,
+    FAST_PATH_ENABLED,
+    FAST_PATH_REGION
+)
+from idempotency import (
+    IdempotencyStore,
+    run_idempotent,
+    validate_idempotency_key,
+    request_fingerprint,
+    IDEMPOTENCY_ENABLED
 )
 
 # ログ設定
 logger = setup_logger(__name__)
 
 # AWS サービス初期化
-dynamodb = boto3.resource('dynamodb')
-bedrock_agent_runtime = boto3.client('bedrock-agent-runtime', region_name=BEDROCK_REGION)
+# （BEDROCK_RECORD_DIR / BEDROCK_REPLAY_DIR 設定時はイベントストリームを記録・再生）
+bedrock_agent_runtime = configure_agent_runtime(
+    client_factory.client('bedrock-agent-runtime', region_name=BEDROCK_REGION)
+)
+
+# Agent の呼び出し先（AGENT_ENDPOINTS で複数のエイリアス・リージョンを設定）と
+# BEDROCK_REGION 以外のリージョンのクライアント（初回利用時に生成）
+agent_router = create_agent_router(AGENT_ID, AGENT_ALIAS_ID, BEDROCK_REGION)
+regional_agent_runtimes = {}
+
+# 雑談の高速経路（FAST_PATH_ENABLED=true の場合のみ。Agent と同じ人格指示で基盤モデルを直接呼び出す）
+bedrock_runtime = client_factory.client('bedrock-runtime', region_name=FAST_PATH_REGION) if FAST_PATH_ENABLED else None
+fast_path_policy = FastPathPolicy()
+fast_path_metrics = FastPathMetrics()
+fast_path_instruction = load_instruction()
+
+# 一括実行用の Bedrock クライアント（アイテム毎のタイムアウトを read_timeout に反映。初回利用時に生成）
+batch_agent_runtime = None
 
 # ヘルパー初期化
-db_helper = DatabaseHelper(dynamodb)
+db_helper = create_database_helper()
 profile_helper = ProfileHelper(db_helper, USER_TABLE)
 history_helper = HistoryHelper(db_helper, HISTORY_TABLE)
 
+# ユーザー毎の Bedrock 使用量（トレースのトークン数を日別カウンタに加算）
+usage_accountant = UsageAccountant(db_helper, HISTORY_TABLE)
+
+# Idempotency-Key のレコード（履歴テーブルの IDEMPOTENCY#<key> 行）
+idempotency_store = IdempotencyStore(db_helper, HISTORY_TABLE)
+
+# asyncio 版ヘルパー（独立した読み込みを並行実行）
+async_db_helper = AsyncDatabaseHelper(db_helper)
+async_profile_helper = AsyncProfileHelper(profile_helper, async_db_helper)
+async_history_helper = AsyncHistoryHelper(history_helper, async_db_helper)
+
+# 履歴検索インデックス（保存・削除時に差分更新）
+if HISTORY_SEARCH_ENABLED:
+    history_helper.search_index = HistorySearchIndex(db_helper, HISTORY_TABLE)
+
+# 類似会話検索の埋め込みチャンク（保存時に追記）
+if EMBEDDING_ENABLED and SIMILARITY_SEARCH_ENABLED:
+    history_helper.embeddings = EmbeddingChunks(db_helper, HISTORY_TABLE)
+
+# 項目上限を超える本文の S3 退避（バケット設定時のみ。未設定時は切り詰めて保存）
+if HISTORY_OVERFLOW_BUCKET:
+    history_helper.overflow = HistoryOverflow(client_factory.client('s3'))
+
+# 初期化フェーズのプライミング（接続確立・初回利用時の読み込みを初回リクエストの前に済ませる）
+primer = Primer('chat')
+primer.add('dynamodb.user', prime_dynamodb(db_helper, USER_TABLE, {'userId': WARMUP_USER_ID}))
+primer.add('dynamodb.history', prime_dynamodb(db_helper, HISTORY_TABLE,
+                                              {'userId': WARMUP_USER_ID, 'timestamp': WARMUP_USER_ID}))
+for agent_endpoint in agent_router.endpoints:
+    primer.add(f'bedrock.{agent_endpoint.name}', prime_bedrock_agent(
+        lambda region=agent_endpoint.region: agent_runtime_for(region), agent_endpoint.agent_id, agent_endpoint.alias_id))
+primer.add('caches', prime_local_caches)
+primer.add('prompt', lambda: profile_helper.customize_message_with_profile(
+    'こんにちは', {'userName': WARMUP_USER_ID}, format_context_turns([{'role': 'user', 'content': 'こんにちは'}])))
+if ASYNC_IO_ENABLED:
+    # イベントループ・非同期クライアントはスレッド毎のため、リクエストを処理するスレッドで用意する
+    primer.add('async', lambda: run_async(load_chat_context(WARMUP_USER_ID, WARMUP_USER_ID)), inline=True)
+
+@tracer.trace_handler('chat.lambda_handler')
 def lambda_handler(event, context):
     """
     チャットメッセージを処理するLambda関数（リファクタリング版）
     """
+    # ウォームアップイベントは即座に返す
+    if is_warmup_event(event):
+        return primer.handle(event)
+    
     try:
         logger.info(f"Received event: {json.dumps(event)}")
         
@@ -48,82 +162,314 @@ def lambda_handler(event, context):
             logger.error(f"Request validation failed: {str(e)}")
             return ResponseBuilder.error(str(e), 400)
         
-        # 必須フィールド検証
-        message = body.get('message')
-        session_id = body.get('sessionId')
+        # POST /chat/batch: テストメッセージの一括実行
+        if is_batch_request(event):
+            return handle_batch(body, auth_info['user_id'], context,
+                                RequestValidator.get_header(event, 'accept-encoding'))
         
-        if not message:
+        # 必須フィールド検証
+        if not body.get('message'):
             return ResponseBuilder.error('メッセージが必要です')
-        
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            logger.info(f"Generated new session_id: {session_id}")
+        if len(body['message'].encode('utf-8')) > CHAT_MESSAGE_MAX_BYTES:
+            return ResponseBuilder.error(f'メッセージは{CHAT_MESSAGE_MAX_BYTES}バイト以内で送信してください', 413)
         
         user_id = auth_info['user_id']
-        logger.info(f"Processing chat for user: {user_id}, session: {session_id}")
         
-        # ユーザープロフィール取得
-        user_profile = profile_helper.get_user_profile(user_id)
-        if user_profile:
-            logger.info(f"Found user profile for {user_id}")
+        # Idempotency-Key 付きの再送は保存済みのレスポンスを返す（Agent 呼び出し・履歴保存は1回だけ）
+        key = RequestValidator.get_header(event, 'idempotency-key')
+        if key and IDEMPOTENCY_ENABLED:
+            try:
+                key = validate_idempotency_key(key)
+            except ValueError as e:
+                return ResponseBuilder.error(str(e), 400)
+            request_hash = request_fingerprint({'message': body.get('message'), 'sessionId': body.get('sessionId')})
+            return run_idempotent(idempotency_store, user_id, key, request_hash,
+                                  lambda: handle_chat(body, user_id), context)
         
-        # メッセージをプロフィールでカスタマイズ
-        customized_message = profile_helper.customize_message_with_profile(message, user_profile)
+        return handle_chat(body, user_id)
         
-        # ユーザーメッセージを履歴に保存
-        if not history_helper.save_message(user_id, session_id, 'user', message):
+    except Exception as e:
+        logger.error(f"Unexpected error in chat lambda: {str(e)}", exc_info=True)
+        return ResponseBuilder.error('内部サーバーエラーが発生しました', 500, str(e))
+
+def new_usage_collector():
+    """1回の呼び出し分の使用量の集計（集計無効時は None）"""
+    return UsageCollector() if USAGE_ACCOUNTING_ENABLED else None
+
+def handle_chat(body: dict, user_id: str):
+    """チャットメッセージを処理（プロフィール・直近会話の読み込み → Agent 呼び出し → 履歴保存）"""
+    message = body.get('message')
+    session_id = body.get('sessionId')
+    
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        logger.info(f"Generated new session_id: {session_id}")
+    
+    logger.info(f"Processing chat for user: {user_id}, session: {session_id}")
+    
+    # ユーザープロフィールと直近の会話（セッション毎のウィンドウ行）を取得
+    if ASYNC_IO_ENABLED:
+        user_profile, context_window = run_async(load_chat_context(user_id, session_id))
+    else:
+        user_profile = profile_helper.get_user_profile(user_id)
+        context_window = history_helper.get_context_window(user_id, session_id) if CONTEXT_WINDOW_ENABLED else None
+    if user_profile:
+        logger.info(f"Found user profile for {user_id}")
+    
+    conversation_context = None
+    if context_window:
+        conversation_context = format_context_turns(
+            select_context_turns(context_window.get('turns'))
+        ) or None
+    
+    # メッセージをプロフィール・直近の会話でカスタマイズ
+    customized_message = profile_helper.customize_message_with_profile(
+        message, user_profile, conversation_context
+    )
+    
+    # 応答の生成とユーザーメッセージの作成（作成日時は受信時点で確定し、応答と一緒に保存）
+    # 非同期 I/O 有効時は Agent の呼び出しとユーザーメッセージの作成（埋め込み計算・S3 退避）を並行実行
+    pinned_endpoint = (context_window or {}).get('agentEndpoint')
+    started = time.monotonic()
+    if ASYNC_IO_ENABLED:
+        reply, user_item = run_async(respond_async(user_id, session_id, message, customized_message, pinned_endpoint))
+        if isinstance(user_item, BaseException):
+            raise user_item
+    else:
+        user_item = history_helper.build_message_item(user_id, session_id, 'user', message)
+        try:
+            reply = invoke_model(message, customized_message, session_id, pinned_endpoint)
+        except Exception as e:
+            reply = e
+    
+    if isinstance(reply, BaseException):
+        logger.error(f"Bedrock Agent error: {str(reply)}")
+        if not history_helper.save_message_item(user_item):
             logger.error("Failed to save user message to history")
-        
-        # Bedrock Agent に送信
+        return ResponseBuilder.error('AI応答の生成に失敗しました', 500, str(reply))
+    agent_response, route, endpoint_name, usage, decision = reply
+    
+    # 経路の判定と応答までの時間を記録
+    model_ms = (time.monotonic() - started) * 1000
+    fast_path_metrics.record(decision, route, model_ms)
+    logger.info(f"Responded via {route} route ({decision.reason}) in {model_ms:.0f}ms")
+    span = tracer.current_span()
+    if span is not None:
+        span.set_attribute('route', route)
+        span.set_attribute('route_reason', decision.reason)
+    
+    if usage is not None:
+        usage_accountant.record(user_id, usage)
+        usage_accountant.flush_async()
+    
+    # ユーザー・AIメッセージと直近会話ウィンドウを1回の書き込みで保存
+    assistant_item = history_helper.build_message_item(user_id, session_id, 'assistant', agent_response)
+    if CONTEXT_WINDOW_ENABLED:
+        saved = history_helper.save_turn([user_item, assistant_item], context_window, endpoint_name)
+    else:
+        saved = all([history_helper.save_message_item(user_item),
+                     history_helper.save_message_item(assistant_item)])
+    if not saved:
+        logger.error("Failed to save messages to history")
+    
+    # 使用量の書き込みは履歴保存と並行して行い、応答は待たせない（USAGE_FLUSH_WAIT_MS > 0 の場合だけその分まで待つ）
+    if usage is not None:
+        usage_accountant.wait()
+    
+    # レスポンス返却
+    response_data = {
+        'response': agent_response,
+        'sessionId': session_id,
+        'route': route,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    
+    logger.info("Chat processing completed successfully")
+    return ResponseBuilder.success(response_data)
+
+def invoke_model(message, customized_message, session_id, pinned_endpoint):
+    """
+    短い雑談はファストパス、それ以外（とファストパスの失敗時）は Agent で応答を生成
+    （応答, 経路, セッションを固定する呼び出し先, 使用量, 経路の判定）を返す。Agent の呼び出しに失敗した場合は例外を送出。
+    """
+    # 使用量は呼び出し毎に別の集計を使い、応答を返した呼び出しの分だけを記録する
+    usage = None
+    decision = fast_path_policy.decide(message)
+    route = ROUTE_AGENT
+    agent_response = None
+    endpoint_name = pinned_endpoint
+    if decision.route == ROUTE_FAST:
+        attempt_usage = new_usage_collector()
         try:
-            agent_response = invoke_bedrock_agent(customized_message, session_id)
-            logger.info("Successfully got response from Bedrock Agent")
+            agent_response = invoke_fast_path(bedrock_runtime, customized_message, fast_path_instruction, attempt_usage)
+            route = ROUTE_FAST
+            usage = attempt_usage
         except Exception as e:
-            logger.error(f"Bedrock Agent error: {str(e)}")
-            return ResponseBuilder.error('AI応答の生成に失敗しました', 500, str(e))
+            logger.warning(f"Fast path failed; falling back to Bedrock Agent: {str(e)}")
+    
+    if agent_response is None:
+        # 呼び出し先を選ぶ（セッションはウィンドウ行に保存した呼び出し先に固定）
+        endpoint = agent_router.select(session_id, pinned_endpoint)
+        attempt_usage = new_usage_collector()
+        try:
+            agent_response = invoke_bedrock_agent(customized_message, session_id, usage=attempt_usage, endpoint=endpoint)
+        except Exception:
+            # 別の呼び出し先があれば1回だけ再試行（セッションは再試行先に固定し直す）
+            fallback = agent_router.failover(endpoint, session_id)
+            if fallback is None:
+                raise
+            endpoint = fallback
+            attempt_usage = new_usage_collector()
+            agent_response = invoke_bedrock_agent(customized_message, session_id, usage=attempt_usage, endpoint=endpoint)
+        usage = attempt_usage
+        logger.info("Successfully got response from Bedrock Agent")
+        endpoint_name = endpoint.name
+    return agent_response, route, endpoint_name, usage, decision
+
+async def invoke_model_async(message, customized_message, session_id, pinned_endpoint):
+    """invoke_model をスレッドで実行（イベントループを止めずに同じリクエストの他の処理と並行させる）"""
+    return await asyncio.to_thread(invoke_model, message, customized_message, session_id, pinned_endpoint)
+
+async def respond_async(user_id: str, session_id: str, message: str, customized_message: str, pinned_endpoint):
+    """応答の生成とユーザーメッセージの作成を並行実行（失敗はそれぞれ例外オブジェクトとして返す）"""
+    return await asyncio.gather(
+        invoke_model_async(message, customized_message, session_id, pinned_endpoint),
+        asyncio.to_thread(history_helper.build_message_item, user_id, session_id, 'user', message),
+        return_exceptions=True
+    )
+
+async def load_chat_context(user_id: str, session_id: str):
+    """プロフィールと直近会話ウィンドウを並行取得"""
+    if not CONTEXT_WINDOW_ENABLED:
+        return await async_profile_helper.get_user_profile(user_id), None
+    return await asyncio.gather(
+        async_profile_helper.get_user_profile(user_id),
+        async_history_helper.get_context_window(user_id, session_id)
+    )
+
+def is_batch_request(event) -> bool:
+    """POST /chat/batch へのリクエストか"""
+    path = event.get('resource') or event.get('path') or ''
+    return path.rstrip('/').endswith('/batch')
+
+def get_batch_agent_runtime():
+    """一括実行用の Bedrock クライアント"""
+    global batch_agent_runtime
+    if batch_agent_runtime is None:
+        batch_agent_runtime = configure_agent_runtime(client_factory.client(
+            'bedrock-agent-runtime',
+            region_name=agent_router.default.region,
+            read_timeout=BATCH_ITEM_TIMEOUT_SECONDS,
+            max_pool_connections=BATCH_MAX_CONCURRENCY
+        ))
+    return batch_agent_runtime
+
+def handle_batch(body: dict, user_id: str, context=None, accept_encoding: str = None):
+    """チャット一括実行処理（履歴には保存せず、アイテム毎の応答とレイテンシを返す）"""
+    try:
+        try:
+            items = parse_batch_items(body.get('items'))
+            concurrency = int(body['concurrency']) if body.get('concurrency') is not None else None
+            item_timeout = float(body['timeoutSeconds']) if body.get('timeoutSeconds') is not None else None
+        except (TypeError, ValueError) as e:
+            return ResponseBuilder.error(str(e), 400)
+        if item_timeout is not None:
+            item_timeout = max(1.0, min(item_timeout, BATCH_ITEM_TIMEOUT_SECONDS))
+        
+        # profile を指定しないアイテムは呼び出しユーザーのプロフィールを使う（1回だけ取得）
+        default_profile = None
+        if any('profile' not in item for item in items):
+            default_profile = profile_helper.get_user_profile(user_id)
+        
+        # Lambda の残り時間が少なくなったら新しいアイテムを開始しない
+        should_stop = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            should_stop = lambda: context.get_remaining_time_in_millis() < BATCH_TIME_MARGIN_MS
         
-        # AIメッセージを履歴に保存
-        if not history_helper.save_message(user_id, session_id, 'assistant', agent_response):
-            logger.error("Failed to save assistant message to history")
+        client = get_batch_agent_runtime()
         
-        # レスポンス返却
-        response_data = {
-            'response': agent_response,
-            'sessionId': session_id,
-            'timestamp': datetime.utcnow().isoformat()
-        }
+        def invoke(message, session_id):
+            usage = new_usage_collector()
+            try:
+                return invoke_bedrock_agent(message, session_id, client, usage=usage, endpoint=agent_router.default)
+            finally:
+                if usage is not None:
+                    usage_accountant.record(user_id, usage)
         
-        logger.info("Chat processing completed successfully")
-        return ResponseBuilder.success(response_data)
+        runner = ChatBatchRunner(profile_helper, invoke, concurrency, item_timeout)
+        result = runner.run(items, default_profile, should_stop)
+        # 全アイテムの使用量をまとめて書き込む
+        usage_accountant.flush()
+        logger.info(f"Chat batch for user {user_id}: {result['summary']['counts']}")
+        
+        return ResponseBuilder.success(result, accept_encoding=accept_encoding)
         
     except Exception as e:
-        logger.error(f"Unexpected error in chat lambda: {str(e)}", exc_info=True)
-        return ResponseBuilder.error('内部サーバーエラーが発生しました', 500, str(e))
+        logger.error(f"Error in chat batch: {str(e)}")
+        return ResponseBuilder.error('一括実行中にエラーが発生しました', 500, str(e))
+
+def agent_runtime_for(region):
+    """リージョンの bedrock-agent-runtime クライアント"""
+    if region == BEDROCK_REGION:
+        return bedrock_agent_runtime
+    client = regional_agent_runtimes.get(region)
+    if client is None:
+        client = regional_agent_runtimes[region] = configure_agent_runtime(
+            client_factory.client('bedrock-agent-runtime', region_name=region)
+        )
+    return client
 
-def invoke_bedrock_agent(message, session_id):
+def invoke_bedrock_agent(message, session_id, client=None, usage=None, endpoint=None):
     """
     Bedrock Agent を呼び出してレスポンスを取得
+    （usage に UsageCollector を渡すとトレースを有効にしてトークン数を集計）
+    endpoint（agent_router.AgentEndpoint）の省略時は既定の呼び出し先。最初のチャンクまでの時間と失敗をルーターに記録する。
     """
+    endpoint = endpoint or agent_router.default
+    ttfb_ms = None
     try:
-        logger.info(f"Invoking Bedrock Agent with session: {session_id}")
-        
-        response = bedrock_agent_runtime.invoke_agent(
-            agentId=AGENT_ID,
-            agentAliasId=AGENT_ALIAS_ID,
-            sessionId=session_id,
-            inputText=message
-        )
+        logger.info(f"Invoking Bedrock Agent with session: {session_id} via {endpoint.name}")
+        started = time.monotonic()
         
-        # ストリーミングレスポンスを処理
-        response_text = ""
-        event_stream = response.get('completion', {})
+        with tracer.span('bedrock.invoke_agent', agent_id=endpoint.agent_id, agent_alias_id=endpoint.alias_id,
+                         endpoint=endpoint.name, region=endpoint.region) as span:
+            response = (client or agent_runtime_for(endpoint.region)).invoke_agent(
+                agentId=endpoint.agent_id,
+                agentAliasId=endpoint.alias_id,
+                sessionId=session_id,
+                inputText=message,
+                enableTrace=usage is not None and USAGE_AGENT_TRACE_ENABLED
+            )
+            
+            # ストリーミングレスポンスを処理
+            response_text = ""
+            chunk_count = 0
+            event_stream = response.get('completion', {})
+            
+            for event in event_stream:
+                if 'chunk' in event:
+                    chunk = event['chunk']
+                    if 'bytes' in chunk:
+                        chunk_text = chunk['bytes'].decode('utf-8')
+                        response_text += chunk_text
+                        chunk_count += 1
+                        if chunk_count == 1:
+                            ttfb_ms = (time.monotonic() - started) * 1000
+                            if span is not None:
+                                span.add_event('first_chunk')
+                elif usage is not None and 'trace' in event:
+                    usage.observe(event['trace'])
+            
+            if span is not None:
+                span.set_attribute('chunk_count', chunk_count)
+                span.set_attribute('response_chars', len(response_text))
         
-        for event in event_stream:
-            if 'chunk' in event:
-                chunk = event['chunk']
-                if 'bytes' in chunk:
-                    chunk_text = chunk['bytes'].decode('utf-8')
-                    response_text += chunk_text
+        agent_router.record(endpoint, ttfb_ms or (time.monotonic() - started) * 1000, True)
+        if usage is not None:
+            usage.agent_ms += (time.monotonic() - started) * 1000
+            if span is not None:
+                span.set_attribute('input_tokens', usage.input_tokens)
+                span.set_attribute('output_tokens', usage.output_tokens)
         
         if not response_text.strip():
             logger.warning("Empty response from Bedrock Agent")
@@ -133,9 +479,14 @@ def invoke_bedrock_agent(message, session_id):
         return response_text.strip()
         
     except Exception as e:
-        logger.error(f"Failed to invoke Bedrock Agent: {str(e)}")
+        agent_router.record(endpoint, ttfb_ms, False)
+        logger.error(f"Failed to invoke Bedrock Agent via {endpoint.name}: {str(e)}")
         raise Exception(f"Bedrock Agent呼び出しエラー: {str(e)}")
 
+# Lambda の初期化フェーズでプライミング（WARMUP_PRIME_ON_INIT で制御）
+if should_prime_on_init():
+    primer.prime()
+
 if __name__ == "__main__":
     # ローカルテスト用
     test_event = {
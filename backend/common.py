@@ -1,9 +1,21 @@
 # 共通ライブラリ - Lambda関数間で使用する共通機能
+import os
 import json
+import hashlib
 import logging
+import threading
+import time
 from datetime import datetime
+import boto3
 import jwt
+from botocore.config import Config
 from typing import Dict, Any, Optional
+from tracing import tracer
+from serializer import get_serializer
+from compression import compress_response
+from history_compression import encode_message_content, decode_message, decode_messages
+from hashed_embedding import embed_bytes
+from dynamo_codec import ItemCodec, HISTORY_CODEC, PROFILE_CODEC, GENERIC_CODEC
 
 # ログ設定
 def setup_logger(name: str, level=logging.INFO):
@@ -22,28 +34,36 @@ def setup_logger(name: str, level=logging.INFO):
     
     return logger
 
+# CORS ヘッダー（全レスポンス共通のためモジュール読み込み時に1度だけ構築）
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, Idempotency-Key',
+    'Content-Type': 'application/json'
+}
+
+_OPTIONS_BODY = json.dumps({'message': 'OK'})
+
 class ResponseBuilder:
     """HTTP レスポンス構築用クラス"""
     
     @staticmethod
     def cors_headers() -> Dict[str, str]:
-        """CORS ヘッダーを返す"""
-        return {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-            'Content-Type': 'application/json'
-        }
+        """CORS ヘッダーを返す（呼び出し側で変更できるようコピー）"""
+        return dict(CORS_HEADERS)
     
     @staticmethod
-    def success(data: Any = None, status_code: int = 200) -> Dict[str, Any]:
-        """成功レスポンスを構築"""
+    def success(data: Any = None, status_code: int = 200, accept_encoding: str = None) -> Dict[str, Any]:
+        """成功レスポンスを構築（accept_encoding 指定時は閾値以上のボディを圧縮）"""
         body = data if data is not None else {'message': 'Success'}
-        return {
+        response = {
             'statusCode': status_code,
-            'headers': ResponseBuilder.cors_headers(),
-            'body': json.dumps(body, ensure_ascii=False, default=str)
+            'headers': dict(CORS_HEADERS),
+            'body': get_serializer().dumps(body)
         }
+        if accept_encoding:
+            response = compress_response(response, accept_encoding)
+        return response
     
     @staticmethod
     def error(message: str, status_code: int = 400, details: str = None) -> Dict[str, Any]:
@@ -54,8 +74,8 @@ class ResponseBuilder:
             
         return {
             'statusCode': status_code,
-            'headers': ResponseBuilder.cors_headers(),
-            'body': json.dumps(error_body, ensure_ascii=False)
+            'headers': dict(CORS_HEADERS),
+            'body': get_serializer().dumps(error_body)
         }
     
     @staticmethod
@@ -63,8 +83,8 @@ class ResponseBuilder:
         """OPTIONSリクエスト用レスポンス"""
         return {
             'statusCode': 200,
-            'headers': ResponseBuilder.cors_headers(),
-            'body': json.dumps({'message': 'OK'})
+            'headers': dict(CORS_HEADERS),
+            'body': _OPTIONS_BODY
         }
 
 class RequestValidator:
@@ -82,17 +102,20 @@ class RequestValidator:
         except json.JSONDecodeError as e:
             raise ValueError(f'無効なJSON形式です: {str(e)}')
     
+    @staticmethod
+    def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+        """ヘッダー取得（大文字小文字の違いに対応）"""
+        headers = event.get('headers') or {}
+        name = name.lower()
+        for key, value in headers.items():
+            if key.lower() == name:
+                return value
+        return None
+    
     @staticmethod
     def validate_auth_token(event: Dict[str, Any]) -> Dict[str, Any]:
         """認証トークンを検証"""
-        headers = event.get('headers', {})
-        
-        # 大文字小文字の違いに対応
-        auth_header = None
-        for key, value in headers.items():
-            if key.lower() == 'authorization':
-                auth_header = value
-                break
+        auth_header = RequestValidator.get_header(event, 'authorization')
         
         if not auth_header:
             raise ValueError('認証ヘッダーが必要です')
@@ -114,23 +137,164 @@ class RequestValidator:
         except Exception as e:
             raise ValueError(f'認証トークンが無効です: {str(e)}')
 
+def client_config_options(**overrides) -> Dict[str, Any]:
+    """botocore Config（aiobotocore の AioConfig と共通）の引数"""
+    settings = {
+        'max_pool_connections': CLIENT_MAX_POOL_CONNECTIONS,
+        'tcp_keepalive': CLIENT_TCP_KEEPALIVE,
+        'connect_timeout': CLIENT_CONNECT_TIMEOUT,
+        'read_timeout': CLIENT_READ_TIMEOUT,
+        'retry_mode': CLIENT_RETRY_MODE,
+        'max_attempts': CLIENT_MAX_ATTEMPTS
+    }
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    
+    return {
+        'max_pool_connections': settings['max_pool_connections'],
+        'tcp_keepalive': settings['tcp_keepalive'],
+        'connect_timeout': settings['connect_timeout'],
+        'read_timeout': settings['read_timeout'],
+        'retries': {
+            'mode': settings['retry_mode'],
+            'max_attempts': settings['max_attempts']
+        }
+    }
+
+def build_client_config(**overrides) -> Config:
+    """接続プール・キープアライブ・タイムアウト・リトライを設定した botocore Config を生成"""
+    return Config(**client_config_options(**overrides))
+
+class ClientFactory:
+    """boto3 クライアント/リソース生成（設定済み Config・生成済みインスタンスを再利用）"""
+    
+    def __init__(self, region_name: str = None, session: boto3.session.Session = None, **config_overrides):
+        self.region_name = region_name or os.environ.get('AWS_REGION') or AWS_REGION
+        self.session = session or boto3.session.Session()
+        self.config_overrides = config_overrides
+        self._instances = {}
+        self._lock = threading.Lock()
+    
+    def _get_or_create(self, kind: str, service_name: str, region_name: Optional[str], overrides: Dict[str, Any]):
+        region = region_name or self.region_name
+        options = dict(self.config_overrides, **overrides)
+        cache_key = (kind, service_name, region, tuple(sorted(options.items())))
+        
+        instance = self._instances.get(cache_key)
+        if instance is not None:
+            return instance
+        
+        # boto3 のセッションはクライアント生成がスレッドセーフでないためロックする
+        with self._lock:
+            instance = self._instances.get(cache_key)
+            if instance is None:
+                create = self.session.resource if kind == 'resource' else self.session.client
+                instance = create(service_name, region_name=region, config=build_client_config(**options))
+                self._instances[cache_key] = instance
+            return instance
+    
+    def client(self, service_name: str, region_name: str = None, **config_overrides):
+        """低レベルクライアントを取得"""
+        return self._get_or_create('client', service_name, region_name, config_overrides)
+    
+    def resource(self, service_name: str, region_name: str = None, **config_overrides):
+        """リソースを取得"""
+        return self._get_or_create('resource', service_name, region_name, config_overrides)
+
 class DatabaseHelper:
-    """DynamoDB操作用ヘルパークラス"""
+    """DynamoDB操作用ヘルパークラス
+    
+    dynamodb_client を渡すと低レベルクライアントモードになり、
+    テーブル毎のコーデックでネイティブ型（Decimal ではなく int/float）を返す。
+    クライアントモードでは条件式は文字列で指定すること。
+    """
     
-    def __init__(self, dynamodb_resource):
+    def __init__(self, dynamodb_resource, dynamodb_client=None, codecs: Dict[str, ItemCodec] = None):
         self.dynamodb = dynamodb_resource
+        self.client = dynamodb_client
+        self.codecs = codecs if codecs is not None else TABLE_CODECS
         self.logger = setup_logger('DatabaseHelper')
+        self._tables = {}
     
     def get_table(self, table_name: str):
-        """テーブル取得"""
-        return self.dynamodb.Table(table_name)
+        """テーブル取得（ハンドルはコンテナ内で再利用）"""
+        table = self._tables.get(table_name)
+        if table is None:
+            table = self.dynamodb.Table(table_name)
+            self._tables[table_name] = table
+        return table
+    
+    def get_codec(self, table_name: str) -> ItemCodec:
+        """テーブルのコーデック取得"""
+        return self.codecs.get(table_name, GENERIC_CODEC)
+    
+    def _call(self, table_name: str, operation: str, **kwargs) -> Dict[str, Any]:
+        """テーブル操作を実行（クライアントモードではコーデックで変換）"""
+        if self.client is None:
+            return getattr(self.get_table(table_name), operation)(**kwargs)
+        
+        response = getattr(self.client, operation)(**self.encode_request(table_name, kwargs))
+        return self.decode_response(table_name, response)
+    
+    def encode_request(self, table_name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """低レベルクライアント用にリクエストを変換（aiobotocore クライアントと共通）"""
+        codec = self.get_codec(table_name)
+        request = dict(kwargs, TableName=table_name)
+        for name in ('Key', 'Item', 'ExclusiveStartKey'):
+            if name in request:
+                request[name] = codec.encode(request[name])
+        if 'ExpressionAttributeValues' in request:
+            request['ExpressionAttributeValues'] = codec.encode_values(request['ExpressionAttributeValues'])
+        return request
+    
+    def decode_response(self, table_name: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """低レベルクライアントのレスポンスをネイティブ型に変換"""
+        codec = self.get_codec(table_name)
+        if 'Item' in response:
+            response['Item'] = codec.decode(response['Item'])
+        if 'Items' in response:
+            response['Items'] = codec.decode_items(response['Items'])
+        for name in ('Attributes', 'LastEvaluatedKey'):
+            if name in response:
+                response[name] = codec.decode(response[name])
+        return response
     
-    def safe_get_item(self, table_name: str, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def transact_write(self, operations: list) -> None:
+        """TransactWriteItems を実行（失敗時は例外をそのまま送出）
+
+        operations は [{'Put': {'TableName': ..., 'Item': {...}, 'ConditionExpression': ...}}, ...] の形式で、
+        Item / Key / ExpressionAttributeValues は Python の値で指定する（テーブル毎のコーデックで変換）。
+        """
+        client = self.client if self.client is not None else self.dynamodb.meta.client
+        transact_items = self.encode_transact_items(operations)
+        
+        with tracer.span('dynamodb.TransactWriteItems', operations=len(transact_items)):
+            client.transact_write_items(TransactItems=transact_items)
+    
+    def encode_transact_items(self, operations: list) -> list:
+        """TransactWriteItems の TransactItems に変換"""
+        transact_items = []
+        for operation in operations:
+            (kind, request), = operation.items()
+            codec = self.get_codec(request['TableName'])
+            request = dict(request)
+            for name in ('Item', 'Key'):
+                if name in request:
+                    request[name] = codec.encode(request[name])
+            if 'ExpressionAttributeValues' in request:
+                request['ExpressionAttributeValues'] = codec.encode_values(request['ExpressionAttributeValues'])
+            transact_items.append({kind: request})
+        return transact_items
+    
+    def safe_get_item(self, table_name: str, key: Dict[str, Any],
+                      consistent_read: bool = False) -> Optional[Dict[str, Any]]:
         """安全なアイテム取得（エラーハンドリング付き）"""
         try:
-            table = self.get_table(table_name)
-            response = table.get_item(Key=key)
-            return response.get('Item')
+            with tracer.span('dynamodb.GetItem', table=table_name):
+                if consistent_read:
+                    response = self._call(table_name, 'get_item', Key=key, ConsistentRead=True)
+                else:
+                    response = self._call(table_name, 'get_item', Key=key)
+                return response.get('Item')
         except Exception as e:
             self.logger.error(f"Failed to get item from {table_name}: {str(e)}")
             return None
@@ -138,19 +302,38 @@ class DatabaseHelper:
     def safe_put_item(self, table_name: str, item: Dict[str, Any]) -> bool:
         """安全なアイテム保存"""
         try:
-            table = self.get_table(table_name)
-            table.put_item(Item=item)
-            return True
+            with tracer.span('dynamodb.PutItem', table=table_name):
+                self._call(table_name, 'put_item', Item=item)
+                return True
         except Exception as e:
             self.logger.error(f"Failed to put item to {table_name}: {str(e)}")
             return False
     
+    def put_item(self, table_name: str, item: Dict[str, Any], **kwargs) -> None:
+        """アイテム保存（条件付き書き込み用。失敗時は例外をそのまま送出）"""
+        with tracer.span('dynamodb.PutItem', table=table_name):
+            self._call(table_name, 'put_item', Item=item, **kwargs)
+    
+    def update_item(self, table_name: str, key: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        """アイテム更新（失敗時は例外をそのまま送出。ReturnValues 指定時は Attributes、それ以外は空辞書を返す）"""
+        with tracer.span('dynamodb.UpdateItem', table=table_name):
+            response = self._call(table_name, 'update_item', Key=key, **kwargs)
+            return response.get('Attributes', {})
+    
+    def safe_update_item(self, table_name: str, key: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        """安全なアイテム更新（ReturnValues 指定時は Attributes、それ以外は空辞書を返す）"""
+        try:
+            return self.update_item(table_name, key, **kwargs)
+        except Exception as e:
+            self.logger.error(f"Failed to update item in {table_name}: {str(e)}")
+            return None
+    
     def safe_delete_item(self, table_name: str, key: Dict[str, Any]) -> bool:
         """安全なアイテム削除"""
         try:
-            table = self.get_table(table_name)
-            table.delete_item(Key=key)
-            return True
+            with tracer.span('dynamodb.DeleteItem', table=table_name):
+                self._call(table_name, 'delete_item', Key=key)
+                return True
         except Exception as e:
             self.logger.error(f"Failed to delete item from {table_name}: {str(e)}")
             return False
@@ -158,9 +341,12 @@ class DatabaseHelper:
     def safe_query(self, table_name: str, **kwargs) -> Optional[list]:
         """安全なクエリ実行"""
         try:
-            table = self.get_table(table_name)
-            response = table.query(**kwargs)
-            return response.get('Items', [])
+            with tracer.span('dynamodb.Query', table=table_name) as span:
+                response = self._call(table_name, 'query', **kwargs)
+                items = response.get('Items', [])
+                if span is not None:
+                    span.set_attribute('item_count', len(items))
+                return items
         except Exception as e:
             self.logger.error(f"Failed to query {table_name}: {str(e)}")
             return None
@@ -168,13 +354,100 @@ class DatabaseHelper:
     def safe_scan(self, table_name: str, **kwargs) -> Optional[list]:
         """安全なスキャン実行"""
         try:
-            table = self.get_table(table_name)
-            response = table.scan(**kwargs)
-            return response.get('Items', [])
+            with tracer.span('dynamodb.Scan', table=table_name) as span:
+                response = self._call(table_name, 'scan', **kwargs)
+                items = response.get('Items', [])
+                if span is not None:
+                    span.set_attribute('item_count', len(items))
+                return items
+        except Exception as e:
+            self.logger.error(f"Failed to scan {table_name}: {str(e)}")
+            return None
+    
+    def _batch_get(self, table_name: str, keys: list, **options) -> tuple:
+        """BatchGetItem を1回実行（(アイテム一覧, 未処理キー一覧) を返す）"""
+        if self.client is None:
+            response = self.dynamodb.batch_get_item(RequestItems={table_name: {'Keys': keys, **options}})
+            unprocessed = (response.get('UnprocessedKeys') or {}).get(table_name, {}).get('Keys', [])
+            return response.get('Responses', {}).get(table_name, []), unprocessed
+        
+        response = self.client.batch_get_item(**self.encode_batch_get(table_name, keys, options))
+        return self.decode_batch_get(table_name, response)
+    
+    def encode_batch_get(self, table_name: str, keys: list, options: Dict[str, Any]) -> Dict[str, Any]:
+        """低レベルクライアント用の BatchGetItem リクエスト（aiobotocore クライアントと共通）"""
+        codec = self.get_codec(table_name)
+        return {'RequestItems': {table_name: {'Keys': [codec.encode(key) for key in keys], **options}}}
+    
+    def decode_batch_get(self, table_name: str, response: Dict[str, Any]) -> tuple:
+        """低レベルクライアントの BatchGetItem レスポンスを (アイテム一覧, 未処理キー一覧) に変換"""
+        codec = self.get_codec(table_name)
+        unprocessed = (response.get('UnprocessedKeys') or {}).get(table_name, {}).get('Keys', [])
+        return (codec.decode_items(response.get('Responses', {}).get(table_name, [])),
+                codec.decode_items(unprocessed))
+    
+    @staticmethod
+    def batch_get_retry_delay(attempt: int, pending: list) -> float:
+        """未処理キーを再試行するまでの待ち時間（再試行回数の上限を超えたら RuntimeError）"""
+        if attempt > BATCH_GET_MAX_RETRIES:
+            raise RuntimeError(f'{len(pending)} keys were not processed')
+        return min(0.05 * (2 ** attempt), 1.0)
+    
+    def safe_batch_get_items(self, table_name: str, keys: list, **options) -> Optional[list]:
+        """複数アイテムを BatchGetItem で取得（100件単位に分割、未処理キーは再試行。順序は保証しない）
+
+        options（ProjectionExpression / ExpressionAttributeNames / ConsistentRead）はテーブル毎のリクエストに渡す。
+        """
+        try:
+            items = []
+            with tracer.span('dynamodb.BatchGetItem', table=table_name, keys=len(keys)):
+                for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+                    pending = keys[start:start + BATCH_GET_MAX_KEYS]
+                    attempt = 0
+                    while pending:
+                        found, pending = self._batch_get(table_name, pending, **options)
+                        items.extend(found)
+                        if pending:
+                            attempt += 1
+                            time.sleep(self.batch_get_retry_delay(attempt, pending))
+            return items
+        except Exception as e:
+            self.logger.error(f"Failed to batch get items from {table_name}: {str(e)}")
+            return None
+    
+    def safe_query_page(self, table_name: str, **kwargs) -> Optional[tuple]:
+        """1ページ分のクエリ実行（(アイテム一覧, LastEvaluatedKey) を返す）"""
+        try:
+            with tracer.span('dynamodb.Query', table=table_name) as span:
+                response = self._call(table_name, 'query', **kwargs)
+                items = response.get('Items', [])
+                if span is not None:
+                    span.set_attribute('item_count', len(items))
+                return items, response.get('LastEvaluatedKey')
+        except Exception as e:
+            self.logger.error(f"Failed to query {table_name}: {str(e)}")
+            return None
+    
+    def safe_scan_page(self, table_name: str, **kwargs) -> Optional[tuple]:
+        """1ページ分のスキャン実行（(アイテム一覧, LastEvaluatedKey) を返す）"""
+        try:
+            with tracer.span('dynamodb.Scan', table=table_name) as span:
+                response = self._call(table_name, 'scan', **kwargs)
+                items = response.get('Items', [])
+                if span is not None:
+                    span.set_attribute('item_count', len(items))
+                return items, response.get('LastEvaluatedKey')
         except Exception as e:
             self.logger.error(f"Failed to scan {table_name}: {str(e)}")
             return None
 
+class ProfileVersionConflict(Exception):
+    """プロフィールの version が期待値と一致しない（楽観的排他制御の競合）"""
+    
+    def __init__(self, expected_version: Optional[int]):
+        super().__init__(f"Profile version conflict (expected {expected_version})")
+        self.expected_version = expected_version
+
 class ProfileHelper:
     """プロフィール関連ヘルパー"""
     
@@ -183,6 +456,7 @@ class ProfileHelper:
         self.user_table = user_table
         self.logger = setup_logger('ProfileHelper')
     
+    @tracer.traced('ProfileHelper.get_user_profile')
     def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
         """ユーザープロフィールを取得"""
         return self.db_helper.safe_get_item(
@@ -190,24 +464,77 @@ class ProfileHelper:
             {'userId': user_id}
         )
     
-    def save_user_profile(self, user_id: str, profile_data: Dict[str, Any]) -> bool:
-        """ユーザープロフィールを保存"""
-        profile = {
-            'userId': user_id,
-            'userName': profile_data.get('userName', ''),
-            'age': profile_data.get('age', ''),
-            'occupation': profile_data.get('occupation', ''),
-            'gender': profile_data.get('gender', ''),
-            'responseLength': profile_data.get('responseLength', 'medium'),
-            'updatedAt': datetime.utcnow().isoformat(),
-            'createdAt': profile_data.get('createdAt', datetime.utcnow().isoformat())
+    @tracer.traced('ProfileHelper.get_user_profiles')
+    def get_user_profiles(self, user_ids: list) -> Optional[Dict[str, Dict[str, Any]]]:
+        """複数ユーザーのプロフィールを BatchGetItem で一括取得（userId → プロフィール。存在しないユーザーは含まない）"""
+        unique_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+        if not unique_ids:
+            return {}
+        items = self.db_helper.safe_batch_get_items(
+            self.user_table,
+            [{'userId': user_id} for user_id in unique_ids]
+        )
+        if items is None:
+            return None
+        return {item['userId']: item for item in items}
+    
+    @tracer.traced('ProfileHelper.upsert_user_profile')
+    def upsert_user_profile(self, user_id: str, profile_data: Dict[str, Any],
+                            expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """プロフィールを1回の UpdateItem で作成・更新し、更新後のプロフィールを返す
+        
+        createdAt は初回のみ設定し、version は書き込み毎に 1 ずつ増やす。
+        expected_version を指定すると現在の version と一致する場合のみ更新し（0 は未作成）、
+        一致しなければ ProfileVersionConflict を送出する。その他の失敗時は None を返す。
+        """
+        now = datetime.utcnow().isoformat()
+        names = {'#version': 'version', '#createdAt': 'createdAt', '#updatedAt': 'updatedAt'}
+        values = {':now': now, ':zero': 0, ':one': 1}
+        assignments = []
+        for field, default in PROFILE_FIELDS.items():
+            names[f'#{field}'] = field
+            values[f':{field}'] = profile_data.get(field, default)
+            assignments.append(f'#{field} = :{field}')
+        assignments += [
+            '#updatedAt = :now',
+            '#createdAt = if_not_exists(#createdAt, :now)',
+            '#version = if_not_exists(#version, :zero) + :one'
+        ]
+        kwargs = {
+            'UpdateExpression': 'SET ' + ', '.join(assignments),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+            'ReturnValues': 'ALL_NEW'
         }
+        if expected_version is not None:
+            if expected_version == 0:
+                kwargs['ConditionExpression'] = 'attribute_not_exists(#version)'
+            else:
+                kwargs['ConditionExpression'] = '#version = :expected'
+                values[':expected'] = expected_version
         
-        return self.db_helper.safe_put_item(self.user_table, profile)
+        try:
+            return self.db_helper.update_item(self.user_table, {'userId': user_id}, **kwargs)
+        except Exception as e:
+            if is_conditional_failure(e):
+                raise ProfileVersionConflict(expected_version) from e
+            self.logger.error(f"Failed to upsert profile for {user_id}: {str(e)}")
+            return None
+    
+    def save_user_profile(self, user_id: str, profile_data: Dict[str, Any]) -> bool:
+        """ユーザープロフィールを保存（upsert_user_profile の互換ラッパー）"""
+        return self.upsert_user_profile(user_id, profile_data) is not None
     
-    def customize_message_with_profile(self, message: str, user_profile: Dict[str, Any]) -> str:
-        """プロフィールに基づいてメッセージをカスタマイズ"""
+    def customize_message_with_profile(self, message: str, user_profile: Dict[str, Any],
+                                       conversation_context: str = None) -> str:
+        """プロフィール（と直近の会話）に基づいてメッセージをカスタマイズ"""
         if not user_profile:
+            if conversation_context:
+                return f"""【これまでの会話】
+{conversation_context}
+
+【ユーザーメッセージ】
+{message}"""
             return message
         
         # プロフィール情報を抽出
@@ -240,116 +567,815 @@ class ProfileHelper:
 
 【応答指示】
 {length_text}で応答してください。
-ユーザーの属性に適した話し方や内容で応答してください。
+ユーザーの属性に適した話し方や内容で応答してください。"""
+        
+        if conversation_context:
+            customized_message += f"""
+
+【これまでの会話】
+{conversation_context}"""
+        
+        customized_message += f"""
 
 【ユーザーメッセージ】
 {message}"""
         
         return customized_message
 
+# ULID 生成（Crockford Base32, 48bit ミリ秒 + 80bit 乱数, 同一ミリ秒内は単調増加）
+_ULID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_ulid_lock = threading.Lock()
+_ulid_last = [0, 0]
+
+def encode_ulid(timestamp_ms: int, randomness: int) -> str:
+    """タイムスタンプと乱数部から ULID 文字列を生成"""
+    value = (timestamp_ms << 80) | (randomness & ((1 << 80) - 1))
+    chars = []
+    for _ in range(26):
+        chars.append(_ULID_ALPHABET[value & 0x1F])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+def new_ulid(timestamp_ms: int = None) -> str:
+    """新しい ULID を生成（同一プロセス内で衝突しない）"""
+    now_ms = timestamp_ms if timestamp_ms is not None else int(time.time() * 1000)
+    with _ulid_lock:
+        if now_ms <= _ulid_last[0]:
+            # 同一ミリ秒（または時計の巻き戻り）は乱数部をインクリメント
+            now_ms = _ulid_last[0]
+            randomness = _ulid_last[1] + 1
+        else:
+            randomness = int.from_bytes(os.urandom(10), 'big')
+        _ulid_last[0], _ulid_last[1] = now_ms, randomness
+    return encode_ulid(now_ms, randomness)
+
+def build_message_key(session_id: str, ulid: str = None) -> str:
+    """メッセージのソートキー（SESSION#<sessionId>#<ULID>）"""
+    return f"{SESSION_KEY_PREFIX}{session_id}#{ulid or new_ulid()}"
+
+def session_key_prefix(session_id: str) -> str:
+    """セッション内メッセージのソートキー接頭辞"""
+    return f"{SESSION_KEY_PREFIX}{session_id}#"
+
+def message_time(message: Dict[str, Any]) -> str:
+    """メッセージの作成日時（旧形式の行はソートキーが ISO 日時）"""
+    return message.get('createdAt') or message.get('timestamp', '')
+
+def context_key(session_id: str) -> str:
+    """セッションの直近会話ウィンドウ行のソートキー"""
+    return f"{CONTEXT_KEY_PREFIX}{session_id}"
+
+def is_conditional_failure(error: Exception) -> bool:
+    """条件付き書き込み（トランザクション含む）の条件不成立によるエラーか"""
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    if code == 'ConditionalCheckFailedException':
+        return True
+    if code == 'TransactionCanceledException':
+        reasons = response.get('CancellationReasons') or []
+        return any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons)
+    return False
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語などの非 ASCII 文字は 1 文字 1 トークン、ASCII は 4 文字 1 トークン）"""
+    ascii_chars = sum(1 for char in text if char < '\x80')
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+def select_context_turns(turns: list, token_budget: int = None) -> list:
+    """トークン予算内に収まる直近の発言を選択（古い発言から切り捨て、時系列順で返す）"""
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    selected = []
+    used = 0
+    for turn in reversed(turns or []):
+        tokens = estimate_tokens(turn.get('content', ''))
+        if used + tokens > budget:
+            break
+        selected.append(turn)
+        used += tokens
+    selected.reverse()
+    return selected
+
+def format_context_turns(turns: list) -> str:
+    """直近の発言をプロンプト用のテキストに整形"""
+    labels = {'user': 'ユーザー', 'assistant': 'ゲンキちゃん'}
+    return "\n".join(f"{labels.get(turn.get('role'), turn.get('role'))}: {turn.get('content', '')}" for turn in turns)
+
+def stored_content_bytes(item: Dict[str, Any]) -> int:
+    """保存する本文属性（content または圧縮済みの contentZ）のバイト数"""
+    if 'contentZ' in item:
+        return len(item['contentZ'])
+    return len((item.get('content') or '').encode('utf-8'))
+
+def is_archive_tombstone(item: Dict[str, Any]) -> bool:
+    """S3 にアーカイブ済みセッションの要約行か"""
+    return item.get('timestamp', '').startswith(ARCHIVE_KEY_PREFIX)
+
+def create_conversation_preview(messages: list) -> str:
+    """会話のプレビューテキストを作成"""
+    # 最新のユーザーメッセージとAIの応答を取得
+    recent_messages = sorted(messages, key=message_time, reverse=True)[:4]
+    
+    preview_parts = []
+    for msg in reversed(recent_messages):  # 時系列順に戻す
+        role = msg.get('role', '')
+        content = msg.get('content', '')
+        
+        if content:
+            if role == 'user':
+                preview_parts.append(f"👤: {content[:30]}")
+            elif role == 'assistant':
+                preview_parts.append(f"🤖: {content[:30]}")
+    
+    preview = " | ".join(preview_parts)
+    
+    # 長さ制限
+    if len(preview) > 150:
+        preview = preview[:147] + "..."
+    
+    return preview
+
+def summarize_session(session_id: str, session_messages: list) -> Dict[str, Any]:
+    """セッションの会話要約（履歴一覧の1件分）を作成"""
+    # メッセージを時系列でソート
+    session_messages = sorted(session_messages, key=message_time)
+    
+    # 最初のユーザーメッセージを取得
+    first_user_message = None
+    for msg in session_messages:
+        if msg.get('role') == 'user':
+            first_user_message = msg.get('content', '')
+            break
+    
+    # 会話の統計情報を計算
+    user_count = sum(1 for msg in session_messages if msg.get('role') == 'user')
+    assistant_count = sum(1 for msg in session_messages if msg.get('role') == 'assistant')
+    
+    latest_timestamp = message_time(session_messages[-1]) if session_messages else datetime.utcnow().isoformat()
+    earliest_timestamp = message_time(session_messages[0]) if session_messages else latest_timestamp
+    
+    return {
+        'sessionId': session_id,
+        'firstMessage': first_user_message or '新しい会話',
+        'messageCount': len(session_messages),
+        'userMessageCount': user_count,
+        'assistantMessageCount': assistant_count,
+        'createdAt': earliest_timestamp,
+        'updatedAt': latest_timestamp,
+        'preview': create_conversation_preview(session_messages)
+    }
+
 class HistoryHelper:
-    """履歴管理ヘルパー"""
+    """履歴管理ヘルパー
     
-    def __init__(self, db_helper: DatabaseHelper, history_table: str):
+    ソートキー（timestamp 属性）は SESSION#<sessionId>#<ULID> 形式。
+    旧形式（ISO 日時）の行は LEGACY_HISTORY_READS が有効な間は併せて読み出す。
+    archive（history_archive.HistoryArchive）を渡すと、S3 にアーカイブ済みの
+    セッション（ARCHIVE#<sessionId> の要約行が残る）を読み出し時に復元し、アーカイブ後の行と併せて返す。
+    search_index（history_search.HistorySearchIndex）を渡すと、保存・削除時に検索インデックスを更新する。
+    overflow（history_overflow.HistoryOverflow）を渡すと、項目上限を超える本文を S3 に退避する
+    （未設定時はプレビュー長まで切り詰めて保存する）。
+    embeddings（history_similarity.EmbeddingChunks）を渡すと、保存時に埋め込みをチャンク行へ追記する。
+    """
+    
+    def __init__(self, db_helper: DatabaseHelper, history_table: str, archive=None, search_index=None,
+                 overflow=None, embeddings=None):
         self.db_helper = db_helper
         self.history_table = history_table
+        self.archive = archive
+        self.search_index = search_index
+        self.overflow = overflow
+        self.embeddings = embeddings
         self.logger = setup_logger('HistoryHelper')
     
-    def save_message(self, user_id: str, session_id: str, role: str, content: str) -> bool:
-        """メッセージを履歴に保存"""
-        timestamp = datetime.utcnow().isoformat()
+    def build_message_item(self, user_id: str, session_id: str, role: str, content: str) -> Dict[str, Any]:
+        """保存用のメッセージアイテムを作成（ソートキー・作成日時はこの時点で確定）"""
+        ulid = new_ulid()
         
         message_item = {
             'userId': user_id,
-            'timestamp': timestamp,
+            'timestamp': build_message_key(session_id, ulid),
             'sessionId': session_id,
             'role': role,
-            'content': content,
-            'messageId': f"{session_id}_{timestamp}_{role}"
+            'createdAt': datetime.utcnow().isoformat(),
+            'messageId': f"{session_id}_{ulid}_{role}"
         }
+        # 長い本文は圧縮して contentZ に保存
+        message_item.update(encode_message_content(content))
+        # 圧縮しても項目上限に収まらない本文は S3 に退避
+        if stored_content_bytes(message_item) > HISTORY_OVERFLOW_THRESHOLD_BYTES:
+            self._overflow_content(message_item, content)
+        # 類似会話検索用のハッシュ埋め込み（int8）
+        if EMBEDDING_ENABLED:
+            embedding = embed_bytes(content)
+            if embedding:
+                message_item['embedding'] = embedding
+        return message_item
+    
+    def _overflow_content(self, message_item: Dict[str, Any], content: str):
+        """本文を S3 に書き出し、行にはプレビューと参照だけを残す（インプレース）"""
+        message_item.pop('contentZ', None)
+        message_item.pop('contentEncoding', None)
+        message_item['content'] = content[:HISTORY_OVERFLOW_PREVIEW_CHARS]
+        message_item['contentBytes'] = len(content.encode('utf-8'))
+        key = self.overflow.put(message_item, content) if self.overflow is not None else None
+        if key:
+            message_item['contentRef'] = key
+        else:
+            # 退避先がない・書き出しに失敗した場合も保存自体は失敗させない
+            self.logger.warning(f"Truncated oversized message {message_item['messageId']} "
+                                f"({message_item['contentBytes']} bytes)")
+            message_item['truncated'] = True
+    
+    @tracer.traced('HistoryHelper.save_message')
+    def save_message(self, user_id: str, session_id: str, role: str, content: str) -> bool:
+        """メッセージを履歴に保存"""
+        return self.save_message_item(self.build_message_item(user_id, session_id, role, content))
+    
+    def save_message_item(self, message_item: Dict[str, Any]) -> bool:
+        """作成済みのメッセージアイテムを保存"""
+        if not self.db_helper.safe_put_item(self.history_table, message_item):
+            return False
+        self._index_messages([message_item])
+        return True
+    
+    def _index_messages(self, message_items: list):
+        """検索インデックス・埋め込みチャンクへの追加（検索インデックスはバックグラウンドまたは DynamoDB Streams で更新。保存の成否には影響しない）"""
+        if self.search_index is not None:
+            self.search_index.index_async(message_items)
+        if self.embeddings is not None:
+            self.embeddings.append_messages(message_items)
+    
+    @tracer.traced('HistoryHelper.get_context_window')
+    def get_context_window(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """セッションの直近会話ウィンドウ（CONTEXT#<sessionId> 行）を1回の GetItem で取得"""
+        return self.db_helper.safe_get_item(
+            self.history_table,
+            {'userId': user_id, 'timestamp': context_key(session_id)}
+        )
+    
+    @tracer.traced('HistoryHelper.save_turn')
+    def save_turn(self, message_items: list, window: Dict[str, Any] = None, endpoint: str = None) -> bool:
+        """1往復分のメッセージと直近会話ウィンドウを1回のトランザクションで保存
+
+        ウィンドウは version による楽観的ロックで更新し、同じセッションへの並行書き込みで
+        競合した場合は読み直して再試行する。トランザクションが失敗した場合は
+        メッセージだけを個別に保存する（ウィンドウは次のターンで追いつく）。
+        endpoint はセッションを固定する Agent の呼び出し先（ウィンドウ行の agentEndpoint に保存）。
+        """
+        user_id = message_items[0]['userId']
+        session_id = message_items[0]['sessionId']
+        
+        for attempt in range(CONTEXT_WRITE_RETRIES + 1):
+            operations = [{'Put': {'TableName': self.history_table, 'Item': item}} for item in message_items]
+            operations.append({'Put': self._context_put(user_id, session_id, window, message_items, endpoint)})
+            try:
+                self.db_helper.transact_write(operations)
+                self._index_messages(message_items)
+                return True
+            except Exception as e:
+                if not is_conditional_failure(e) or attempt == CONTEXT_WRITE_RETRIES:
+                    self.logger.error(f"Failed to save turn with context window: {str(e)}")
+                    break
+                window = self.get_context_window(user_id, session_id)
         
-        return self.db_helper.safe_put_item(self.history_table, message_item)
+        return all([self.save_message_item(item) for item in message_items])
     
+    def _context_put(self, user_id: str, session_id: str, window: Optional[Dict[str, Any]],
+                     message_items: list, endpoint: str = None) -> Dict[str, Any]:
+        """直近会話ウィンドウ更新用の Put リクエスト（直近 CONTEXT_WINDOW_SIZE 件のみ保持）"""
+        turns = list((window or {}).get('turns') or [])
+        for item in message_items:
+            turns.append({
+                'role': item['role'],
+                'content': decode_message(dict(item))['content'][:CONTEXT_TURN_MAX_CHARS],
+                'createdAt': item['createdAt']
+            })
+        version = int((window or {}).get('version', 0))
+        
+        request = {
+            'TableName': self.history_table,
+            'Item': {
+                'userId': user_id,
+                'timestamp': context_key(session_id),
+                'turns': turns[-CONTEXT_WINDOW_SIZE:],
+                'version': version + 1,
+                'updatedAt': message_items[-1]['createdAt']
+            }
+        }
+        endpoint = endpoint or (window or {}).get('agentEndpoint')
+        if endpoint:
+            request['Item']['agentEndpoint'] = endpoint
+        if window:
+            request['ConditionExpression'] = 'version = :expectedVersion'
+            request['ExpressionAttributeValues'] = {':expectedVersion': version}
+        else:
+            request['ConditionExpression'] = 'attribute_not_exists(#ts)'
+            request['ExpressionAttributeNames'] = {'#ts': 'timestamp'}
+        return request
+    
+    @tracer.traced('HistoryHelper.get_user_history')
     def get_user_history(self, user_id: str) -> Optional[list]:
-        """ユーザーの全履歴を取得"""
+        """ユーザーの全履歴を取得（並び順はソートキー降順）
+
+        同じパーティションの直近会話ウィンドウ・冪等性キー・使用量などの行は読まないよう、
+        メッセージ（SESSION#）・アーカイブの要約行（ARCHIVE#）・旧形式の行の範囲だけをページングして読む。
+        """
+        ranges = [
+            ('begins_with(#ts, :prefix)', {':prefix': SESSION_KEY_PREFIX}),
+            ('begins_with(#ts, :prefix)', {':prefix': ARCHIVE_KEY_PREFIX})
+        ]
+        if LEGACY_HISTORY_READS:
+            ranges.append(('#ts < :legacyEnd', {':legacyEnd': LEGACY_KEY_UPPER_BOUND}))
         try:
-            return self.db_helper.safe_query(
-                self.history_table,
-                KeyConditionExpression='userId = :userId',
-                ExpressionAttributeValues={':userId': user_id},
-                ScanIndexForward=False  # 最新順
-            )
+            items = []
+            for condition, values in ranges:
+                start_key = None
+                while True:
+                    kwargs = {
+                        'KeyConditionExpression': f'userId = :userId AND {condition}',
+                        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+                        'ExpressionAttributeValues': dict(values, **{':userId': user_id}),
+                        'ScanIndexForward': False
+                    }
+                    if start_key:
+                        kwargs['ExclusiveStartKey'] = start_key
+                    page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+                    if page is None:
+                        return None
+                    page_items, start_key = page
+                    items.extend(page_items)
+                    if not start_key:
+                        break
+            items.sort(key=lambda item: item['timestamp'], reverse=True)
+            return decode_messages(items)
         except Exception as e:
             self.logger.error(f"Failed to get user history: {str(e)}")
             return None
     
-    def get_session_history(self, user_id: str, session_id: str) -> Optional[list]:
-        """特定セッションの履歴を取得"""
+    def iter_user_history(self, user_id: str, page_size: int = 500, start_key: Dict[str, Any] = None):
+        """ユーザーの全履歴をページ単位で列挙（(アイテム一覧, 次ページのキー) を返す）"""
+        kwargs = {
+            'KeyConditionExpression': 'userId = :userId',
+            'ExpressionAttributeValues': {':userId': user_id},
+            'Limit': page_size
+        }
+        while True:
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+            if page is None:
+                raise RuntimeError(f'Failed to query history for user {user_id}')
+            items, start_key = page
+            yield decode_messages(items), start_key
+            if not start_key:
+                break
+    
+    @tracer.traced('HistoryHelper.get_session_history')
+    def get_session_history(self, user_id: str, session_id: str, hydrate: bool = True) -> Optional[list]:
+        """特定セッションの履歴を取得（時系列順。hydrate=True なら S3 に退避した本文も復元）"""
+        messages = self._load_session_history(user_id, session_id)
+        return self.hydrate_overflow(messages) if hydrate else messages
+    
+    def _load_session_history(self, user_id: str, session_id: str) -> Optional[list]:
         try:
-            return self.db_helper.safe_query(
-                self.history_table,
-                KeyConditionExpression='userId = :userId',
-                FilterExpression='sessionId = :sessionId',
-                ExpressionAttributeValues={
-                    ':userId': user_id,
-                    ':sessionId': session_id
-                },
-                ScanIndexForward=True  # 時系列順
-            )
+            messages = self.db_helper.safe_query(self.history_table, **self.session_query(user_id, session_id))
+            legacy_messages = self._get_legacy_session_history(user_id, session_id) if LEGACY_HISTORY_READS else []
+            tombstone = None
+            if self.reads_archive():
+                tombstone = self.db_helper.safe_get_item(self.history_table, self.archive_key(user_id, session_id))
+            return self.merge_session_history(messages, legacy_messages, tombstone)
         except Exception as e:
             self.logger.error(f"Failed to get session history: {str(e)}")
             return None
     
+    def reads_archive(self) -> bool:
+        """アーカイブの要約行も読むか（アーカイブ後に続けられたセッションは両方を返すため常に読む）"""
+        return self.archive is not None
+    
+    def merge_session_history(self, messages: Optional[list], legacy_messages: Optional[list],
+                              tombstone: Optional[Dict[str, Any]]) -> Optional[list]:
+        """読み込んだ行からセッションの履歴を組み立てる（asyncio 版と共通。アーカイブは S3 から復元）"""
+        if messages is None or legacy_messages is None:
+            return None
+        # 旧形式の行は新形式より前に書かれているため先頭に連結
+        messages = decode_messages(legacy_messages + messages)
+        if not tombstone:
+            return messages
+        archived = self.archive.hydrate_session(tombstone)
+        if archived is None:
+            # 復元できない場合は DynamoDB に残っている行だけを返す
+            return messages if messages else None
+        # アーカイブされたメッセージは残っている行より前（削除に失敗して両方にある行は残っている方を使う）
+        live_keys = {m['timestamp'] for m in messages}
+        return [m for m in archived if m['timestamp'] not in live_keys] + messages
+    
+    def hydrate_overflow(self, messages: Optional[list]) -> Optional[list]:
+        """S3 に退避した本文をメッセージに戻す（退避先が未設定ならプレビューのまま）"""
+        if not messages or self.overflow is None:
+            return messages
+        return self.overflow.hydrate(messages)
+    
+    @staticmethod
+    def session_query(user_id: str, session_id: str) -> Dict[str, Any]:
+        """セッションのメッセージ行（新形式）を時系列順に読むクエリ条件"""
+        return {
+            'KeyConditionExpression': 'userId = :userId AND begins_with(#ts, :prefix)',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'ExpressionAttributeValues': {
+                ':userId': user_id,
+                ':prefix': session_key_prefix(session_id)
+            },
+            'ScanIndexForward': True
+        }
+    
+    @staticmethod
+    def legacy_session_query(user_id: str, session_id: str) -> Dict[str, Any]:
+        """旧形式（ISO 日時ソートキー）の行からセッションを読むクエリ条件"""
+        return {
+            'KeyConditionExpression': 'userId = :userId AND #ts < :legacyEnd',
+            'FilterExpression': 'sessionId = :sessionId',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'ExpressionAttributeValues': {
+                ':userId': user_id,
+                ':legacyEnd': LEGACY_KEY_UPPER_BOUND,
+                ':sessionId': session_id
+            },
+            'ScanIndexForward': True
+        }
+    
+    @staticmethod
+    def archive_key(user_id: str, session_id: str) -> Dict[str, Any]:
+        """アーカイブ済みセッションの要約行（ARCHIVE#<sessionId>）のキー"""
+        return {'userId': user_id, 'timestamp': f"{ARCHIVE_KEY_PREFIX}{session_id}"}
+    
+    def _get_legacy_session_history(self, user_id: str, session_id: str) -> Optional[list]:
+        """旧形式（ISO 日時ソートキー）の行からセッションの履歴を取得"""
+        return self.db_helper.safe_query(self.history_table, **self.legacy_session_query(user_id, session_id))
+    
+    @tracer.traced('HistoryHelper.delete_session')
     def delete_session(self, user_id: str, session_id: str) -> bool:
         """セッション全体を削除"""
         try:
-            # セッションの全メッセージを取得
-            messages = self.get_session_history(user_id, session_id)
+            # アーカイブ済みの場合は S3 オブジェクトと要約行を削除
+            success = True
+            if self.archive is not None:
+                tombstone_key = self.archive_key(user_id, session_id)
+                tombstone = self.db_helper.safe_get_item(self.history_table, tombstone_key)
+                if tombstone:
+                    if not self.archive.delete_archived_session(tombstone):
+                        success = False
+                    elif not self.db_helper.safe_delete_item(self.history_table, tombstone_key):
+                        success = False
+            
+            # 直近会話ウィンドウを削除
+            if not self.db_helper.safe_delete_item(
+                self.history_table,
+                {'userId': user_id, 'timestamp': context_key(session_id)}
+            ):
+                success = False
+            
+            # S3 に退避した本文を削除
+            if self.overflow is not None and not self.overflow.delete_session(user_id, session_id):
+                success = False
+            
+            # 類似検索の埋め込みチャンクから除外
+            if self.embeddings is not None and not self.embeddings.forget_session(user_id, session_id):
+                success = False
+            
+            # セッションの全メッセージを取得（本文の復元は不要）
+            messages = self.get_session_history(user_id, session_id, hydrate=False)
             if not messages:
-                return True
+                return success
             
             # 各メッセージを削除
-            success = True
             for message in messages:
+                if message.get('archived'):
+                    continue
                 if not self.db_helper.safe_delete_item(
                     self.history_table,
                     {'userId': user_id, 'timestamp': message['timestamp']}
                 ):
                     success = False
+                elif self.search_index is not None:
+                    self.search_index.unindex_async([message])
             
             return success
         except Exception as e:
             self.logger.error(f"Failed to delete session: {str(e)}")
             return False
     
+    @tracer.traced('HistoryHelper.delete_user_history')
     def delete_user_history(self, user_id: str) -> bool:
         """ユーザーの全履歴を削除"""
         try:
-            messages = self.get_user_history(user_id)
-            if not messages:
-                return True
-            
             success = True
-            for message in messages:
-                if not self.db_helper.safe_delete_item(
-                    self.history_table,
-                    {'userId': user_id, 'timestamp': message['timestamp']}
-                ):
-                    success = False
+            for messages, _ in self.iter_user_history(user_id):
+                for message in messages:
+                    # 使用量のカウンタ行は課金の集計用に残す
+                    if message['timestamp'].startswith(USAGE_KEY_PREFIX):
+                        continue
+                    if is_archive_tombstone(message) and self.archive is not None:
+                        if not self.archive.delete_archived_session(message):
+                            success = False
+                    if not self.db_helper.safe_delete_item(
+                        self.history_table,
+                        {'userId': user_id, 'timestamp': message['timestamp']}
+                    ):
+                        success = False
+            
+            # 検索インデックスを削除（このコンテナのバックグラウンドの更新が後から行を作らないよう先に待つ）
+            if self.search_index is not None:
+                self.search_index.wait()
+            if self.search_index is not None and not self.search_index.delete_user(user_id):
+                success = False
+            
+            # 類似検索の埋め込みチャンクを削除
+            if self.embeddings is not None and not self.embeddings.delete_user(user_id):
+                success = False
+            
+            # S3 に退避した本文を削除
+            if self.overflow is not None and not self.overflow.delete_user(user_id):
+                success = False
             
             return success
         except Exception as e:
             self.logger.error(f"Failed to delete user history: {str(e)}")
             return False
 
+# single-flight: 同時に届いた同一の読み込みリクエストを1回のクエリ・集計にまとめる
+_FLIGHT_MISS = object()
+
+class _Flight:
+    """実行中の呼び出し（完了時に結果を待機中の呼び出し元へ渡す）"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+def flight_key(route: str, params: Dict[str, Any] = None) -> str:
+    """ルートとパラメータから呼び出しのキーを作成（パラメータの順序は無視）"""
+    if not params:
+        return route
+    return f"{route}?{json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)}"
+
+class SharedFlightStore:
+    """コンテナ間の single-flight 用ロック行（履歴テーブルの SINGLEFLIGHT#<hash> 行）
+
+    最初のコンテナが条件付き Put でロックを取り、結果を行に書き込む。
+    他のコンテナはロック中の行をポーリングし、結果が書き込まれればそれを使う。
+    結果は SINGLE_FLIGHT_RESULT_GRACE_MS の間だけ有効で、それ以降のリクエストは新たにクエリする。
+    """
+
+    def __init__(self, db_helper: DatabaseHelper, table_name: str):
+        self.db_helper = db_helper
+        self.table_name = table_name
+        self.logger = setup_logger('SharedFlightStore')
+
+    @staticmethod
+    def _key(user_id: str, key: str) -> Dict[str, Any]:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return {'userId': user_id, 'timestamp': f"{SINGLE_FLIGHT_KEY_PREFIX}{digest}"}
+
+    def acquire(self, user_id: str, key: str) -> bool:
+        """ロックを取得（他のコンテナが実行中・結果の有効期間中なら False）"""
+        now_ms = int(time.time() * 1000)
+        item = dict(self._key(user_id, key), **{
+            'lockExpiresAt': now_ms + SINGLE_FLIGHT_LOCK_MS,
+            'expiresAt': now_ms // 1000 + SINGLE_FLIGHT_ITEM_TTL_SECONDS
+        })
+        try:
+            self.db_helper.put_item(
+                self.table_name, item,
+                ConditionExpression='attribute_not_exists(#ts) OR lockExpiresAt < :now',
+                ExpressionAttributeNames={'#ts': 'timestamp'},
+                ExpressionAttributeValues={':now': now_ms}
+            )
+            return True
+        except Exception as e:
+            if not is_conditional_failure(e):
+                self.logger.error(f"Failed to acquire flight lock: {str(e)}")
+            return False
+
+    def publish(self, user_id: str, key: str, result: Any) -> bool:
+        """結果を書き込み、有効期間を SINGLE_FLIGHT_RESULT_GRACE_MS に縮める（大きすぎる結果はロックを解放）"""
+        payload = get_serializer().dumps(result)
+        if len(payload.encode('utf-8')) > SINGLE_FLIGHT_MAX_RESULT_BYTES:
+            return self.release(user_id, key)
+        return self.db_helper.safe_update_item(
+            self.table_name, self._key(user_id, key),
+            UpdateExpression='SET #result = :result, lockExpiresAt = :lockExpiresAt',
+            ExpressionAttributeNames={'#result': 'result'},
+            ExpressionAttributeValues={
+                ':result': payload,
+                ':lockExpiresAt': int(time.time() * 1000) + SINGLE_FLIGHT_RESULT_GRACE_MS
+            }
+        ) is not None
+
+    def release(self, user_id: str, key: str) -> bool:
+        """ロックを解放（待機中のコンテナは自分でクエリする）"""
+        return self.db_helper.safe_delete_item(self.table_name, self._key(user_id, key))
+
+    def wait(self, user_id: str, key: str, timeout: float) -> Any:
+        """他のコンテナの結果を待つ（ロックが消えた・期限切れ・タイムアウトの場合は _FLIGHT_MISS）"""
+        deadline = time.monotonic() + timeout
+        interval = SINGLE_FLIGHT_POLL_INTERVAL_MS / 1000
+        while True:
+            item = self.db_helper.safe_get_item(self.table_name, self._key(user_id, key), consistent_read=True)
+            if item is None or int(item.get('lockExpiresAt', 0)) < time.time() * 1000:
+                return _FLIGHT_MISS
+            if 'result' in item:
+                return json.loads(item['result'])
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return _FLIGHT_MISS
+            time.sleep(min(interval, remaining))
+
+class SingleFlight:
+    """同一ユーザー・ルート・パラメータの並行した読み込みを1回の実行にまとめる
+
+    コンテナ内では実行中の呼び出しの完了を待って同じ結果を返す（結果は呼び出し元で変更しないこと）。
+    store（SharedFlightStore）を渡すとコンテナ間でもまとめる。結果が None（取得失敗）の場合は
+    コンテナ間で共有しない。カウンタは stats() で取得できる。
+    """
+
+    def __init__(self, name: str, store: SharedFlightStore = None, wait_timeout: float = None):
+        self.name = name
+        self.store = store
+        self.wait_timeout = wait_timeout if wait_timeout is not None else SINGLE_FLIGHT_WAIT_SECONDS
+        self.logger = setup_logger('SingleFlight')
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counters = {'calls': 0, 'executions': 0, 'coalesced': 0, 'sharedHits': 0, 'sharedMisses': 0, 'errors': 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """呼び出し数・実行数・まとめられた数などのカウンタ"""
+        with self._lock:
+            return dict(self._counters, inFlight=len(self._flights))
+
+    def do(self, user_id: str, route: str, params: Dict[str, Any], func):
+        """func() を実行して結果を返す（同一キーの実行中の呼び出しがあればその結果を返す）"""
+        key = (user_id, flight_key(route, params))
+        with self._lock:
+            self._counters['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._counters['coalesced'] += 1
+        
+        if not leader:
+            with tracer.span('singleflight.wait', flight=self.name):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        try:
+            flight.result = self._execute(user_id, key[1], func)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _execute(self, user_id: str, key: str, func):
+        """コンテナ内の代表として実行（store があれば他のコンテナの結果を優先）"""
+        if self.store is None:
+            self._count('executions')
+            return func()
+        
+        with tracer.span('singleflight.shared', flight=self.name) as span:
+            acquired = self.store.acquire(user_id, key)
+            if not acquired:
+                result = self.store.wait(user_id, key, self.wait_timeout)
+                if result is not _FLIGHT_MISS:
+                    self._count('sharedHits')
+                    if span is not None:
+                        span.set_attribute('singleflight.shared_hit', True)
+                    return result
+                self._count('sharedMisses')
+            
+            self._count('executions')
+            try:
+                result = func()
+            except Exception:
+                if acquired:
+                    self.store.release(user_id, key)
+                raise
+            if acquired:
+                if result is None:
+                    self.store.release(user_id, key)
+                else:
+                    self.store.publish(user_id, key, result)
+            return result
+
 # 共通設定
 AWS_REGION = 'ap-northeast-1'
-BEDROCK_REGION = 'us-east-1'  # Bedrock Agentのリージョン
+BEDROCK_REGION = os.environ.get('BEDROCK_REGION', 'us-east-1')  # Bedrock Agentのリージョン（既定の呼び出し先）
+
+# boto3 クライアント設定（環境変数で上書き可能）
+CLIENT_MAX_POOL_CONNECTIONS = int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', '50'))
+CLIENT_TCP_KEEPALIVE = os.environ.get('CLIENT_TCP_KEEPALIVE', 'true').lower() == 'true'
+CLIENT_CONNECT_TIMEOUT = float(os.environ.get('CLIENT_CONNECT_TIMEOUT', '2'))
+CLIENT_READ_TIMEOUT = float(os.environ.get('CLIENT_READ_TIMEOUT', '60'))
+CLIENT_RETRY_MODE = os.environ.get('CLIENT_RETRY_MODE', 'standard')
+CLIENT_MAX_ATTEMPTS = int(os.environ.get('CLIENT_MAX_ATTEMPTS', '3'))
 
 # テーブル名
 USER_TABLE = 'GenkiChatUserTable'
 HISTORY_TABLE = 'GenkiChatHistoryTable'
 
-# Bedrock Agent設定
-AGENT_ID = 'PLMASWUNAG'
-AGENT_ALIAS_ID = 'XWFWAS7SOV'
\ No newline at end of file
+# プロフィールの保存対象フィールドと既定値
+PROFILE_FIELDS = {
+    'userName': '',
+    'age': '',
+    'occupation': '',
+    'gender': '',
+    'responseLength': 'medium'
+}
+
+# 履歴ソートキー設定
+SESSION_KEY_PREFIX = 'SESSION#'
+LEGACY_KEY_UPPER_BOUND = 'A'  # 旧形式の ISO 日時キーは数字始まりのためこれより小さい
+ARCHIVE_KEY_PREFIX = 'ARCHIVE#'  # S3 アーカイブ済みセッションの要約行
+CONTEXT_KEY_PREFIX = 'CONTEXT#'  # セッション毎の直近会話ウィンドウ行
+IDEMPOTENCY_KEY_PREFIX = 'IDEMPOTENCY#'  # POST /chat の Idempotency-Key 行
+SINGLE_FLIGHT_KEY_PREFIX = 'SINGLEFLIGHT#'  # コンテナ間 single-flight のロック行
+USAGE_KEY_PREFIX = 'USAGE#'  # Bedrock 使用量のカウンタ行（履歴削除の対象外）
+LEGACY_HISTORY_READS = os.environ.get('LEGACY_HISTORY_READS', 'true').lower() == 'true'
+
+# 1リクエストで一括取得できるセッション数（GET /history?sessionIds=a,b,c）
+HISTORY_MULTI_SESSION_MAX = int(os.environ.get('HISTORY_MULTI_SESSION_MAX', '20'))
+
+# 直近会話ウィンドウ設定（Agent プロンプトに含める直近の発言）
+CONTEXT_WINDOW_ENABLED = os.environ.get('CONTEXT_WINDOW_ENABLED', 'true').lower() == 'true'
+CONTEXT_WINDOW_SIZE = int(os.environ.get('CONTEXT_WINDOW_SIZE', '6'))
+CONTEXT_TURN_MAX_CHARS = int(os.environ.get('CONTEXT_TURN_MAX_CHARS', '1000'))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '1500'))
+CONTEXT_WRITE_RETRIES = int(os.environ.get('CONTEXT_WRITE_RETRIES', '1'))
+
+# 大きなメッセージの S3 退避設定（項目上限 400KB に対し他の属性・トランザクションの余裕を残す）
+HISTORY_OVERFLOW_THRESHOLD_BYTES = int(os.environ.get('HISTORY_OVERFLOW_THRESHOLD_BYTES', '300000'))
+# 行に残すプレビューの文字数（直近会話ウィンドウの CONTEXT_TURN_MAX_CHARS 以上にする）
+HISTORY_OVERFLOW_PREVIEW_CHARS = int(os.environ.get('HISTORY_OVERFLOW_PREVIEW_CHARS', '1000'))
+# POST /chat で受け付けるメッセージの上限
+CHAT_MESSAGE_MAX_BYTES = int(os.environ.get('CHAT_MESSAGE_MAX_BYTES', str(1024 * 1024)))
+
+# メッセージ保存時にハッシュ埋め込みを計算（類似会話検索用）
+EMBEDDING_ENABLED = os.environ.get('EMBEDDING_ENABLED', 'true').lower() == 'true'
+
+# single-flight 設定（同時に届いた同一の GET /history・GET /profile を1回の読み込みにまとめる）
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+# コンテナ間でもまとめる（DynamoDB のロック行を使うため書き込みが増える）
+SINGLE_FLIGHT_SHARED = os.environ.get('SINGLE_FLIGHT_SHARED', 'false').lower() == 'true'
+SINGLE_FLIGHT_LOCK_MS = int(os.environ.get('SINGLE_FLIGHT_LOCK_MS', '3000'))
+SINGLE_FLIGHT_RESULT_GRACE_MS = int(os.environ.get('SINGLE_FLIGHT_RESULT_GRACE_MS', '200'))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.environ.get('SINGLE_FLIGHT_WAIT_SECONDS', '3'))
+SINGLE_FLIGHT_POLL_INTERVAL_MS = int(os.environ.get('SINGLE_FLIGHT_POLL_INTERVAL_MS', '25'))
+SINGLE_FLIGHT_MAX_RESULT_BYTES = int(os.environ.get('SINGLE_FLIGHT_MAX_RESULT_BYTES', '300000'))
+SINGLE_FLIGHT_ITEM_TTL_SECONDS = 300
+
+# BatchGetItem 設定（1リクエストの上限は100キー）
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = int(os.environ.get('BATCH_GET_MAX_RETRIES', '5'))
+
+# テーブル毎のコーデック（低レベルクライアントモード用）
+TABLE_CODECS = {
+    USER_TABLE: PROFILE_CODEC,
+    HISTORY_TABLE: HISTORY_CODEC
+}
+
+# 低レベルクライアントモード（DYNAMODB_CLIENT_MODE=true で有効）
+DYNAMODB_CLIENT_MODE = os.environ.get('DYNAMODB_CLIENT_MODE', 'false').lower() == 'true'
+
+# Bedrock Agent設定（複数の呼び出し先は agent_router の AGENT_ENDPOINTS で設定）
+AGENT_ID = os.environ.get('AGENT_ID', 'PLMASWUNAG')
+AGENT_ALIAS_ID = os.environ.get('AGENT_ALIAS_ID', 'XWFWAS7SOV')
+
+# コンテナ内で共有するクライアントファクトリ
+client_factory = ClientFactory()
+
+def create_single_flight(name: str, db_helper: DatabaseHelper) -> Optional[SingleFlight]:
+    """ハンドラ用の single-flight（無効時は None。SINGLE_FLIGHT_SHARED でコンテナ間でもまとめる）"""
+    if not SINGLE_FLIGHT_ENABLED:
+        return None
+    store = SharedFlightStore(db_helper, HISTORY_TABLE) if SINGLE_FLIGHT_SHARED else None
+    return SingleFlight(name, store)
+
+def create_database_helper(factory: ClientFactory = None) -> DatabaseHelper:
+    """設定に応じた DatabaseHelper を生成"""
+    factory = factory or client_factory
+    dynamodb_client = factory.client('dynamodb') if DYNAMODB_CLIENT_MODE else None
+    return DatabaseHelper(factory.resource('dynamodb'), dynamodb_client)
@@ -0,0 +1,96 @@
+# レスポンス圧縮 - Accept-Encoding に応じた gzip / brotli 圧縮
+import os
+import gzip
+import base64
+from typing import Dict, Any, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli はオプション依存
+    brotli = None
+
+# 圧縮を行う最小ボディサイズ（バイト）
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+
+# 圧縮レベル（gzip: 1-9, brotli: 0-11）
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+def supported_encodings() -> list:
+    """サーバー側で対応している圧縮形式（優先順）"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding ヘッダーを {形式: q値} に解析"""
+    result = {}
+    if not header:
+        return result
+    for part in header.split(','):
+        fields = part.strip().split(';')
+        name = fields[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[name] = q
+    return result
+
+def negotiate_encoding(header: Optional[str]) -> Optional[str]:
+    """クライアントが受け付ける形式から最適なものを選択"""
+    accepted = parse_accept_encoding(header)
+    if not accepted:
+        return None
+    wildcard = accepted.get('*', 0.0)
+    best = None
+    best_q = 0.0
+    for encoding in supported_encodings():
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress_bytes(data: bytes, encoding: str, level: int = None) -> bytes:
+    """指定形式で圧縮"""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+    if encoding == 'br':
+        if brotli is None:
+            raise RuntimeError('brotli がインストールされていません')
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level, mode=brotli.MODE_TEXT)
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+def compress_response(response: Dict[str, Any], accept_encoding: Optional[str],
+                      min_bytes: int = None) -> Dict[str, Any]:
+    """API Gateway プロキシレスポンスのボディを圧縮（base64 + isBase64Encoded 形式）
+
+    閾値未満・非対応クライアントの場合はそのまま返す。
+    """
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    raw = body.encode('utf-8')
+    if len(raw) < (COMPRESSION_MIN_BYTES if min_bytes is None else min_bytes):
+        return response
+
+    compressed = compress_bytes(raw, encoding)
+    headers = dict(response.get('headers') or {})
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+
+    return dict(
+        response,
+        headers=headers,
+        body=base64.b64encode(compressed).decode('ascii'),
+        isBase64Encoded=True
+    )
\ No newline at end of file
@@ -0,0 +1,165 @@
+# DynamoDB 低レベルクライアント用アイテムコーデック
+#
+# boto3 の TypeSerializer / TypeDeserializer の代わりに、履歴・プロフィールの
+# 固定スキーマ向けに Python ネイティブ型（str / int / float）を直接返す。
+from decimal import Decimal
+from typing import Dict, Any, Optional
+
+def _decode_number(value: str):
+    """数値文字列を int / float に変換（Decimal を経由しない）"""
+    if '.' in value or 'e' in value or 'E' in value:
+        return float(value)
+    return int(value)
+
+def decode_value(av: Dict[str, Any]) -> Any:
+    """AttributeValue を Python 値に変換（汎用パス）"""
+    if 'S' in av:
+        return av['S']
+    if 'N' in av:
+        return _decode_number(av['N'])
+    if 'BOOL' in av:
+        return av['BOOL']
+    if 'NULL' in av:
+        return None
+    if 'B' in av:
+        return av['B']
+    if 'M' in av:
+        return {k: decode_value(v) for k, v in av['M'].items()}
+    if 'L' in av:
+        return [decode_value(v) for v in av['L']]
+    if 'SS' in av:
+        return set(av['SS'])
+    if 'NS' in av:
+        return {_decode_number(v) for v in av['NS']}
+    if 'BS' in av:
+        return set(av['BS'])
+    raise ValueError(f'Unsupported attribute value: {list(av.keys())}')
+
+def encode_value(value: Any) -> Dict[str, Any]:
+    """Python 値を AttributeValue に変換（汎用パス）"""
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, float):
+        return {'N': repr(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if hasattr(value, 'value') and isinstance(value.value, (bytes, bytearray)):
+        # boto3.dynamodb.types.Binary
+        return {'B': bytes(value.value)}
+    if isinstance(value, dict):
+        return {'M': {k: encode_value(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [encode_value(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(v, str) for v in value):
+            return {'SS': list(value)}
+        if all(isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) for v in value):
+            return {'NS': [str(v) for v in value]}
+        return {'BS': [bytes(v) for v in value]}
+    raise TypeError(f'Unsupported type for DynamoDB: {type(value).__name__}')
+
+class ItemCodec:
+    """固定スキーマ（属性名 → 型）に基づくアイテムの変換"""
+
+    def __init__(self, schema: Optional[Dict[str, str]] = None):
+        self.schema = dict(schema or {})
+        self._string_fields = frozenset(k for k, t in self.schema.items() if t == 'S')
+        self._number_fields = frozenset(k for k, t in self.schema.items() if t == 'N')
+
+    def decode(self, item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """低レベル形式のアイテムを Python 辞書に変換"""
+        if item is None:
+            return None
+        string_fields = self._string_fields
+        number_fields = self._number_fields
+        result = {}
+        for name, av in item.items():
+            if name in string_fields:
+                value = av.get('S')
+                if value is not None:
+                    result[name] = value
+                    continue
+            elif name in number_fields:
+                value = av.get('N')
+                if value is not None:
+                    result[name] = _decode_number(value)
+                    continue
+            result[name] = decode_value(av)
+        return result
+
+    def decode_items(self, items: list) -> list:
+        """アイテム一覧を変換"""
+        decode = self.decode
+        return [decode(item) for item in items]
+
+    def encode(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Python 辞書を低レベル形式に変換"""
+        string_fields = self._string_fields
+        result = {}
+        for name, value in item.items():
+            if name in string_fields and isinstance(value, str):
+                result[name] = {'S': value}
+            else:
+                result[name] = encode_value(value)
+        return result
+
+    def encode_values(self, values: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """ExpressionAttributeValues 等の値辞書を変換"""
+        if values is None:
+            return None
+        return {k: encode_value(v) for k, v in values.items()}
+
+# 履歴テーブルのスキーマ
+HISTORY_SCHEMA = {
+    'userId': 'S',
+    'timestamp': 'S',
+    'sessionId': 'S',
+    'role': 'S',
+    'content': 'S',
+    'message': 'S',
+    'messageId': 'S',
+    'createdAt': 'S',
+    'contentEncoding': 'S',
+    'contentZ': 'B',
+    'embedding': 'B',
+    'updatedAt': 'S',
+    'version': 'N',
+    'status': 'S',
+    'requestHash': 'S',
+    'response': 'S',
+    'expiresAt': 'N',
+    'leaseExpiresAt': 'N',
+    'lockExpiresAt': 'N',
+    'result': 'S',
+    'requests': 'N',
+    'modelInvocations': 'N',
+    'inputTokens': 'N',
+    'outputTokens': 'N',
+    'agentMs': 'N',
+    'contentRef': 'S',
+    'contentBytes': 'N',
+    'agentEndpoint': 'S'
+}
+
+# ユーザーテーブルのスキーマ
+PROFILE_SCHEMA = {
+    'userId': 'S',
+    'userName': 'S',
+    'age': 'S',
+    'occupation': 'S',
+    'gender': 'S',
+    'responseLength': 'S',
+    'createdAt': 'S',
+    'updatedAt': 'S',
+    'version': 'N'
+}
+
+HISTORY_CODEC = ItemCodec(HISTORY_SCHEMA)
+PROFILE_CODEC = ItemCodec(PROFILE_SCHEMA)
+GENERIC_CODEC = ItemCodec()
\ No newline at end of file
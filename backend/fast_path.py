@@ -0,0 +1,165 @@
+# 雑談向けの高速経路 - 短いメッセージを Agent を介さず bedrock-runtime のストリーミング呼び出しで応答する
+#
+# Agent はオーケストレーション（前処理・推論・後処理）のモデル呼び出しを挟むため、挨拶・相づち程度の短い雑談でも
+# 応答までに時間がかかる。FAST_PATH_ENABLED=true の場合、FastPathPolicy が条件を満たすターンだけを
+# ConverseStream で基盤モデルに直接送る。Agent と同じ人格指示（infrastructure/bedrock-agent-config.json の instruction）と
+# 同じプロフィール・直近会話入りのプロンプトを使う。直接呼び出しが失敗した場合は Agent で応答する。
+# 経路の判定（理由毎の件数）と経路毎のレイテンシは FastPathMetrics に記録し、スパンの route / reason 属性にも残す。
+# FAST_PATH_SAMPLE_RATE を 1 未満にすると、対象のターンの一部を Agent に送って比較対象（control）にできる。
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from typing import Dict, Any, List
+
+from common import setup_logger, tracer, AWS_REGION
+
+# 高速経路の設定
+FAST_PATH_ENABLED = os.environ.get('FAST_PATH_ENABLED', 'false').lower() == 'true'
+FAST_PATH_MODEL_ID = os.environ.get('FAST_PATH_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+# 既定はユーザー・DynamoDB と同じリージョン（Agent の us-east-1 より往復が短い）
+FAST_PATH_REGION = os.environ.get('FAST_PATH_REGION', AWS_REGION)
+FAST_PATH_MAX_TOKENS = int(os.environ.get('FAST_PATH_MAX_TOKENS', '400'))
+FAST_PATH_TEMPERATURE = float(os.environ.get('FAST_PATH_TEMPERATURE', '0.7'))
+# 高速経路の対象にするメッセージの最大文字数
+FAST_PATH_MAX_CHARS = int(os.environ.get('FAST_PATH_MAX_CHARS', '40'))
+# これらの語を含むメッセージは相談として Agent に送る（カンマ区切りで上書き可能）
+FAST_PATH_AGENT_KEYWORDS = [k.strip() for k in os.environ.get(
+    'FAST_PATH_AGENT_KEYWORDS',
+    '悩,不安,心配,相談,どうしたら,どうすれば,アドバイス,助けて,つらい,辛い,しんどい,苦しい,'
+    '死に,消えたい,眠れな,病院,薬,お金,借金,仕事を辞め,教えて,調べて,あなたは誰'
+).split(',') if k.strip()]
+# 対象のターンのうち高速経路に送る割合（残りは比較用に Agent に送る）
+FAST_PATH_SAMPLE_RATE = float(os.environ.get('FAST_PATH_SAMPLE_RATE', '1.0'))
+# 人格指示の読み込み元（存在しなければ下の既定値）
+FAST_PATH_AGENT_CONFIG = os.environ.get(
+    'FAST_PATH_AGENT_CONFIG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'infrastructure', 'bedrock-agent-config.json')
+)
+# レイテンシの統計に使う直近のサンプル数
+FAST_PATH_METRICS_WINDOW = int(os.environ.get('FAST_PATH_METRICS_WINDOW', '500'))
+
+# infrastructure/bedrock-agent-config.json の instruction（デプロイ物に設定ファイルが含まれない場合に使用）
+DEFAULT_INSTRUCTION = (
+    'あなたは元気で前向きなチャットアシスタント「ゲンキちゃん」です。\n\n'
+    '基本方針：\n- ユーザーの気持ちに共感し、優しく寄り添う\n- 前向きで建設的なアドバイスを提供\n'
+    '- 具体的で実践しやすい提案を3つ程度提示\n- 励ましの言葉を自然に織り込む\n- 親しみやすい日本語で会話\n\n'
+    '応答パターン：\n1. ユーザーの気持ちを受け止める\n2. 共感や理解を示す\n3. 前向きな視点を提示\n'
+    '4. 具体的なアクション案を3つ提案\n5. 励ましのメッセージで締めくくる\n\n'
+    '禁止事項：\n- 否定的・批判的な表現\n- 専門的な医療・法的アドバイス\n- 過度に楽観的すぎる表現'
+)
+
+# 高速経路で応答するのは雑談のため、提案の列挙は求めない
+FAST_PATH_INSTRUCTION_SUFFIX = '\n\n短い雑談や挨拶には、提案を列挙せず、自然で短い返事をしてください。'
+
+ROUTE_FAST = 'fast'
+ROUTE_AGENT = 'agent'
+
+logger = setup_logger(__name__)
+
+def load_instruction(path: str = None) -> str:
+    """Agent の人格指示を読み込む（読めない場合は DEFAULT_INSTRUCTION）"""
+    try:
+        with open(path or FAST_PATH_AGENT_CONFIG, encoding='utf-8') as f:
+            return json.load(f).get('instruction') or DEFAULT_INSTRUCTION
+    except (OSError, ValueError):
+        return DEFAULT_INSTRUCTION
+
+class FastPathDecision:
+    """経路の判定結果"""
+
+    __slots__ = ('route', 'reason')
+
+    def __init__(self, route: str, reason: str):
+        self.route = route
+        self.reason = reason
+
+class FastPathPolicy:
+    """メッセージ毎に高速経路・Agent のどちらで応答するかを判定"""
+
+    def __init__(self, enabled: bool = None, max_chars: int = None, agent_keywords: List[str] = None,
+                 sample_rate: float = None, rng: random.Random = None):
+        self.enabled = FAST_PATH_ENABLED if enabled is None else enabled
+        self.max_chars = FAST_PATH_MAX_CHARS if max_chars is None else max_chars
+        self.agent_keywords = FAST_PATH_AGENT_KEYWORDS if agent_keywords is None else agent_keywords
+        self.sample_rate = FAST_PATH_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.rng = rng or random.Random()
+
+    def decide(self, message: str) -> FastPathDecision:
+        if not self.enabled:
+            return FastPathDecision(ROUTE_AGENT, 'disabled')
+        text = (message or '').strip()
+        if len(text) > self.max_chars:
+            return FastPathDecision(ROUTE_AGENT, 'too_long')
+        if '\n' in text or any(keyword in text for keyword in self.agent_keywords):
+            return FastPathDecision(ROUTE_AGENT, 'needs_agent')
+        if self.sample_rate < 1.0 and self.rng.random() >= self.sample_rate:
+            return FastPathDecision(ROUTE_AGENT, 'control')
+        return FastPathDecision(ROUTE_FAST, 'small_talk')
+
+class FastPathMetrics:
+    """判定理由毎の件数と経路毎のレイテンシ（コンテナ内）"""
+
+    def __init__(self, window: int = None):
+        self._lock = threading.Lock()
+        self.decisions: Dict[str, int] = {}
+        self.fallbacks = 0
+        self._latencies: Dict[str, deque] = {}
+        self._window = window or FAST_PATH_METRICS_WINDOW
+
+    def record(self, decision: FastPathDecision, route: str, latency_ms: float):
+        """1ターン分を記録（route は実際に応答した経路。高速経路の失敗で Agent に切り替えた場合は agent）"""
+        with self._lock:
+            self.decisions[decision.reason] = self.decisions.get(decision.reason, 0) + 1
+            key = route
+            if decision.route == ROUTE_FAST and route != ROUTE_FAST:
+                self.fallbacks += 1
+                # 失敗した直接呼び出しの時間を含むため、Agent とは分けて集計
+                key = 'fallback'
+            # 比較用に同じ条件（small_talk / control）のターンだけを経路毎に集計
+            if decision.reason in ('small_talk', 'control'):
+                self._latencies.setdefault(key, deque(maxlen=self._window)).append(latency_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {}
+            for route, values in self._latencies.items():
+                ordered = sorted(values)
+                routes[route] = {
+                    'samples': len(ordered),
+                    'p50Ms': round(ordered[len(ordered) // 2], 1),
+                    'p95Ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1)
+                }
+            return {'decisions': dict(self.decisions), 'fallbacks': self.fallbacks, 'eligibleLatency': routes}
+
+def invoke_fast_path(client, message: str, instruction: str, usage=None) -> str:
+    """基盤モデルを ConverseStream で直接呼び出して応答を取得（usage に UsageCollector を渡すとトークン数を加算）"""
+    started = time.monotonic()
+    with tracer.span('bedrock.converse_stream', model_id=FAST_PATH_MODEL_ID, region=FAST_PATH_REGION) as span:
+        response = client.converse_stream(
+            modelId=FAST_PATH_MODEL_ID,
+            system=[{'text': instruction + FAST_PATH_INSTRUCTION_SUFFIX}],
+            messages=[{'role': 'user', 'content': [{'text': message}]}],
+            inferenceConfig={'maxTokens': FAST_PATH_MAX_TOKENS, 'temperature': FAST_PATH_TEMPERATURE}
+        )
+        parts = []
+        for event in response['stream']:
+            if 'contentBlockDelta' in event:
+                text = event['contentBlockDelta'].get('delta', {}).get('text')
+                if text:
+                    if not parts and span is not None:
+                        span.add_event('first_chunk')
+                    parts.append(text)
+            elif 'metadata' in event and usage is not None:
+                usage.add_invocation(event['metadata'].get('usage'))
+        if span is not None:
+            span.set_attribute('chunk_count', len(parts))
+
+    if usage is not None:
+        usage.agent_ms += (time.monotonic() - started) * 1000
+    text = ''.join(parts).strip()
+    if not text:
+        raise RuntimeError('Empty response from fast path model')
+    return text
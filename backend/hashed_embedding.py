@@ -0,0 +1,148 @@
+# ローカルで計算するハッシュ埋め込み（外部の埋め込みサービス不要）
+#
+# 正規化した本文の文字 n-gram（2〜3文字）を feature hashing で固定次元に落とし、
+# L2 正規化した後 int8 に量子化して保存する（既定 256 次元 = 256 バイト / メッセージ）。
+# NumPy があればベクトル化して計算し、なければ純 Python で同じ結果を返す。
+import os
+import re
+import math
+import zlib
+import unicodedata
+from typing import List, Optional
+
+try:
+    import numpy
+except ImportError:  # numpy はオプション依存
+    numpy = None
+
+# 埋め込みの次元数（変更した場合は保存済みベクトルの再計算が必要）
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', '256'))
+
+# 使用する文字 n-gram の長さ
+EMBEDDING_NGRAMS = (2, 3)
+
+# 埋め込みを計算する最大文字数
+EMBEDDING_MAX_CHARS = int(os.environ.get('EMBEDDING_MAX_CHARS', '2000'))
+
+# 類似度計算で一度に float32 に変換する行数（CPU キャッシュに収まる程度）
+_SCORE_BLOCK_ROWS = 4096
+
+_RUN_RE = re.compile(r'\w+')
+
+def _features(text: str) -> dict:
+    """ハッシュ済み特徴量（次元 → 符号付きの出現回数）"""
+    text = unicodedata.normalize('NFKC', (text or '')[:EMBEDDING_MAX_CHARS]).lower()
+    counts = {}
+    for run in _RUN_RE.findall(text):
+        for n in EMBEDDING_NGRAMS:
+            for i in range(len(run) - n + 1):
+                h = zlib.crc32(run[i:i + n].encode('utf-8'))
+                index = h % EMBEDDING_DIM
+                # 上位ビットで符号を決め、衝突による偏りを打ち消す
+                counts[index] = counts.get(index, 0) + (1 if h & 0x80000000 else -1)
+    return counts
+
+def embed_text(text: str) -> List[float]:
+    """L2 正規化済みの埋め込みベクトル（サブリニア TF）"""
+    vector = [0.0] * EMBEDDING_DIM
+    for index, count in _features(text).items():
+        if count:
+            vector[index] = math.copysign(1.0 + math.log(abs(count)), count)
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm:
+        vector = [v / norm for v in vector]
+    return vector
+
+def quantize(vector: List[float]) -> bytes:
+    """int8 に量子化（最大絶対値を 127 に合わせる）"""
+    scale = max((abs(v) for v in vector), default=0.0)
+    if not scale:
+        return bytes(len(vector))
+    return bytes(int(round(v / scale * 127)) & 0xFF for v in vector)
+
+def embed_bytes(text: str) -> Optional[bytes]:
+    """保存用の量子化済み埋め込み（特徴量がなければ None）"""
+    vector = embed_text(text)
+    if not any(vector):
+        return None
+    return quantize(vector)
+
+def dequantize(data: bytes) -> List[float]:
+    """int8 バイト列を L2 正規化済みベクトルに戻す"""
+    values = [b - 256 if b > 127 else b for b in data]
+    norm = math.sqrt(sum(v * v for v in values))
+    return [v / norm for v in values] if norm else [0.0] * len(values)
+
+class VectorMatrix:
+    """1ユーザー分の埋め込みを詰めた行列（行 i がメッセージ ids[i]）
+
+    NumPy があれば (n, dim) の int8 配列と行ノルムを保持し、コサイン類似度を一括計算する。
+    """
+
+    def __init__(self, ids: List[str], rows: List[bytes], dim: int = None):
+        self.ids = ids
+        self.dim = dim or EMBEDDING_DIM
+        if numpy is not None:
+            data = numpy.frombuffer(b''.join(rows), dtype=numpy.int8) if rows else numpy.zeros(0, numpy.int8)
+            self.matrix = data.reshape(len(rows), self.dim)
+            norms = numpy.sqrt(numpy.einsum('ij,ij->i', self.matrix, self.matrix, dtype=numpy.float32))
+            self.inv_norms = numpy.divide(1.0, norms, out=numpy.zeros_like(norms), where=norms > 0)
+        else:
+            self.matrix = [dequantize(row) for row in rows]
+            self.inv_norms = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """行列本体のメモリ使用量"""
+        if numpy is not None:
+            return int(self.matrix.nbytes + self.inv_norms.nbytes)
+        return sum(len(row) * 8 for row in self.matrix)
+
+    def scores(self, query: List[float]):
+        """全行とのコサイン類似度"""
+        if numpy is not None:
+            q = numpy.asarray(query, dtype=numpy.float32)
+            # int8 → float32 の変換をブロック単位で行い、行列全体の一時コピーを作らない
+            scores = numpy.empty(len(self.ids), dtype=numpy.float32)
+            for start in range(0, len(self.ids), _SCORE_BLOCK_ROWS):
+                block = self.matrix[start:start + _SCORE_BLOCK_ROWS]
+                scores[start:start + len(block)] = block.astype(numpy.float32) @ q
+            return scores * self.inv_norms
+        return [sum(a * b for a, b in zip(row, query)) for row in self.matrix]
+
+    def top_k(self, query: List[float], k: int, exclude: set = None) -> List[tuple]:
+        """類似度上位 k 件の (id, 類似度)"""
+        if not self.ids:
+            return []
+        scores = self.scores(query)
+        exclude = exclude or set()
+        if numpy is not None:
+            # 除外分を見込んで多めに部分ソート
+            take = min(len(self.ids), k + len(exclude))
+            candidates = numpy.argpartition(-scores, take - 1)[:take]
+            ordered = candidates[numpy.argsort(-scores[candidates])]
+            pairs = ((self.ids[i], float(scores[i])) for i in ordered)
+        else:
+            pairs = sorted(zip(self.ids, scores), key=lambda pair: pair[1], reverse=True)
+        result = []
+        for doc_id, score in pairs:
+            if doc_id in exclude:
+                continue
+            result.append((doc_id, score))
+            if len(result) >= k:
+                break
+        return result
+
+    def mean_vector(self, indices: List[int]) -> List[float]:
+        """指定行の平均ベクトル（L2 正規化済み）"""
+        if numpy is not None:
+            rows = self.matrix[indices].astype(numpy.float32) * self.inv_norms[indices, None]
+            mean = rows.sum(axis=0)
+            norm = float(numpy.linalg.norm(mean))
+            return (mean / norm).tolist() if norm else mean.tolist()
+        mean = [sum(values) for values in zip(*(self.matrix[i] for i in indices))]
+        norm = math.sqrt(sum(v * v for v in mean))
+        return [v / norm for v in mean] if norm else mean
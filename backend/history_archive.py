@@ -0,0 +1,212 @@
+# 履歴アーカイブ - 古いセッションを S3 に移し、DynamoDB には要約行だけを残す
+#
+# S3 オブジェクトはユーザー毎のプレフィックス配下にセッション単位で gzip JSON として保存する
+# （<prefix>/<userId>/<sessionId>.json.gz）。開かれたセッションだけを1回の GetObject で復元できる。
+# アーカイブ後に続けられたセッションは、読み出し時にアーカイブと新しい行をまとめて返し、
+# 次回のアーカイブで同じオブジェクトに統合する。
+import os
+import gzip
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
+from common import (
+    setup_logger,
+    tracer,
+    is_archive_tombstone,
+    summarize_session,
+    message_time,
+    ARCHIVE_KEY_PREFIX
+)
+from serializer import json_default
+
+# アーカイブ設定
+HISTORY_ARCHIVE_BUCKET = os.environ.get('HISTORY_ARCHIVE_BUCKET', '')
+HISTORY_ARCHIVE_PREFIX = os.environ.get('HISTORY_ARCHIVE_PREFIX', 'history-archive')
+HISTORY_ARCHIVE_AFTER_DAYS = int(os.environ.get('HISTORY_ARCHIVE_AFTER_DAYS', '7'))
+
+# 復元済みセッションのコンテナ内キャッシュ件数
+HYDRATION_CACHE_SIZE = int(os.environ.get('HISTORY_HYDRATION_CACHE_SIZE', '32'))
+
+# アーカイブに保存するメッセージ属性
+_ARCHIVED_FIELDS = ('timestamp', 'sessionId', 'role', 'content', 'createdAt', 'messageId',
+                    'contentRef', 'contentBytes', 'truncated')
+
+class HistoryArchive:
+    """S3 アーカイブへの書き出しと復元"""
+
+    def __init__(self, history_helper, s3_client, bucket: str = None, prefix: str = None):
+        self.history_helper = history_helper
+        self.db_helper = history_helper.db_helper
+        self.history_table = history_helper.history_table
+        self.s3 = s3_client
+        self.bucket = bucket or HISTORY_ARCHIVE_BUCKET
+        self.prefix = (prefix or HISTORY_ARCHIVE_PREFIX).rstrip('/')
+        self.logger = setup_logger('HistoryArchive')
+        self._cache = OrderedDict()
+
+    def object_key(self, user_id: str, session_id: str) -> str:
+        return f"{self.prefix}/{user_id}/{session_id}.json.gz"
+
+    @tracer.traced('HistoryArchive.archive_user')
+    def archive_user(self, user_id: str, older_than_days: int = None, now: datetime = None) -> Dict[str, int]:
+        """最終更新が指定日数より古いセッションをアーカイブ"""
+        days = HISTORY_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+        cutoff = ((now or datetime.utcnow()) - timedelta(days=days)).isoformat()
+        stats = {'archived_sessions': 0, 'archived_messages': 0, 'failed_sessions': 0}
+
+        sessions = {}
+        tombstones = {}
+        for items, _ in self.history_helper.iter_user_history(user_id):
+            for item in items:
+                session_id = item.get('sessionId')
+                if not session_id:
+                    continue
+                if is_archive_tombstone(item):
+                    tombstones[session_id] = item
+                elif 'role' in item:
+                    sessions.setdefault(session_id, []).append(item)
+
+        for session_id, messages in sessions.items():
+            if max(message_time(m) for m in messages) >= cutoff:
+                continue
+            if self.archive_session(user_id, session_id, messages, tombstones.get(session_id, False)):
+                stats['archived_sessions'] += 1
+                stats['archived_messages'] += len(messages)
+            else:
+                stats['failed_sessions'] += 1
+
+        self.logger.info(f"Archived history for {user_id}: {stats}")
+        return stats
+
+    def archive_session(self, user_id: str, session_id: str, messages: List[Dict[str, Any]],
+                        tombstone: Optional[Dict[str, Any]] = None) -> bool:
+        """1セッションを S3 に書き出し、要約行を残して元の行を削除
+
+        アーカイブ後に続けられたセッションは、既存のアーカイブと新しい行をまとめて書き直す
+        （tombstone に既存の要約行を渡す。False なら要約行がないことが分かっている。省略時は読み込む）。
+        S3 書き込み → 要約行の保存 → 元の行の削除 の順で行うため、途中で失敗しても
+        データは失われない（元の行とアーカイブは読み出し時にまとめて返す）。
+        """
+        if tombstone is None:
+            tombstone = self.db_helper.safe_get_item(
+                self.history_table, self.history_helper.archive_key(user_id, session_id)
+            )
+        archived = []
+        if tombstone:
+            # 既存のアーカイブを読めない場合は上書きしない（次回の実行で再試行）
+            archived = self.hydrate_session(tombstone, use_cache=False)
+            if archived is None:
+                return False
+        # 同じ行がアーカイブと元の行の両方にある場合（前回の削除の失敗）は元の行を使う
+        live_keys = {m['timestamp'] for m in messages}
+        messages = sorted([m for m in archived if m['timestamp'] not in live_keys] + list(messages),
+                          key=message_time)
+        key = (tombstone or {}).get('archiveKey') or self.object_key(user_id, session_id)
+        archived_at = datetime.utcnow().isoformat()
+        payload = {
+            'userId': user_id,
+            'sessionId': session_id,
+            'archivedAt': archived_at,
+            'messages': [{f: m[f] for f in _ARCHIVED_FIELDS if f in m} for m in messages]
+        }
+        body = gzip.compress(json.dumps(payload, ensure_ascii=False, default=json_default).encode('utf-8'))
+
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=body,
+                ContentType='application/json',
+                ContentEncoding='gzip'
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to upload archive {key}: {str(e)}")
+            return False
+
+        tombstone = {
+            'userId': user_id,
+            'timestamp': f"{ARCHIVE_KEY_PREFIX}{session_id}",
+            'sessionId': session_id,
+            'archiveKey': key,
+            'archivedAt': archived_at,
+            'archivedBytes': len(body),
+            'summary': summarize_session(session_id, messages)
+        }
+        if not self.db_helper.safe_put_item(self.history_table, tombstone):
+            return False
+
+        success = True
+        for message in messages:
+            if message.get('archived'):
+                continue
+            if not self.db_helper.safe_delete_item(
+                self.history_table,
+                {'userId': user_id, 'timestamp': message['timestamp']}
+            ):
+                success = False
+        # 削除した行の埋め込みを類似検索から除外
+        embeddings = self.history_helper.embeddings
+        if embeddings is not None and not embeddings.forget_session(user_id, session_id):
+            success = False
+        return success
+
+    @tracer.traced('HistoryArchive.hydrate_session')
+    def hydrate_session(self, tombstone: Dict[str, Any], use_cache: bool = True) -> Optional[list]:
+        """要約行が指す S3 オブジェクトからセッションのメッセージを復元"""
+        key = tombstone.get('archiveKey') or self.object_key(tombstone['userId'], tombstone['sessionId'])
+        # 同じオブジェクトを書き直すため、要約行の archivedAt（書き出し時刻）もキャッシュのキーに含める
+        cache_key = (key, tombstone.get('archivedAt'))
+        cached = self._cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            return [dict(m) for m in cached]
+
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+            payload = json.loads(gzip.decompress(response['Body'].read()))
+        except Exception as e:
+            self.logger.error(f"Failed to hydrate archive {key}: {str(e)}")
+            return None
+
+        messages = payload.get('messages', [])
+        for message in messages:
+            message['userId'] = tombstone['userId']
+            message['archived'] = True
+
+        self._cache[cache_key] = messages
+        if len(self._cache) > HYDRATION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return [dict(m) for m in messages]
+
+    def delete_archived_session(self, tombstone: Dict[str, Any]) -> bool:
+        """アーカイブ済みセッションの S3 オブジェクトを削除"""
+        key = tombstone.get('archiveKey') or self.object_key(tombstone['userId'], tombstone['sessionId'])
+        self._cache.pop((key, tombstone.get('archivedAt')), None)
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to delete archive {key}: {str(e)}")
+            return False
+
+def archive_all_users(archive: HistoryArchive, user_table: str, older_than_days: int = None) -> Dict[str, int]:
+    """ユーザーテーブルの全ユーザーについてアーカイブを実行"""
+    totals = {'users': 0, 'archived_sessions': 0, 'archived_messages': 0, 'failed_sessions': 0}
+    start_key = None
+    while True:
+        kwargs = {'ProjectionExpression': 'userId'}
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        page = archive.db_helper.safe_scan_page(user_table, **kwargs)
+        if page is None:
+            break
+        users, start_key = page
+        for user in users:
+            stats = archive.archive_user(user['userId'], older_than_days)
+            totals['users'] += 1
+            for name in ('archived_sessions', 'archived_messages', 'failed_sessions'):
+                totals[name] += stats[name]
+        if not start_key:
+            break
+    return totals
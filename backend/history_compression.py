@@ -0,0 +1,168 @@
+# 履歴メッセージ本文の透過圧縮
+#
+# 閾値を超える本文は共有辞書付き zlib（zstandard があれば zstd も選択可）で圧縮し、
+# content の代わりに Binary 属性 contentZ と圧縮方式 contentEncoding を保存する。
+import os
+import zlib
+import argparse
+from collections import Counter
+from typing import Dict, Any, Optional, List
+
+try:
+    import zstandard
+except ImportError:  # zstandard はオプション依存
+    zstandard = None
+
+# 圧縮を行う最小本文サイズ（UTF-8 バイト数）
+HISTORY_COMPRESSION_MIN_BYTES = int(os.environ.get('HISTORY_COMPRESSION_MIN_BYTES', '512'))
+
+# 圧縮方式（zlib / zstd / none）
+HISTORY_COMPRESSION_CODEC = os.environ.get('HISTORY_COMPRESSION_CODEC', 'zlib').lower()
+
+# 圧縮レベル
+HISTORY_COMPRESSION_LEVEL = int(os.environ.get('HISTORY_COMPRESSION_LEVEL', '6'))
+
+# 共有辞書（ゲンキちゃんの応答に頻出する言い回し）
+# 出現頻度の高いものほど末尾に置く（zlib は辞書末尾ほど短い距離で参照できる）
+_DEFAULT_DICTIONARY_TEXT = (
+    '専門的なアドバイスが必要な場合は、専門家に相談することも考えてみてください。'
+    '睡眠・食事・運動のバランスを整えることも大切です。'
+    '誰かに話を聞いてもらうだけでも、気持ちが軽くなることがありますよ。'
+    '完璧を目指さなくても大丈夫です。できたことに目を向けてみましょう。'
+    '今日の自分をたくさん褒めてあげてくださいね。'
+    '好きな音楽を聴いたり、温かい飲み物を飲んだりしてリラックスしましょう。'
+    '5分だけ散歩してみるのはいかがでしょう。'
+    '小さな目標を立てて、一つずつクリアしていきましょう。'
+    '具体的にできることを3つ提案しますね。\n\n1. '
+    '\n2. '
+    '\n3. '
+    '\n\nあなたならきっと大丈夫です。応援しています！'
+    '無理をせず、自分のペースで進んでいきましょう。'
+    '小さな一歩でも、前に進んでいることに変わりはありません。'
+    'まずは深呼吸をして、気持ちを落ち着けてみましょう。'
+    'そう感じるのは、それだけ真剣に向き合っている証拠です。'
+    'その気持ち、とてもよくわかります。'
+    'お話ししてくれてありがとうございます！'
+    'お疲れさまです！毎日本当によく頑張っていますね。'
+)
+DEFAULT_DICTIONARY = _DEFAULT_DICTIONARY_TEXT.encode('utf-8')
+
+# 辞書ID → 辞書（保存済みデータの復元用に過去の辞書も残すこと）
+DICTIONARIES = {
+    'd1': DEFAULT_DICTIONARY
+}
+CURRENT_DICTIONARY_ID = 'd1'
+
+_zstd_compressors = {}
+_zstd_decompressors = {}
+
+def _zstd_dict(dictionary_id: str):
+    return zstandard.ZstdCompressionDict(DICTIONARIES[dictionary_id], dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+def compress_text(text: str, codec: str = None, dictionary_id: str = None, level: int = None) -> Dict[str, Any]:
+    """本文を圧縮し {contentEncoding, contentZ} を返す"""
+    codec = codec or HISTORY_COMPRESSION_CODEC
+    dictionary_id = dictionary_id or CURRENT_DICTIONARY_ID
+    level = HISTORY_COMPRESSION_LEVEL if level is None else level
+    raw = text.encode('utf-8')
+
+    if codec == 'zstd' and zstandard is not None:
+        key = (dictionary_id, level)
+        compressor = _zstd_compressors.get(key)
+        if compressor is None:
+            compressor = _zstd_compressors[key] = zstandard.ZstdCompressor(
+                level=level, dict_data=_zstd_dict(dictionary_id), write_content_size=True)
+        return {'contentEncoding': f'zstd-{dictionary_id}', 'contentZ': compressor.compress(raw)}
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=DICTIONARIES[dictionary_id])
+    return {'contentEncoding': f'zlib-{dictionary_id}', 'contentZ': compressor.compress(raw) + compressor.flush()}
+
+def decompress_text(encoding: str, data: Any) -> str:
+    """contentEncoding / contentZ から本文を復元"""
+    if hasattr(data, 'value'):
+        # boto3.dynamodb.types.Binary
+        data = data.value
+    codec, _, dictionary_id = encoding.partition('-')
+
+    if codec == 'zlib':
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DICTIONARIES[dictionary_id])
+        return (decompressor.decompress(bytes(data)) + decompressor.flush()).decode('utf-8')
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard がインストールされていません')
+        decompressor = _zstd_decompressors.get(dictionary_id)
+        if decompressor is None:
+            decompressor = _zstd_decompressors[dictionary_id] = zstandard.ZstdDecompressor(
+                dict_data=_zstd_dict(dictionary_id))
+        return decompressor.decompress(bytes(data)).decode('utf-8')
+    raise ValueError(f'Unknown content encoding: {encoding}')
+
+def encode_message_content(content: str, min_bytes: int = None) -> Dict[str, Any]:
+    """保存用の本文属性を返す（閾値未満はそのまま content）"""
+    threshold = HISTORY_COMPRESSION_MIN_BYTES if min_bytes is None else min_bytes
+    if HISTORY_COMPRESSION_CODEC == 'none' or not content or len(content.encode('utf-8')) < threshold:
+        return {'content': content}
+    compressed = compress_text(content)
+    # 圧縮しても小さくならない場合は平文のまま
+    if len(compressed['contentZ']) >= len(content.encode('utf-8')):
+        return {'content': content}
+    return compressed
+
+def decode_message(item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """圧縮済みのアイテムを content を持つ形に戻す（インプレース）"""
+    if item and 'contentZ' in item:
+        item['content'] = decompress_text(item.pop('contentEncoding'), item.pop('contentZ'))
+    return item
+
+def decode_messages(items: Optional[list]) -> Optional[list]:
+    """アイテム一覧を復元"""
+    if items:
+        for item in items:
+            if 'contentZ' in item:
+                decode_message(item)
+    return items
+
+def train_dictionary(samples: List[str], size: int = 8192, min_chars: int = 6, max_chars: int = 24) -> bytes:
+    """応答サンプルから zlib / zstd 用の生コンテンツ辞書を作成
+
+    サンプル中で繰り返し現れる文字列（句読点区切りのフレーズ）を頻度順に集め、
+    頻度の高いものが辞書末尾に来るよう並べる。
+    """
+    counter = Counter()
+    for sample in samples:
+        phrase = []
+        for char in sample:
+            phrase.append(char)
+            if char in '。！？!?\n、':
+                text = ''.join(phrase).strip()
+                if min_chars <= len(text) <= max_chars * 4:
+                    counter[text] += 1
+                phrase = []
+
+    selected = []
+    total = 0
+    for phrase, count in counter.most_common():
+        if count < 2:
+            break
+        encoded = phrase.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        selected.append(encoded)
+        total += len(encoded)
+
+    # 頻度の高いものを末尾へ
+    return b''.join(reversed(selected))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='応答コーパスから共有辞書を作成')
+    parser.add_argument('input', help='1行1応答のテキストファイル（改行は \\n でエスケープ）')
+    parser.add_argument('output', help='辞書の出力先')
+    parser.add_argument('--size', type=int, default=8192)
+    args = parser.parse_args()
+
+    with open(args.input, encoding='utf-8') as f:
+        corpus = [line.rstrip('\n').replace('\\n', '\n') for line in f if line.strip()]
+    dictionary = train_dictionary(corpus, args.size)
+    with open(args.output, 'wb') as f:
+        f.write(dictionary)
+    print(f'{len(dictionary)} bytes written to {args.output}')
\ No newline at end of file
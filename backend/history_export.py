@@ -0,0 +1,207 @@
+# 履歴エクスポート - ユーザーの全履歴を NDJSON でストリーミング出力
+#
+# ページ単位のクエリで 1 行 1 メッセージの NDJSON を書き出すため、メモリ使用量はページサイズで決まる。
+# レスポンス上限を超える場合は S3 に書き出して署名付き URL を返す。
+# 途中で打ち切った場合はカーソル（次ページの開始キー）から再開できる。
+#   python history_export.py <userId> --output history.ndjson.gz --gzip
+import os
+import sys
+import gzip
+import json
+import uuid
+import base64
+import argparse
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable, Iterator, Tuple
+from common import (
+    setup_logger,
+    tracer,
+    is_archive_tombstone,
+    message_time
+)
+from serializer import json_default
+
+# エクスポート設定
+EXPORT_PAGE_SIZE = int(os.environ.get('HISTORY_EXPORT_PAGE_SIZE', '500'))
+
+# API Gateway 経由で直接返す最大サイズ（Lambda のレスポンス上限 6MB と base64 化の膨張を考慮）
+EXPORT_RESPONSE_LIMIT_BYTES = int(os.environ.get('HISTORY_EXPORT_RESPONSE_LIMIT_BYTES', str(4 * 1024 * 1024)))
+
+# 上限超過時の書き出し先（未設定時はアーカイブ用バケットを使用）
+HISTORY_EXPORT_BUCKET = os.environ.get('HISTORY_EXPORT_BUCKET', os.environ.get('HISTORY_ARCHIVE_BUCKET', ''))
+HISTORY_EXPORT_PREFIX = os.environ.get('HISTORY_EXPORT_PREFIX', 'history-export')
+EXPORT_URL_EXPIRES_SECONDS = int(os.environ.get('HISTORY_EXPORT_URL_EXPIRES_SECONDS', '3600'))
+
+# Lambda の残り時間がこれを下回ったらページ境界で打ち切り、カーソルを返す
+EXPORT_TIME_MARGIN_MS = int(os.environ.get('HISTORY_EXPORT_TIME_MARGIN_MS', '10000'))
+
+def encode_cursor(start_key: Optional[Dict[str, Any]]) -> Optional[str]:
+    """次ページの開始キーを URL セーフな文字列に変換"""
+    if not start_key:
+        return None
+    raw = json.dumps(start_key, separators=(',', ':'), default=json_default).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    """カーソル文字列を開始キーに戻す"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        start_key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('無効なカーソルです')
+    if not isinstance(start_key, dict) or 'userId' not in start_key or 'timestamp' not in start_key:
+        raise ValueError('無効なカーソルです')
+    return start_key
+
+def export_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    """履歴アイテムをエクスポート用のレコードに変換"""
+    record = {
+        'sessionId': item.get('sessionId'),
+        'role': item.get('role'),
+        'content': item.get('content', item.get('message', '')),
+        'timestamp': message_time(item)
+    }
+    if item.get('messageId'):
+        record['messageId'] = item['messageId']
+    if item.get('archived'):
+        record['archived'] = True
+    if item.get('truncated'):
+        record['truncated'] = True
+    return record
+
+def read_overflow(overflow, item: Dict[str, Any]) -> Dict[str, Any]:
+    """S3 に退避した本文を読み出す（エクスポートはサイズによらず全文を書き出す）"""
+    if overflow is not None and item.get('contentRef'):
+        item['content'] = overflow.read_content(item['contentRef'])
+    return item
+
+class HistoryExporter:
+    """ユーザー履歴の NDJSON エクスポート"""
+
+    def __init__(self, history_helper, s3_client=None, bucket: str = None, prefix: str = None):
+        self.history_helper = history_helper
+        self.s3 = s3_client
+        self.bucket = bucket or HISTORY_EXPORT_BUCKET
+        self.prefix = (prefix or HISTORY_EXPORT_PREFIX).rstrip('/')
+        self.logger = setup_logger('HistoryExporter')
+
+    def iter_pages(self, user_id: str, cursor: str = None,
+                   page_size: int = None) -> Iterator[Tuple[list, Optional[str]]]:
+        """(レコード一覧, 次ページのカーソル) をページ単位で列挙（アーカイブ済みセッションは復元）"""
+        start_key = decode_cursor(cursor)
+        if start_key and start_key['userId'] != user_id:
+            raise ValueError('無効なカーソルです')
+
+        archive = self.history_helper.archive
+        overflow = self.history_helper.overflow
+        for items, next_key in self.history_helper.iter_user_history(
+                user_id, page_size or EXPORT_PAGE_SIZE, start_key):
+            records = []
+            for item in items:
+                if is_archive_tombstone(item):
+                    if archive is None:
+                        continue
+                    messages = archive.hydrate_session(item)
+                    if messages is None:
+                        raise RuntimeError(f"Failed to hydrate archived session {item.get('sessionId')}")
+                    records.extend(export_record(read_overflow(overflow, m)) for m in messages)
+                elif 'role' in item:
+                    records.append(export_record(read_overflow(overflow, item)))
+            yield records, encode_cursor(next_key)
+
+    @tracer.traced('HistoryExporter.write')
+    def write(self, user_id: str, fileobj, cursor: str = None, compress: bool = False,
+              page_size: int = None, should_stop: Callable[[], bool] = None) -> Dict[str, Any]:
+        """NDJSON をファイルオブジェクトに書き出し、件数と再開用カーソルを返す
+
+        should_stop が True を返した場合はページ境界で打ち切る（nextCursor から再開可能）。
+        """
+        out = gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0) if compress else fileobj
+        stats = {'messages': 0, 'pages': 0, 'nextCursor': None, 'complete': True}
+        try:
+            for records, next_cursor in self.iter_pages(user_id, cursor, page_size):
+                lines = [
+                    json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=json_default)
+                    for record in records
+                ]
+                if lines:
+                    out.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                stats['messages'] += len(lines)
+                stats['pages'] += 1
+                stats['nextCursor'] = next_cursor
+                if next_cursor and should_stop and should_stop():
+                    stats['complete'] = False
+                    break
+        finally:
+            if compress:
+                out.close()
+        if stats['complete']:
+            stats['nextCursor'] = None
+        return stats
+
+    @tracer.traced('HistoryExporter.export')
+    def export(self, user_id: str, cursor: str = None, compress: bool = False,
+               should_stop: Callable[[], bool] = None, response_limit: int = None) -> Dict[str, Any]:
+        """エクスポートを実行
+
+        上限以下なら本文（bytes）を 'body' に、超える場合は S3 に書き出して 'url' を返す。
+        """
+        limit = EXPORT_RESPONSE_LIMIT_BYTES if response_limit is None else response_limit
+        # 上限まではメモリ上、超えたら /tmp に退避
+        with tempfile.SpooledTemporaryFile(max_size=limit + 1) as spool:
+            result = self.write(user_id, spool, cursor, compress, should_stop=should_stop)
+            size = spool.tell()
+            result['bytes'] = size
+            spool.seek(0)
+
+            if size <= limit:
+                result['body'] = spool.read()
+                return result
+
+            if self.s3 is None or not self.bucket:
+                raise RuntimeError('エクスポートがレスポンス上限を超えましたが、出力先バケットが設定されていません')
+
+            key = self.object_key(user_id, compress)
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=spool,
+                ContentType='application/x-ndjson',
+                **({'ContentEncoding': 'gzip'} if compress else {})
+            )
+
+        result['key'] = key
+        result['url'] = self.s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=EXPORT_URL_EXPIRES_SECONDS
+        )
+        self.logger.info(f"Export for {user_id} written to s3://{self.bucket}/{key} ({size} bytes)")
+        return result
+
+    def object_key(self, user_id: str, compress: bool = False) -> str:
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        suffix = '.ndjson.gz' if compress else '.ndjson'
+        return f"{self.prefix}/{user_id}/{stamp}-{uuid.uuid4().hex[:8]}{suffix}"
+
+if __name__ == "__main__":
+    from common import HistoryHelper, create_database_helper, HISTORY_TABLE
+
+    parser = argparse.ArgumentParser(description='ユーザーの全履歴を NDJSON でエクスポート')
+    parser.add_argument('user', help='対象ユーザーID')
+    parser.add_argument('--output', default='-', help='出力先ファイル（既定: 標準出力）')
+    parser.add_argument('--gzip', action='store_true', help='gzip 圧縮して出力')
+    parser.add_argument('--cursor', default=None, help='前回の nextCursor から再開')
+    parser.add_argument('--page-size', type=int, default=EXPORT_PAGE_SIZE)
+    args = parser.parse_args()
+
+    exporter = HistoryExporter(HistoryHelper(create_database_helper(), HISTORY_TABLE))
+    if args.output == '-':
+        stats = exporter.write(args.user, sys.stdout.buffer, args.cursor, args.gzip, args.page_size)
+    else:
+        with open(args.output, 'ab' if args.cursor else 'wb') as f:
+            stats = exporter.write(args.user, f, args.cursor, args.gzip, args.page_size)
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
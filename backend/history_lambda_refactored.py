@@ -1,34 +1,106 @@
 import json
-import boto3
-from datetime import datetime
+import base64
 import logging
 from collections import defaultdict
 from common import (
     setup_logger,
+    tracer,
     ResponseBuilder,
     RequestValidator,
-    DatabaseHelper,
+    create_database_helper,
     HistoryHelper,
-    HISTORY_TABLE
+    client_factory,
+    message_time,
+    is_archive_tombstone,
+    summarize_session,
+    create_single_flight,
+    HISTORY_TABLE,
+    USER_TABLE,
+    HISTORY_MULTI_SESSION_MAX
 )
+from async_helpers import AsyncDatabaseHelper, AsyncHistoryHelper, run_async, ASYNC_IO_ENABLED
+from history_search import HistorySearchIndex, HISTORY_SEARCH_ENABLED
+from history_similarity import SimilaritySearch, EmbeddingChunks, SIMILARITY_SEARCH_ENABLED, SIMILARITY_DEFAULT_K, SIMILARITY_MAX_K
+from history_archive import HistoryArchive, archive_all_users, HISTORY_ARCHIVE_BUCKET
+from history_overflow import HistoryOverflow, HISTORY_OVERFLOW_BUCKET
+from warmup import (
+    Primer,
+    is_warmup_event,
+    should_prime_on_init,
+    prime_dynamodb,
+    prime_local_caches,
+    WARMUP_USER_ID
+)
+from usage_accounting import UsageAccountant, parse_usage_range
+from history_export import HistoryExporter, HISTORY_EXPORT_BUCKET, EXPORT_TIME_MARGIN_MS, EXPORT_URL_EXPIRES_SECONDS
 
 # ログ設定
 logger = setup_logger(__name__)
 
-# AWS サービス初期化
-dynamodb = boto3.resource('dynamodb')
-
-# ヘルパー初期化
-db_helper = DatabaseHelper(dynamodb)
+# AWS サービス・ヘルパー初期化
+db_helper = create_database_helper()
 history_helper = HistoryHelper(db_helper, HISTORY_TABLE)
 
+# 同時に届いた同一の履歴取得をまとめる（SINGLE_FLIGHT_ENABLED=false で無効）
+history_flight = create_single_flight('history', db_helper)
+
+# asyncio 版ヘルパー（セッション毎のクエリを並行実行）
+async_history_helper = AsyncHistoryHelper(history_helper, AsyncDatabaseHelper(db_helper))
+
+# 履歴検索インデックス（保存・削除時に差分更新）
+if HISTORY_SEARCH_ENABLED:
+    history_helper.search_index = HistorySearchIndex(db_helper, HISTORY_TABLE)
+
+# 類似会話検索（ハッシュ埋め込み。セッション削除・アーカイブ時にチャンク行から除外）
+similarity_search = None
+if SIMILARITY_SEARCH_ENABLED:
+    history_helper.embeddings = EmbeddingChunks(db_helper, HISTORY_TABLE)
+    similarity_search = SimilaritySearch(history_helper)
+
+# S3 アーカイブ（バケット設定時のみ）
+history_archive = None
+if HISTORY_ARCHIVE_BUCKET:
+    history_archive = HistoryArchive(history_helper, client_factory.client('s3'))
+    history_helper.archive = history_archive
+
+# S3 に退避した大きな本文（セッション詳細を開いた時だけ読み出す）
+if HISTORY_OVERFLOW_BUCKET:
+    history_helper.overflow = HistoryOverflow(client_factory.client('s3'))
+
+# NDJSON エクスポート（レスポンス上限超過時は S3 に書き出す）
+history_exporter = HistoryExporter(
+    history_helper,
+    client_factory.client('s3') if HISTORY_EXPORT_BUCKET else None
+)
+
+# Bedrock 使用量の参照（書き込みはチャット Lambda）
+usage_accountant = UsageAccountant(db_helper, HISTORY_TABLE)
+
+# 初期化フェーズのプライミング（接続確立・初回利用時の読み込みを初回リクエストの前に済ませる）
+primer = Primer('history')
+primer.add('dynamodb.history', prime_dynamodb(db_helper, HISTORY_TABLE,
+                                              {'userId': WARMUP_USER_ID, 'timestamp': WARMUP_USER_ID}))
+primer.add('caches', prime_local_caches)
+primer.add('conversations', lambda: organize_conversations([
+    {'sessionId': WARMUP_USER_ID, 'role': 'user', 'content': 'こんにちは', 'createdAt': '2025-01-01T00:00:00'}
+]))
+
+@tracer.trace_handler('history.lambda_handler')
 def lambda_handler(event, context):
     """
     チャット履歴を管理するLambda関数（リファクタリング版）
     """
+    # ウォームアップイベントは即座に返す
+    if is_warmup_event(event):
+        return primer.handle(event)
+    
     try:
         logger.info(f"Received event: {json.dumps(event)}")
         
+        # スケジュール実行によるアーカイブ（API Gateway 経由のイベントではない）
+        if 'httpMethod' not in event and event.get('action') == 'archiveHistory':
+            return handle_archive(event)
+        
         # OPTIONSリクエストの処理
         if event.get('httpMethod') == 'OPTIONS':
             return ResponseBuilder.options()
@@ -43,16 +115,36 @@ def lambda_handler(event, context):
         
         http_method = event.get('httpMethod', 'GET')
         query_params = event.get('queryStringParameters') or {}
+        path_params = event.get('pathParameters') or {}
+        session_id = path_params.get('sessionId') or query_params.get('sessionId')
+        accept_encoding = RequestValidator.get_header(event, 'accept-encoding')
         
         logger.info(f"Processing {http_method} request for user: {user_id}")
         
         if http_method == 'GET':
+            if is_export_request(event):
+                # 全履歴のエクスポート
+                return handle_export(user_id, query_params, context)
+            if is_search_request(event):
+                # 全文検索
+                return handle_search(user_id, query_params, accept_encoding)
+            if is_similar_request(event):
+                # 類似会話検索
+                return handle_similar(user_id, query_params, accept_encoding)
+            if is_usage_request(event):
+                # Bedrock 使用量
+                return handle_usage(user_id, query_params, accept_encoding)
+            if query_params.get('sessionIds'):
+                # 複数セッションの詳細を一括取得
+                return handle_get_sessions(user_id, query_params['sessionIds'], accept_encoding)
+            if session_id:
+                # セッション詳細取得
+                return handle_get_session(user_id, session_id, accept_encoding)
             # 履歴取得
-            return handle_get_history(user_id)
+            return handle_get_history(user_id, accept_encoding)
         
         elif http_method == 'DELETE':
             # 履歴削除
-            session_id = query_params.get('sessionId')
             return handle_delete_history(user_id, session_id)
         
         else:
@@ -62,35 +154,124 @@ def lambda_handler(event, context):
         logger.error(f"Unexpected error in history lambda: {str(e)}", exc_info=True)
         return ResponseBuilder.error('内部サーバーエラーが発生しました', 500, str(e))
 
-def handle_get_history(user_id: str):
+def handle_get_history(user_id: str, accept_encoding: str = None):
     """履歴取得処理"""
     try:
         logger.info(f"Getting history for user: {user_id}")
         
-        # ユーザーの全メッセージを取得
-        messages = history_helper.get_user_history(user_id)
+        # 同時に届いた同じユーザーの履歴取得は1回のクエリ・集計にまとめる
+        if history_flight is not None:
+            result = history_flight.do(user_id, 'GET /history', None, lambda: load_conversations(user_id))
+        else:
+            result = load_conversations(user_id)
         
-        if messages is None:
+        if result is None:
             logger.error("Failed to retrieve user history")
             return ResponseBuilder.error('履歴の取得に失敗しました', 500)
         
+        logger.info(f"Successfully processed {len(result['conversations'])} conversations")
+        
+        return ResponseBuilder.success(result, accept_encoding=accept_encoding)
+        
+    except Exception as e:
+        logger.error(f"Error in get history: {str(e)}")
+        return ResponseBuilder.error('履歴取得中にエラーが発生しました', 500, str(e))
+
+def load_conversations(user_id: str):
+    """ユーザーの全メッセージを取得してセッション別の会話一覧を作成（取得失敗時は None）"""
+    messages = history_helper.get_user_history(user_id)
+    
+    if messages is None:
+        return None
+    
+    if not messages:
+        logger.info("No history found for user")
+        return {'conversations': []}
+    
+    # セッション別に会話を整理
+    conversations = organize_conversations(messages)
+    return {
+        'conversations': conversations,
+        'totalCount': len(conversations)
+    }
+
+def handle_get_session(user_id: str, session_id: str, accept_encoding: str = None):
+    """セッション詳細取得処理"""
+    try:
+        logger.info(f"Getting session {session_id} for user: {user_id}")
+        
+        # 新形式・旧形式の行のクエリは並行実行
+        if ASYNC_IO_ENABLED:
+            messages = run_async(async_history_helper.get_session_history(user_id, session_id))
+        else:
+            messages = history_helper.get_session_history(user_id, session_id)
+        
+        if messages is None:
+            logger.error("Failed to retrieve session history")
+            return ResponseBuilder.error('セッションの取得に失敗しました', 500)
+        
         if not messages:
-            logger.info("No history found for user")
-            return ResponseBuilder.success({'conversations': []})
+            return ResponseBuilder.error('セッションが見つかりません', 404)
         
-        # セッション別に会話を整理
-        conversations = organize_conversations(messages)
+        return ResponseBuilder.success(format_session(session_id, messages), accept_encoding=accept_encoding)
+        
+    except Exception as e:
+        logger.error(f"Error in get session: {str(e)}")
+        return ResponseBuilder.error('セッション取得中にエラーが発生しました', 500, str(e))
+
+def handle_get_sessions(user_id: str, session_ids_param: str, accept_encoding: str = None):
+    """複数セッション詳細の一括取得処理（sessionIds はカンマ区切り）"""
+    try:
+        session_ids = list(dict.fromkeys(sid.strip() for sid in session_ids_param.split(',') if sid.strip()))
+        if not session_ids:
+            return ResponseBuilder.error('sessionIds が必要です')
+        if len(session_ids) > HISTORY_MULTI_SESSION_MAX:
+            return ResponseBuilder.error(f'sessionIds は{HISTORY_MULTI_SESSION_MAX}件以内で指定してください')
         
-        logger.info(f"Successfully processed {len(conversations)} conversations")
+        logger.info(f"Getting {len(session_ids)} sessions for user: {user_id}")
+        
+        # セッション毎のクエリを並行実行
+        if ASYNC_IO_ENABLED:
+            results = run_async(async_history_helper.get_sessions_history(user_id, session_ids))
+        else:
+            results = {sid: history_helper.get_session_history(user_id, sid) for sid in session_ids}
+        
+        failed = [sid for sid, messages in results.items() if messages is None]
+        if failed and len(failed) == len(session_ids):
+            logger.error("Failed to retrieve session histories")
+            return ResponseBuilder.error('セッションの取得に失敗しました', 500)
         
         return ResponseBuilder.success({
-            'conversations': conversations,
-            'totalCount': len(conversations)
-        })
+            'sessions': [format_session(sid, messages) for sid, messages in results.items() if messages],
+            'notFound': [sid for sid, messages in results.items() if messages is not None and not messages],
+            'failed': failed
+        }, accept_encoding=accept_encoding)
         
     except Exception as e:
-        logger.error(f"Error in get history: {str(e)}")
-        return ResponseBuilder.error('履歴取得中にエラーが発生しました', 500, str(e))
+        logger.error(f"Error in get sessions: {str(e)}")
+        return ResponseBuilder.error('セッション取得中にエラーが発生しました', 500, str(e))
+
+def format_session(session_id: str, messages: list) -> dict:
+    """セッション詳細のレスポンス形式"""
+    return {
+        'sessionId': session_id,
+        'messages': [format_session_message(msg) for msg in messages],
+        'messageCount': len(messages)
+    }
+
+def format_session_message(msg: dict) -> dict:
+    """メッセージのレスポンス形式（大きな本文はプレビューと取得用 URL・切り詰めた旨を付与）"""
+    message = {
+        'role': msg.get('role'),
+        'content': msg.get('content', msg.get('message', '')),
+        'timestamp': message_time(msg)
+    }
+    if msg.get('contentUrl'):
+        message['contentUrl'] = msg['contentUrl']
+        message['contentBytes'] = int(msg.get('contentBytes', 0))
+    if msg.get('truncated'):
+        message['truncated'] = True
+    return message
 
 def handle_delete_history(user_id: str, session_id: str = None):
     """履歴削除処理"""
@@ -123,59 +304,188 @@ def handle_delete_history(user_id: str, session_id: str = None):
         logger.error(f"Error in delete history: {str(e)}")
         return ResponseBuilder.error('履歴削除中にエラーが発生しました', 500, str(e))
 
+def is_export_request(event) -> bool:
+    """GET /history/export へのリクエストか"""
+    path = event.get('resource') or event.get('path') or ''
+    return path.rstrip('/').endswith('/export')
+
+def is_search_request(event) -> bool:
+    """GET /history/search へのリクエストか"""
+    path = event.get('resource') or event.get('path') or ''
+    return path.rstrip('/').endswith('/search')
+
+def is_similar_request(event) -> bool:
+    """GET /history/similar へのリクエストか"""
+    path = event.get('resource') or event.get('path') or ''
+    return path.rstrip('/').endswith('/similar')
+
+def is_usage_request(event) -> bool:
+    """GET /history/usage へのリクエストか"""
+    path = event.get('resource') or event.get('path') or ''
+    return path.rstrip('/').endswith('/usage')
+
+def handle_usage(user_id: str, query_params: dict, accept_encoding: str = None):
+    """日別のトークン数・概算コスト（from / to: YYYY-MM-DD、既定は直近30日）"""
+    try:
+        try:
+            start, end = parse_usage_range(query_params)
+        except ValueError as e:
+            return ResponseBuilder.error(str(e), 400)
+        
+        result = usage_accountant.get_user_usage(user_id, start, end)
+        if result is None:
+            return ResponseBuilder.error('使用量の取得に失敗しました', 500)
+        
+        return ResponseBuilder.success(result, accept_encoding=accept_encoding)
+        
+    except Exception as e:
+        logger.error(f"Error in usage: {str(e)}")
+        return ResponseBuilder.error('使用量の取得中にエラーが発生しました', 500, str(e))
+
+def handle_similar(user_id: str, query_params: dict, accept_encoding: str = None):
+    """類似会話検索処理（sessionId: 似たセッション、q: 似たメッセージ、k: 件数）"""
+    try:
+        if similarity_search is None:
+            return ResponseBuilder.error('類似会話検索は無効化されています', 404)
+        
+        try:
+            k = max(1, min(int(query_params.get('k') or SIMILARITY_DEFAULT_K), SIMILARITY_MAX_K))
+        except ValueError:
+            return ResponseBuilder.error('k が不正です')
+        
+        session_id = query_params.get('sessionId')
+        text = (query_params.get('q') or '').strip()
+        try:
+            if session_id:
+                results = similarity_search.similar_sessions(user_id, session_id, k)
+            elif text:
+                results = similarity_search.similar_messages(user_id, text, k)
+            else:
+                return ResponseBuilder.error('sessionId または q が必要です')
+        except ValueError as e:
+            return ResponseBuilder.error(str(e), 400)
+        
+        return ResponseBuilder.success({'results': results}, accept_encoding=accept_encoding)
+        
+    except Exception as e:
+        logger.error(f"Error in similar history: {str(e)}")
+        return ResponseBuilder.error('類似会話検索中にエラーが発生しました', 500, str(e))
+
+def handle_search(user_id: str, query_params: dict, accept_encoding: str = None):
+    """履歴の全文検索処理（q: 検索語、limit: 件数、cursor: 次ページ）"""
+    try:
+        if history_helper.search_index is None:
+            return ResponseBuilder.error('履歴検索は無効化されています', 404)
+        
+        query = (query_params.get('q') or '').strip()
+        if not query:
+            return ResponseBuilder.error('検索語(q)が必要です')
+        
+        try:
+            result = history_helper.search_index.search(
+                user_id, query, query_params.get('limit'), query_params.get('cursor')
+            )
+        except ValueError as e:
+            return ResponseBuilder.error(str(e), 400)
+        
+        logger.info(f"Search returned {len(result['results'])} of {result['candidateCount']} candidates for user: {user_id}")
+        
+        return ResponseBuilder.success({
+            'query': query,
+            'results': result['results'],
+            'nextCursor': result['nextCursor']
+        }, accept_encoding=accept_encoding)
+        
+    except Exception as e:
+        logger.error(f"Error in search history: {str(e)}")
+        return ResponseBuilder.error('履歴検索中にエラーが発生しました', 500, str(e))
+
+def handle_export(user_id: str, query_params: dict, context=None):
+    """全履歴エクスポート処理（NDJSON、gzip=true で圧縮）"""
+    try:
+        compress = str(query_params.get('gzip', '')).lower() in ('1', 'true')
+        cursor = query_params.get('cursor')
+        
+        # Lambda の残り時間が少なくなったらページ境界で打ち切る
+        should_stop = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            should_stop = lambda: context.get_remaining_time_in_millis() < EXPORT_TIME_MARGIN_MS
+        
+        try:
+            result = history_exporter.export(user_id, cursor, compress, should_stop)
+        except ValueError as e:
+            return ResponseBuilder.error(str(e), 400)
+        
+        logger.info(f"Exported {result['messages']} messages ({result['bytes']} bytes) for user: {user_id}")
+        
+        if 'url' in result:
+            # レスポンス上限超過: S3 の署名付き URL を返す
+            return ResponseBuilder.success({
+                'url': result['url'],
+                'expiresIn': EXPORT_URL_EXPIRES_SECONDS,
+                'bytes': result['bytes'],
+                'messageCount': result['messages'],
+                'nextCursor': result['nextCursor'],
+                'complete': result['complete']
+            })
+        
+        headers = ResponseBuilder.cors_headers()
+        headers['Access-Control-Expose-Headers'] = 'X-Export-Cursor'
+        headers['Content-Disposition'] = f"attachment; filename=\"history.ndjson{'.gz' if compress else ''}\""
+        if result['nextCursor']:
+            headers['X-Export-Cursor'] = result['nextCursor']
+        
+        if compress:
+            headers['Content-Type'] = 'application/gzip'
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': base64.b64encode(result['body']).decode('ascii'),
+                'isBase64Encoded': True
+            }
+        
+        headers['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': result['body'].decode('utf-8')
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in export history: {str(e)}")
+        return ResponseBuilder.error('履歴エクスポート中にエラーが発生しました', 500, str(e))
+
 def organize_conversations(messages):
     """
     メッセージをセッション別の会話に整理
     """
     try:
-        # セッション別にメッセージをグループ化
+        # セッション別にメッセージをグループ化（アーカイブ済みセッションは要約行を使用）
         sessions = defaultdict(list)
+        archived = {}
         
         for message in messages:
             session_id = message.get('sessionId')
-            if session_id:
+            if not session_id:
+                continue
+            if is_archive_tombstone(message):
+                archived[session_id] = message
+            else:
                 sessions[session_id].append(message)
         
-        conversations = []
+        conversations = [
+            summarize_session(session_id, session_messages)
+            for session_id, session_messages in sessions.items()
+        ]
         
-        for session_id, session_messages in sessions.items():
-            # メッセージを時系列でソート
-            session_messages.sort(key=lambda x: x.get('timestamp', ''))
-            
-            # 最初のユーザーメッセージを取得
-            first_user_message = None
-            for msg in session_messages:
-                if msg.get('role') == 'user':
-                    first_user_message = msg.get('content', '')
-                    break
-            
-            # 会話の統計情報を計算
-            user_messages = [msg for msg in session_messages if msg.get('role') == 'user']
-            assistant_messages = [msg for msg in session_messages if msg.get('role') == 'assistant']
-            
-            # 最新のタイムスタンプを取得
-            latest_timestamp = max(
-                (msg.get('timestamp', '') for msg in session_messages),
-                default=datetime.utcnow().isoformat()
-            )
-            
-            # 最初のタイムスタンプを取得
-            earliest_timestamp = min(
-                (msg.get('timestamp', '') for msg in session_messages),
-                default=latest_timestamp
-            )
-            
-            conversation = {
-                'sessionId': session_id,
-                'firstMessage': first_user_message or '新しい会話',
-                'messageCount': len(session_messages),
-                'userMessageCount': len(user_messages),
-                'assistantMessageCount': len(assistant_messages),
-                'createdAt': earliest_timestamp,
-                'updatedAt': latest_timestamp,
-                'preview': create_conversation_preview(session_messages)
-            }
-            
+        for session_id, tombstone in archived.items():
+            summary = tombstone.get('summary') or {'sessionId': session_id}
+            if session_id in sessions:
+                # アーカイブ後に続けられたセッションは件数・開始日時・最初のメッセージをアーカイブ分と合算
+                merge_archived_summary(conversations, summary)
+                continue
+            conversation = dict(summary)
+            conversation['archived'] = True
             conversations.append(conversation)
         
         # 最新順でソート
@@ -189,36 +499,32 @@ def organize_conversations(messages):
         logger.error(f"Error organizing conversations: {str(e)}")
         return []
 
-def create_conversation_preview(messages):
-    """
-    会話のプレビューテキストを作成
-    """
-    try:
-        # 最新のユーザーメッセージとAIの応答を取得
-        recent_messages = sorted(messages, key=lambda x: x.get('timestamp', ''), reverse=True)[:4]
-        
-        preview_parts = []
-        for msg in reversed(recent_messages):  # 時系列順に戻す
-            role = msg.get('role', '')
-            content = msg.get('content', '')
-            
-            if content:
-                if role == 'user':
-                    preview_parts.append(f"👤: {content[:30]}")
-                elif role == 'assistant':
-                    preview_parts.append(f"🤖: {content[:30]}")
-        
-        preview = " | ".join(preview_parts)
-        
-        # 長さ制限
-        if len(preview) > 150:
-            preview = preview[:147] + "..."
-        
-        return preview
-        
-    except Exception as e:
-        logger.error(f"Error creating preview: {str(e)}")
-        return "会話プレビューを作成できませんでした"
+def merge_archived_summary(conversations, summary):
+    """元の行から作った会話要約にアーカイブ済み部分の要約を合算（インプレース）"""
+    for conversation in conversations:
+        if conversation['sessionId'] != summary.get('sessionId'):
+            continue
+        for name in ('messageCount', 'userMessageCount', 'assistantMessageCount'):
+            conversation[name] = conversation.get(name, 0) + int(summary.get(name, 0))
+        if summary.get('createdAt') and summary['createdAt'] < conversation.get('createdAt', ''):
+            conversation['createdAt'] = summary['createdAt']
+            conversation['firstMessage'] = summary.get('firstMessage', conversation.get('firstMessage'))
+        return
+
+def handle_archive(event):
+    """古いセッションの S3 アーカイブ（EventBridge スケジュール実行）"""
+    if history_archive is None:
+        logger.warning("HISTORY_ARCHIVE_BUCKET is not configured; skipping archive")
+        return {'archived_sessions': 0}
+    
+    older_than_days = event.get('olderThanDays')
+    if event.get('userId'):
+        return history_archive.archive_user(event['userId'], older_than_days)
+    return archive_all_users(history_archive, USER_TABLE, older_than_days)
+
+# Lambda の初期化フェーズでプライミング（WARMUP_PRIME_ON_INIT で制御）
+if should_prime_on_init():
+    primer.prime()
 
 if __name__ == "__main__":
     # ローカルテスト用
@@ -0,0 +1,155 @@
+# 大きなメッセージの S3 退避 - DynamoDB の項目上限（400KB）を超える本文を履歴から落とさない
+#
+# 本文（圧縮後）が HISTORY_OVERFLOW_THRESHOLD_BYTES を超えるメッセージは本文を S3 に gzip で書き出し、
+# DynamoDB の行には先頭のプレビュー（content）と S3 キー（contentRef）・元のサイズ（contentBytes）だけを残す。
+# 一覧・検索・直近会話ウィンドウはプレビューで足りるため S3 は読まず、セッション詳細を開いた時だけ
+# 本文をストリーミングで読み出して復元する。HISTORY_OVERFLOW_INLINE_MAX_BYTES を超える本文は
+# レスポンスに埋め込まず、署名付き URL（contentUrl）で S3 から直接取得させる。
+# S3 オブジェクトはユーザー・セッション毎のプレフィックス配下に置く（<prefix>/<userId>/<sessionId>/<ULID>-<role>.txt.gz）。
+# userId / sessionId は URL エンコードし、'/' を含む ID が他のセッションのプレフィックスと重ならないようにする。
+import os
+import gzip
+import zlib
+import codecs
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Iterator, List
+from common import setup_logger, tracer
+
+# S3 退避設定（未設定時はアーカイブ用バケットを使用）
+HISTORY_OVERFLOW_BUCKET = os.environ.get('HISTORY_OVERFLOW_BUCKET', os.environ.get('HISTORY_ARCHIVE_BUCKET', ''))
+HISTORY_OVERFLOW_PREFIX = os.environ.get('HISTORY_OVERFLOW_PREFIX', 'history-overflow')
+# セッション詳細のレスポンスに本文を埋め込む上限（超える場合は署名付き URL を返す。Lambda のレスポンス上限は 6MB）
+HISTORY_OVERFLOW_INLINE_MAX_BYTES = int(os.environ.get('HISTORY_OVERFLOW_INLINE_MAX_BYTES', str(1024 * 1024)))
+HISTORY_OVERFLOW_URL_EXPIRES_SECONDS = int(os.environ.get('HISTORY_OVERFLOW_URL_EXPIRES_SECONDS', '900'))
+# 本文の読み出しの並行数
+HISTORY_OVERFLOW_READ_CONCURRENCY = int(os.environ.get('HISTORY_OVERFLOW_READ_CONCURRENCY', '4'))
+
+# ストリーミング読み出しのチャンクサイズ
+_READ_CHUNK_BYTES = 64 * 1024
+
+class HistoryOverflow:
+    """大きなメッセージ本文の S3 への書き出し・読み出し・削除"""
+
+    def __init__(self, s3_client, bucket: str = None, prefix: str = None):
+        self.s3 = s3_client
+        self.bucket = bucket or HISTORY_OVERFLOW_BUCKET
+        self.prefix = (prefix or HISTORY_OVERFLOW_PREFIX).rstrip('/')
+        self.logger = setup_logger('HistoryOverflow')
+
+    def object_key(self, message_item: Dict[str, Any]) -> str:
+        # ソートキー末尾の ULID でメッセージを一意にする
+        ulid = message_item['timestamp'].rsplit('#', 1)[-1]
+        return (f"{self.session_prefix(message_item['userId'], message_item['sessionId'])}"
+                f"{ulid}-{message_item['role']}.txt.gz")
+
+    def session_prefix(self, user_id: str, session_id: str = None) -> str:
+        # クライアントが指定する ID は '/' を含み得るため、区切りとして解釈されないようエンコードする
+        if session_id is None:
+            return f"{self.prefix}/{quote(user_id, safe='')}/"
+        return f"{self.prefix}/{quote(user_id, safe='')}/{quote(session_id, safe='')}/"
+
+    @tracer.traced('HistoryOverflow.put')
+    def put(self, message_item: Dict[str, Any], content: str) -> Optional[str]:
+        """本文を書き出して S3 キーを返す（失敗時は None）
+
+        DynamoDB への保存より先に書き出すため、保存に失敗した場合はオブジェクトだけが残る
+        （バケットのライフサイクルルールで掃除する）。
+        """
+        key = self.object_key(message_item)
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=gzip.compress(content.encode('utf-8'), compresslevel=6),
+                ContentType='text/plain; charset=utf-8',
+                ContentEncoding='gzip'
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to upload overflow content {key}: {str(e)}")
+            return None
+        return key
+
+    def iter_content(self, key: str, chunk_size: int = _READ_CHUNK_BYTES) -> Iterator[str]:
+        """本文をチャンク単位で展開しながら読み出す（全体を圧縮・展開の両方でメモリに載せない）"""
+        response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        body = response['Body']
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                text = decoder.decode(decompressor.decompress(chunk))
+                if text:
+                    yield text
+            text = decoder.decode(decompressor.flush(), final=True)
+            if text:
+                yield text
+        finally:
+            body.close()
+
+    def read_content(self, key: str) -> str:
+        """本文全体を読み出す"""
+        return ''.join(self.iter_content(key))
+
+    def content_url(self, key: str) -> str:
+        """本文を直接取得する署名付き URL（gzip は Content-Encoding によりブラウザが展開する）"""
+        return self.s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=HISTORY_OVERFLOW_URL_EXPIRES_SECONDS
+        )
+
+    def _hydrate_message(self, message: Dict[str, Any]):
+        key = message['contentRef']
+        try:
+            if int(message.get('contentBytes', 0)) > HISTORY_OVERFLOW_INLINE_MAX_BYTES:
+                message['contentUrl'] = self.content_url(key)
+            else:
+                message['content'] = self.read_content(key)
+        except Exception as e:
+            # 読み出せない場合はプレビューのまま返す
+            self.logger.error(f"Failed to read overflow content {key}: {str(e)}")
+            message['truncated'] = True
+
+    @tracer.traced('HistoryOverflow.hydrate')
+    def hydrate(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """S3 に退避した本文をメッセージに戻す（インプレース。退避していないメッセージはそのまま）"""
+        targets = [m for m in messages if m.get('contentRef')]
+        if len(targets) == 1:
+            self._hydrate_message(targets[0])
+        elif targets:
+            with ThreadPoolExecutor(max_workers=min(HISTORY_OVERFLOW_READ_CONCURRENCY, len(targets))) as executor:
+                list(executor.map(self._hydrate_message, targets))
+        return messages
+
+    def _delete_prefix(self, prefix: str) -> bool:
+        success = True
+        token = None
+        while True:
+            kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+            if token:
+                kwargs['ContinuationToken'] = token
+            try:
+                page = self.s3.list_objects_v2(**kwargs)
+            except Exception as e:
+                self.logger.error(f"Failed to list overflow content under {prefix}: {str(e)}")
+                return False
+            for obj in page.get('Contents', []):
+                try:
+                    self.s3.delete_object(Bucket=self.bucket, Key=obj['Key'])
+                except Exception as e:
+                    self.logger.error(f"Failed to delete overflow content {obj['Key']}: {str(e)}")
+                    success = False
+            if not page.get('IsTruncated'):
+                return success
+            token = page.get('NextContinuationToken')
+
+    @tracer.traced('HistoryOverflow.delete_session')
+    def delete_session(self, user_id: str, session_id: str) -> bool:
+        """セッションの退避済み本文を全て削除"""
+        return self._delete_prefix(self.session_prefix(user_id, session_id))
+
+    @tracer.traced('HistoryOverflow.delete_user')
+    def delete_user(self, user_id: str) -> bool:
+        """ユーザーの退避済み本文を全て削除"""
+        return self._delete_prefix(self.session_prefix(user_id))
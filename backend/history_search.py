@@ -0,0 +1,501 @@
+# 履歴の全文検索 - 文字バイグラムの転置インデックス
+#
+# 形態素解析を使わず、正規化した本文の文字バイグラム毎にメッセージのソートキーを記録する。
+# インデックスは履歴テーブルの別パーティション（<userId>#SEARCH）に
+# <バイグラム>#<期間シャード> 単位の String Set として保存し、保存・削除時に差分更新する。
+# 1行に記録するメッセージ数は SEARCH_POSTING_MAX_DOCS までで、超えた分は <バイグラム>#<期間シャード>#<n> の行に続ける。
+# UpdateItem は更新後の項目サイズで課金されるため、行は小さく（既定 50 件 ≒ 4KB）、期間シャードは約9時間単位にし、
+# 1メッセージでインデックスするバイグラムは先頭から SEARCH_INDEX_MAX_BIGRAMS 種類までに抑える。
+# 更新はバイグラム毎の（トランザクションではない）UpdateItem で、同じメッセージを何度追加・削除しても結果は同じ。
+# SEARCH_INDEX_MODE で更新のタイミングを選ぶ:
+#   stream    : 履歴テーブルの DynamoDB Streams から stream_handler で更新（既定。チャット Lambda は書き込まない）
+#   background: 保存・削除後にバックグラウンドのスレッドで更新（開発・検証用。応答後に実行環境が止まると失われる）
+#   python history_search.py --user <userId>    # 既存履歴からインデックスを再構築
+import os
+import re
+import math
+import time
+import heapq
+import argparse
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Tuple, Iterable
+from common import (
+    setup_logger,
+    tracer,
+    message_time,
+    is_conditional_failure,
+    SESSION_KEY_PREFIX
+)
+from history_compression import decode_message
+
+# 検索インデックス設定
+HISTORY_SEARCH_ENABLED = os.environ.get('HISTORY_SEARCH_ENABLED', 'true').lower() == 'true'
+SEARCH_INDEX_PARTITION_SUFFIX = '#SEARCH'
+SEARCH_INDEX_MAX_CHARS = int(os.environ.get('SEARCH_INDEX_MAX_CHARS', '2000'))  # 1メッセージでインデックスする文字数
+SEARCH_INDEX_MAX_BIGRAMS = int(os.environ.get('SEARCH_INDEX_MAX_BIGRAMS', '64'))  # 1メッセージでインデックスするバイグラムの種類数
+SEARCH_MAX_TERMS = 5
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_SNIPPET_CHARS = 40
+
+# インデックスの更新方法（stream / background）
+SEARCH_INDEX_MODE = os.environ.get('SEARCH_INDEX_MODE', 'stream').lower()
+SEARCH_INDEX_MODES = ('background', 'stream')
+# background モードの更新スレッド数
+SEARCH_INDEX_CONCURRENCY = int(os.environ.get('SEARCH_INDEX_CONCURRENCY', '4'))
+# スロットリング等で失敗した UpdateItem の再試行回数
+SEARCH_INDEX_WRITE_RETRIES = int(os.environ.get('SEARCH_INDEX_WRITE_RETRIES', '3'))
+# ポスティング1行あたりのメッセージ数の上限（1件 70〜100 バイトで 1行 4KB 前後 = 更新1回 4WCU 程度）
+SEARCH_POSTING_MAX_DOCS = int(os.environ.get('SEARCH_POSTING_MAX_DOCS', '50'))
+# バイグラム・シャード毎の行数の上限（超えた分はインデックスしない）
+SEARCH_POSTING_MAX_PARTS = int(os.environ.get('SEARCH_POSTING_MAX_PARTS', '20'))
+# 期間シャードに使う ULID の先頭文字数（5文字 ≒ 9.3時間単位）
+_SHARD_ULID_CHARS = 5
+
+# これより長いソートキー（長い sessionId）のメッセージはインデックスしない（行の上限の前提が崩れるため）
+_MAX_DOC_ID_BYTES = 160
+
+_RUN_RE = re.compile(r'\w+')
+
+def normalize_text(text: str) -> str:
+    """検索用の正規化（全角/半角の統一・小文字化）"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+def text_runs(text: str) -> List[str]:
+    """正規化済みテキストを記号・空白で区切った文字列の並び"""
+    return _RUN_RE.findall(text)
+
+def extract_bigrams(text: str) -> set:
+    """本文の文字バイグラム集合（記号・空白をまたがない）"""
+    bigrams = set()
+    for run in text_runs(normalize_text(text)):
+        for i in range(len(run) - 1):
+            bigrams.add(run[i:i + 2])
+    return bigrams
+
+def index_bigrams(text: str) -> List[str]:
+    """インデックスするバイグラム（本文の先頭から出現順に SEARCH_INDEX_MAX_BIGRAMS 種類まで）"""
+    bigrams = {}
+    for run in text_runs(normalize_text((text or '')[:SEARCH_INDEX_MAX_CHARS])):
+        for i in range(len(run) - 1):
+            bigrams.setdefault(run[i:i + 2], None)
+            if len(bigrams) >= SEARCH_INDEX_MAX_BIGRAMS:
+                return list(bigrams)
+    return list(bigrams)
+
+def parse_query(query: str) -> List[List[str]]:
+    """検索語（空白区切り）を語毎の文字列並びに変換（2文字未満の語は除外）"""
+    terms = []
+    for term in normalize_text(query).split():
+        runs = [run for run in text_runs(term) if len(run) >= 2]
+        if runs and runs not in terms:
+            terms.append(runs)
+    if not terms:
+        raise ValueError('検索語は2文字以上で指定してください')
+    return terms[:SEARCH_MAX_TERMS]
+
+def term_bigrams(runs: List[str]) -> set:
+    return {run[i:i + 2] for run in runs for i in range(len(run) - 1)}
+
+def matches_term(normalized_text: str, runs: List[str]) -> bool:
+    """バイグラムの一致だけでなく語として含まれるか（偽陽性の除去）"""
+    return all(run in normalized_text for run in runs)
+
+def recency_key(doc_id: str) -> str:
+    """メッセージのソートキーから時系列順の比較キー（ULID または旧形式の ISO 日時）を取得"""
+    return doc_id.rsplit('#', 1)[-1]
+
+def rank_candidates(term_postings: List[set], top: int = None) -> List[Tuple[str, float]]:
+    """語毎の候補集合から (メッセージキー, スコア) をスコア降順・新しい順に並べる
+
+    スコアは一致した語の重みの合計で、候補の少ない（珍しい）語ほど重い。
+    top を指定した場合は上位 top 件だけを部分ソートで返す。
+    """
+    scores = {}
+    for postings in term_postings:
+        weight = 1.0 / math.log2(2 + len(postings))
+        for doc_id in postings:
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight
+    if top is not None:
+        return heapq.nlargest(top, scores.items(), key=lambda entry: (entry[1], recency_key(entry[0])))
+    ranked = sorted(scores.items(), key=lambda entry: recency_key(entry[0]), reverse=True)
+    ranked.sort(key=lambda entry: entry[1], reverse=True)
+    return ranked
+
+def make_snippet(content: str, runs: Iterable[str]) -> str:
+    """最初に一致した箇所の前後を抜き出す"""
+    normalized = normalize_text(content)
+    # NFKC で長さが変わった場合は先頭から
+    if len(normalized) != len(content):
+        return content[:SEARCH_SNIPPET_CHARS * 2]
+    positions = [normalized.find(run) for run in runs if run in normalized]
+    if not positions:
+        return content[:SEARCH_SNIPPET_CHARS * 2]
+    start = max(0, min(positions) - SEARCH_SNIPPET_CHARS)
+    end = min(len(content), min(positions) + SEARCH_SNIPPET_CHARS)
+    return ('…' if start > 0 else '') + content[start:end] + ('…' if end < len(content) else '')
+
+class BigramIndex:
+    """インメモリのバイグラム転置インデックス（ベンチマーク・ローカル確認用）"""
+
+    def __init__(self):
+        self.postings = {}
+        self.texts = {}
+
+    def add(self, doc_id: str, text: str):
+        self.texts[doc_id] = normalize_text(text)
+        for bigram in extract_bigrams(text):
+            self.postings.setdefault(bigram, set()).add(doc_id)
+
+    def remove(self, doc_id: str):
+        text = self.texts.pop(doc_id, None)
+        if text is None:
+            return
+        for bigram in extract_bigrams(text):
+            postings = self.postings.get(bigram)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self.postings[bigram]
+
+    def candidates(self, runs: List[str]) -> set:
+        """語の全バイグラムを含むメッセージ（短いポスティングから積集合）"""
+        lists = sorted((self.postings.get(bigram, set()) for bigram in term_bigrams(runs)), key=len)
+        if not lists or not lists[0]:
+            return set()
+        result = set(lists[0])
+        for postings in lists[1:]:
+            result &= postings
+            if not result:
+                break
+        return result
+
+    def search(self, query: str, limit: int = SEARCH_DEFAULT_LIMIT, offset: int = 0) -> List[Tuple[str, float]]:
+        terms = parse_query(query)
+        term_postings = []
+        for runs in terms:
+            term_postings.append({doc_id for doc_id in self.candidates(runs)
+                                  if matches_term(self.texts[doc_id], runs)})
+        return rank_candidates(term_postings, offset + limit)[offset:]
+
+class HistorySearchIndex:
+    """DynamoDB 上のバイグラム転置インデックス"""
+
+    def __init__(self, db_helper, history_table: str, mode: str = None):
+        self.db_helper = db_helper
+        self.history_table = history_table
+        self.mode = mode or SEARCH_INDEX_MODE
+        if self.mode not in SEARCH_INDEX_MODES:
+            raise ValueError(f'SEARCH_INDEX_MODE は {SEARCH_INDEX_MODES} のいずれかを指定してください')
+        self.logger = setup_logger('HistorySearchIndex')
+        self._lock = threading.Lock()
+        self._futures = []
+        self._executor = None
+        # 再試行しても更新できなかったメッセージ数（コンテナ内）
+        self.failures = 0
+
+    @staticmethod
+    def index_partition(user_id: str) -> str:
+        return f"{user_id}{SEARCH_INDEX_PARTITION_SUFFIX}"
+
+    @staticmethod
+    def shard_of(doc_id: str) -> str:
+        """ポスティングを分割する期間シャード（ULID 先頭5文字 ≒ 9.3時間単位、旧形式は L）"""
+        if doc_id.startswith(SESSION_KEY_PREFIX):
+            return recency_key(doc_id)[:_SHARD_ULID_CHARS]
+        return 'L'
+
+    @staticmethod
+    def posting_key(bigram: str, shard: str, part: int = 0) -> str:
+        """ポスティング行のソートキー（上限を超えた分は #<n> の行に続ける）"""
+        return f"{bigram}#{shard}" if part == 0 else f"{bigram}#{shard}#{part}"
+
+    def _update_row(self, key: Dict[str, Any], action: str, doc_id: str, condition: str,
+                    values: Dict[str, Any]) -> bool:
+        """ポスティング行を1回更新（条件不成立なら False。それ以外の失敗は再試行して例外を送出）"""
+        for attempt in range(SEARCH_INDEX_WRITE_RETRIES + 1):
+            try:
+                self.db_helper.update_item(
+                    self.history_table, key,
+                    UpdateExpression=f"{action} postings :doc",
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=dict(values, **{':doc': {doc_id}})
+                )
+                return True
+            except Exception as e:
+                if is_conditional_failure(e):
+                    return False
+                if attempt == SEARCH_INDEX_WRITE_RETRIES:
+                    raise
+                time.sleep(min(0.05 * (2 ** attempt), 1.0))
+
+    def _add_posting(self, partition: str, bigram: str, shard: str, doc_id: str):
+        # 上限に達した行は次の行へ（既に含まれていれば何もしない）
+        for part in range(SEARCH_POSTING_MAX_PARTS):
+            if self._update_row(
+                {'userId': partition, 'timestamp': self.posting_key(bigram, shard, part)}, 'ADD', doc_id,
+                'attribute_not_exists(postings) OR size(postings) < :maxDocs OR contains(postings, :docId)',
+                {':maxDocs': SEARCH_POSTING_MAX_DOCS, ':docId': doc_id}
+            ):
+                return
+        raise RuntimeError(f'Posting rows for {bigram}#{shard} are full')
+
+    def _delete_posting(self, partition: str, bigram: str, shard: str, doc_id: str):
+        # 行は空になっても残るため、存在しない行に達したら以降の行もない
+        for part in range(SEARCH_POSTING_MAX_PARTS):
+            if not self._update_row(
+                {'userId': partition, 'timestamp': self.posting_key(bigram, shard, part)}, 'DELETE', doc_id,
+                'attribute_exists(userId)', {}
+            ):
+                return
+
+    def _update_postings(self, item: Dict[str, Any], action: str) -> bool:
+        content = decode_message(dict(item)).get('content', item.get('message', ''))
+        doc_id = item['timestamp']
+        bigrams = index_bigrams(content)
+        if not bigrams:
+            return True
+        if len(doc_id.encode('utf-8')) > _MAX_DOC_ID_BYTES:
+            self.logger.warning(f"Skipped search indexing for a long message key ({len(doc_id)} chars)")
+            return True
+
+        partition = self.index_partition(item['userId'])
+        shard = self.shard_of(doc_id)
+        update = self._add_posting if action == 'ADD' else self._delete_posting
+        failed = 0
+        for bigram in bigrams:
+            try:
+                update(partition, bigram, shard, doc_id)
+            except Exception as e:
+                failed += 1
+                last_error = e
+        if failed:
+            with self._lock:
+                self.failures += 1
+            self.logger.error(f"Failed to update search index ({action}) for {doc_id}: "
+                              f"{failed}/{len(bigrams)} bigrams: {str(last_error)}")
+            return False
+        return True
+
+    @tracer.traced('HistorySearchIndex.index_message')
+    def index_message(self, item: Dict[str, Any]) -> bool:
+        """メッセージをインデックスに追加"""
+        return self._update_postings(item, 'ADD')
+
+    @tracer.traced('HistorySearchIndex.unindex_message')
+    def unindex_message(self, item: Dict[str, Any]) -> bool:
+        """メッセージをインデックスから削除"""
+        return self._update_postings(item, 'DELETE')
+
+    def index_async(self, items: List[Dict[str, Any]]):
+        """保存したメッセージをバックグラウンドでインデックスに追加（stream モードでは何もしない）"""
+        self._submit(self.index_message, items)
+
+    def unindex_async(self, items: List[Dict[str, Any]]):
+        """削除したメッセージをバックグラウンドでインデックスから削除（stream モードでは何もしない）"""
+        self._submit(self.unindex_message, items)
+
+    def _submit(self, func, items: List[Dict[str, Any]]):
+        if self.mode == 'stream' or not items:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=SEARCH_INDEX_CONCURRENCY,
+                                                    thread_name_prefix='search-index')
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.extend(self._executor.submit(func, item) for item in items)
+
+    def wait(self, timeout: float = None) -> bool:
+        """バックグラウンドの更新を待つ（再構築・ベンチマーク用。未完了が残れば False）"""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        if not futures:
+            return True
+        _, pending = wait(futures, timeout=timeout)
+        return not pending
+
+    def handle_stream_records(self, records: List[Dict[str, Any]]) -> List[str]:
+        """DynamoDB Streams のレコードでインデックスを更新し、失敗したレコードのシーケンス番号を返す
+
+        追加（INSERT）は NewImage、削除（REMOVE）は OldImage のメッセージ行だけを対象にする
+        （ストリームのビュータイプは NEW_AND_OLD_IMAGES）。
+        """
+        codec = self.db_helper.get_codec(self.history_table)
+        failed = []
+        for record in records:
+            event_name = record.get('eventName')
+            change = record.get('dynamodb') or {}
+            image = change.get('NewImage') if event_name == 'INSERT' else change.get('OldImage')
+            if event_name not in ('INSERT', 'REMOVE') or not image:
+                continue
+            item = codec.decode(image)
+            if 'role' not in item or not item.get('sessionId') or item['userId'].endswith(SEARCH_INDEX_PARTITION_SUFFIX):
+                continue
+            ok = self.index_message(item) if event_name == 'INSERT' else self.unindex_message(item)
+            if not ok:
+                failed.append(change.get('SequenceNumber'))
+        return failed
+
+    def delete_user(self, user_id: str) -> bool:
+        """ユーザーのインデックスを全て削除"""
+        partition = self.index_partition(user_id)
+        success = True
+        start_key = None
+        while True:
+            kwargs = {
+                'KeyConditionExpression': 'userId = :userId',
+                'ExpressionAttributeValues': {':userId': partition},
+                'ProjectionExpression': 'userId, #ts',
+                'ExpressionAttributeNames': {'#ts': 'timestamp'}
+            }
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+            if page is None:
+                return False
+            rows, start_key = page
+            for row in rows:
+                if not self.db_helper.safe_delete_item(
+                    self.history_table,
+                    {'userId': partition, 'timestamp': row['timestamp']}
+                ):
+                    success = False
+            if not start_key:
+                return success
+
+    def _postings(self, user_id: str, bigram: str, cache: Dict[str, set]) -> set:
+        """バイグラムのポスティング（全シャード分）"""
+        if bigram in cache:
+            return cache[bigram]
+        kwargs = {
+            'KeyConditionExpression': 'userId = :userId AND begins_with(#ts, :prefix)',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'ExpressionAttributeValues': {':userId': self.index_partition(user_id), ':prefix': f"{bigram}#"}
+        }
+        postings = set()
+        start_key = None
+        while True:
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+            if page is None:
+                raise RuntimeError(f'Failed to read search index for {bigram}')
+            rows, start_key = page
+            for row in rows:
+                postings.update(row.get('postings') or ())
+            if not start_key:
+                break
+        cache[bigram] = postings
+        return postings
+
+    def _term_candidates(self, user_id: str, runs: List[str], cache: Dict[str, set]) -> set:
+        result = None
+        # 見つからないバイグラムがあれば残りは読まない
+        for bigram in sorted(term_bigrams(runs)):
+            postings = self._postings(user_id, bigram, cache)
+            result = set(postings) if result is None else result & postings
+            if not result:
+                return set()
+        return result or set()
+
+    @tracer.traced('HistorySearchIndex.search')
+    def search(self, user_id: str, query: str, limit: int = SEARCH_DEFAULT_LIMIT,
+               cursor: str = None) -> Dict[str, Any]:
+        """検索してスコア順の結果ページと次ページのカーソルを返す
+
+        インデックスの候補はバイグラム単位の一致のため、本文を取得して語として含むかを確認する。
+        """
+        terms = parse_query(query)
+        try:
+            limit = max(1, min(int(limit or SEARCH_DEFAULT_LIMIT), SEARCH_MAX_LIMIT))
+            offset = max(0, int(cursor)) if cursor else 0
+        except (TypeError, ValueError):
+            raise ValueError('limit または cursor が不正です')
+
+        cache = {}
+        term_postings = [self._term_candidates(user_id, runs, cache) for runs in terms]
+        ranked = rank_candidates(term_postings)
+
+        results = []
+        position = offset
+        while position < len(ranked) and len(results) < limit:
+            batch = ranked[position:position + limit * 2]
+            items = self.db_helper.safe_batch_get_items(
+                self.history_table,
+                [{'userId': user_id, 'timestamp': doc_id} for doc_id, _ in batch]
+            )
+            if items is None:
+                raise RuntimeError('Failed to fetch search results')
+            found = {item['timestamp']: decode_message(item) for item in items}
+
+            for doc_id, score in batch:
+                position += 1
+                item = found.get(doc_id)
+                # アーカイブ済み・削除済みのメッセージはスキップ
+                if item is None:
+                    continue
+                content = item.get('content', item.get('message', ''))
+                normalized = normalize_text(content)
+                matched = [runs for runs in terms if matches_term(normalized, runs)]
+                if not matched:
+                    continue
+                results.append({
+                    'sessionId': item.get('sessionId'),
+                    'messageId': item.get('messageId'),
+                    'role': item.get('role'),
+                    'snippet': make_snippet(content, [run for runs in matched for run in runs]),
+                    'timestamp': message_time(item),
+                    'score': round(score, 4)
+                })
+                if len(results) >= limit:
+                    break
+
+        return {
+            'results': results,
+            'candidateCount': len(ranked),
+            'nextCursor': str(position) if position < len(ranked) else None
+        }
+
+    def rebuild_user(self, user_id: str, history_helper) -> Dict[str, int]:
+        """既存の履歴からユーザーのインデックスを作り直す（同期的に更新）"""
+        stats = {'indexed': 0, 'failed': 0}
+        self.delete_user(user_id)
+        for items, _ in history_helper.iter_user_history(user_id):
+            for item in items:
+                if 'role' not in item or not item.get('sessionId'):
+                    continue
+                if self.index_message(item):
+                    stats['indexed'] += 1
+                else:
+                    stats['failed'] += 1
+        return stats
+
+_stream_index = None
+
+def stream_handler(event, context):
+    """履歴テーブルの DynamoDB Streams から検索インデックスを更新する Lambda ハンドラ
+
+    失敗したレコードは batchItemFailures で返して再試行させる（イベントソースマッピングで
+    ReportBatchItemFailures を有効にすること）。更新は冪等のため再試行で重複しない。
+    """
+    global _stream_index
+    if _stream_index is None:
+        from common import create_database_helper, HISTORY_TABLE
+        _stream_index = HistorySearchIndex(create_database_helper(), HISTORY_TABLE, mode='stream')
+    failed = _stream_index.handle_stream_records(event.get('Records') or [])
+    return {'batchItemFailures': [{'itemIdentifier': sequence} for sequence in failed]}
+
+if __name__ == "__main__":
+    from common import HistoryHelper, create_database_helper, HISTORY_TABLE
+
+    parser = argparse.ArgumentParser(description='履歴検索インデックスの再構築')
+    parser.add_argument('--user', required=True, help='対象ユーザーID')
+    parser.add_argument('--table', default=HISTORY_TABLE)
+    args = parser.parse_args()
+
+    db_helper = create_database_helper()
+    index = HistorySearchIndex(db_helper, args.table)
+    result = index.rebuild_user(args.user, HistoryHelper(db_helper, args.table))
+    setup_logger(__name__).info(f"Rebuild finished: {result}")
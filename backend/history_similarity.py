@@ -0,0 +1,449 @@
+# 類似会話検索 - ハッシュ埋め込みのコサイン類似度による top-k 検索
+#
+# 各メッセージの embedding 属性（hashed_embedding.py の int8 ベクトル）を、ユーザー単位で
+# 1つの行列（VectorMatrix）に詰めてコンテナ内にキャッシュし、NumPy で一括計算する。
+# 検索時にメッセージ行を全件読まないよう、保存時に埋め込みだけを <userId>#EMBED パーティションの
+# 小さなチャンク行（CHUNK#<n>）へ追記しておき、コンテナのキャッシュがない場合はチャンク行だけを読む。
+#   python history_similarity.py --user <userId>    # embedding のない既存メッセージを補完
+import os
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from common import (
+    setup_logger,
+    tracer,
+    message_time,
+    new_ulid,
+    is_conditional_failure,
+    SESSION_KEY_PREFIX
+)
+from history_compression import decode_message
+from hashed_embedding import VectorMatrix, embed_text, embed_bytes, EMBEDDING_DIM
+
+# 類似検索設定
+SIMILARITY_SEARCH_ENABLED = os.environ.get('SIMILARITY_SEARCH_ENABLED', 'true').lower() == 'true'
+SIMILARITY_CACHE_USERS = int(os.environ.get('SIMILARITY_CACHE_USERS', '16'))
+SIMILARITY_CACHE_TTL_SECONDS = float(os.environ.get('SIMILARITY_CACHE_TTL_SECONDS', '300'))
+SIMILARITY_DEFAULT_K = 5
+SIMILARITY_MAX_K = 50
+SIMILARITY_SNIPPET_CHARS = 80
+
+# 埋め込みチャンク行の設定（1行 = EMBED_CHUNK_MAX_VECTORS 件。UpdateItem は更新後の項目サイズで
+# 課金されるため小さく保つ。既定 256 次元で約 12KB）
+EMBED_PARTITION_SUFFIX = '#EMBED'
+EMBED_CHUNK_KEY_PREFIX = 'CHUNK#'
+EMBED_DELETED_KEY_PREFIX = 'DELETED#'
+EMBED_CHUNK_MAX_VECTORS = int(os.environ.get('EMBED_CHUNK_MAX_VECTORS', '32'))
+EMBED_WRITE_RETRIES = int(os.environ.get('EMBED_WRITE_RETRIES', '3'))
+
+def _binary(value) -> bytes:
+    """boto3 の Binary 型を bytes に"""
+    return bytes(value.value) if hasattr(value, 'value') else bytes(value)
+
+class UserVectors:
+    """1ユーザー分の埋め込み行列とメッセージのメタデータ"""
+
+    def __init__(self, ids: List[str], sessions: List[str], roles: List[str], rows: List[bytes]):
+        self.matrix = VectorMatrix(ids, rows)
+        self.sessions = sessions
+        self.roles = roles
+        self.loaded_at = time.monotonic()
+
+    def rows_of_session(self, session_id: str, role: str = None) -> List[int]:
+        return [i for i, sid in enumerate(self.sessions)
+                if sid == session_id and (role is None or self.roles[i] == role)]
+
+class EmbeddingChunks:
+    """ユーザー単位の埋め込みチャンク行（<userId>#EMBED パーティションの CHUNK#<n>）
+
+    各行は ids / sessions / roles / vectors の並列リストで、保存したメッセージを保存と同じ
+    リクエスト内で list_append により追記する（上限に達した行は次の行へ）。CHUNK#00000 の complete 属性は、
+    既存メッセージの取り込みが済んでいることを表す（未設定なら読み出し側がメッセージ行を1度だけ走査して補う）。
+    追記に失敗した場合は complete を外し、次の読み込みで走査し直す。
+    削除したセッションは DELETED#<sessionId> 行に削除時点の ULID を記録し、それ以前のベクトルを読み飛ばす。
+    """
+
+    def __init__(self, db_helper, history_table: str):
+        self.db_helper = db_helper
+        self.history_table = history_table
+        self.logger = setup_logger('EmbeddingChunks')
+        self._lock = threading.Lock()
+        # ユーザー毎の追記先チャンク番号（コンテナ内）
+        self._parts = OrderedDict()
+
+    @staticmethod
+    def partition(user_id: str) -> str:
+        return f"{user_id}{EMBED_PARTITION_SUFFIX}"
+
+    @staticmethod
+    def chunk_key(part: int) -> str:
+        return f"{EMBED_CHUNK_KEY_PREFIX}{part:05d}"
+
+    @staticmethod
+    def deleted_key(session_id: str) -> str:
+        return f"{EMBED_DELETED_KEY_PREFIX}{session_id}"
+
+    def _last_part(self, user_id: str) -> int:
+        """追記先のチャンク番号（コンテナ内で不明なら最後の行を1件だけ読む）"""
+        with self._lock:
+            part = self._parts.get(user_id)
+        if part is not None:
+            return part
+        page = self.db_helper.safe_query_page(
+            self.history_table,
+            KeyConditionExpression='userId = :userId AND begins_with(#ts, :prefix)',
+            ProjectionExpression='#ts',
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={':userId': self.partition(user_id), ':prefix': EMBED_CHUNK_KEY_PREFIX},
+            ScanIndexForward=False,
+            Limit=1
+        )
+        items = page[0] if page else []
+        return int(items[0]['timestamp'][len(EMBED_CHUNK_KEY_PREFIX):]) if items else 0
+
+    def _remember_part(self, user_id: str, part: int):
+        with self._lock:
+            self._parts[user_id] = part
+            self._parts.move_to_end(user_id)
+            while len(self._parts) > 1000:
+                self._parts.popitem(last=False)
+
+    def append(self, user_id: str, entries: List[tuple]) -> bool:
+        """(doc_id, sessionId, role, embedding) の一覧をチャンク行に追記
+
+        再試行で同じメッセージが重複して追記されることがあるため、読み出し側で doc_id により重複を除く。
+        """
+        part = self._last_part(user_id)
+        for start in range(0, len(entries), EMBED_CHUNK_MAX_VECTORS):
+            batch = entries[start:start + EMBED_CHUNK_MAX_VECTORS]
+            values = {
+                ':ids': [e[0] for e in batch],
+                ':sessions': [e[1] for e in batch],
+                ':roles': [e[2] for e in batch],
+                ':vectors': [e[3] for e in batch],
+                ':empty': [],
+                # 追記後も上限を超えない行にだけ書く
+                ':room': EMBED_CHUNK_MAX_VECTORS - len(batch)
+            }
+            while not self._append_row(user_id, part, values):
+                part += 1
+        self._remember_part(user_id, part)
+        return True
+
+    def _append_row(self, user_id: str, part: int, values: Dict[str, Any]) -> bool:
+        """1行に追記（行に空きがなければ False。それ以外の失敗は再試行して例外を送出）"""
+        for attempt in range(EMBED_WRITE_RETRIES + 1):
+            try:
+                self.db_helper.update_item(
+                    self.history_table,
+                    {'userId': self.partition(user_id), 'timestamp': self.chunk_key(part)},
+                    UpdateExpression=(
+                        'SET ids = list_append(if_not_exists(ids, :empty), :ids), '
+                        'sessions = list_append(if_not_exists(sessions, :empty), :sessions), '
+                        'roles = list_append(if_not_exists(roles, :empty), :roles), '
+                        'vectors = list_append(if_not_exists(vectors, :empty), :vectors)'
+                    ),
+                    ConditionExpression='attribute_not_exists(ids) OR size(ids) <= :room',
+                    ExpressionAttributeValues=values
+                )
+                return True
+            except Exception as e:
+                if is_conditional_failure(e):
+                    return False
+                if attempt == EMBED_WRITE_RETRIES:
+                    raise
+                time.sleep(min(0.05 * (2 ** attempt), 1.0))
+
+    @tracer.traced('EmbeddingChunks.append_messages')
+    def append_messages(self, message_items: List[Dict[str, Any]]) -> bool:
+        """保存したメッセージの埋め込みを追記（失敗時は complete を外して False。保存の成否には影響しない）"""
+        entries = [(m['timestamp'], m.get('sessionId'), m.get('role'), m['embedding'])
+                   for m in message_items if m.get('embedding')]
+        if not entries:
+            return True
+        user_id = message_items[0]['userId']
+        try:
+            return self.append(user_id, entries)
+        except Exception as e:
+            self.logger.error(f"Failed to append embeddings: {str(e)}")
+            # 追記できなかったメッセージは次の読み込み時の走査で取り込む
+            if not self.mark_complete(user_id, False):
+                self.logger.error(f"Failed to mark embedding chunks incomplete for {user_id}")
+            return False
+
+    def forget_session(self, user_id: str, session_id: str) -> bool:
+        """削除したセッションのベクトルをこれ以降読み飛ばす（同じセッションに後から保存した分は読む）"""
+        return self.db_helper.safe_put_item(self.history_table, {
+            'userId': self.partition(user_id),
+            'timestamp': self.deleted_key(session_id),
+            'before': new_ulid()
+        })
+
+    def mark_complete(self, user_id: str, complete: bool = True) -> bool:
+        """既存メッセージの取り込み済みフラグを設定・解除"""
+        key = {'userId': self.partition(user_id), 'timestamp': self.chunk_key(0)}
+        if complete:
+            result = self.db_helper.safe_update_item(
+                self.history_table, key,
+                UpdateExpression='SET complete = :true',
+                ExpressionAttributeValues={':true': True}
+            )
+        else:
+            result = self.db_helper.safe_update_item(self.history_table, key, UpdateExpression='REMOVE complete')
+        return result is not None
+
+    @tracer.traced('EmbeddingChunks.read')
+    def read(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """チャンク行を読み、削除済みセッション・重複を除いたベクトルを返す（失敗時 None）
+
+        戻り値は {'entries': {doc_id: (sessionId, role, embedding)}, 'complete': bool, 'deleted': {sessionId: ULID}}。
+        """
+        entries, deleted, complete = OrderedDict(), {}, False
+        start_key = None
+        while True:
+            kwargs = {
+                'KeyConditionExpression': 'userId = :userId',
+                'ExpressionAttributeValues': {':userId': self.partition(user_id)}
+            }
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+            if page is None:
+                return None
+            items, start_key = page
+            for item in items:
+                if item['timestamp'].startswith(EMBED_DELETED_KEY_PREFIX):
+                    deleted[item['timestamp'][len(EMBED_DELETED_KEY_PREFIX):]] = item.get('before', '')
+                    continue
+                if item['timestamp'] == self.chunk_key(0):
+                    complete = bool(item.get('complete'))
+                rows = zip(item.get('ids', []), item.get('sessions', []),
+                           item.get('roles', []), item.get('vectors', []))
+                for doc_id, session_id, role, vector in rows:
+                    entries[doc_id] = (session_id, role, _binary(vector))
+            if not start_key:
+                break
+        # 削除時点より前に保存されたベクトルを除く（ソートキー末尾の ULID で比較）
+        if deleted:
+            for doc_id in [d for d, (sid, _, _) in entries.items()
+                           if sid in deleted and d.rsplit('#', 1)[-1] < deleted[sid]]:
+                del entries[doc_id]
+        return {'entries': entries, 'complete': complete, 'deleted': deleted}
+
+    def delete_user(self, user_id: str) -> bool:
+        """ユーザーのチャンク行を全て削除"""
+        partition = self.partition(user_id)
+        with self._lock:
+            self._parts.pop(user_id, None)
+        success = True
+        start_key = None
+        while True:
+            kwargs = {
+                'KeyConditionExpression': 'userId = :userId',
+                'ExpressionAttributeValues': {':userId': partition},
+                'ProjectionExpression': 'userId, #ts',
+                'ExpressionAttributeNames': {'#ts': 'timestamp'}
+            }
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+            if page is None:
+                return False
+            rows, start_key = page
+            for row in rows:
+                if not self.db_helper.safe_delete_item(
+                    self.history_table,
+                    {'userId': partition, 'timestamp': row['timestamp']}
+                ):
+                    success = False
+            if not start_key:
+                return success
+
+class SimilaritySearch:
+    """類似メッセージ・類似セッションの検索"""
+
+    def __init__(self, history_helper):
+        self.history_helper = history_helper
+        self.db_helper = history_helper.db_helper
+        self.history_table = history_helper.history_table
+        self.chunks = history_helper.embeddings or EmbeddingChunks(self.db_helper, self.history_table)
+        self.logger = setup_logger('SimilaritySearch')
+        self._cache = OrderedDict()
+
+    @tracer.traced('SimilaritySearch.load_user')
+    def load_user(self, user_id: str) -> UserVectors:
+        """ユーザーの埋め込み行列を取得（TTL 付きでコンテナ内にキャッシュ）"""
+        cached = self._cache.get(user_id)
+        if cached is not None and time.monotonic() - cached.loaded_at < SIMILARITY_CACHE_TTL_SECONDS:
+            self._cache.move_to_end(user_id)
+            return cached
+
+        chunks = self.chunks.read(user_id)
+        if chunks is None:
+            raise RuntimeError(f'Failed to load embeddings for user {user_id}')
+        entries = chunks['entries']
+        if not chunks['complete']:
+            # 既存メッセージをまだ取り込んでいないユーザーは、メッセージ行を1度だけ走査してチャンク行を補う
+            missing = [e for e in self._scan_messages(user_id)
+                       if e[0] not in entries and chunks['deleted'].get(e[1], '') <= e[0].rsplit('#', 1)[-1]]
+            try:
+                if self.chunks.append(user_id, missing):
+                    self.chunks.mark_complete(user_id)
+            except Exception as e:
+                # 取り込めなかった場合も今回の検索は走査結果で行う（次回のコールドスタートで再試行）
+                self.logger.warning(f"Failed to build embedding chunks for {user_id}: {str(e)}")
+            for doc_id, session_id, role, row in missing:
+                entries[doc_id] = (session_id, role, row)
+
+        ids, sessions, roles, rows = [], [], [], []
+        for doc_id, (session_id, role, row) in entries.items():
+            if len(row) != EMBEDDING_DIM:
+                continue
+            ids.append(doc_id)
+            sessions.append(session_id)
+            roles.append(role)
+            rows.append(row)
+        vectors = UserVectors(ids, sessions, roles, rows)
+        self._cache[user_id] = vectors
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > SIMILARITY_CACHE_USERS:
+            self._cache.popitem(last=False)
+        return vectors
+
+    def _scan_messages(self, user_id: str) -> List[tuple]:
+        """メッセージ行から埋め込みを読む（チャンク行の初回構築用）"""
+        entries = []
+        start_key = None
+        while True:
+            # 埋め込みとキーだけを射影して読む（本文は読まない）
+            kwargs = {
+                'KeyConditionExpression': 'userId = :userId AND begins_with(#ts, :prefix)',
+                'FilterExpression': 'attribute_exists(embedding)',
+                'ProjectionExpression': '#ts, sessionId, #role, embedding',
+                'ExpressionAttributeNames': {'#ts': 'timestamp', '#role': 'role'},
+                'ExpressionAttributeValues': {':userId': user_id, ':prefix': SESSION_KEY_PREFIX}
+            }
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            page = self.db_helper.safe_query_page(self.history_table, **kwargs)
+            if page is None:
+                raise RuntimeError(f'Failed to load embeddings for user {user_id}')
+            items, start_key = page
+            for item in items:
+                row = _binary(item['embedding'])
+                if len(row) == EMBEDDING_DIM:
+                    entries.append((item['timestamp'], item.get('sessionId'), item.get('role'), row))
+            if not start_key:
+                break
+        return entries
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id, None)
+
+    def _fetch(self, user_id: str, doc_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """表示用に本文を取得"""
+        items = self.db_helper.safe_batch_get_items(
+            self.history_table,
+            [{'userId': user_id, 'timestamp': doc_id} for doc_id in doc_ids]
+        )
+        if items is None:
+            raise RuntimeError('Failed to fetch similar messages')
+        return {item['timestamp']: decode_message(item) for item in items}
+
+    @staticmethod
+    def _describe(item: Optional[Dict[str, Any]], score: float) -> Dict[str, Any]:
+        item = item or {}
+        content = item.get('content', item.get('message', ''))
+        return {
+            'sessionId': item.get('sessionId'),
+            'messageId': item.get('messageId'),
+            'role': item.get('role'),
+            'snippet': content[:SIMILARITY_SNIPPET_CHARS],
+            'timestamp': message_time(item),
+            'score': round(score, 4)
+        }
+
+    @tracer.traced('SimilaritySearch.similar_messages')
+    def similar_messages(self, user_id: str, text: str, k: int = SIMILARITY_DEFAULT_K) -> List[Dict[str, Any]]:
+        """テキストに似たメッセージ上位 k 件"""
+        if not embed_bytes(text):
+            raise ValueError('検索テキストが短すぎます')
+        vectors = self.load_user(user_id)
+        top = vectors.matrix.top_k(embed_text(text), k)
+        found = self._fetch(user_id, [doc_id for doc_id, _ in top])
+        return [self._describe(found.get(doc_id), score) for doc_id, score in top if doc_id in found]
+
+    @tracer.traced('SimilaritySearch.similar_sessions')
+    def similar_sessions(self, user_id: str, session_id: str, k: int = SIMILARITY_DEFAULT_K) -> List[Dict[str, Any]]:
+        """セッション（ユーザー発言の平均ベクトル）に似た他のセッション上位 k 件
+
+        AI の応答は定型表現が多くどのセッションとも似てしまうため、ユーザー発言同士で比較する。
+        セッション毎のスコアは最も似ているメッセージの類似度。
+        """
+        vectors = self.load_user(user_id)
+        own_rows = vectors.rows_of_session(session_id, 'user') or vectors.rows_of_session(session_id)
+        if not own_rows:
+            return []
+        ids = vectors.matrix.ids
+        exclude = {ids[i] for i in vectors.rows_of_session(session_id)}
+        exclude.update(ids[i] for i, role in enumerate(vectors.roles) if role == 'assistant')
+        query = vectors.matrix.mean_vector(own_rows)
+
+        # 同じセッションのメッセージが上位を占めることがあるため多めに取得して集約
+        best = OrderedDict()
+        for doc_id, score in vectors.matrix.top_k(query, k * 10, exclude=exclude):
+            sid = doc_id[len(SESSION_KEY_PREFIX):].rsplit('#', 1)[0]
+            if sid not in best:
+                best[sid] = (doc_id, score)
+                if len(best) >= k:
+                    break
+
+        found = self._fetch(user_id, [doc_id for doc_id, _ in best.values()])
+        results = []
+        for sid, (doc_id, score) in best.items():
+            if doc_id not in found:
+                continue
+            result = self._describe(found[doc_id], score)
+            result['sessionId'] = sid
+            results.append(result)
+        return results
+
+    def backfill_user(self, user_id: str) -> Dict[str, int]:
+        """embedding のない既存メッセージに埋め込みを追加"""
+        stats = {'updated': 0, 'skipped': 0, 'failed': 0}
+        for items, _ in self.history_helper.iter_user_history(user_id):
+            for item in items:
+                if 'role' not in item or 'embedding' in item or not item.get('sessionId'):
+                    stats['skipped'] += 1
+                    continue
+                embedding = embed_bytes(item.get('content', item.get('message', '')))
+                if not embedding:
+                    stats['skipped'] += 1
+                    continue
+                updated = self.db_helper.safe_update_item(
+                    self.history_table,
+                    {'userId': user_id, 'timestamp': item['timestamp']},
+                    UpdateExpression='SET embedding = :embedding',
+                    ConditionExpression='attribute_exists(#ts)',
+                    ExpressionAttributeNames={'#ts': 'timestamp'},
+                    ExpressionAttributeValues={':embedding': embedding}
+                )
+                stats['updated' if updated is not None else 'failed'] += 1
+        # 補完した埋め込みは次回の読み込みでチャンク行に取り込む
+        self.chunks.mark_complete(user_id, False)
+        self.invalidate(user_id)
+        return stats
+
+if __name__ == "__main__":
+    from common import HistoryHelper, create_database_helper, HISTORY_TABLE
+
+    parser = argparse.ArgumentParser(description='既存メッセージのハッシュ埋め込みを補完')
+    parser.add_argument('--user', required=True, help='対象ユーザーID')
+    parser.add_argument('--table', default=HISTORY_TABLE)
+    args = parser.parse_args()
+
+    search = SimilaritySearch(HistoryHelper(create_database_helper(), args.table))
+    result = search.backfill_user(args.user)
+    setup_logger(__name__).info(f"Backfill finished: {result}")
@@ -0,0 +1,202 @@
+# POST /chat の冪等性 - Idempotency-Key ヘッダー付きの再送で Agent 呼び出しと履歴保存を重複させない
+#
+# キーは履歴テーブルの IDEMPOTENCY#<key> 行（ユーザー毎のパーティション）に条件付き Put で確保する。
+#   IN_PROGRESS : 最初のリクエストが処理中（leaseExpiresAt を過ぎたら放棄されたものとして引き継ぐ）
+#   COMPLETED   : 成功レスポンスを保存済み（同じキーの再送にはそのまま返す）
+# 処理中の重複リクエストは完了まで待って同じレスポンスを返し、失敗時は行を削除して再送を受け付ける。
+# 行は expiresAt（エポック秒）で DynamoDB TTL により削除される（削除までの間は読み出し時に期限切れとして扱う）。
+import os
+import re
+import json
+import time
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable
+
+from common import (
+    setup_logger,
+    tracer,
+    ResponseBuilder,
+    is_conditional_failure,
+    IDEMPOTENCY_KEY_PREFIX
+)
+
+# 冪等性設定
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+# 処理中の行を放棄されたとみなすまでの秒数（Lambda のタイムアウトより長くする）
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '120'))
+# 処理中の重複リクエストが完了を待つ最大秒数とポーリング間隔
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '25'))
+IDEMPOTENCY_POLL_INTERVAL_MS = int(os.environ.get('IDEMPOTENCY_POLL_INTERVAL_MS', '250'))
+# Lambda の残り時間がこれを下回ったら待機を打ち切る
+IDEMPOTENCY_TIME_MARGIN_MS = int(os.environ.get('IDEMPOTENCY_TIME_MARGIN_MS', '2000'))
+
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_\-:.]{1,128}$')
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+
+# 再送に保存済みのレスポンスを返したことを示すヘッダー
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+def validate_idempotency_key(key: str) -> str:
+    """Idempotency-Key を検証（不正な場合は ValueError）"""
+    key = key.strip()
+    if not IDEMPOTENCY_KEY_PATTERN.match(key):
+        raise ValueError('Idempotency-Key は128文字以内の英数字と _-:. で指定してください')
+    return key
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """同じキーで異なるリクエストが送られたことを検出するためのハッシュ"""
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def idempotency_key(key: str) -> str:
+    """冪等性レコード行のソートキー"""
+    return f"{IDEMPOTENCY_KEY_PREFIX}{key}"
+
+class IdempotencyStore:
+    """冪等性レコード（履歴テーブルの IDEMPOTENCY#<key> 行）の確保・完了・解放"""
+
+    def __init__(self, db_helper, table_name: str):
+        self.db_helper = db_helper
+        self.table_name = table_name
+        self.logger = setup_logger('IdempotencyStore')
+
+    @staticmethod
+    def _key(user_id: str, key: str) -> Dict[str, Any]:
+        return {'userId': user_id, 'timestamp': idempotency_key(key)}
+
+    @tracer.traced('IdempotencyStore.claim')
+    def claim(self, user_id: str, key: str, request_hash: str) -> Optional[Dict[str, Any]]:
+        """キーを確保（確保できたら None、既存の有効なレコードがあればそれを返す）
+
+        期限切れの行と、リースが切れた処理中の行は上書きして確保する。
+        """
+        now = int(time.time())
+        item = dict(self._key(user_id, key), **{
+            'status': STATUS_IN_PROGRESS,
+            'requestHash': request_hash,
+            'createdAt': datetime.utcnow().isoformat(),
+            'expiresAt': now + IDEMPOTENCY_TTL_SECONDS,
+            'leaseExpiresAt': now + IDEMPOTENCY_LEASE_SECONDS
+        })
+        try:
+            self.db_helper.put_item(
+                self.table_name, item,
+                ConditionExpression=('attribute_not_exists(#ts) OR expiresAt < :now OR '
+                                     '(#status = :inProgress AND leaseExpiresAt < :now)'),
+                ExpressionAttributeNames={'#ts': 'timestamp', '#status': 'status'},
+                ExpressionAttributeValues={':now': now, ':inProgress': STATUS_IN_PROGRESS}
+            )
+            return None
+        except Exception as e:
+            if not is_conditional_failure(e):
+                raise
+        record = self.get(user_id, key)
+        if record is None:
+            # 条件判定の後に解放・期限切れになった場合はもう一度確保する
+            return self.claim(user_id, key, request_hash)
+        return record
+
+    def get(self, user_id: str, key: str) -> Optional[Dict[str, Any]]:
+        """有効なレコードを取得（存在しない・期限切れの場合は None）"""
+        record = self.db_helper.safe_get_item(self.table_name, self._key(user_id, key), consistent_read=True)
+        if record is None or int(record.get('expiresAt', 0)) < time.time():
+            return None
+        return record
+
+    @tracer.traced('IdempotencyStore.complete')
+    def complete(self, user_id: str, key: str, response: Dict[str, Any]) -> bool:
+        """成功レスポンスを保存して COMPLETED にする"""
+        result = self.db_helper.safe_update_item(
+            self.table_name, self._key(user_id, key),
+            UpdateExpression='SET #status = :completed, #response = :response, expiresAt = :expiresAt',
+            ExpressionAttributeNames={'#status': 'status', '#response': 'response'},
+            ExpressionAttributeValues={
+                ':completed': STATUS_COMPLETED,
+                ':response': json.dumps(response, ensure_ascii=False),
+                ':expiresAt': int(time.time()) + IDEMPOTENCY_TTL_SECONDS
+            }
+        )
+        return result is not None
+
+    def release(self, user_id: str, key: str) -> bool:
+        """処理に失敗したキーを解放（同じキーの再送を新しいリクエストとして受け付ける）"""
+        return self.db_helper.safe_delete_item(self.table_name, self._key(user_id, key))
+
+    @tracer.traced('IdempotencyStore.wait')
+    def wait(self, user_id: str, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """処理中のレコードが完了・解放されるまで待つ（タイムアウト時は処理中のレコードを返す）"""
+        deadline = time.monotonic() + timeout
+        interval = IDEMPOTENCY_POLL_INTERVAL_MS / 1000
+        record = None
+        while True:
+            record = self.get(user_id, key)
+            if record is None or record.get('status') != STATUS_IN_PROGRESS:
+                return record
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return record
+            time.sleep(min(interval, remaining))
+
+def replay_response(record: Dict[str, Any]) -> Dict[str, Any]:
+    """保存済みのレスポンスを再送用に復元"""
+    response = json.loads(record['response'])
+    headers = dict(response.get('headers') or ResponseBuilder.cors_headers())
+    headers[REPLAYED_HEADER] = 'true'
+    headers['Access-Control-Expose-Headers'] = REPLAYED_HEADER
+    response['headers'] = headers
+    return response
+
+def run_idempotent(store: IdempotencyStore, user_id: str, key: str, request_hash: str,
+                   process: Callable[[], Dict[str, Any]], context=None) -> Dict[str, Any]:
+    """Idempotency-Key 付きリクエストを1回だけ処理
+
+    最初のリクエストは process() を実行し、2xx のレスポンスを保存する（それ以外はキーを解放）。
+    同じキーの再送は保存済みのレスポンスを返し、処理中であれば完了を待つ。
+    リクエスト内容が異なる場合は 422、待機がタイムアウトした場合は 409 を返す。
+    """
+    logger = store.logger
+    while True:
+        try:
+            record = store.claim(user_id, key, request_hash)
+        except Exception as e:
+            # 冪等性レコードを確保できない場合も通常どおり処理する（重複防止より可用性を優先）
+            logger.error(f"Failed to claim idempotency key: {str(e)}")
+            return process()
+
+        if record is None:
+            break
+        if record.get('requestHash') != request_hash:
+            return ResponseBuilder.error('同じ Idempotency-Key で異なるリクエストが送信されました', 422)
+        if record.get('status') == STATUS_COMPLETED:
+            logger.info(f"Replaying stored response for idempotency key {key}")
+            return replay_response(record)
+
+        # 処理中: 完了まで待つ（Lambda の残り時間を超えない範囲で）
+        timeout = IDEMPOTENCY_WAIT_SECONDS
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            timeout = min(timeout, (context.get_remaining_time_in_millis() - IDEMPOTENCY_TIME_MARGIN_MS) / 1000)
+        record = store.wait(user_id, key, max(0.0, timeout))
+        if record is not None and record.get('status') == STATUS_COMPLETED:
+            logger.info(f"Reusing in-flight result for idempotency key {key}")
+            return replay_response(record)
+        if record is not None:
+            response = ResponseBuilder.error('同じ Idempotency-Key のリクエストを処理中です', 409)
+            response['headers'] = dict(response['headers'], **{'Retry-After': '1'})
+            return response
+        # 最初のリクエストが失敗してキーが解放された: このリクエストで処理する
+
+    try:
+        response = process()
+    except Exception:
+        store.release(user_id, key)
+        raise
+    if 200 <= int(response.get('statusCode', 500)) < 300:
+        if not store.complete(user_id, key, response):
+            logger.error(f"Failed to store response for idempotency key {key}")
+    else:
+        store.release(user_id, key)
+    return response
@@ -0,0 +1,829 @@
+# ローカル実行用の AWS スタンドイン（インメモリ DynamoDB・S3・Bedrock Agent / ConverseStream ストリーム）
+#
+# ベンチマーク・ローカルサーバー・動作確認用。boto3 リソース層と同じ呼び出し形式で、
+# このリポジトリが使う式（=, <, begins_with, size, AND/OR/NOT など）のみサポートする。
+import re
+import time
+import bisect
+import random
+import threading
+from decimal import Decimal
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+from dynamo_codec import GENERIC_CODEC, decode_value
+
+class LocalClientError(Exception):
+    """botocore.exceptions.ClientError 相当（response['Error']['Code'] を持つ）"""
+
+    def __init__(self, code: str, message: str = ''):
+        super().__init__(f'{code}: {message}')
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+# 既知テーブルのキースキーマ（パーティションキー, ソートキー）
+DEFAULT_KEY_SCHEMAS = {
+    'GenkiChatUserTable': ('userId', None),
+    'GenkiChatHistoryTable': ('userId', 'timestamp')
+}
+
+_TOKEN_RE = re.compile(r'\s*(<>|<=|>=|=|<|>|\(|\)|,|[:#]?[A-Za-z_][A-Za-z0-9_.\-]*|\+|-)')
+
+def _tokenize(expression: str) -> List[str]:
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if not match:
+            raise LocalClientError('ValidationException', f'Invalid expression: {expression}')
+        tokens.append(match.group(1))
+        pos = match.end()
+        while pos < len(expression) and expression[pos].isspace():
+            pos += 1
+    return tokens
+
+class _ConditionParser:
+    """条件式を評価関数に変換する簡易パーサー"""
+
+    def __init__(self, expression: str, names: Dict[str, str], values: Dict[str, Any]):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+        # 「属性 = :値」の等値条件（クエリのパーティションキー特定用）
+        self.equalities = {}
+
+    def parse(self):
+        func = self._or()
+        if self.pos != len(self.tokens):
+            raise LocalClientError('ValidationException', f'Unexpected token: {self.tokens[self.pos]}')
+        return func
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _or(self):
+        left = self._and()
+        while self._peek() and self._peek().upper() == 'OR':
+            self._next()
+            right = self._and()
+            left = (lambda l, r: lambda item: l(item) or r(item))(left, right)
+        return left
+
+    def _and(self):
+        left = self._not()
+        while self._peek() and self._peek().upper() == 'AND':
+            self._next()
+            right = self._not()
+            left = (lambda l, r: lambda item: l(item) and r(item))(left, right)
+        return left
+
+    def _not(self):
+        if self._peek() and self._peek().upper() == 'NOT':
+            self._next()
+            inner = self._not()
+            return lambda item: not inner(item)
+        return self._primary()
+
+    def _path(self, token):
+        return self.names.get(token, token) if token.startswith('#') else token
+
+    def _operand(self, token):
+        if token.startswith(':'):
+            value = self.values[token]
+            return lambda item: value
+        path = self._path(token)
+        return lambda item: item.get(path)
+
+    def _primary(self):
+        token = self._next()
+        if token == '(':
+            func = self._or()
+            self._next()  # ')'
+            return func
+
+        lowered = token.lower()
+        if lowered in ('begins_with', 'attribute_exists', 'attribute_not_exists', 'contains'):
+            self._next()  # '('
+            path = self._path(self._next())
+            args = []
+            while self._peek() == ',':
+                self._next()
+                args.append(self._operand(self._next()))
+            self._next()  # ')'
+            if lowered == 'attribute_exists':
+                return lambda item: path in item
+            if lowered == 'attribute_not_exists':
+                return lambda item: path not in item
+            if lowered == 'begins_with':
+                prefix = args[0]
+                return lambda item: isinstance(item.get(path), str) and item[path].startswith(prefix(item))
+            needle = args[0]
+            return lambda item: item.get(path) is not None and needle(item) in item[path]
+
+        if lowered == 'size':
+            self._next()  # '('
+            path = self._path(self._next())
+            self._next()  # ')'
+            left = lambda item: len(item[path]) if item.get(path) is not None else None
+        else:
+            left = self._operand(token)
+        operator = self._next()
+        if operator == '=' and not token.startswith(':') and (self._peek() or '').startswith(':'):
+            self.equalities[self._path(token)] = self.values[self._peek()]
+        if operator.upper() == 'BETWEEN':
+            low = self._operand(self._next())
+            self._next()  # AND
+            high = self._operand(self._next())
+            return lambda item: _compare(left(item), low(item), '>=') and _compare(left(item), high(item), '<=')
+        right = self._operand(self._next())
+        return lambda item: _compare(left(item), right(item), operator)
+
+def _compare(a, b, operator):
+    if operator == '=':
+        return a == b
+    if operator == '<>':
+        return a != b
+    if a is None or b is None:
+        return False
+    try:
+        if operator == '<':
+            return a < b
+        if operator == '<=':
+            return a <= b
+        if operator == '>':
+            return a > b
+        if operator == '>=':
+            return a >= b
+    except TypeError:
+        return False
+    raise LocalClientError('ValidationException', f'Unsupported operator: {operator}')
+
+def compile_condition(expression: Optional[str], names=None, values=None):
+    """条件式を item -> bool の関数に変換"""
+    if not expression:
+        return lambda item: True
+    return _ConditionParser(expression, names, values).parse()
+
+def compile_key_condition(expression: str, names=None, values=None):
+    """キー条件式を (評価関数, 等値条件) に変換"""
+    parser = _ConditionParser(expression, names, values)
+    return parser.parse(), parser.equalities
+
+_UPDATE_CLAUSES = ('SET', 'REMOVE', 'ADD', 'DELETE')
+
+class _UpdateParser:
+    """更新式（SET / REMOVE / ADD / DELETE、トップレベル属性のみ）を item -> item の関数に変換"""
+
+    def __init__(self, expression: str, names: Dict[str, str], values: Dict[str, Any]):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _path(self, token):
+        return self.names.get(token, token) if token.startswith('#') else token
+
+    def _value(self):
+        """SET の右辺（operand [+|- operand]）"""
+        left = self._operand()
+        if self._peek() in ('+', '-'):
+            operator = self._next()
+            right = self._operand()
+            if operator == '+':
+                return lambda item: left(item) + right(item)
+            return lambda item: left(item) - right(item)
+        return left
+
+    def _operand(self):
+        token = self._next()
+        lowered = token.lower()
+        if lowered in ('if_not_exists', 'list_append'):
+            self._next()  # '('
+            first = self._operand() if lowered == 'list_append' else None
+            path = None if first else self._path(self._next())
+            self._next()  # ','
+            second = self._operand()
+            self._next()  # ')'
+            if lowered == 'if_not_exists':
+                return lambda item: item[path] if path in item else second(item)
+            return lambda item: list(first(item)) + list(second(item))
+        if token.startswith(':'):
+            value = _to_dynamo_number(self.values[token])
+            return lambda item: value
+        path = self._path(token)
+
+        def read(item):
+            if path not in item:
+                raise LocalClientError('ValidationException',
+                                       f'The provided expression refers to an attribute that does not exist: {path}')
+            return item[path]
+        return read
+
+    def parse(self):
+        actions = []
+        while self._peek() is not None:
+            clause = self._next().upper()
+            if clause not in _UPDATE_CLAUSES:
+                raise LocalClientError('ValidationException', f'Invalid UpdateExpression: {clause}')
+            while True:
+                path = self._path(self._next())
+                if clause == 'SET':
+                    self._next()  # '='
+                    actions.append((clause, path, self._value()))
+                elif clause == 'REMOVE':
+                    actions.append((clause, path, None))
+                else:
+                    token = self._next()
+                    value = _to_dynamo_number(self.values[token])
+                    actions.append((clause, path, lambda item, value=value: value))
+                if self._peek() != ',':
+                    break
+                self._next()
+        return self._apply(actions)
+
+    @staticmethod
+    def _apply(actions):
+        def update(item):
+            # 右辺は全て更新前のアイテムで評価する
+            evaluated = [(clause, path, value(item) if value else None) for clause, path, value in actions]
+            result = dict(item)
+            for clause, path, value in evaluated:
+                if clause == 'SET':
+                    result[path] = value
+                elif clause == 'REMOVE':
+                    result.pop(path, None)
+                elif clause == 'ADD':
+                    current = result.get(path)
+                    if isinstance(value, (set, frozenset)):
+                        result[path] = set(current or ()) | set(value)
+                    else:
+                        result[path] = (current or 0) + value
+                elif clause == 'DELETE':
+                    remaining = set(result.get(path) or ()) - set(value)
+                    if remaining:
+                        result[path] = remaining
+                    else:
+                        result.pop(path, None)
+            return result
+        return update
+
+def compile_update(expression: str, names=None, values=None):
+    """更新式を item -> 更新後 item の関数に変換"""
+    return _UpdateParser(expression, names, values).parse()
+
+def _to_dynamo_number(value):
+    """boto3 リソース層と同様に数値を Decimal で保持"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo_number(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamo_number(v) for v in value]
+    return value
+
+class _Partition:
+    """1パーティション分のアイテム（ソートキー順を維持）"""
+
+    __slots__ = ('sort_keys', 'items')
+
+    def __init__(self):
+        self.sort_keys = []
+        self.items = {}
+
+class InMemoryTable:
+    """boto3 Table 相当のインメモリ実装"""
+
+    def __init__(self, name: str, hash_key: str, range_key: Optional[str] = None, latency: float = 0.0):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.latency = latency
+        self.partitions = {}
+        self.lock = threading.RLock()
+        self.call_counts = {}
+
+    def _record(self, operation: str):
+        self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _key_of(self, item_or_key: Dict[str, Any]):
+        try:
+            pk = item_or_key[self.hash_key]
+            sk = item_or_key[self.range_key] if self.range_key else None
+        except KeyError as e:
+            raise LocalClientError('ValidationException', f'Missing key attribute: {e}')
+        return pk, sk
+
+    def _get(self, pk, sk):
+        partition = self.partitions.get(pk)
+        if partition is None:
+            return None
+        return partition.items.get(sk)
+
+    def _check_condition(self, current, kwargs):
+        condition = kwargs.get('ConditionExpression')
+        if condition:
+            func = compile_condition(condition, kwargs.get('ExpressionAttributeNames'),
+                                     kwargs.get('ExpressionAttributeValues'))
+            if not func(current or {}):
+                raise LocalClientError('ConditionalCheckFailedException', 'The conditional request failed')
+
+    def _store(self, pk, sk, item):
+        partition = self.partitions.get(pk)
+        if partition is None:
+            partition = self.partitions[pk] = _Partition()
+        if sk not in partition.items:
+            bisect.insort(partition.sort_keys, sk) if sk is not None else partition.sort_keys.append(sk)
+        partition.items[sk] = item
+
+    def _remove(self, pk, sk):
+        partition = self.partitions.get(pk)
+        if partition is None or sk not in partition.items:
+            return None
+        item = partition.items.pop(sk)
+        index = bisect.bisect_left(partition.sort_keys, sk) if sk is not None else 0
+        del partition.sort_keys[index]
+        if not partition.items:
+            del self.partitions[pk]
+        return item
+
+    def get_item(self, Key, **kwargs):
+        self._record('GetItem')
+        with self.lock:
+            item = self._get(*self._key_of(Key))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self._record('PutItem')
+        item = _to_dynamo_number(dict(Item))
+        pk, sk = self._key_of(item)
+        with self.lock:
+            self._check_condition(self._get(pk, sk), kwargs)
+            self._store(pk, sk, item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._record('DeleteItem')
+        pk, sk = self._key_of(Key)
+        with self.lock:
+            self._check_condition(self._get(pk, sk), kwargs)
+            old = self._remove(pk, sk)
+        if kwargs.get('ReturnValues') == 'ALL_OLD' and old is not None:
+            return {'Attributes': old}
+        return {}
+
+    def update_item(self, Key, UpdateExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        self._record('UpdateItem')
+        pk, sk = self._key_of(Key)
+        with self.lock:
+            old = self._apply_update(pk, sk, Key, UpdateExpression, ExpressionAttributeNames,
+                                     ExpressionAttributeValues, kwargs)
+            new = self._get(pk, sk)
+        if ReturnValues in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': dict(new)}
+        if ReturnValues in ('ALL_OLD', 'UPDATED_OLD') and old is not None:
+            return {'Attributes': dict(old)}
+        return {}
+
+    def _apply_update(self, pk, sk, key, expression, names, values, kwargs):
+        """条件を評価して更新を適用（ロック取得済みで呼ぶこと）。更新前のアイテムを返す"""
+        current = self._get(pk, sk)
+        self._check_condition(current, dict(kwargs, ExpressionAttributeNames=names,
+                                             ExpressionAttributeValues=values))
+        item = dict(current) if current is not None else _to_dynamo_number(dict(key))
+        if expression:
+            item = compile_update(expression, names, values)(item)
+        self._store(pk, sk, item)
+        return current
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+              FilterExpression=None, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None,
+              ProjectionExpression=None, **kwargs):
+        self._record('Query')
+        values = ExpressionAttributeValues or {}
+        names = ExpressionAttributeNames or {}
+        key_condition, equalities = compile_key_condition(KeyConditionExpression, names, values)
+        item_filter = compile_condition(FilterExpression, names, values)
+        if self.hash_key not in equalities:
+            raise LocalClientError('ValidationException', 'Query condition missed key schema element')
+        pk_value = equalities[self.hash_key]
+
+        with self.lock:
+            partition = self.partitions.get(pk_value)
+            if partition is None:
+                return {'Items': [], 'Count': 0, 'ScannedCount': 0}
+            sort_keys = list(partition.sort_keys)
+            items = partition.items
+
+            if not ScanIndexForward:
+                sort_keys.reverse()
+            if ExclusiveStartKey is not None and self.range_key:
+                start = ExclusiveStartKey[self.range_key]
+                sort_keys = [sk for sk in sort_keys if (sk > start if ScanIndexForward else sk < start)]
+
+            result = []
+            evaluated = 0
+            last_key = None
+            for sk in sort_keys:
+                item = items[sk]
+                if not key_condition(item):
+                    continue
+                evaluated += 1
+                if item_filter(item):
+                    result.append(dict(item))
+                if Limit is not None and evaluated >= Limit:
+                    last_key = {self.hash_key: pk_value}
+                    if self.range_key:
+                        last_key[self.range_key] = sk
+                    break
+
+        response = {'Items': result, 'Count': len(result), 'ScannedCount': evaluated}
+        if last_key is not None:
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def scan(self, FilterExpression=None, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+             Limit=None, ExclusiveStartKey=None, **kwargs):
+        self._record('Scan')
+        item_filter = compile_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            all_items = [item for partition in self.partitions.values()
+                         for item in (partition.items[sk] for sk in partition.sort_keys)]
+        result = [dict(item) for item in all_items if item_filter(item)]
+        return {'Items': result, 'Count': len(result), 'ScannedCount': len(all_items)}
+
+    def item_count(self) -> int:
+        with self.lock:
+            return sum(len(p.items) for p in self.partitions.values())
+
+class InMemoryDynamoDB:
+    """boto3.resource('dynamodb') 相当のインメモリ実装"""
+
+    def __init__(self, key_schemas: Dict[str, tuple] = None, latency_ms: float = 0.0):
+        self.key_schemas = dict(DEFAULT_KEY_SCHEMAS)
+        self.key_schemas.update(key_schemas or {})
+        self.latency = latency_ms / 1000
+        self.tables = {}
+        self.lock = threading.Lock()
+
+        self.meta = _Meta(InMemoryDynamoDBClient(self))
+
+    def create_table(self, name: str, hash_key: str, range_key: Optional[str] = None):
+        """キースキーマを登録"""
+        self.key_schemas[name] = (hash_key, range_key)
+        return self.Table(name)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            table._record('BatchGetItem')
+            with table.lock:
+                found = (table._get(*table._key_of(key)) for key in request['Keys'])
+                responses[name] = [dict(item) for item in found if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def Table(self, name: str) -> InMemoryTable:
+        table = self.tables.get(name)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(name)
+                if table is None:
+                    if name not in self.key_schemas:
+                        raise LocalClientError('ResourceNotFoundException', f'Table not found: {name}')
+                    hash_key, range_key = self.key_schemas[name]
+                    table = self.tables[name] = InMemoryTable(name, hash_key, range_key, self.latency)
+        return table
+
+class _Meta:
+    """boto3 リソースの meta（低レベルクライアントへの参照）"""
+
+    def __init__(self, client):
+        self.client = client
+
+class InMemoryDynamoDBClient:
+    """boto3.client('dynamodb') 相当（リソース層では表現できない操作のみ）"""
+
+    def __init__(self, resource: InMemoryDynamoDB):
+        self.resource = resource
+
+    @staticmethod
+    def _decode(request: Dict[str, Any]) -> Dict[str, Any]:
+        request = dict(request)
+        for name in ('Item', 'Key'):
+            if name in request:
+                request[name] = GENERIC_CODEC.decode(request[name])
+        if 'ExpressionAttributeValues' in request:
+            request['ExpressionAttributeValues'] = {
+                k: decode_value(v) for k, v in request['ExpressionAttributeValues'].items()
+            }
+        return request
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        """全操作の条件を評価してから一括で適用（いずれかが不成立なら何も書き込まない）"""
+        operations = []
+        for entry in TransactItems:
+            (kind, request), = entry.items()
+            request = self._decode(request)
+            operations.append((kind, self.resource.Table(request['TableName']), request))
+
+        tables = sorted({table.name: table for _, table, _ in operations}.values(), key=lambda t: t.name)
+        for table in tables:
+            table._record('TransactWriteItems')
+            table.lock.acquire()
+        try:
+            reasons = []
+            failed = False
+            for kind, table, request in operations:
+                pk, sk = table._key_of(request['Item'] if kind == 'Put' else request['Key'])
+                try:
+                    table._check_condition(table._get(pk, sk), request)
+                    reasons.append({'Code': 'None'})
+                except LocalClientError:
+                    reasons.append({'Code': 'ConditionalCheckFailed'})
+                    failed = True
+            if failed:
+                error = LocalClientError('TransactionCanceledException', 'Transaction cancelled')
+                error.response['CancellationReasons'] = reasons
+                raise error
+
+            for kind, table, request in operations:
+                if kind == 'Put':
+                    item = _to_dynamo_number(request['Item'])
+                    table._store(*table._key_of(item), item)
+                elif kind == 'Delete':
+                    table._remove(*table._key_of(request['Key']))
+                elif kind == 'Update':
+                    pk, sk = table._key_of(request['Key'])
+                    table._apply_update(pk, sk, request['Key'], request.get('UpdateExpression'),
+                                        request.get('ExpressionAttributeNames'),
+                                        request.get('ExpressionAttributeValues'), {})
+        finally:
+            for table in tables:
+                table.lock.release()
+        return {}
+
+class FakeEventStream:
+    """invoke_agent の completion・converse_stream の stream イベントストリーム"""
+
+    def __init__(self, events: List[Dict[str, Any]], delays: List[float]):
+        self.events = events
+        self.delays = delays
+
+    def __iter__(self):
+        for event, delay in zip(self.events, self.delays):
+            if delay:
+                time.sleep(delay)
+            yield event
+
+class FakeBedrockAgentRuntime:
+    """bedrock-agent-runtime クライアント相当のスタンドイン"""
+
+    DEFAULT_REPLY = ('お話ししてくれてありがとうございます！その気持ち、とてもよくわかります。'
+                     'まずは深呼吸をして、今日できたことを一つ思い出してみましょう。'
+                     '小さな一歩でも前に進んでいますよ。応援しています！')
+
+    def __init__(self, reply: str = None, chunk_chars: int = 20, first_chunk_ms: float = 0.0,
+                 chunk_interval_ms: float = 0.0, trace_events: List[Dict[str, Any]] = None):
+        self.reply = reply or self.DEFAULT_REPLY
+        self.chunk_chars = chunk_chars
+        self.first_chunk_delay = first_chunk_ms / 1000
+        self.chunk_interval = chunk_interval_ms / 1000
+        self.trace_events = trace_events or []
+        self.calls = []
+
+    def invoke_agent(self, **kwargs):
+        self.calls.append(kwargs)
+        events = [{'trace': trace} for trace in self.trace_events]
+        delays = [0.0] * len(events)
+        text = self.reply
+        for i in range(0, len(text), self.chunk_chars):
+            events.append({'chunk': {'bytes': text[i:i + self.chunk_chars].encode('utf-8')}})
+            delays.append(self.first_chunk_delay if i == 0 else self.chunk_interval)
+        return {
+            'completion': FakeEventStream(events, delays),
+            'contentType': 'application/json',
+            'sessionId': kwargs.get('sessionId')
+        }
+
+class FakeBedrockRuntime:
+    """bedrock-runtime クライアント（ConverseStream）相当のスタンドイン"""
+
+    DEFAULT_REPLY = 'こんにちは！声をかけてくれてうれしいです。今日はどんな一日でしたか？'
+
+    def __init__(self, reply: str = None, chunk_chars: int = 20, first_chunk_ms: float = 0.0,
+                 chunk_interval_ms: float = 0.0):
+        self.reply = reply or self.DEFAULT_REPLY
+        self.chunk_chars = chunk_chars
+        self.first_chunk_delay = first_chunk_ms / 1000
+        self.chunk_interval = chunk_interval_ms / 1000
+        self.calls = []
+
+    def converse_stream(self, **kwargs):
+        self.calls.append(kwargs)
+        events = [{'messageStart': {'role': 'assistant'}}]
+        delays = [0.0]
+        text = self.reply
+        for i in range(0, len(text), self.chunk_chars):
+            events.append({'contentBlockDelta': {'delta': {'text': text[i:i + self.chunk_chars]}, 'contentBlockIndex': 0}})
+            delays.append(self.first_chunk_delay if i == 0 else self.chunk_interval)
+        # 入力トークン数は文字数からの概算
+        input_chars = sum(len(block.get('text', '')) for message in kwargs.get('messages', [])
+                          for block in message.get('content', []))
+        input_chars += sum(len(block.get('text', '')) for block in kwargs.get('system', []))
+        events.append({'messageStop': {'stopReason': 'end_turn'}})
+        events.append({'metadata': {
+            'usage': {'inputTokens': input_chars, 'outputTokens': len(text), 'totalTokens': input_chars + len(text)},
+            'metrics': {'latencyMs': int(self.first_chunk_delay * 1000)}
+        }})
+        delays.extend([0.0, 0.0])
+        return {'stream': FakeEventStream(events, delays)}
+
+def attach_to_handler(module, dynamodb=None, bedrock_agent_runtime=None, s3=None, bedrock_runtime=None):
+    """Lambda ハンドラモジュールの AWS 依存をスタンドインに差し替え"""
+    if s3 is not None and hasattr(module, 'history_helper'):
+        # 大きな本文の退避先をインメモリ S3 にする（バケット未設定時もローカルでは退避する）
+        from history_overflow import HistoryOverflow, HISTORY_OVERFLOW_BUCKET
+        module.history_helper.overflow = HistoryOverflow(s3, bucket=HISTORY_OVERFLOW_BUCKET or 'local-history')
+    if dynamodb is not None and hasattr(module, 'db_helper'):
+        module.db_helper.dynamodb = dynamodb
+        module.db_helper.client = None
+        module.db_helper._tables = {}
+        # asyncio 版ヘルパーも同期ヘルパー（スタンドイン）経由で呼び出す
+        import async_helpers
+        async_helpers.set_native_clients(False)
+    if bedrock_agent_runtime is not None and hasattr(module, 'bedrock_agent_runtime'):
+        module.bedrock_agent_runtime = bedrock_agent_runtime
+        # 他のリージョンの呼び出し先も同じスタンドインに向ける
+        if hasattr(module, 'agent_router'):
+            for endpoint in module.agent_router.endpoints:
+                module.regional_agent_runtimes[endpoint.region] = bedrock_agent_runtime
+        if hasattr(module, 'batch_agent_runtime'):
+            module.batch_agent_runtime = bedrock_agent_runtime
+    if bedrock_runtime is not None and hasattr(module, 'bedrock_runtime'):
+        module.bedrock_runtime = bedrock_runtime
+
+class _StreamingBody:
+    """botocore StreamingBody 相当"""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+
+    def read(self, amt: int = None) -> bytes:
+        if amt is None:
+            chunk = self._data[self._pos:]
+        else:
+            chunk = self._data[self._pos:self._pos + amt]
+        self._pos += len(chunk)
+        return chunk
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        pass
+
+class InMemoryS3:
+    """boto3.client('s3') 相当のインメモリ実装（このリポジトリで使う操作のみ）"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.buckets = {}
+        self.latency = latency_ms / 1000
+        self.lock = threading.Lock()
+        self.call_counts = {}
+
+    def _record(self, operation: str):
+        self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _bucket(self, name: str) -> Dict[str, Any]:
+        with self.lock:
+            return self.buckets.setdefault(name, {})
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self._record('PutObject')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        metadata = {k: v for k, v in kwargs.items() if k in ('ContentType', 'ContentEncoding', 'Metadata')}
+        self._bucket(Bucket)[Key] = {'Body': bytes(Body), **metadata}
+        return {'ETag': f'"{len(Body)}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._record('GetObject')
+        obj = self._bucket(Bucket).get(Key)
+        if obj is None:
+            raise LocalClientError('NoSuchKey', f'The specified key does not exist: {Key}')
+        data = obj['Body']
+        if Range:
+            start, _, end = Range.replace('bytes=', '').partition('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        response = {k: v for k, v in obj.items() if k != 'Body'}
+        response.update({'Body': _StreamingBody(data), 'ContentLength': len(data)})
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._record('HeadObject')
+        obj = self._bucket(Bucket).get(Key)
+        if obj is None:
+            raise LocalClientError('404', f'Not Found: {Key}')
+        return {'ContentLength': len(obj['Body'])}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._record('DeleteObject')
+        self._bucket(Bucket).pop(Key, None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._record('ListObjectsV2')
+        keys = sorted(k for k in self._bucket(Bucket) if k.startswith(Prefix))
+        if ContinuationToken:
+            keys = [k for k in keys if k > ContinuationToken]
+        page = keys[:MaxKeys]
+        response = {
+            'Contents': [{'Key': k, 'Size': len(self._bucket(Bucket)[k]['Body'])} for k in page],
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > MaxKeys
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        params = Params or {}
+        return f"http://local-s3/{params.get('Bucket')}/{params.get('Key')}?expires={ExpiresIn}"
+
+# ベンチマーク・ローカルサーバー用の擬似データ
+USER_MESSAGES = [
+    '今日は仕事でミスをしてしまって落ち込んでいます。',
+    '明日の面接がうまくいくか不安です。',
+    '最近ランニングを始めました！',
+    'なかなか眠れない日が続いています。',
+    '友達とけんかしてしまいました。どうしたらいいでしょう。'
+]
+ASSISTANT_MESSAGES = [
+    'お話ししてくれてありがとうございます！その気持ち、とてもよくわかります。まずは深呼吸してみましょう。',
+    '緊張するのは真剣に取り組んでいる証拠です。準備してきたことを信じて、笑顔でいきましょう！',
+    '素晴らしいですね！続けるコツは小さな目標を立てることです。今週は3回走ってみませんか？'
+]
+
+def seed_dataset(dynamodb, users, sessions, messages, seed=42):
+    """users × sessions × messages の履歴とプロフィールを投入"""
+    from common import USER_TABLE, HISTORY_TABLE, build_message_key, new_ulid
+    rng = random.Random(seed)
+    history_table = dynamodb.Table(HISTORY_TABLE)
+    user_table = dynamodb.Table(USER_TABLE)
+    base = datetime(2025, 1, 1)
+    for u in range(users):
+        user_id = f'bench-user-{u:04d}'
+        user_table.put_item(Item={
+            'userId': user_id,
+            'userName': f'ユーザー{u}',
+            'age': '30代',
+            'occupation': 'エンジニア',
+            'gender': '答えない',
+            'responseLength': 'medium',
+            'createdAt': base.isoformat(),
+            'updatedAt': base.isoformat()
+        })
+        for s in range(sessions):
+            session_id = f'session-{u:04d}-{s:04d}'
+            start = base + timedelta(hours=s)
+            for m in range(messages):
+                role = 'user' if m % 2 == 0 else 'assistant'
+                created = start + timedelta(seconds=m)
+                ulid = new_ulid(int(created.timestamp() * 1000))
+                content = rng.choice(USER_MESSAGES if role == 'user' else ASSISTANT_MESSAGES)
+                history_table.put_item(Item={
+                    'userId': user_id,
+                    'timestamp': build_message_key(session_id, ulid),
+                    'sessionId': session_id,
+                    'role': role,
+                    'content': content,
+                    'createdAt': created.isoformat(),
+                    'messageId': f'{session_id}_{ulid}_{role}'
+                })
@@ -0,0 +1,299 @@
+# ローカル HTTP サーバー - 3つの Lambda ハンドラを1台のマシンで配信する（負荷試験・プロファイル用）
+#
+# WSGI アプリ（LambdaWSGIApp）が HTTP リクエストを API Gateway プロキシ統合のイベントに変換して
+# ハンドラを呼び出し、戻り値を HTTP レスポンスに戻す。サーバーは待ち受けソケットを共有する
+# ワーカープロセスを fork し、各ワーカーは1件ずつ処理する（Lambda コンテナ1つ分に相当）。
+# ハンドラモジュールは各ワーカーで初回リクエスト時に読み込むため、コールドスタートと
+# コンテナの再利用（ウォーム状態）をワーカー毎に再現できる。
+#   python local_server.py --workers 4 --port 8080 --local     # インメモリ DynamoDB・擬似 Bedrock
+#   gunicorn -w 4 -b :8080 local_server:app                    # 他の WSGI サーバーでも動作
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import socket
+import signal
+import logging
+import argparse
+import importlib
+import multiprocessing
+from urllib.parse import parse_qsl, unquote
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+from common import setup_logger
+
+# ローカル実行設定
+LOCAL_LAMBDA_TIMEOUT_SECONDS = float(os.environ.get('LOCAL_LAMBDA_TIMEOUT_SECONDS', '30'))
+# --local 時にインメモリ DynamoDB の各呼び出しへ加える擬似レイテンシ
+LOCAL_DB_LATENCY_MS = float(os.environ.get('LOCAL_DB_LATENCY_MS', '0'))
+
+# (リソースパス, ハンドラモジュール)。API Gateway と同じく固定パスを変数パスより先に照合する
+ROUTES = [
+    ('/chat/batch', 'chat_lambda_refactored'),
+    ('/chat', 'chat_lambda_refactored'),
+    ('/history/export', 'history_lambda_refactored'),
+    ('/history/search', 'history_lambda_refactored'),
+    ('/history/similar', 'history_lambda_refactored'),
+    ('/history/usage', 'history_lambda_refactored'),
+    ('/history/{sessionId}', 'history_lambda_refactored'),
+    ('/history', 'history_lambda_refactored'),
+    ('/profile', 'profile_lambda_refactored')
+]
+
+HTTP_REASONS = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 206: 'Partial Content', 304: 'Not Modified',
+    400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable', 504: 'Gateway Timeout'
+}
+
+logger = setup_logger(__name__)
+
+def match_route(path: str) -> Optional[Tuple[str, str, Dict[str, str]]]:
+    """パスに一致する (リソースパス, モジュール名, パスパラメータ)"""
+    parts = [p for p in path.split('/') if p]
+    for resource, module_name in ROUTES:
+        template = [p for p in resource.split('/') if p]
+        if len(template) != len(parts):
+            continue
+        params = {}
+        for expected, actual in zip(template, parts):
+            if expected.startswith('{') and expected.endswith('}'):
+                params[expected[1:-1]] = unquote(actual)
+            elif expected != actual:
+                break
+        else:
+            return resource, module_name, params
+    return None
+
+def _header_name(environ_key: str) -> str:
+    return '-'.join(part.capitalize() for part in environ_key.split('_'))
+
+def build_event(environ: Dict[str, Any], resource: str, path_params: Dict[str, str]) -> Dict[str, Any]:
+    """WSGI の environ を API Gateway プロキシ統合（REST API, ペイロード 1.0）のイベントに変換"""
+    headers, multi_headers = {}, {}
+    for key, value in environ.items():
+        if key.startswith('HTTP_'):
+            name = _header_name(key[5:])
+        elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH') and value:
+            name = _header_name(key)
+        else:
+            continue
+        headers[name] = value
+        multi_headers[name] = [value]
+
+    query, multi_query = {}, {}
+    for key, value in parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True):
+        query[key] = value
+        multi_query.setdefault(key, []).append(value)
+
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    raw_body = environ['wsgi.input'].read(length) if length else b''
+    body, is_base64 = None, False
+    if raw_body:
+        try:
+            body = raw_body.decode('utf-8')
+        except UnicodeDecodeError:
+            body, is_base64 = base64.b64encode(raw_body).decode('ascii'), True
+
+    method = environ.get('REQUEST_METHOD', 'GET')
+    path = environ.get('PATH_INFO') or '/'
+    return {
+        'resource': resource,
+        'path': path,
+        'httpMethod': method,
+        'headers': headers or None,
+        'multiValueHeaders': multi_headers or None,
+        'queryStringParameters': query or None,
+        'multiValueQueryStringParameters': multi_query or None,
+        'pathParameters': path_params or None,
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': resource,
+            'httpMethod': method,
+            'path': path,
+            'stage': 'local',
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': int(time.time() * 1000),
+            'identity': {
+                'sourceIp': environ.get('REMOTE_ADDR'),
+                'userAgent': environ.get('HTTP_USER_AGENT')
+            }
+        },
+        'body': body,
+        'isBase64Encoded': is_base64
+    }
+
+class LocalLambdaContext:
+    """Lambda の context オブジェクト相当（残り時間は呼び出し開始からのタイムアウトで計算）"""
+
+    def __init__(self, function_name: str, timeout_seconds: float = None):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.memory_limit_in_mb = 1024
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = f'arn:aws:lambda:local:000000000000:function:{function_name}'
+        self._deadline = time.monotonic() + (timeout_seconds or LOCAL_LAMBDA_TIMEOUT_SECONDS)
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+class LambdaWSGIApp:
+    """Lambda ハンドラを WSGI アプリとして配信
+
+    ハンドラモジュールはプロセス内で初回リクエスト時に読み込んで使い回す。
+    レスポンスにはワーカーの状態（X-Worker-Id / X-Worker-Requests / X-Cold-Start）を付ける。
+    """
+
+    def __init__(self, local_stubs: bool = False, seed_users: int = 0):
+        self.local_stubs = local_stubs
+        self.seed_users = seed_users
+        self.modules = {}
+        self.requests = 0
+        self.stubs = None
+
+    def _load(self, module_name: str):
+        """ハンドラモジュールを読み込む（コールドスタート）。読み込み時間も返す"""
+        module = self.modules.get(module_name)
+        if module is not None:
+            return module, None
+        stubs = self._local_stubs() if self.local_stubs else None
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        init_ms = (time.perf_counter() - started) * 1000
+        if stubs is not None:
+            from local_aws import attach_to_handler
+            attach_to_handler(module, dynamodb=stubs[0], bedrock_agent_runtime=stubs[1], s3=stubs[2],
+                              bedrock_runtime=stubs[3])
+        self.modules[module_name] = module
+        return module, init_ms
+
+    def _local_stubs(self):
+        """ワーカー内で共有するスタンドイン（ワーカー毎に独立したインメモリのデータ）"""
+        if self.stubs is None:
+            from local_aws import InMemoryDynamoDB, InMemoryS3, FakeBedrockAgentRuntime, FakeBedrockRuntime, seed_dataset
+            from bedrock_replay import configure_agent_runtime
+            dynamodb = InMemoryDynamoDB(latency_ms=LOCAL_DB_LATENCY_MS)
+            if self.seed_users:
+                seed_dataset(dynamodb, self.seed_users, 5, 10)
+            # BEDROCK_REPLAY_DIR 設定時は記録済みの応答を再生
+            self.stubs = (dynamodb, configure_agent_runtime(FakeBedrockAgentRuntime()), InMemoryS3(),
+                          FakeBedrockRuntime())
+        return self.stubs
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        route = match_route(path)
+        if route is None:
+            return self._respond(start_response, 404, {'Content-Type': 'application/json'},
+                                 json.dumps({'error': f'Not found: {path}'}).encode('utf-8'))
+        resource, module_name, path_params = route
+
+        self.requests += 1
+        module, init_ms = self._load(module_name)
+        event = build_event(environ, resource, path_params)
+        context = LocalLambdaContext(module_name)
+        try:
+            response = module.lambda_handler(event, context)
+        except Exception as e:
+            logger.error(f"Unhandled error in {module_name}: {str(e)}", exc_info=True)
+            response = {'statusCode': 502, 'headers': {'Content-Type': 'application/json'},
+                        'body': json.dumps({'message': 'Internal server error'})}
+
+        headers = dict(response.get('headers') or {})
+        for name, values in (response.get('multiValueHeaders') or {}).items():
+            headers[name] = ', '.join(values)
+        headers['X-Worker-Id'] = str(os.getpid())
+        headers['X-Worker-Requests'] = str(self.requests)
+        if init_ms is not None:
+            headers['X-Cold-Start'] = f'{init_ms:.1f}ms'
+
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(body)
+        else:
+            payload = body.encode('utf-8') if isinstance(body, str) else body
+        return self._respond(start_response, int(response.get('statusCode', 200)), headers, payload)
+
+    @staticmethod
+    def _respond(start_response, status: int, headers: Dict[str, str], payload: bytes) -> List[bytes]:
+        headers = {k: str(v) for k, v in headers.items() if k.lower() != 'content-length'}
+        headers['Content-Length'] = str(len(payload))
+        start_response(f"{status} {HTTP_REASONS.get(status, 'Unknown')}", list(headers.items()))
+        return [payload]
+
+# gunicorn などの WSGI サーバー用（python local_server.py では使わない）
+app = LambdaWSGIApp(local_stubs=os.environ.get('LOCAL_STUBS', 'false').lower() == 'true')
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    access_log = False
+
+    def log_message(self, format, *args):
+        if self.access_log:
+            super().log_message(format, *args)
+
+def _serve_worker(listener: socket.socket, local_stubs: bool, seed_users: int, access_log: bool):
+    """ワーカープロセス: 共有ソケットで受け付けたリクエストを1件ずつ処理"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    logging.disable(logging.INFO)
+    _QuietRequestHandler.access_log = access_log
+
+    server = WSGIServer(listener.getsockname(), _QuietRequestHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.server_name, server.server_port = 'localhost', listener.getsockname()[1]
+    server.setup_environ()
+    server.set_app(LambdaWSGIApp(local_stubs, seed_users))
+    server.serve_forever()
+
+def serve(host: str, port: int, workers: int, local_stubs: bool = False, seed_users: int = 0,
+          access_log: bool = False):
+    """待ち受けソケットを作成してワーカープロセスを起動（Ctrl+C で全ワーカーを停止）"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(max(128, workers * 16))
+
+    # 共有ソケットを引き継ぐため fork で起動する
+    mp = multiprocessing.get_context('fork')
+    processes = [
+        mp.Process(target=_serve_worker, args=(listener, local_stubs, seed_users, access_log), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Serving on http://{host}:{listener.getsockname()[1]} with {workers} workers "
+                f"({'local stand-ins' if local_stubs else 'AWS'})")
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(5)
+        listener.close()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Lambda ハンドラのローカル HTTP サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='ワーカープロセス数（Lambda の同時実行コンテナ数に相当）')
+    parser.add_argument('--local', action='store_true',
+                        help='インメモリ DynamoDB と擬似 Bedrock を使う（データはワーカー毎に独立）')
+    parser.add_argument('--seed-users', type=int, default=0, help='--local 時に投入するベンチマーク用ユーザー数')
+    parser.add_argument('--access-log', action='store_true')
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, args.local, args.seed_users, args.access_log)
@@ -0,0 +1,111 @@
+# 履歴テーブルのソートキー移行ツール
+#
+# 旧形式（timestamp = ISO 日時）の行を SESSION#<sessionId>#<ULID> 形式に書き換える。
+# ULID は旧キーから決定的に生成するため、途中で中断しても再実行できる。
+#   python migrate_history_keys.py --dry-run
+#   python migrate_history_keys.py --user <userId>
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict, Any, Optional
+from common import (
+    setup_logger,
+    client_factory,
+    encode_ulid,
+    build_message_key,
+    HISTORY_TABLE,
+    LEGACY_KEY_UPPER_BOUND
+)
+
+logger = setup_logger(__name__)
+
+def is_legacy_item(item: Dict[str, Any]) -> bool:
+    """旧形式（ISO 日時ソートキー）の行か"""
+    return item.get('timestamp', '') < LEGACY_KEY_UPPER_BOUND and bool(item.get('sessionId'))
+
+def legacy_ulid(item: Dict[str, Any]) -> str:
+    """旧キーから決定的に ULID を生成（時刻部は旧タイムスタンプ）"""
+    legacy_key = item['timestamp']
+    try:
+        created = datetime.fromisoformat(legacy_key)
+        timestamp_ms = int((created - datetime(1970, 1, 1)).total_seconds() * 1000)
+    except ValueError:
+        timestamp_ms = 0
+    seed = f"{item['userId']}|{legacy_key}|{item.get('role', '')}".encode('utf-8')
+    randomness = int.from_bytes(hashlib.sha256(seed).digest()[:10], 'big')
+    return encode_ulid(timestamp_ms, randomness)
+
+def migrate_item(table, item: Dict[str, Any], dry_run: bool = False) -> Optional[str]:
+    """1行を新形式に書き換え、新しいソートキーを返す"""
+    ulid = legacy_ulid(item)
+    new_key = build_message_key(item['sessionId'], ulid)
+    new_item = dict(item)
+    new_item['timestamp'] = new_key
+    new_item.setdefault('createdAt', item['timestamp'])
+    # chat_lambda_clean 形式（message 属性）も content に揃える
+    if 'content' not in new_item and 'message' in new_item:
+        new_item['content'] = new_item.pop('message')
+
+    if dry_run:
+        return new_key
+
+    try:
+        table.put_item(
+            Item=new_item,
+            ConditionExpression='attribute_not_exists(#ts)',
+            ExpressionAttributeNames={'#ts': 'timestamp'}
+        )
+    except Exception as e:
+        # 前回の実行で書き込み済み（旧行の削除前に中断した場合）
+        if _error_code(e) != 'ConditionalCheckFailedException':
+            raise
+    table.delete_item(Key={'userId': item['userId'], 'timestamp': item['timestamp']})
+    return new_key
+
+def _error_code(error: Exception) -> Optional[str]:
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+def iter_legacy_items(table, user_id: str = None, page_size: int = 500):
+    """旧形式の行をページ単位で列挙"""
+    kwargs = {'Limit': page_size}
+    if user_id:
+        kwargs.update(
+            KeyConditionExpression='userId = :userId AND #ts < :legacyEnd',
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={':userId': user_id, ':legacyEnd': LEGACY_KEY_UPPER_BOUND}
+        )
+    while True:
+        response = table.query(**kwargs) if user_id else table.scan(**kwargs)
+        for item in response.get('Items', []):
+            if is_legacy_item(item):
+                yield item
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+
+def migrate(table, user_id: str = None, dry_run: bool = False, page_size: int = 500) -> Dict[str, int]:
+    """旧形式の行を全て移行"""
+    stats = {'migrated': 0, 'failed': 0}
+    for item in iter_legacy_items(table, user_id, page_size):
+        try:
+            new_key = migrate_item(table, item, dry_run)
+            stats['migrated'] += 1
+            logger.info(f"{'[dry-run] ' if dry_run else ''}{item['userId']} {item['timestamp']} -> {new_key}")
+        except Exception as e:
+            stats['failed'] += 1
+            logger.error(f"Failed to migrate {item['userId']} {item['timestamp']}: {str(e)}")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='履歴テーブルのソートキーを SESSION#<id>#<ULID> 形式に移行')
+    parser.add_argument('--user', default=None, help='対象ユーザーID（省略時はテーブル全体をスキャン）')
+    parser.add_argument('--table', default=HISTORY_TABLE)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    table = client_factory.resource('dynamodb').Table(args.table)
+    result = migrate(table, args.user, args.dry_run, args.page_size)
+    logger.info(f"Migration finished: {result}")
\ No newline at end of file
@@ -1,30 +1,49 @@
 import json
-import boto3
-from datetime import datetime
 import logging
 from common import (
     setup_logger,
+    tracer,
     ResponseBuilder,
     RequestValidator,
-    DatabaseHelper,
+    create_database_helper,
     ProfileHelper,
+    ProfileVersionConflict,
+    create_single_flight,
     USER_TABLE
 )
+from warmup import (
+    Primer,
+    is_warmup_event,
+    should_prime_on_init,
+    prime_dynamodb,
+    prime_local_caches,
+    WARMUP_USER_ID
+)
 
 # ログ設定
 logger = setup_logger(__name__)
 
-# AWS サービス初期化
-dynamodb = boto3.resource('dynamodb')
-
-# ヘルパー初期化
-db_helper = DatabaseHelper(dynamodb)
+# AWS サービス・ヘルパー初期化
+db_helper = create_database_helper()
 profile_helper = ProfileHelper(db_helper, USER_TABLE)
 
+# 同時に届いた同一のプロフィール取得をまとめる（SINGLE_FLIGHT_ENABLED=false で無効）
+profile_flight = create_single_flight('profile', db_helper)
+
+# 初期化フェーズのプライミング（接続確立・初回利用時の読み込みを初回リクエストの前に済ませる）
+primer = Primer('profile')
+primer.add('dynamodb.user', prime_dynamodb(db_helper, USER_TABLE, {'userId': WARMUP_USER_ID}))
+primer.add('caches', prime_local_caches)
+
+@tracer.trace_handler('profile.lambda_handler')
 def lambda_handler(event, context):
     """
     プロフィール管理を行うLambda関数（リファクタリング版）
     """
+    # ウォームアップイベントは即座に返す
+    if is_warmup_event(event):
+        return primer.handle(event)
+    
     try:
         logger.info(f"Received event: {json.dumps(event)}")
         
@@ -64,38 +83,47 @@ def handle_get_profile(user_id: str):
     try:
         logger.info(f"Getting profile for user: {user_id}")
         
-        profile = profile_helper.get_user_profile(user_id)
-        
-        if profile:
-            logger.info("Profile found for user")
-            
-            # 不要なフィールドを除去（セキュリティ）
-            safe_profile = {
-                'userName': profile.get('userName', ''),
-                'age': profile.get('age', ''),
-                'occupation': profile.get('occupation', ''),
-                'gender': profile.get('gender', ''),
-                'responseLength': profile.get('responseLength', 'medium'),
-                'updatedAt': profile.get('updatedAt', ''),
-                'createdAt': profile.get('createdAt', '')
-            }
-            
-            return ResponseBuilder.success(safe_profile)
-        else:
-            logger.info("No profile found for user")
-            return ResponseBuilder.success({
-                'userName': '',
-                'age': '',
-                'occupation': '',
-                'gender': '',
-                'responseLength': 'medium',
-                'message': 'プロフィールが見つかりません'
-            })
+        # 同時に届いた同じユーザーのプロフィール取得は1回の読み込みにまとめる
+        if profile_flight is not None:
+            return ResponseBuilder.success(
+                profile_flight.do(user_id, 'GET /profile', None, lambda: load_profile(user_id))
+            )
+        return ResponseBuilder.success(load_profile(user_id))
         
     except Exception as e:
         logger.error(f"Error in get profile: {str(e)}")
         return ResponseBuilder.error('プロフィール取得中にエラーが発生しました', 500, str(e))
 
+def load_profile(user_id: str):
+    """レスポンス用のプロフィールを作成（未登録の場合は既定値）"""
+    profile = profile_helper.get_user_profile(user_id)
+    
+    if profile:
+        logger.info("Profile found for user")
+        
+        # 不要なフィールドを除去（セキュリティ）
+        return {
+            'userName': profile.get('userName', ''),
+            'age': profile.get('age', ''),
+            'occupation': profile.get('occupation', ''),
+            'gender': profile.get('gender', ''),
+            'responseLength': profile.get('responseLength', 'medium'),
+            'updatedAt': profile.get('updatedAt', ''),
+            'createdAt': profile.get('createdAt', ''),
+            'version': int(profile.get('version', 0))
+        }
+    
+    logger.info("No profile found for user")
+    return {
+        'userName': '',
+        'age': '',
+        'occupation': '',
+        'gender': '',
+        'responseLength': 'medium',
+        'version': 0,
+        'message': 'プロフィールが見つかりません'
+    }
+
 def handle_save_profile(event, user_id: str):
     """プロフィール保存処理"""
     try:
@@ -113,15 +141,20 @@ def handle_save_profile(event, user_id: str):
         if isinstance(profile_data, dict) and 'error' in profile_data:
             return ResponseBuilder.error(profile_data['error'], 400)
         
-        # 既存プロフィール取得（作成日時保持のため）
-        existing_profile = profile_helper.get_user_profile(user_id)
-        if existing_profile:
-            profile_data['createdAt'] = existing_profile.get('createdAt')
+        # 楽観的排他制御用の期待バージョン（任意。ボディの version または If-Match ヘッダー）
+        try:
+            expected_version = parse_expected_version(body, event)
+        except ValueError as e:
+            return ResponseBuilder.error(str(e), 400)
         
-        # プロフィール保存
-        success = profile_helper.save_user_profile(user_id, profile_data)
+        # プロフィール保存（1回の UpdateItem で作成日時の保持とバージョン更新を行う）
+        try:
+            saved = profile_helper.upsert_user_profile(user_id, profile_data, expected_version)
+        except ProfileVersionConflict:
+            logger.info(f"Profile version conflict (expected {expected_version})")
+            return ResponseBuilder.error('プロフィールが他の操作で更新されています。再読み込みしてください', 409)
         
-        if not success:
+        if saved is None:
             logger.error("Failed to save profile to database")
             return ResponseBuilder.error('プロフィールの保存に失敗しました', 500)
         
@@ -130,12 +163,14 @@ def handle_save_profile(event, user_id: str):
         return ResponseBuilder.success({
             'message': 'プロフィールが保存されました',
             'profile': {
-                'userName': profile_data.get('userName', ''),
-                'age': profile_data.get('age', ''),
-                'occupation': profile_data.get('occupation', ''),
-                'gender': profile_data.get('gender', ''),
-                'responseLength': profile_data.get('responseLength', 'medium'),
-                'updatedAt': profile_data.get('updatedAt')
+                'userName': saved.get('userName', ''),
+                'age': saved.get('age', ''),
+                'occupation': saved.get('occupation', ''),
+                'gender': saved.get('gender', ''),
+                'responseLength': saved.get('responseLength', 'medium'),
+                'updatedAt': saved.get('updatedAt'),
+                'createdAt': saved.get('createdAt'),
+                'version': int(saved.get('version', 0))
             }
         })
         
@@ -190,9 +225,6 @@ def validate_profile_data(data):
                 else:
                     validated_data[field] = value
         
-        # タイムスタンプ追加
-        validated_data['updatedAt'] = datetime.utcnow().isoformat()
-        
         logger.info(f"Profile data validated: {validated_data}")
         
         return validated_data
@@ -201,6 +233,32 @@ def validate_profile_data(data):
         logger.error(f"Error validating profile data: {str(e)}")
         return {'error': 'プロフィールデータの検証中にエラーが発生しました'}
 
+def parse_expected_version(body, event):
+    """期待バージョンを取得（指定なしは None、0 は未作成のプロフィールを意味する）"""
+    value = body.get('version')
+    if value is None:
+        value = RequestValidator.get_header(event, 'if-match')
+        if value is not None:
+            value = value.strip()
+            if value == '*':
+                return None
+            if value.startswith('W/'):
+                value = value[2:]
+            value = value.strip('"')
+    if value is None or value == '':
+        return None
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('無効なバージョンが指定されています')
+    if isinstance(value, bool) or version < 0:
+        raise ValueError('無効なバージョンが指定されています')
+    return version
+
+# Lambda の初期化フェーズでプライミング（WARMUP_PRIME_ON_INIT で制御）
+if should_prime_on_init():
+    primer.prime()
+
 if __name__ == "__main__":
     # ローカルテスト用
     test_event_get = {
@@ -0,0 +1,118 @@
+# JSON シリアライザ - orjson が使えれば高速パス、なければ標準ライブラリ
+import os
+import json
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Any, Iterator
+
+try:
+    import orjson
+except ImportError:  # orjson はオプション依存
+    orjson = None
+
+# チャンク分割時の既定サイズ（文字数）
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+def json_default(obj: Any) -> Any:
+    """標準では扱えない型の変換（Decimal / datetime / set など）"""
+    if type(obj) is Decimal:
+        # NaN・Infinity は JSON で表せないため null に
+        if not obj.is_finite():
+            return None
+        # 整数値の Decimal は int に（DynamoDB の数値は Decimal で返るため）
+        value = int(obj)
+        return value if value == obj else float(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode('utf-8', errors='replace')
+    return str(obj)
+
+class JsonSerializer:
+    """シリアライザの基底クラス"""
+
+    name = 'base'
+
+    def dumps(self, obj: Any) -> str:
+        raise NotImplementedError
+
+    def iter_encode(self, obj: Any, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+        """大きなボディを chunk_size 程度の断片に分けてエンコード
+
+        トップレベルの dict / list の要素毎に dumps するため、
+        全体を1つの文字列として保持せずに送出・書き込みできる。
+        """
+        buffer = []
+        size = 0
+        for piece in self._iter_pieces(obj):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer)
+
+    def _iter_pieces(self, obj: Any, depth: int = 0) -> Iterator[str]:
+        if depth < 2 and isinstance(obj, dict):
+            yield '{'
+            for i, (key, value) in enumerate(obj.items()):
+                yield (',' if i else '') + self.dumps(str(key)) + ':'
+                yield from self._iter_pieces(value, depth + 1)
+            yield '}'
+        elif depth < 2 and isinstance(obj, (list, tuple)):
+            yield '['
+            for i, value in enumerate(obj):
+                if i:
+                    yield ','
+                yield self.dumps(value)
+            yield ']'
+        else:
+            yield self.dumps(obj)
+
+class StdlibJsonSerializer(JsonSerializer):
+    """標準ライブラリ json によるシリアライザ"""
+
+    name = 'stdlib'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, default=json_default, separators=(', ', ': '))
+
+    def dumps(self, obj: Any) -> str:
+        return self._encoder.encode(obj)
+
+class OrjsonSerializer(JsonSerializer):
+    """orjson によるシリアライザ（datetime はネイティブ対応）"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError('orjson がインストールされていません')
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: Any) -> str:
+        return orjson.dumps(obj, default=json_default, option=self._option).decode('utf-8')
+
+def create_serializer(name: str = None) -> JsonSerializer:
+    """'auto' / 'orjson' / 'stdlib' からシリアライザを生成"""
+    name = (name or os.environ.get('JSON_SERIALIZER', 'auto')).lower()
+    if name == 'stdlib':
+        return StdlibJsonSerializer()
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        return OrjsonSerializer()
+    return StdlibJsonSerializer()
+
+# モジュール共通のシリアライザ
+serializer = create_serializer()
+
+def set_serializer(new_serializer: JsonSerializer):
+    """共通シリアライザを差し替え"""
+    global serializer
+    serializer = new_serializer
+
+def get_serializer() -> JsonSerializer:
+    return serializer
\ No newline at end of file
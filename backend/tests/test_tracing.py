@@ -0,0 +1,122 @@
+# チャット1ターン分のスパンツリーの結合テスト（local_aws のスタンドインで chat_lambda_refactored を実行）
+#   python -m pytest -q tests    # backend ディレクトリで実行
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import jwt
+
+import chat_lambda_refactored
+from common import USER_TABLE, HISTORY_TABLE
+from tracing import tracer, build_span_tree, InMemoryExporter, AlwaysOnSampler, AlwaysOffSampler
+from local_aws import InMemoryDynamoDB, FakeBedrockAgentRuntime, attach_to_handler, seed_dataset
+
+USER_ID = 'bench-user-0000'
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+def chat_event(headers: dict = None) -> dict:
+    token = jwt.encode({'sub': USER_ID}, None, algorithm='none')
+    return {
+        'httpMethod': 'POST', 'resource': '/chat', 'path': '/chat',
+        'headers': dict({'Authorization': f'Bearer {token}'}, **(headers or {})),
+        'body': json.dumps({'message': '最近ランニングを始めました！', 'sessionId': 'trace-session'})
+    }
+
+def find_child(node: dict, name: str) -> dict:
+    matches = [child for child in node['children'] if child['name'] == name]
+    if not matches:
+        raise AssertionError(f"{name} not found under {node['name']}: {[c['name'] for c in node['children']]}")
+    return matches[0]
+
+class ChatTurnSpanTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.module = chat_lambda_refactored
+        dynamodb = InMemoryDynamoDB()
+        seed_dataset(dynamodb, 1, 0, 0)
+        attach_to_handler(self.module, dynamodb=dynamodb, bedrock_agent_runtime=FakeBedrockAgentRuntime())
+        # 逐次実行の経路でスパンの親子関係を確認する
+        self._async_io = self.module.ASYNC_IO_ENABLED
+        self.module.ASYNC_IO_ENABLED = False
+        self._tracer_config = (tracer.sampler, tracer.exporter)
+        self.exporter = InMemoryExporter()
+
+    def tearDown(self):
+        self.module.ASYNC_IO_ENABLED = self._async_io
+        tracer.configure(*self._tracer_config)
+
+    def run_turn(self, headers: dict = None) -> dict:
+        response = self.module.lambda_handler(chat_event(headers), None)
+        self.assertEqual(response['statusCode'], 200, response.get('body'))
+        return response
+
+    def test_span_tree_for_one_chat_turn(self):
+        tracer.configure(AlwaysOnSampler(), self.exporter)
+        self.run_turn()
+
+        roots = build_span_tree(self.exporter.spans)
+        self.assertEqual([root['name'] for root in roots], ['chat.lambda_handler'])
+        root = roots[0]
+        self.assertEqual(root['span']['attributes']['http.method'], 'POST')
+        self.assertEqual(root['span']['attributes']['http.status_code'], 200)
+        self.assertEqual({span.trace_id for span in self.exporter.spans}, {root['span']['traceId']})
+
+        profile = find_child(root, 'ProfileHelper.get_user_profile')
+        profile_get = find_child(profile, 'dynamodb.GetItem')
+        self.assertEqual(profile_get['span']['attributes']['table'], USER_TABLE)
+
+        context_window = find_child(root, 'HistoryHelper.get_context_window')
+        history_get = find_child(context_window, 'dynamodb.GetItem')
+        self.assertEqual(history_get['span']['attributes']['table'], HISTORY_TABLE)
+
+        bedrock = find_child(root, 'bedrock.invoke_agent')
+        self.assertIn('first_chunk', [event['name'] for event in bedrock['span']['events']])
+        # 読み込みが終わってから Agent を呼び出し、その後に保存する
+        self.assertLessEqual(profile['span']['endTime'], bedrock['span']['startTime'])
+        self.assertLessEqual(context_window['span']['endTime'], bedrock['span']['startTime'])
+        save = find_child(root, 'HistoryHelper.save_turn')
+        self.assertLessEqual(bedrock['span']['endTime'], save['span']['startTime'])
+
+    def test_span_tree_with_async_io(self):
+        # asyncio 版ヘルパー・スレッドで実行する Agent 呼び出しのスパンもハンドラのスパンの下に入る
+        self.module.ASYNC_IO_ENABLED = True
+        tracer.configure(AlwaysOnSampler(), self.exporter)
+        self.run_turn()
+
+        roots = build_span_tree(self.exporter.spans)
+        self.assertEqual([root['name'] for root in roots], ['chat.lambda_handler'])
+        root = roots[0]
+        self.assertEqual({span.trace_id for span in self.exporter.spans}, {root['span']['traceId']})
+
+        reads = {child['span']['attributes'].get('table'): child
+                 for child in root['children'] if child['name'] == 'dynamodb.GetItem'}
+        self.assertEqual(set(reads), {USER_TABLE, HISTORY_TABLE})
+
+        bedrock = find_child(root, 'bedrock.invoke_agent')
+        for read in reads.values():
+            self.assertLessEqual(read['span']['endTime'], bedrock['span']['startTime'])
+        save = find_child(root, 'HistoryHelper.save_turn')
+        self.assertLessEqual(bedrock['span']['endTime'], save['span']['startTime'])
+
+    def test_incoming_traceparent_is_propagated(self):
+        # サンプリング率 0 でも受信した sampled フラグに従って記録する
+        tracer.configure(AlwaysOffSampler(), self.exporter)
+        self.run_turn({'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+
+        self.assertTrue(self.exporter.spans)
+        self.assertEqual({span.trace_id for span in self.exporter.spans}, {TRACE_ID})
+        root = build_span_tree(self.exporter.spans)[0]
+        self.assertEqual(root['name'], 'chat.lambda_handler')
+        self.assertEqual(root['span']['parentId'], PARENT_ID)
+
+    def test_unsampled_trace_records_nothing(self):
+        tracer.configure(AlwaysOffSampler(), self.exporter)
+        self.run_turn({'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-00'})
+        self.assertEqual(self.exporter.spans, [])
+
+if __name__ == "__main__":
+    unittest.main()
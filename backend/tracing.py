@@ -0,0 +1,372 @@
+# トレーシング - ハンドラ・DynamoDB・Bedrock 呼び出しのスパン計測
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Any, Optional, List, Callable
+
+# W3C Trace Context ヘッダー名
+TRACEPARENT_HEADER = 'traceparent'
+
+# 現在アクティブなスパン（スレッド・タスク毎に独立）
+_current_span = contextvars.ContextVar('genki_current_span', default=None)
+
+class Span:
+    """1つの処理区間を表すスパン"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_time', 'end_time',
+                 'attributes', 'events', 'status', '_trace')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], trace: '_TraceBuffer'):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_time = time.time()
+        self.end_time = None
+        self.attributes = {}
+        self.events = []
+        self.status = 'OK'
+        self._trace = trace
+
+    def set_attribute(self, key: str, value: Any):
+        """属性を設定"""
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        """スパン内のイベントを記録（初回チャンク受信など）"""
+        self.events.append({'name': name, 'time': time.time(), 'attributes': attributes})
+
+    def record_error(self, error: BaseException):
+        """例外を記録"""
+        self.status = 'ERROR'
+        self.attributes['error.type'] = type(error).__name__
+        self.attributes['error.message'] = str(error)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        """エクスポート用の辞書に変換"""
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentId': self.parent_id,
+            'name': self.name,
+            'startTime': self.start_time,
+            'endTime': self.end_time,
+            'durationMs': self.duration_ms,
+            'status': self.status,
+            'attributes': self.attributes,
+            'events': self.events
+        }
+
+class _TraceBuffer:
+    """1トレース分の終了済みスパンを溜めておくバッファ"""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+# サンプラー
+class Sampler:
+    """サンプリング判定の基底クラス"""
+
+    def should_sample(self, trace_id: str) -> bool:
+        raise NotImplementedError
+
+class AlwaysOnSampler(Sampler):
+    def should_sample(self, trace_id: str) -> bool:
+        return True
+
+class AlwaysOffSampler(Sampler):
+    def should_sample(self, trace_id: str) -> bool:
+        return False
+
+class RatioSampler(Sampler):
+    """トレースIDに基づく割合サンプリング（同一トレースは常に同じ判定）"""
+
+    def __init__(self, ratio: float):
+        self.ratio = max(0.0, min(1.0, ratio))
+        self._bound = int(self.ratio * (1 << 64))
+
+    def should_sample(self, trace_id: str) -> bool:
+        if self.ratio >= 1.0:
+            return True
+        if self.ratio <= 0.0:
+            return False
+        return int(trace_id[-16:], 16) < self._bound
+
+# エクスポーター
+class SpanExporter:
+    """スパン出力先の基底クラス"""
+
+    def export(self, spans: List[Span]):
+        raise NotImplementedError
+
+class NoopExporter(SpanExporter):
+    def export(self, spans: List[Span]):
+        pass
+
+class StdoutExporter(SpanExporter):
+    """スパンを1行1JSONで標準出力へ（CloudWatch Logs / ローカル確認用）"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def export(self, spans: List[Span]):
+        lines = [json.dumps({'span': span.to_dict()}, ensure_ascii=False, default=str) for span in spans]
+        self.stream.write('\n'.join(lines) + '\n')
+        self.stream.flush()
+
+class FileExporter(SpanExporter):
+    """スパンをNDJSONファイルへ追記（ローカル実行用）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        lines = [json.dumps(span.to_dict(), ensure_ascii=False, default=str) for span in spans]
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+
+class InMemoryExporter(SpanExporter):
+    """スパンをメモリに保持（検証・ベンチマーク用）"""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans: List[Span]):
+        self.spans.extend(spans)
+
+    def clear(self):
+        self.spans = []
+
+def parse_traceparent(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    """W3C traceparent ヘッダーを解析"""
+    if not value:
+        return None
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return {'trace_id': parts[1], 'parent_id': parts[2], 'sampled': bool(flags & 0x01)}
+
+def _find_header(headers: Optional[Dict[str, Any]], name: str) -> Optional[str]:
+    """大文字小文字を区別せずヘッダーを取得"""
+    if not headers:
+        return None
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+class Tracer:
+    """スパンの生成・ネスト管理・エクスポートを行うトレーサー"""
+
+    def __init__(self, sampler: Sampler = None, exporter: SpanExporter = None):
+        self.sampler = sampler or AlwaysOffSampler()
+        self.exporter = exporter or NoopExporter()
+
+    @classmethod
+    def from_env(cls) -> 'Tracer':
+        """環境変数から設定（TRACE_SAMPLE_RATE / TRACE_EXPORTER）"""
+        try:
+            ratio = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+        except ValueError:
+            ratio = 0.0
+        return cls(RatioSampler(ratio), exporter_from_spec(os.environ.get('TRACE_EXPORTER', 'stdout')))
+
+    def configure(self, sampler: Sampler = None, exporter: SpanExporter = None):
+        """サンプラー・エクスポーターを差し替え"""
+        if sampler is not None:
+            self.sampler = sampler
+        if exporter is not None:
+            self.exporter = exporter
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def start_trace(self, name: str, headers: Optional[Dict[str, Any]] = None, **attributes):
+        """ルートスパンを開始（受信した traceparent があれば引き継ぐ）"""
+        incoming = parse_traceparent(_find_header(headers, TRACEPARENT_HEADER))
+        if incoming:
+            trace_id = incoming['trace_id']
+            parent_id = incoming['parent_id']
+            sampled = incoming['sampled'] or self.sampler.should_sample(trace_id)
+        else:
+            trace_id = uuid.uuid4().hex
+            parent_id = None
+            sampled = self.sampler.should_sample(trace_id)
+
+        if not sampled:
+            # 非サンプリング時は子スパンも生成しない
+            token = _current_span.set(None)
+            try:
+                yield None
+            finally:
+                _current_span.reset(token)
+            return
+
+        trace = _TraceBuffer()
+        span = Span(name, trace_id, parent_id, trace)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end_time = time.time()
+            _current_span.reset(token)
+            trace.add(span)
+            self._export(trace.spans)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """現在のスパンの子スパンを開始（トレース外では何もしない）"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(name, parent.trace_id, parent.span_id, parent._trace)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end_time = time.time()
+            _current_span.reset(token)
+            parent._trace.add(span)
+
+    def traced(self, name: str = None):
+        """関数呼び出しを子スパンで囲むデコレーター"""
+        def decorator(func: Callable):
+            span_name = name or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def trace_handler(self, name: str):
+        """lambda_handler をルートスパンで囲むデコレーター"""
+        def decorator(func: Callable):
+            @wraps(func)
+            def wrapper(event, context):
+                headers = event.get('headers') if isinstance(event, dict) else None
+                with self.start_trace(name, headers) as span:
+                    response = func(event, context)
+                    if span is not None:
+                        if isinstance(event, dict):
+                            span.set_attribute('http.method', event.get('httpMethod'))
+                        if isinstance(response, dict):
+                            span.set_attribute('http.status_code', response.get('statusCode'))
+                    return response
+            return wrapper
+        return decorator
+
+    def _export(self, spans: List[Span]):
+        try:
+            # 開始時刻順に並べて出力
+            self.exporter.export(sorted(spans, key=lambda s: s.start_time))
+        except Exception as e:
+            sys.stderr.write(f"[WARNING] tracing - Failed to export spans: {str(e)}\n")
+
+def exporter_from_spec(spec: str) -> SpanExporter:
+    """'stdout' / 'file:<path>' / 'none' からエクスポーターを生成"""
+    spec = (spec or '').strip()
+    if spec.startswith('file:'):
+        return FileExporter(spec[len('file:'):])
+    if spec == 'stdout':
+        return StdoutExporter()
+    return NoopExporter()
+
+def build_span_tree(spans: List[Any]) -> List[Dict[str, Any]]:
+    """スパン（Span または to_dict 済み辞書）から親子ツリーを構築"""
+    nodes = {}
+    for span in spans:
+        data = span.to_dict() if isinstance(span, Span) else span
+        nodes[data['spanId']] = {'name': data['name'], 'span': data, 'children': []}
+
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node['span']['parentId'])
+        if parent:
+            parent['children'].append(node)
+        else:
+            roots.append(node)
+
+    for node in nodes.values():
+        node['children'].sort(key=lambda n: n['span']['startTime'])
+    return roots
+
+def format_span_tree(spans: List[Any]) -> str:
+    """スパンツリーをインデント付きテキストに整形"""
+    lines = []
+
+    def walk(node, depth):
+        span = node['span']
+        duration = span.get('durationMs') or 0.0
+        lines.append(f"{'  ' * depth}{node['name']} ({duration:.1f}ms) [{span['status']}]")
+        for child in node['children']:
+            walk(child, depth + 1)
+
+    for root in build_span_tree(spans):
+        walk(root, 0)
+    return '\n'.join(lines)
+
+# モジュール共通のトレーサー
+tracer = Tracer.from_env()
+
+if __name__ == "__main__":
+    # ローカル確認用
+    exporter = InMemoryExporter()
+    tracer.configure(AlwaysOnSampler(), exporter)
+
+    @tracer.traced('ProfileHelper.get_user_profile')
+    def fake_profile():
+        with tracer.span('dynamodb.GetItem', table='GenkiChatUserTable'):
+            time.sleep(0.005)
+
+    with tracer.start_trace('chat.lambda_handler',
+                            {'traceparent': '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'}):
+        fake_profile()
+        with tracer.span('bedrock.invoke_agent') as s:
+            time.sleep(random.uniform(0.01, 0.02))
+            s.add_event('first_chunk')
+
+    print(format_span_tree(exporter.spans))
\ No newline at end of file
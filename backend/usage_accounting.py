@@ -0,0 +1,295 @@
+# ユーザー毎のトークン数・コスト集計 - Bedrock Agent のトレースイベントから使用量を抽出する
+#
+# invoke_agent(enableTrace=True) のトレースには、Agent 内部のモデル呼び出し毎に
+# modelInvocationOutput.metadata.usage（inputTokens / outputTokens）が含まれる。
+# UsageCollector がストリームを読みながら合計し、UsageAccountant が (ユーザー, 日) 単位の
+# アトミックカウンタ（UpdateItem の ADD）にリクエストの最後でまとめて書き込む。
+# 書き込みは履歴保存と並行してバックグラウンドで行い、応答を遅らせない（既定では完了を待たず、
+# 未完了の書き込みは実行環境の再開後に完了する）。
+#   ユーザー別: 履歴テーブル userId=<userId>, timestamp=USAGE#<日付>
+#   日別:       履歴テーブル userId=USAGE#<日付>#<シャード>, timestamp=<userId>（その日の利用者の一覧）
+#               1日分の書き込みが1パーティションに集中しないよう、userId のハッシュで
+#               USAGE_DAY_SHARDS 個に分け、読み出し時は全シャードを順に読む。
+#   python usage_accounting.py top --day 2025-01-01 --limit 20
+#   python usage_accounting.py user <userId> --from 2025-01-01 --to 2025-01-31
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Optional
+
+from common import (
+    setup_logger,
+    tracer,
+    USAGE_KEY_PREFIX
+)
+
+# 使用量集計設定
+USAGE_ACCOUNTING_ENABLED = os.environ.get('USAGE_ACCOUNTING_ENABLED', 'true').lower() == 'true'
+# 1,000 トークンあたりの料金（USD。既定は Agent の基盤モデル Claude 3 Haiku のオンデマンド料金）
+USAGE_INPUT_PRICE_PER_1K = float(os.environ.get('USAGE_INPUT_PRICE_PER_1K', '0.00025'))
+USAGE_OUTPUT_PRICE_PER_1K = float(os.environ.get('USAGE_OUTPUT_PRICE_PER_1K', '0.00125'))
+# 日付の区切り（UTC からの時差。既定は日本時間）
+USAGE_TIMEZONE_OFFSET_HOURS = float(os.environ.get('USAGE_TIMEZONE_OFFSET_HOURS', '9'))
+# Agent のトレースを有効にしてトークン数を集計する（無効時はリクエスト数・応答時間と直接呼び出しの分だけ）
+USAGE_AGENT_TRACE_ENABLED = os.environ.get('USAGE_AGENT_TRACE_ENABLED', 'true').lower() == 'true'
+# 履歴保存の後に書き込みの完了を待つ最大時間（0 = 待たない）
+USAGE_FLUSH_WAIT_MS = int(os.environ.get('USAGE_FLUSH_WAIT_MS', '0'))
+USAGE_QUERY_MAX_DAYS = int(os.environ.get('USAGE_QUERY_MAX_DAYS', '92'))
+# 日別の行を分けるシャード数（減らすとその日の既存の行の一部が読まれなくなるため、日の切り替わりに合わせて変更する）
+USAGE_DAY_SHARDS = int(os.environ.get('USAGE_DAY_SHARDS', '16'))
+
+# 使用量を含むトレースの種類
+_MODEL_TRACE_TYPES = ('preProcessingTrace', 'orchestrationTrace', 'postProcessingTrace', 'routingClassifierTrace')
+
+# カウンタ属性（UpdateItem の ADD で加算）
+USAGE_COUNTERS = ('requests', 'modelInvocations', 'inputTokens', 'outputTokens', 'agentMs')
+
+def usage_day(timestamp: float = None) -> str:
+    """集計日（USAGE_TIMEZONE_OFFSET_HOURS の時差で区切った YYYY-MM-DD）"""
+    tz = timezone(timedelta(hours=USAGE_TIMEZONE_OFFSET_HOURS))
+    return datetime.fromtimestamp(timestamp if timestamp is not None else time.time(), tz).strftime('%Y-%m-%d')
+
+def day_partition(day: str, user_id: str) -> str:
+    """日別の行のパーティションキー（userId のハッシュでシャードを決める）"""
+    return f'{USAGE_KEY_PREFIX}{day}#{zlib.crc32(user_id.encode("utf-8")) % USAGE_DAY_SHARDS}'
+
+def day_partitions(day: str) -> List[str]:
+    """日別の行の全パーティション（シャード導入前の USAGE#<日付> を含む）"""
+    return [f'{USAGE_KEY_PREFIX}{day}'] + [f'{USAGE_KEY_PREFIX}{day}#{n}' for n in range(USAGE_DAY_SHARDS)]
+
+def estimate_cost(input_tokens: int, output_tokens: int) -> float:
+    """トークン数から概算コスト（USD）"""
+    return round(input_tokens / 1000 * USAGE_INPUT_PRICE_PER_1K + output_tokens / 1000 * USAGE_OUTPUT_PRICE_PER_1K, 6)
+
+class UsageCollector:
+    """1回の Agent 呼び出しのトレースイベントから使用量を合計"""
+
+    __slots__ = ('model_invocations', 'input_tokens', 'output_tokens', 'agent_ms')
+
+    def __init__(self):
+        self.model_invocations = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.agent_ms = 0.0
+
+    def observe(self, trace_event: Dict[str, Any]):
+        """トレースイベント（event['trace']）を取り込む（usage を含まないイベントは無視）"""
+        trace = trace_event.get('trace')
+        if not trace:
+            return
+        for trace_type in _MODEL_TRACE_TYPES:
+            part = trace.get(trace_type)
+            if not part:
+                continue
+            output = part.get('modelInvocationOutput')
+            if not output:
+                continue
+            self.add_invocation((output.get('metadata') or {}).get('usage'))
+
+    def add_invocation(self, usage: Optional[Dict[str, Any]]):
+        """モデル呼び出し1回分の usage（inputTokens / outputTokens）を加算"""
+        if usage:
+            self.model_invocations += 1
+            self.input_tokens += int(usage.get('inputTokens') or 0)
+            self.output_tokens += int(usage.get('outputTokens') or 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'modelInvocations': self.model_invocations,
+            'inputTokens': self.input_tokens,
+            'outputTokens': self.output_tokens,
+            'agentMs': round(self.agent_ms, 1)
+        }
+
+class UsageAccountant:
+    """(ユーザー, 日) 単位の使用量カウンタ
+
+    record() でメモリ上に合計し、flush_async() で UpdateItem（ADD）をバックグラウンド実行する。
+    ハンドラは履歴保存の後に wait() を呼ぶ（USAGE_FLUSH_WAIT_MS まで。既定の 0 では待たない）。
+    """
+
+    def __init__(self, db_helper, table_name: str):
+        self.db_helper = db_helper
+        self.table_name = table_name
+        self.logger = setup_logger('UsageAccountant')
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, Dict[str, float]] = {}
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='usage')
+
+    def record(self, user_id: str, usage: UsageCollector, day: str = None):
+        """1回分の使用量を加算（書き込みは flush まで行わない）"""
+        key = (user_id, day or usage_day())
+        with self._lock:
+            totals = self._pending.setdefault(key, dict.fromkeys(USAGE_COUNTERS, 0))
+            totals['requests'] += 1
+            totals['modelInvocations'] += usage.model_invocations
+            totals['inputTokens'] += usage.input_tokens
+            totals['outputTokens'] += usage.output_tokens
+            totals['agentMs'] += int(round(usage.agent_ms))
+
+    def flush_async(self):
+        """未書き込みの使用量をバックグラウンドで書き込む"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            self._futures.append(self._executor.submit(self._write, pending))
+
+    def wait(self, timeout_ms: int = None) -> bool:
+        """バックグラウンドの書き込みを待つ（完了していない書き込みは後続のリクエストの間に完了する）"""
+        timeout_ms = USAGE_FLUSH_WAIT_MS if timeout_ms is None else timeout_ms
+        with self._lock:
+            futures, self._futures = [f for f in self._futures if not f.done()], []
+        if not futures:
+            return True
+        pending = futures
+        if timeout_ms > 0:
+            _, pending = wait(futures, timeout=timeout_ms / 1000)
+            if pending:
+                self.logger.warning(f"{len(pending)} usage writes still pending")
+        if pending:
+            with self._lock:
+                self._futures.extend(pending)
+        return not pending
+
+    def flush(self) -> bool:
+        """未書き込みの使用量を書き込んで完了を待つ（一括実行・CLI 用）"""
+        self.flush_async()
+        with self._lock:
+            futures, self._futures = self._futures, []
+        wait(futures)
+        return all(f.result() for f in futures)
+
+    @tracer.traced('UsageAccountant.write')
+    def _write(self, pending: Dict[tuple, Dict[str, float]]) -> bool:
+        success = True
+        now = datetime.utcnow().isoformat()
+        for (user_id, day), totals in pending.items():
+            values = {f':{name}': value for name, value in totals.items()}
+            values[':now'] = now
+            update = {
+                'UpdateExpression': 'ADD ' + ', '.join(f'#{name} :{name}' for name in USAGE_COUNTERS)
+                                    + ' SET updatedAt = :now',
+                'ExpressionAttributeNames': {f'#{name}': name for name in USAGE_COUNTERS},
+                'ExpressionAttributeValues': values
+            }
+            # ユーザー別と日別の2行を更新（日別の行でその日の利用者を一覧できる）
+            for key in ({'userId': user_id, 'timestamp': f'{USAGE_KEY_PREFIX}{day}'},
+                        {'userId': day_partition(day, user_id), 'timestamp': user_id}):
+                if self.db_helper.safe_update_item(self.table_name, key, **update) is None:
+                    success = False
+        if not success:
+            self.logger.error(f"Failed to write usage for {len(pending)} user-days")
+        return success
+
+    @tracer.traced('UsageAccountant.get_user_usage')
+    def get_user_usage(self, user_id: str, start_day: str, end_day: str) -> Optional[Dict[str, Any]]:
+        """ユーザーの日別使用量と合計（取得失敗時は None）"""
+        items = self.db_helper.safe_query(
+            self.table_name,
+            KeyConditionExpression='userId = :userId AND #ts BETWEEN :start AND :end',
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={
+                ':userId': user_id,
+                ':start': f'{USAGE_KEY_PREFIX}{start_day}',
+                ':end': f'{USAGE_KEY_PREFIX}{end_day}'
+            }
+        )
+        if items is None:
+            return None
+        days = [dict(format_usage(item), day=item['timestamp'][len(USAGE_KEY_PREFIX):]) for item in items]
+        return {'from': start_day, 'to': end_day, 'days': days, 'total': sum_usage(days)}
+
+    @tracer.traced('UsageAccountant.get_top_users')
+    def get_top_users(self, day: str, limit: int = 20) -> Optional[List[Dict[str, Any]]]:
+        """指定日のコスト上位のユーザー（運用向け。API には公開しない）"""
+        items = self.get_day_rows(day)
+        if items is None:
+            return None
+        users = [dict(format_usage(item), userId=user_id) for user_id, item in items.items()]
+        users.sort(key=lambda u: u['estimatedCostUsd'], reverse=True)
+        return users[:limit]
+
+    def get_day_rows(self, day: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """指定日の全シャードの行をユーザー毎に合算（取得失敗時は None）"""
+        rows = {}
+        for partition in day_partitions(day):
+            start_key = None
+            while True:
+                kwargs = {
+                    'KeyConditionExpression': 'userId = :day',
+                    'ExpressionAttributeValues': {':day': partition}
+                }
+                if start_key:
+                    kwargs['ExclusiveStartKey'] = start_key
+                page = self.db_helper.safe_query_page(self.table_name, **kwargs)
+                if page is None:
+                    return None
+                items, start_key = page
+                for item in items:
+                    totals = rows.setdefault(item['timestamp'], dict.fromkeys(USAGE_COUNTERS, 0))
+                    for name in USAGE_COUNTERS:
+                        totals[name] += int(item.get(name, 0))
+                if not start_key:
+                    break
+        return rows
+
+def format_usage(item: Dict[str, Any]) -> Dict[str, Any]:
+    """カウンタ行をレスポンス用に変換（概算コストを付与）"""
+    usage = {name: int(item.get(name, 0)) for name in USAGE_COUNTERS}
+    usage['estimatedCostUsd'] = estimate_cost(usage['inputTokens'], usage['outputTokens'])
+    return usage
+
+def sum_usage(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """日別の使用量を合計"""
+    total = {name: sum(row[name] for row in rows) for name in USAGE_COUNTERS}
+    total['estimatedCostUsd'] = estimate_cost(total['inputTokens'], total['outputTokens'])
+    return total
+
+def parse_usage_range(query_params: Dict[str, Any]) -> tuple:
+    """from / to（YYYY-MM-DD、既定は直近30日）を検証（不正な場合は ValueError）"""
+    end = query_params.get('to') or usage_day()
+    start = query_params.get('from')
+    try:
+        end_date = datetime.strptime(end, '%Y-%m-%d')
+        if not start:
+            start = (end_date - timedelta(days=29)).strftime('%Y-%m-%d')
+        start_date = datetime.strptime(start, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('from / to は YYYY-MM-DD 形式で指定してください')
+    if start_date > end_date:
+        raise ValueError('from は to 以前の日付を指定してください')
+    if (end_date - start_date).days >= USAGE_QUERY_MAX_DAYS:
+        raise ValueError(f'期間は{USAGE_QUERY_MAX_DAYS}日以内で指定してください')
+    return start, end
+
+if __name__ == "__main__":
+    from common import create_database_helper, HISTORY_TABLE
+
+    parser = argparse.ArgumentParser(description='Bedrock 使用量の集計結果を表示')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    top = subparsers.add_parser('top', help='指定日のコスト上位ユーザー')
+    top.add_argument('--day', default=None, help='YYYY-MM-DD（既定: 今日）')
+    top.add_argument('--limit', type=int, default=20)
+    user = subparsers.add_parser('user', help='ユーザーの日別使用量')
+    user.add_argument('user_id')
+    user.add_argument('--from', dest='start', default=None)
+    user.add_argument('--to', dest='end', default=None)
+    args = parser.parse_args()
+
+    accountant = UsageAccountant(create_database_helper(), HISTORY_TABLE)
+    if args.command == 'top':
+        result = accountant.get_top_users(args.day or usage_day(), args.limit)
+    else:
+        start, end = parse_usage_range({'from': args.start, 'to': args.end})
+        result = accountant.get_user_usage(args.user_id, start, end)
+    if result is None:
+        sys.exit('使用量の取得に失敗しました')
+    print(json.dumps(result, ensure_ascii=False, indent=2))
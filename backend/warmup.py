@@ -0,0 +1,138 @@
+# ウォームアップイベントと初期化フェーズのプライミング
+#
+# プロビジョンド同時実行・定期ウォーマーの効果を出すため、初回リクエストが払っていた
+# DynamoDB・Bedrock への接続確立（TLS ハンドシェイク）、初回利用時の読み込み（boto3 のサービスモデル、
+# 圧縮・埋め込み・シリアライザの初期化）を初期化フェーズでまとめて行う。
+# ウォームアップイベント（{"action": "warmup"}）は各ハンドラで即座に返す（未プライミングならここで実行）。
+#   aws lambda invoke --function-name genki-chat --payload '{"action": "warmup"}' out.json
+#   python benchmarks/bench_warmup.py --runs 5
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, Callable, List, Tuple
+
+import jwt
+from common import setup_logger, tracer, ResponseBuilder, RequestValidator
+from history_compression import encode_message_content, decode_message
+from hashed_embedding import embed_bytes
+
+# ウォームアップ設定
+WARMUP_ACTION = 'warmup'
+# 初期化フェーズでプライミングする（auto: Lambda 上でのみ。ローカル実行では AWS に接続しない）
+WARMUP_PRIME_ON_INIT = os.environ.get('WARMUP_PRIME_ON_INIT', 'auto').lower()
+# プライミング全体の待ち時間の上限（初期化フェーズは10秒まで）
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get('WARMUP_TIMEOUT_SECONDS', '3'))
+WARMUP_MAX_WORKERS = int(os.environ.get('WARMUP_MAX_WORKERS', '8'))
+
+# プライミング時の読み込みに使う存在しないキー
+WARMUP_USER_ID = '__warmup__'
+
+logger = setup_logger(__name__)
+
+def is_warmup_event(event: Dict[str, Any]) -> bool:
+    """ウォームアップイベント（API Gateway 経由ではない {"action": "warmup"}）か"""
+    return isinstance(event, dict) and 'httpMethod' not in event and event.get('action') == WARMUP_ACTION
+
+def should_prime_on_init() -> bool:
+    """モジュール読み込み時にプライミングするか"""
+    if WARMUP_PRIME_ON_INIT == 'auto':
+        return bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+    return WARMUP_PRIME_ON_INIT == 'true'
+
+class Primer:
+    """ハンドラ毎のプライミング手順（登録した手順を並行実行し、失敗しても続行する）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.steps: List[Tuple[str, Callable[[], Any]]] = []
+        self.inline_steps: List[Tuple[str, Callable[[], Any]]] = []
+        self.results: Dict[str, Any] = {}
+        self.primed = False
+        self.duration_ms = None
+
+    def add(self, name: str, func: Callable[[], Any], inline: bool = False) -> 'Primer':
+        """手順を登録（inline=True の手順は呼び出し元のスレッドで実行。スレッド毎のイベントループ用）"""
+        (self.inline_steps if inline else self.steps).append((name, func))
+        return self
+
+    def _run_step(self, name: str, func: Callable[[], Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            func()
+            status = 'ok'
+        except Exception as e:
+            # 接続は確立済みで権限・リソースの不足だけの場合もあるため、失敗は記録のみ
+            logger.warning(f"Warm-up step {self.name}.{name} failed: {str(e)}")
+            status = 'error'
+        return {'status': status, 'ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    @tracer.traced('warmup.prime')
+    def prime(self) -> Dict[str, Any]:
+        """全手順を実行（実行済みなら何もしない）"""
+        if self.primed:
+            return self.results
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=max(1, min(WARMUP_MAX_WORKERS, len(self.steps))),
+                                      thread_name_prefix='warmup')
+        futures = {executor.submit(self._run_step, name, func): name for name, func in self.steps}
+        done, pending = wait(futures, timeout=WARMUP_TIMEOUT_SECONDS)
+        for future in done:
+            self.results[futures[future]] = future.result()
+        for future in pending:
+            self.results[futures[future]] = {'status': 'timeout'}
+        # タイムアウトした手順の終了は待たない
+        executor.shutdown(wait=False)
+        for name, func in self.inline_steps:
+            self.results[name] = self._run_step(name, func)
+        self.primed = True
+        self.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Primed {self.name} in {self.duration_ms}ms: {self.results}")
+        return self.results
+
+    def handle(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """ウォームアップイベントへの応答（未プライミングならここで実行）"""
+        cold = not self.primed
+        self.prime()
+        return ResponseBuilder.success({
+            'warm': True,
+            'handler': self.name,
+            'primedOnThisInvocation': cold,
+            'primeMs': self.duration_ms,
+            'steps': self.results
+        })
+
+def prime_dynamodb(db_helper, table_name: str, key: Dict[str, Any]) -> Callable[[], Any]:
+    """存在しないキーへの GetItem でテーブルハンドル・サービスモデル・接続を用意"""
+    return lambda: db_helper.safe_get_item(table_name, key)
+
+def prime_bedrock_agent(get_client: Callable[[], Any], agent_id: str, agent_alias_id: str) -> Callable[[], Any]:
+    """課金されない読み取り API で bedrock-agent-runtime の接続を確立（Agent は呼び出さない）
+
+    メモリ未設定・権限不足のエラーでも TLS 接続はプールに残る。
+    """
+    def prime():
+        client = get_client()
+        get_agent_memory = getattr(client, 'get_agent_memory', None)
+        if get_agent_memory is None:
+            return None
+        try:
+            return get_agent_memory(agentId=agent_id, agentAliasId=agent_alias_id,
+                                    memoryId=WARMUP_USER_ID, memoryType='SESSION_SUMMARY', maxItems=1)
+        except Exception as e:
+            code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+            if code is None:
+                raise
+            return None
+    return prime
+
+def prime_local_caches():
+    """JWT デコード・本文圧縮・埋め込み・シリアライザ・レスポンス圧縮を初回利用相当まで初期化"""
+    # JWT のデコード（署名検証は API Gateway の Cognito オーソライザーで行うため JWKS は取得しない）
+    token = jwt.encode({'sub': WARMUP_USER_ID}, None, algorithm='none')
+    RequestValidator.validate_auth_token({'headers': {'Authorization': f'Bearer {token}'}})
+
+    sample = 'ウォームアップ用のサンプルメッセージです。' * 40
+    item = dict(encode_message_content(sample), role='assistant')
+    decode_message(item)
+    embed_bytes(sample)
+    ResponseBuilder.success({'conversations': [{'preview': sample}]}, accept_encoding='br, gzip')